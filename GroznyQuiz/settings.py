@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы время запроса включало все остальные middleware; выключен, пока RATINGS_PROFILER_ENABLED = False
+    'ratings.profiling.SamplingProfilerMiddleware',
+    # Число SQL-запросов в заголовках ответа для manage.py load_test; выключен, пока RATINGS_QUERY_HEADERS = False
+    'ratings.profiling.QueryCountMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,6 +58,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'ratings.routers.PrimaryStickinessMiddleware',
 ]
 
 ROOT_URLCONF = 'GroznyQuiz.urls'
@@ -87,9 +93,43 @@ DATABASES = {
         'PASSWORD': '1232',      
         'HOST': 'localhost',     
         'PORT': '5432',          
+        # Постоянные соединения: воркер держит соединение и проверяет его перед повторным использованием
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Реплика для чтения публичных страниц рейтинга (index, team_modal, game_modal)
+if os.environ.get('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ['DB_REPLICA_HOST'],
+        'PORT': os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'CONN_MAX_AGE': int(os.environ.get('DB_REPLICA_CONN_MAX_AGE', 600)),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Локальная проверка роутера: два SQLite-файла вместо основной БД и реплики.
+# Схему в реплике создаем через migrate --database=replica
+if os.environ.get('DB_SQLITE_REPLICA'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        },
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db_replica.sqlite3',
+            'TEST': {'MIRROR': 'default'},
+        },
+    }
+
+DATABASE_ROUTERS = ['ratings.routers.PrimaryReplicaRouter']
+# Алиас для чтения публичных страниц; если его нет в DATABASES, читаем из default
+DATABASE_READ_ALIAS = 'replica'
+# Сколько секунд после сохранения в админке браузер читает из default
+DATABASE_STICKY_SECONDS = 15
+
 # DATABASES = {
 #     'default': {
 #         'ENGINE': 'django.db.backends.sqlite3',
@@ -99,6 +139,84 @@ DATABASES = {
 
 
 
+# Общие для всех воркеров кеши. У каждого свой каталог: файловый кеш при переполнении (MAX_ENTRIES)
+# удаляет треть файлов своего каталога.
+# versions - версии снимков в памяти процессов (ratings/reference.py): ключей несколько, их нельзя терять.
+# live - live-табло (ratings/live.py): таблица каждого турнира, номер канала и по ключу на каждое сообщение
+# (живет 60 с). За вечер игры - сотни пересчетов на турнир; запас MAX_ENTRIES, чтобы вытеснение не задевало
+# таблицы и номера каналов идущих турниров
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    },
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'versions',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'live': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'live',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+
+# Брокер для онлайн-таблицы турниров (ratings/live.py). Пересчеты идут в воркере очереди, поэтому брокер
+# должен передавать сообщения между процессами: CacheBroker - через CACHES['live'] (файловый кеш годится
+# для одного сервера; MAX_ENTRIES - по числу пересчетов за вечер, см. выше, другой кеш - {'cache_alias': ...}), для нескольких серверов: 'ratings.live.RedisBroker' и {'url': 'redis://localhost:6379/0'}.
+# LocalBroker - только вместе с RATINGS_JOBS_EAGER = True, воркер с ним не запустится
+RATINGS_LIVE_BROKER = 'ratings.live.CacheBroker'
+RATINGS_LIVE_BROKER_OPTIONS = {}
+
+
+# Пересчет итогов и мест идет через очередь: python manage.py run_rating_worker.
+# True - считать сразу после сохранения, без воркера (удобно при локальной разработке)
+RATINGS_JOBS_EAGER = False
+
+
+# Сэмплирующий профайлер (ratings/profiling.py): снимает стеки у доли SAMPLE_RATE запросов (0.01 - каждый сотый),
+# у остальных только замеряет время и сохраняет без стеков запросы дольше SLOW_MS. Сводка: python manage.py profile_report
+RATINGS_PROFILER_ENABLED = os.environ.get('RATINGS_PROFILER_ENABLED') == '1'
+RATINGS_PROFILER_SAMPLE_RATE = 0.01
+# Адреса, которые не профилируются совсем
+RATINGS_PROFILER_SKIP_PATHS = ['/static/', '/media/', '/__debug__/']
+RATINGS_PROFILER_SLOW_MS = 500
+# Как часто снимать стек, сек
+RATINGS_PROFILER_INTERVAL = 0.005
+RATINGS_PROFILER_DIR = BASE_DIR / 'profiles'
+# Почасовых файлов на диске (168 - неделя для одного процесса)
+RATINGS_PROFILER_MAX_FILES = 168
+# Заголовки X-DB-Queries / X-DB-Time-Ms (manage.py load_test включает их у сервера, который сам запускает)
+RATINGS_QUERY_HEADERS = os.environ.get('RATINGS_QUERY_HEADERS') == '1'
+
+
+# Журнал изменений результатов (ratings/changelog.py): сколько ждать запись на пропуске номера, сек,
+# и сколько дней хранить обработанные записи (manage.py changelog --prune)
+RATINGS_CHANGELOG_GAP_SECONDS = 60
+RATINGS_CHANGELOG_RETENTION_DAYS = 30
+
+
+# Матрица команда × тема для карточек команд (похожие команды, процентили): python manage.py build_team_matrix
+RATINGS_ANALYTICS_DIR = BASE_DIR / 'analytics'
+
+# Сила города в общей таблице - средние очки стольких лучших команд города (ratings/rankings.py)
+RATINGS_CITY_TOP_TEAMS = 10
+
+# Лидеры по темам (ratings/topic_leaders.py): сколько команд хранить в каждом списке
+# и сколько игр по теме нужно для списка по среднему баллу
+RATINGS_TOPIC_TOP_K = 100
+RATINGS_TOPIC_MIN_GAMES = 3
+
+# Рекорды (ratings/records.py): сколько команд показывать в каждом рекорде города
+RATINGS_RECORDS_TOP = 10
+
+# Зачет серий за сезон (/standings/, ratings/standings.py): очки за 1-е, 2-е, ... место, дальше - 0.
+# Сколько лучших игр идут в зачет - поле "Лучших игр в зачете" у серии в админке
+RATINGS_STANDINGS_POINTS = [25, 20, 16, 13, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 1]
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -139,6 +257,27 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static'
     ]
 
+# Сюда collectstatic (и manage.py build_assets) собирает статику для nginx
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# STATIC_MANIFEST=1 в окружении продакшена: статика с хешами в именах (manifest), минифицированными CSS/JS
+# и .gz/.br копиями рядом. С ним перед запуском нужен manage.py build_assets (без manifest страницы не откроются),
+# поэтому по умолчанию - обычное хранилище (разработка и тесты)
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'ratings.storage.OptimizedManifestStaticFilesStorage' if os.environ.get('STATIC_MANIFEST') == '1'
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        ),
+    },
+}
+
+# Сюда build_static_site складывает пререндеренные страницы для nginx
+STATIC_SITE_ROOT = BASE_DIR / 'static_site'
+
 INTERNAL_IPS = [
     '127.0.0.1',
     'localhost',
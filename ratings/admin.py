@@ -1,6 +1,45 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.forms.models import BaseInlineFormSet
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from .forms import ScoreGridForm
+from .jobs import enqueue
+from .reference import get_reference_data
 from .models import *
 
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для больших таблиц: без фильтров берет примерное число строк из статистики PostgreSQL
+    (pg_class.reltuples) вместо COUNT(*) по всей таблице. С фильтрами и поиском считает точно.
+    """
+    # На небольших таблицах точный COUNT(*) дешевый
+    ESTIMATE_THRESHOLD = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            connection = connections[queryset.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                        [queryset.model._meta.db_table],
+                    )
+                    row = cursor.fetchone()
+                # reltuples = -1, пока таблицу ни разу не анализировали
+                if row and row[0] >= self.ESTIMATE_THRESHOLD:
+                    return row[0]
+        return super().count
+
 @admin.register(City)
 class CityAdmin(admin.ModelAdmin):
     list_display = ['name']
@@ -9,7 +48,7 @@ class CityAdmin(admin.ModelAdmin):
 
 @admin.register(TournamentSeries)
 class TournamentSeriesAdmin(admin.ModelAdmin):
-    list_display = ['name', 'tournament_type', 'display_order']
+    list_display = ['name', 'tournament_type', 'display_order', 'best_of']
     list_filter = ['tournament_type']
     search_fields = ['name']
 
@@ -23,28 +62,94 @@ class TeamAdmin(admin.ModelAdmin):
     list_display = ['name', 'city']
     list_filter = ['city']
     search_fields = ['name']
+    list_select_related = ['city']
 
 
 
 class TournamentTopicInline(admin.TabularInline):
     model = TournamentTopic
     extra = 8
+    autocomplete_fields = ['topic']
     verbose_name = "Тема турнира"
     verbose_name_plural = "Темы турнира"
 
 @admin.register(Tournament)  # ← Используем декоратор здесь
 class TournamentAdmin(admin.ModelAdmin):
-    list_display = ['name', 'series', 'date', 'city']
+    list_display = ['name', 'series', 'date', 'city', 'score_grid_link']
     list_filter = ['series', 'city', 'date']
     search_fields = ['name']
     ordering = ['-date']
+    list_select_related = ['series', 'city']
     inlines = [TournamentTopicInline]
 
+    # Ввод результатов всего турнира одной таблицей вместо карточек GameResult
+    def get_urls(self):
+        return [
+            path(
+                '<path:object_id>/scores/',
+                self.admin_site.admin_view(self.score_grid_view),
+                name='ratings_tournament_scores',
+            ),
+        ] + super().get_urls()
+
+    @admin.display(description='Результаты')
+    def score_grid_link(self, obj):
+        return format_html('<a href="{}">Таблица</a>', reverse('admin:ratings_tournament_scores', args=[obj.pk]))
+
+    def score_grid_view(self, request, object_id):
+        if not (request.user.has_perm('ratings.add_gameresult') and request.user.has_perm('ratings.change_gameresult')):
+            raise PermissionDenied
+        tournament = get_object_or_404(Tournament.objects.select_related('series', 'city'), pk=object_id)
+
+        if request.method == 'POST':
+            form = ScoreGridForm(tournament, request.POST, admin_site=self.admin_site)
+            if form.is_valid():
+                saved = form.save()
+                self.message_user(request, f'Сохранены результаты {saved} команд', messages.SUCCESS)
+                return redirect(request.path)
+        else:
+            form = ScoreGridForm(tournament, admin_site=self.admin_site)
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': f'Результаты: {tournament}',
+            'opts': self.model._meta,
+            'original': tournament,
+            'form': form,
+        }
+        return TemplateResponse(request, 'admin/ratings/tournament/score_grid.html', context)
+
+
+
+class TopicResultInlineFormSet(BaseInlineFormSet):
+    """Темы турнира читаются один раз на весь формсет: и для выпадающих списков, и для TopicResult.clean"""
+
+    @cached_property
+    def tournament_topics(self):
+        tournament_id = self.instance.tournament_id
+        if not tournament_id:
+            return list(Topic.objects.order_by('short_name'))
+        return list(Topic.objects.filter(tournamenttopic__tournament_id=tournament_id).order_by('tournamenttopic__order'))
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        topics = self.tournament_topics
+        form.fields['topic'].choices = [('', '---------')] + [(topic.pk, str(topic)) for topic in topics]
+        if self.instance.tournament_id:
+            form.instance.allowed_topic_ids = {topic.pk for topic in topics}
+        return form
 
 
 class TopicResultInline(admin.TabularInline):
     model = TopicResult
+    formset = TopicResultInlineFormSet
     extra = 7
+
+    def get_queryset(self, request):
+        # Каждая строка инлайна выводит __str__: результат игры, команду, турнир и их города
+        return super().get_queryset(request).select_related(
+            'topic', 'game_result__team__city', 'game_result__tournament__city'
+        )
     verbose_name = "Результат по теме"
     verbose_name_plural = "Результаты по темам"
 
@@ -55,6 +160,77 @@ class GameResultAdmin(admin.ModelAdmin):
     search_fields = ['team__name', 'tournament__name']
     exclude = ('total_points',)
     inlines = [TopicResultInline]
-    
+    # Выпадающие списки со всеми турнирами и командами заменены поиском
+    autocomplete_fields = ['tournament', 'team']
+    # __str__ команды и турнира показывают город; серию турнира в списке не джойним
+    list_select_related = ['team__city', 'tournament__city']
+    # На 100 тыс. результатов COUNT(*) без фильтров заменяется оценкой, второй COUNT при поиске не нужен
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(RatingJob)
+class RatingJobAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'object_id', 'status', 'attempts', 'run_after', 'updated_at']
+    list_filter = ['kind', 'status']
+    readonly_fields = ['kind', 'object_id', 'attempts', 'last_error', 'created_at', 'updated_at']
+    actions = ['retry_jobs']
+
+    @admin.action(description='Повторить выбранные задачи')
+    def retry_jobs(self, request, queryset):
+        for job in queryset.filter(status=RatingJob.STATUS_FAILED):
+            enqueue(job.kind, [job.object_id])
+            job.delete()
+
+
+@admin.register(TopicDifficulty)
+class TopicDifficultyAdmin(admin.ModelAdmin):
+    """Только просмотр: строки пересчитывает задача турнира (ratings/difficulty.py)"""
+    list_display = ['topic', 'scope', 'scope_object', 'games_count', 'mean_points', 'stdev_points', 'median_points', 'updated_at']
+    list_filter = ['scope', 'topic']
+    list_select_related = ['topic']
+    ordering = ['scope', 'object_id', 'topic__full_name']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='Объект')
+    def scope_object(self, obj):
+        if obj.scope == TopicDifficulty.SCOPE_SERIES:
+            series = get_reference_data().series_by_id.get(obj.object_id)
+            return series.name if series else f'Серия #{obj.object_id}'
+        if obj.scope == TopicDifficulty.SCOPE_TOURNAMENT:
+            return f'Турнир #{obj.object_id}'
+        return '-'
+
+    @admin.display(description='Средний балл')
+    def mean_points(self, obj):
+        return f'{obj.mean:.2f}'
+
+    @admin.display(description='Стандартное отклонение')
+    def stdev_points(self, obj):
+        return f'{obj.stdev:.2f}'
+
+    @admin.display(description='Медиана')
+    def median_points(self, obj):
+        return obj.percentile(0.5)
+
+
+@admin.register(Season)
+class SeasonAdmin(admin.ModelAdmin):
+    """Сезоны заводятся здесь, закрываются командой close_season (ratings/seasons.py)"""
+    list_display = ['name', 'start_date', 'end_date', 'closed_at']
+    ordering = ['-start_date']
+    readonly_fields = ['closed_at']
 
+    def get_readonly_fields(self, request, obj=None):
+        # Даты закрытого сезона не меняем: сводки собраны по ним. Сначала close_season --reopen
+        if obj is not None and obj.is_closed:
+            return ['start_date', 'end_date', 'closed_at']
+        return self.readonly_fields
 
+    def has_delete_permission(self, request, obj=None):
+        return obj is None or not obj.is_closed
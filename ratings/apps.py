@@ -7,4 +7,6 @@ class RatingsConfig(AppConfig):
     
     def ready(self):
         # Импортируем и подключаем сигналы
-        import ratings.signals
\ No newline at end of file
+        import ratings.signals
+        # Live-табло подписывается на пересчет мест
+        import ratings.live
\ No newline at end of file
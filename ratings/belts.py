@@ -0,0 +1,169 @@
+"""
+Повышения поясов: события "команда перешла на новый пояс или полоску" с турниром, который их вызвал.
+
+Уровень - номер пояса и полоски одним числом по порядку BELT_SYSTEM (Белый 0 = 0, Белый 1 = 1, ...).
+События пишутся в момент изменения очков, а не вычисляются по истории:
+- recalculate_tournament после сохранения итогов передает разницу total_points по командам турнира;
+  новые очки команды - одна сумма по индексу team_id, прежние - новые минус разница;
+- удаление результата (сигнал GameResult) - прежние очки команды это новые плюс очки удаленной строки.
+Понижения (исправление результатов, удаление игр) тоже записываются: в истории команды они видны,
+в ленте города - нет.
+
+Лента города и история команды - запросы по индексам (город, время) и (команда, время).
+Восстановить историю по всем играм (время события - дата турнира): python manage.py rebuild_belt_history
+"""
+from collections import defaultdict
+from datetime import datetime, time
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import BELT_SYSTEM, BeltPromotion, GameResult, Team, Tournament, get_belt_info
+
+
+# (номер пояса, число полосок, название) по возрастанию очков
+LEVELS = [
+    (belt_index, stripes, level['name'])
+    for belt_index, belt in enumerate(BELT_SYSTEM)
+    for stripes, level in enumerate(belt['levels'])
+]
+_LEVEL_INDEX = {(belt_index, stripes): index for index, (belt_index, stripes, _) in enumerate(LEVELS)}
+
+
+def level_of(score):
+    """Уровень по очкам. Очки - сумма половинок, но после вычитаний округляем, чтобы не поймать 99.999..."""
+    info = get_belt_info(round(score or 0, 6))
+    return _LEVEL_INDEX[(info['belt_index'], info['stripes_count'])]
+
+
+def level_name(level):
+    return LEVELS[level][2]
+
+
+def record(totals, tournament_id=None, created_at=None):
+    """
+    Записывает события для команд, у которых сменился уровень: totals - {team_id: (прежние очки, новые)}.
+    Город берется текущий: лента города показывает, кто повысился, пока играл за него
+    """
+    changes = {
+        team_id: (level_of(old), level_of(new), new)
+        for team_id, (old, new) in totals.items()
+    }
+    changes = {team_id: change for team_id, change in changes.items() if change[0] != change[1]}
+    if not changes:
+        return 0
+    cities = dict(Team.objects.filter(id__in=list(changes)).values_list('id', 'city_id'))
+    created_at = created_at or timezone.now()
+    BeltPromotion.objects.bulk_create([
+        BeltPromotion(
+            team_id=team_id, city_id=cities[team_id], tournament_id=tournament_id,
+            from_level=from_level, to_level=to_level, total_points=points, created_at=created_at,
+        )
+        for team_id, (from_level, to_level, points) in changes.items()
+        if team_id in cities
+    ])
+    return len(changes)
+
+
+def _team_totals(team_ids):
+    return dict(
+        GameResult.objects.filter(team_id__in=team_ids).values('team_id')
+        .annotate(total=Sum('total_points')).values_list('team_id', 'total')
+    )
+
+
+def record_tournament(tournament_id, deltas):
+    """Из recalculate_tournament: deltas - {team_id: новые total_points результата минус прежние}"""
+    deltas = {team_id: delta for team_id, delta in deltas.items() if delta}
+    if not deltas:
+        return 0
+    # Два воркера с разными турнирами одной команды: второй ждет коммита первого и считает сумму уже с его очками,
+    # иначе оба увидели бы только свою разницу и пропустили переход
+    list(Team.objects.select_for_update().filter(id__in=list(deltas)).order_by('id').values_list('id', flat=True))
+    totals = _team_totals(list(deltas))
+    return record(
+        {team_id: ((totals.get(team_id) or 0.0) - delta, totals.get(team_id) or 0.0) for team_id, delta in deltas.items()},
+        tournament_id,
+    )
+
+
+def record_result_deleted(result):
+    """Из сигнала удаления GameResult: строки в БД уже нет, ее очки были в прежней сумме команды"""
+    if not result.total_points:
+        return 0
+    total = _team_totals([result.team_id]).get(result.team_id) or 0.0
+    return record({result.team_id: (total + result.total_points, total)}, result.tournament_id)
+
+
+def forget_deleted_team(team_id):
+    """
+    События удаленной команды. Внешнего ключа в БД нет: при каскадном удалении команды ее результаты
+    удаляются первыми и успевают записать события - их убирает задача команды
+    """
+    if Team.objects.filter(id=team_id).exists():
+        return False
+    deleted, _ = BeltPromotion.objects.filter(team_id=team_id).delete()
+    return bool(deleted)
+
+
+def with_tournaments(events):
+    """Проставляет событиям турнир одним запросом (турнир мог быть удален - тогда None)"""
+    events = list(events)
+    tournaments = Tournament.objects.in_bulk({event.tournament_id for event in events if event.tournament_id})
+    for event in events:
+        event.tournament = tournaments.get(event.tournament_id)
+    return events
+
+
+def city_feed(city_ids=None):
+    """Повышения в городах city_ids (None - во всех), новые сверху. Queryset - для постраничного вывода"""
+    events = BeltPromotion.objects.filter(to_level__gt=F('from_level')).select_related('team', 'team__city')
+    if city_ids is not None:
+        events = events.filter(city_id__in=city_ids)
+    return events
+
+
+def team_history(team_id, limit=20):
+    """Последние переходы команды между уровнями (и вверх, и вниз), новые сверху"""
+    return with_tournaments(BeltPromotion.objects.filter(team_id=team_id)[:limit])
+
+
+def expected_history():
+    """
+    История по всем играм: команда проходит турниры по дате и копит очки, каждый переход уровня - событие
+    со временем начала дня турнира. [BeltPromotion, ...] без сохранения
+    """
+    by_team = defaultdict(list)
+    results = GameResult.objects.order_by('tournament__date', 'tournament_id').values_list(
+        'team_id', 'tournament_id', 'tournament__date', 'total_points',
+    )
+    for team_id, tournament_id, date, points in results.iterator(chunk_size=5000):
+        by_team[team_id].append((tournament_id, date, points))
+    cities = dict(Team.objects.values_list('id', 'city_id'))
+
+    events = []
+    for team_id, games in by_team.items():
+        if team_id not in cities:
+            continue
+        total, level = 0.0, level_of(0)
+        for tournament_id, date, points in games:
+            total += points
+            new_level = level_of(total)
+            if new_level != level:
+                events.append(BeltPromotion(
+                    team_id=team_id, city_id=cities[team_id], tournament_id=tournament_id,
+                    from_level=level, to_level=new_level, total_points=total,
+                    created_at=timezone.make_aware(datetime.combine(date, time.min)),
+                ))
+                level = new_level
+    return events
+
+
+def rebuild_history():
+    """Заменяет все события восстановленной историей. Возвращает число событий"""
+    events = expected_history()
+    with transaction.atomic():
+        BeltPromotion.objects.all().delete()
+        BeltPromotion.objects.bulk_create(events, batch_size=1000)
+    return len(events)
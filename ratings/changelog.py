@@ -0,0 +1,143 @@
+"""
+Журнал изменений результатов: упорядоченная лента create/update/delete для GameResult, TopicResult,
+TournamentTopic и Tournament.
+
+Записи делают сигналы (ratings/signals.py). Сигналы обходят только две массовые записи, и они пишут журнал сами
+через record_many: таблица результатов в админке (forms.ScoreGridForm) и bulk_update итогов в
+recalculate_tournament (через него же идут исправления audit_ratings --repair). seed_load_data журнал не пишет:
+он заполняет пустую базу до появления потребителей. Запись идет в той же транзакции, что и изменение,
+поэтому откаченное изменение не попадает в журнал.
+
+Потребитель хранит номер последней обработанной записи и после простоя дочитывает только то, что изменилось.
+Так работает manage.py audit_ratings --changed - проверяет только турниры, измененные после прошлого запуска:
+
+    for batch in changelog.batches('audit_ratings'):
+        audit(changelog.changed_tournaments(batch))
+        changelog.ack('audit_ratings', batch[-1].seq)
+
+Обзор и очистка: python manage.py changelog
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import ChangeConsumer, ChangeLogEntry
+
+
+BATCH_SIZE = 500
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def record(instance, action, tournament_id=None):
+    """Одна запись для сохраненного или удаленного объекта"""
+    ChangeLogEntry.objects.create(
+        model=instance._meta.model_name, object_id=instance.pk, action=action, tournament_id=tournament_id,
+    )
+
+
+def record_many(model, changes):
+    """Записи для массовых операций: changes - [(object_id, action, tournament_id), ...]"""
+    now = timezone.now()
+    ChangeLogEntry.objects.bulk_create([
+        ChangeLogEntry(
+            model=model._meta.model_name, object_id=object_id, action=action, tournament_id=tournament_id, created_at=now,
+        )
+        for object_id, action, tournament_id in changes
+    ])
+
+
+def head():
+    """Номер последней записи журнала (0, если журнал пуст)"""
+    return ChangeLogEntry.objects.aggregate(seq=Max('seq'))['seq'] or 0
+
+
+def register(name, from_head=True):
+    """
+    Заводит потребителя. Новый потребитель обычно сначала строит свои данные целиком,
+    поэтому по умолчанию начинает с текущего конца журнала, а не с начала.
+    """
+    consumer, _ = ChangeConsumer.objects.get_or_create(name=name, defaults={'last_seq': head() if from_head else 0})
+    return consumer
+
+
+def read(name, limit=BATCH_SIZE):
+    """
+    Следующие записи после позиции потребителя, по возрастанию seq.
+
+    Номера выдаются при вставке, а видны записи после коммита, поэтому запись с меньшим номером может появиться
+    позже записи с большим. На пропуске в номерах чтение останавливается, пока более поздняя запись моложе
+    RATINGS_CHANGELOG_GAP_SECONDS: за это время транзакция либо закоммитится, либо пропуск остался от отката.
+    """
+    position = register(name).last_seq
+    entries = list(ChangeLogEntry.objects.filter(seq__gt=position).order_by('seq')[:limit])
+
+    gap_deadline = timezone.now() - timedelta(seconds=_setting('RATINGS_CHANGELOG_GAP_SECONDS', 60))
+    expected = position + 1
+    for index, entry in enumerate(entries):
+        if entry.seq != expected and entry.created_at > gap_deadline:
+            return entries[:index]
+        expected = entry.seq + 1
+    return entries
+
+
+def ack(name, seq):
+    """Подтверждает обработку записей до seq включительно; позиция только растет"""
+    ChangeConsumer.objects.filter(name=name, last_seq__lt=seq).update(last_seq=seq, updated_at=timezone.now())
+
+
+def batches(name, limit=BATCH_SIZE):
+    """
+    Пачки непрочитанных записей, пока журнал не дочитан. Позицию двигает сам потребитель через ack
+    после обработки пачки; без ack следующая пачка начнется с того же места.
+    """
+    while True:
+        entries = read(name, limit)
+        if not entries:
+            return
+        yield entries
+        if register(name).last_seq < entries[-1].seq:
+            # Пачку не подтвердили - не крутимся на ней бесконечно
+            return
+
+
+def changed_tournaments(entries):
+    """Турниры, которых касаются записи"""
+    return {entry.tournament_id for entry in entries if entry.tournament_id is not None}
+
+
+def stats():
+    """Размер журнала и отставание каждого потребителя"""
+    bounds = ChangeLogEntry.objects.aggregate(first=Min('seq'), last=Max('seq'))
+    last = bounds['last'] or 0
+    return {
+        'first': bounds['first'] or 0,
+        'last': last,
+        'entries': ChangeLogEntry.objects.count(),
+        'consumers': [
+            (consumer.name, consumer.last_seq, max(last - consumer.last_seq, 0), consumer.updated_at)
+            for consumer in ChangeConsumer.objects.order_by('name')
+        ],
+    }
+
+
+def prune(retention_days=None):
+    """
+    Удаляет записи старше retention_days, которые уже подтвердили все потребители.
+    Последнюю запись не удаляем никогда: в SQLite без нее номера начались бы заново.
+    """
+    if retention_days is None:
+        retention_days = _setting('RATINGS_CHANGELOG_RETENTION_DAYS', 30)
+    last = head()
+    limit = last - 1
+    slowest = ChangeConsumer.objects.aggregate(seq=Min('last_seq'))['seq']
+    if slowest is not None:
+        limit = min(limit, slowest)
+    deleted, _ = ChangeLogEntry.objects.filter(
+        seq__lte=limit, created_at__lt=timezone.now() - timedelta(days=retention_days),
+    ).delete()
+    return deleted
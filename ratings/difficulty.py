@@ -0,0 +1,217 @@
+"""
+Сложность тем: сколько очков команды набирают по каждой теме в турнире, в серии и за все время.
+
+Строки турнира пересчитывает задача очереди (recalculate_tournament) по topic_scores. Итоги серии
+и всего сайта не пересобираются целиком: к ним прибавляется разница между новыми и прежними строками турнира.
+Полный пересчет (после сбоев или для старых данных): python manage.py rebuild_topic_difficulty
+
+Для карточки команды итоги серий и всего сайта держатся в памяти процесса, версия - в общем кеше
+(reference.VersionedSnapshot, как у справочников).
+"""
+from collections import Counter, defaultdict, namedtuple
+
+from django.db import transaction
+
+from .models import GameResult, TopicDifficulty
+from .reference import VersionedSnapshot
+
+
+VERSION_KEY = 'ratings:difficulty_version'
+
+DifficultyRef = namedtuple('DifficultyRef', ['games_count', 'mean', 'stdev'])
+
+
+class Stats:
+    """Складываемая статистика одной темы в одном разрезе"""
+
+    def __init__(self, games_count=0, points_sum=0.0, points_sq_sum=0.0, histogram=None):
+        self.games_count = games_count
+        self.points_sum = points_sum
+        self.points_sq_sum = points_sq_sum
+        self.histogram = Counter(histogram or {})
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.games_count, row.points_sum, row.points_sq_sum, row.histogram)
+
+    def add_points(self, points):
+        self.games_count += 1
+        self.points_sum += points
+        self.points_sq_sum += points * points
+        self.histogram[str(float(points))] += 1
+
+    def add(self, other, sign=1):
+        self.games_count += sign * other.games_count
+        self.points_sum += sign * other.points_sum
+        self.points_sq_sum += sign * other.points_sq_sum
+        for points, count in other.histogram.items():
+            self.histogram[points] += sign * count
+
+    def apply_to(self, row):
+        row.games_count = self.games_count
+        row.points_sum = self.points_sum
+        row.points_sq_sum = self.points_sq_sum
+        row.histogram = {points: count for points, count in self.histogram.items() if count > 0}
+
+    def as_key(self):
+        return (self.games_count, round(self.points_sum, 6), round(self.points_sq_sum, 6), +self.histogram)
+
+
+def collect_topic_stats(topic_scores_list):
+    """{topic_id: Stats} по списку topic_scores результатов; несыгранные темы (None) не считаются"""
+    stats = defaultdict(Stats)
+    for topic_scores in topic_scores_list:
+        for topic_id, points in topic_scores:
+            if points is not None:
+                stats[topic_id].add_points(points)
+    return stats
+
+
+def refresh_tournament(tournament_id, series_id, topic_scores_list):
+    """
+    Обновляет строки турнира и прибавляет разницу к итогам серии и всего сайта.
+    Вызывается из recalculate_tournament внутри транзакции задачи; series_id = None - турнир удален.
+    """
+    old_rows = list(TopicDifficulty.objects.filter(scope=TopicDifficulty.SCOPE_TOURNAMENT, object_id=tournament_id))
+    new_stats = collect_topic_stats(topic_scores_list) if series_id is not None else {}
+
+    old_state = {row.topic_id: (row.series_id, Stats.from_row(row).as_key()) for row in old_rows}
+    new_state = {topic_id: (series_id, stats.as_key()) for topic_id, stats in new_stats.items()}
+    if old_state == new_state:
+        return False
+
+    # Разница для итогов: (scope, object_id, topic_id) -> Stats
+    deltas = defaultdict(Stats)
+    for row in old_rows:
+        old = Stats.from_row(row)
+        if row.series_id is not None:
+            deltas[(TopicDifficulty.SCOPE_SERIES, row.series_id, row.topic_id)].add(old, -1)
+        deltas[(TopicDifficulty.SCOPE_ALL, 0, row.topic_id)].add(old, -1)
+    for topic_id, stats in new_stats.items():
+        deltas[(TopicDifficulty.SCOPE_SERIES, series_id, topic_id)].add(stats)
+        deltas[(TopicDifficulty.SCOPE_ALL, 0, topic_id)].add(stats)
+    apply_deltas(deltas)
+
+    TopicDifficulty.objects.filter(scope=TopicDifficulty.SCOPE_TOURNAMENT, object_id=tournament_id).delete()
+    rows = []
+    for topic_id, stats in new_stats.items():
+        row = TopicDifficulty(
+            scope=TopicDifficulty.SCOPE_TOURNAMENT, object_id=tournament_id, topic_id=topic_id, series_id=series_id,
+        )
+        stats.apply_to(row)
+        rows.append(row)
+    TopicDifficulty.objects.bulk_create(rows)
+
+    transaction.on_commit(bump_version)
+    return True
+
+
+def apply_deltas(deltas):
+    """Прибавляет разницу к итоговым строкам под блокировкой, чтобы параллельные воркеры не потеряли обновления"""
+    keys = [key for key, delta in deltas.items() if delta.as_key() != Stats().as_key()]
+    if not keys:
+        return
+
+    # Недостающие строки создаем пустыми заранее: конфликт при одновременной вставке просто игнорируется
+    TopicDifficulty.objects.bulk_create(
+        [
+            TopicDifficulty(scope=scope, object_id=object_id, topic_id=topic_id,
+                            series_id=object_id if scope == TopicDifficulty.SCOPE_SERIES else None)
+            for scope, object_id, topic_id in keys
+        ],
+        ignore_conflicts=True,
+    )
+
+    topic_ids = {topic_id for _, _, topic_id in keys}
+    rows = {
+        (row.scope, row.object_id, row.topic_id): row
+        for row in TopicDifficulty.objects.select_for_update().filter(
+            scope__in=[TopicDifficulty.SCOPE_SERIES, TopicDifficulty.SCOPE_ALL], topic_id__in=topic_ids,
+        ).order_by('id')
+    }
+
+    changed, empty = [], []
+    for key in keys:
+        row = rows.get(key)
+        if row is None:
+            # Тему удалили, пока шла задача
+            continue
+        stats = Stats.from_row(row)
+        stats.add(deltas[key])
+        stats.apply_to(row)
+        (changed if row.games_count > 0 else empty).append(row)
+
+    if changed:
+        TopicDifficulty.objects.bulk_update(changed, ['games_count', 'points_sum', 'points_sq_sum', 'histogram'])
+    if empty:
+        TopicDifficulty.objects.filter(id__in=[row.id for row in empty]).delete()
+
+
+def rebuild_all():
+    """Полный пересчет всех строк по topic_scores. Возвращает число строк"""
+    by_tournament = defaultdict(list)
+    series_of = {}
+    for tournament_id, series_id, topic_scores in GameResult.objects.values_list(
+        'tournament_id', 'tournament__series_id', 'topic_scores'
+    ).iterator(chunk_size=5000):
+        by_tournament[tournament_id].append(topic_scores)
+        series_of[tournament_id] = series_id
+
+    totals = defaultdict(Stats)
+    rows = []
+    for tournament_id, topic_scores_list in by_tournament.items():
+        series_id = series_of[tournament_id]
+        for topic_id, stats in collect_topic_stats(topic_scores_list).items():
+            row = TopicDifficulty(
+                scope=TopicDifficulty.SCOPE_TOURNAMENT, object_id=tournament_id, topic_id=topic_id, series_id=series_id,
+            )
+            stats.apply_to(row)
+            rows.append(row)
+            totals[(TopicDifficulty.SCOPE_SERIES, series_id, topic_id)].add(stats)
+            totals[(TopicDifficulty.SCOPE_ALL, 0, topic_id)].add(stats)
+
+    for (scope, object_id, topic_id), stats in totals.items():
+        row = TopicDifficulty(
+            scope=scope, object_id=object_id, topic_id=topic_id,
+            series_id=object_id if scope == TopicDifficulty.SCOPE_SERIES else None,
+        )
+        stats.apply_to(row)
+        rows.append(row)
+
+    with transaction.atomic():
+        TopicDifficulty.objects.all().delete()
+        TopicDifficulty.objects.bulk_create(rows, batch_size=1000)
+        transaction.on_commit(bump_version)
+    return len(rows)
+
+
+class DifficultySnapshot:
+    """Итоги серий и всего сайта в памяти: {(scope, object_id): {topic_id: DifficultyRef}}"""
+
+    def __init__(self, version):
+        self.version = version
+        self.scopes = defaultdict(dict)
+        for row in TopicDifficulty.objects.filter(
+            scope__in=[TopicDifficulty.SCOPE_SERIES, TopicDifficulty.SCOPE_ALL]
+        ).only('scope', 'object_id', 'topic_id', 'games_count', 'points_sum', 'points_sq_sum'):
+            self.scopes[(row.scope, row.object_id)][row.topic_id] = DifficultyRef(row.games_count, row.mean, row.stdev)
+
+    def z_score(self, topic_id, value, series_id=None):
+        """
+        Насколько value выше среднего по теме в стандартных отклонениях.
+        С series_id сравнивается с играми серии, иначе со всеми играми; None, если сравнивать не с чем.
+        """
+        if series_id is not None:
+            scope = (TopicDifficulty.SCOPE_SERIES, series_id)
+        else:
+            scope = (TopicDifficulty.SCOPE_ALL, 0)
+        stats = self.scopes.get(scope, {}).get(topic_id)
+        if stats is None or stats.games_count < 2 or not stats.stdev:
+            return None
+        return (value - stats.mean) / stats.stdev
+
+
+_difficulty = VersionedSnapshot(VERSION_KEY, DifficultySnapshot)
+get_version = _difficulty.get_version
+bump_version = _difficulty.bump_version
+get_difficulty = _difficulty.get
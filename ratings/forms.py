@@ -0,0 +1,228 @@
+from decimal import Decimal
+
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.db import transaction
+from django.db.models import Q
+
+from . import changelog
+from .models import ChangeLogEntry, GameResult, Team, TopicResult, TournamentTopic
+from .signals import recalculate_tournament
+
+
+# Сколько пустых строк для новых команд показывать в таблице (как extra у инлайнов)
+EXTRA_ROWS = 5
+
+
+def _points_field():
+    return forms.DecimalField(
+        max_digits=4, decimal_places=1, required=False,
+        widget=forms.NumberInput(attrs={'step': '0.1', 'class': 'score-cell'}),
+    )
+
+
+def _black_box_fields():
+    answer = forms.CharField(max_length=100, required=False, widget=forms.TextInput(attrs={'class': 'score-answer'}))
+    points = forms.DecimalField(
+        max_digits=6, decimal_places=1, required=False,
+        widget=forms.NumberInput(attrs={'step': '0.1', 'class': 'score-cell'}),
+    )
+    return answer, points
+
+
+class ScoreGridForm(forms.Form):
+    """
+    Таблица результатов всего турнира: команды x темы (в порядке TournamentTopic) + черный ящик.
+    Проверяется целиком, а сохраняется одной транзакцией с пересчетом мест один раз.
+    """
+
+    def __init__(self, tournament, *args, admin_site=admin.site, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tournament = tournament
+
+        self.topics = [
+            tournament_topic.topic
+            for tournament_topic in TournamentTopic.objects.filter(tournament=tournament)
+            .select_related('topic').order_by('order')
+        ]
+        self.results = list(
+            GameResult.objects.filter(tournament=tournament).select_related('team').order_by('team__name')
+        )
+
+        existing_points = {
+            (game_result_id, topic_id): points
+            for game_result_id, topic_id, points in TopicResult.objects.filter(
+                game_result__tournament=tournament
+            ).values_list('game_result_id', 'topic_id', 'points')
+        }
+
+        # Строки уже участвующих команд
+        for result in self.results:
+            prefix = f'team_{result.team_id}'
+            for topic in self.topics:
+                field = _points_field()
+                field.initial = existing_points.get((result.id, topic.id))
+                self.fields[f'{prefix}_topic_{topic.id}'] = field
+            answer, points = _black_box_fields()
+            answer.initial = result.black_box_answer
+            points.initial = result.black_box_points
+            self.fields[f'{prefix}_bb_answer'] = answer
+            self.fields[f'{prefix}_bb_points'] = points
+
+        # Пустые строки для новых команд. Команда выбирается поиском (как autocomplete_fields в админке GameResult):
+        # список всех команд в каждой строке - тысячи <option> на странице. queryset только проверяет выбор
+        available_teams = Team.objects.exclude(id__in=[result.team_id for result in self.results])
+        team_field = GameResult._meta.get_field('team')
+        for i in range(EXTRA_ROWS):
+            prefix = f'new_{i}'
+            self.fields[f'{prefix}_team'] = forms.ModelChoiceField(
+                queryset=available_teams, required=False,
+                widget=AutocompleteSelect(team_field, admin_site, attrs={'data-placeholder': 'Команда'}),
+            )
+            for topic in self.topics:
+                self.fields[f'{prefix}_topic_{topic.id}'] = _points_field()
+            answer, points = _black_box_fields()
+            self.fields[f'{prefix}_bb_answer'] = answer
+            self.fields[f'{prefix}_bb_points'] = points
+
+        self.existing_points = existing_points
+
+    # Строки для шаблона: название команды (или поле выбора) + ячейки по темам + черный ящик
+    def rows(self):
+        rows = []
+        for result in self.results:
+            prefix = f'team_{result.team_id}'
+            rows.append(self._row(prefix, team_name=result.team.name))
+        for i in range(EXTRA_ROWS):
+            prefix = f'new_{i}'
+            rows.append(self._row(prefix, team_field=self[f'{prefix}_team']))
+        return rows
+
+    def _row(self, prefix, team_name=None, team_field=None):
+        return {
+            'team_name': team_name,
+            'team_field': team_field,
+            'cells': [self[f'{prefix}_topic_{topic.id}'] for topic in self.topics],
+            'bb_answer': self[f'{prefix}_bb_answer'],
+            'bb_points': self[f'{prefix}_bb_points'],
+        }
+
+    def _row_values(self, prefix):
+        data = self.cleaned_data
+        return (
+            {topic.id: data.get(f'{prefix}_topic_{topic.id}') for topic in self.topics},
+            data.get(f'{prefix}_bb_answer'),
+            data.get(f'{prefix}_bb_points'),
+        )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        seen_teams = set()
+        for i in range(EXTRA_ROWS):
+            prefix = f'new_{i}'
+            if f'{prefix}_team' in self.errors:
+                continue
+            team = cleaned_data.get(f'{prefix}_team')
+            points, answer, black_box_points = self._row_values(prefix)
+            has_values = any(value is not None for value in points.values()) or answer or black_box_points is not None
+            if team is None:
+                if has_values:
+                    self.add_error(f'{prefix}_team', 'Выберите команду для заполненной строки')
+                continue
+            if team.id in seen_teams:
+                self.add_error(f'{prefix}_team', f'Команда "{team.name}" выбрана несколько раз')
+            seen_teams.add(team.id)
+        return cleaned_data
+
+    def _collect_rows(self):
+        """Список (team_id, {topic_id: points}, ответ, очки за черный ящик) для всех заполненных строк"""
+        rows = []
+        for result in self.results:
+            rows.append((result.team_id, *self._row_values(f'team_{result.team_id}')))
+        for i in range(EXTRA_ROWS):
+            prefix = f'new_{i}'
+            team = self.cleaned_data.get(f'{prefix}_team')
+            if team is not None:
+                rows.append((team.id, *self._row_values(prefix)))
+        return rows
+
+    @transaction.atomic
+    def save(self):
+        rows = self._collect_rows()
+        if not rows:
+            return 0
+
+        # 1. Результаты команд: одна вставка с обновлением при конфликте
+        GameResult.objects.bulk_create(
+            [
+                GameResult(
+                    tournament=self.tournament,
+                    team_id=team_id,
+                    black_box_answer=answer or '-',
+                    black_box_points=black_box_points if black_box_points is not None else Decimal('0.0'),
+                )
+                for team_id, _, answer, black_box_points in rows
+            ],
+            update_conflicts=True,
+            unique_fields=['tournament', 'team'],
+            update_fields=['black_box_answer', 'black_box_points'],
+        )
+        result_ids = dict(
+            GameResult.objects.filter(tournament=self.tournament).values_list('team_id', 'id')
+        )
+        # bulk_create обходит сигналы: вставки и обновления пишем в журнал изменений сами, только измененные строки
+        existing_results = {result.team_id: result for result in self.results}
+        result_changes = []
+        for team_id, _, answer, black_box_points in rows:
+            old = existing_results.get(team_id)
+            if old is None:
+                result_changes.append((result_ids[team_id], ChangeLogEntry.ACTION_CREATE, self.tournament.id))
+            elif (old.black_box_answer, old.black_box_points) != (
+                answer or '-', black_box_points if black_box_points is not None else Decimal('0.0')
+            ):
+                result_changes.append((old.id, ChangeLogEntry.ACTION_UPDATE, self.tournament.id))
+        changelog.record_many(GameResult, result_changes)
+
+        # 2. Очки по темам: заполненные ячейки вставляем/обновляем, очищенные удаляем
+        topic_results = []
+        cleared = []
+        for team_id, points, _, _ in rows:
+            game_result_id = result_ids[team_id]
+            for topic_id, value in points.items():
+                if value is not None:
+                    topic_results.append(TopicResult(game_result_id=game_result_id, topic_id=topic_id, points=value))
+                elif (game_result_id, topic_id) in self.existing_points:
+                    cleared.append((game_result_id, topic_id))
+
+        topic_changes = []
+        if topic_results:
+            TopicResult.objects.bulk_create(
+                topic_results,
+                update_conflicts=True,
+                unique_fields=['game_result', 'topic'],
+                update_fields=['points'],
+            )
+            topic_result_ids = {
+                (game_result_id, topic_id): topic_result_id
+                for topic_result_id, game_result_id, topic_id in TopicResult.objects.filter(
+                    game_result__tournament=self.tournament
+                ).values_list('id', 'game_result_id', 'topic_id')
+            }
+            for topic_result in topic_results:
+                key = (topic_result.game_result_id, topic_result.topic_id)
+                if key not in self.existing_points:
+                    topic_changes.append((topic_result_ids[key], ChangeLogEntry.ACTION_CREATE, self.tournament.id))
+                elif self.existing_points[key] != topic_result.points:
+                    topic_changes.append((topic_result_ids[key], ChangeLogEntry.ACTION_UPDATE, self.tournament.id))
+        if cleared:
+            condition = Q()
+            for game_result_id, topic_id in cleared:
+                condition |= Q(game_result_id=game_result_id, topic_id=topic_id)
+            # QuerySet.delete() отправляет post_delete, удаление в журнал пишет сигнал
+            TopicResult.objects.filter(condition).delete()
+        changelog.record_many(TopicResult, topic_changes)
+
+        # 3. Итоги и места пересчитываем один раз на весь турнир
+        recalculate_tournament(self.tournament.id)
+        return len(rows)
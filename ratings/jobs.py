@@ -0,0 +1,126 @@
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import RatingJob
+
+
+# Обработчики задач по типу. Пути строками, чтобы не было циклического импорта с signals.py
+HANDLERS = {
+    RatingJob.KIND_TOURNAMENT: 'ratings.signals.recalculate_tournament',
+    RatingJob.KIND_TEAM: 'ratings.rankings.refresh_team',
+    RatingJob.KIND_SEASON: 'ratings.seasons.freeze',
+    RatingJob.KIND_STANDINGS: 'ratings.standings.refresh_series',
+}
+
+# Через сколько секунд повторять упавшую задачу: 10, 20, 40, ... но не дольше 10 минут
+RETRY_BASE_DELAY = 10
+RETRY_MAX_DELAY = 600
+# Задача в статусе running дольше этого времени считается брошенной упавшим воркером
+STALE_RUNNING_AFTER = timedelta(minutes=10)
+
+
+def enqueue(kind, object_ids):
+    """
+    Ставит задачи в очередь в той же транзакции, что и изменение данных.
+    Если задача для объекта уже ожидает, новая не создается.
+    """
+    object_ids = {object_id for object_id in object_ids if object_id is not None}
+    if not object_ids:
+        return
+
+    if getattr(settings, 'RATINGS_JOBS_EAGER', False):
+        # Режим без воркера (локальная разработка): считаем сразу после коммита
+        handler = import_string(HANDLERS[kind])
+        for object_id in object_ids:
+            transaction.on_commit(lambda object_id=object_id: handler(object_id))
+        return
+
+    RatingJob.objects.bulk_create(
+        [RatingJob(kind=kind, object_id=object_id) for object_id in object_ids],
+        ignore_conflicts=True,
+    )
+
+
+def enqueue_tournament(tournament_id):
+    enqueue(RatingJob.KIND_TOURNAMENT, [tournament_id])
+
+
+def enqueue_teams(team_ids):
+    enqueue(RatingJob.KIND_TEAM, team_ids)
+
+
+def claim_job():
+    """Забирает одну готовую задачу. Несколько воркеров на Postgres не получат одну и ту же (skip_locked)"""
+    with transaction.atomic():
+        job = (
+            RatingJob.objects.select_for_update(skip_locked=True)
+            .filter(status=RatingJob.STATUS_PENDING, run_after__lte=timezone.now())
+            .order_by('run_after', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = RatingJob.STATUS_RUNNING
+        job.attempts += 1
+        job.save(update_fields=['status', 'attempts', 'updated_at'])
+    return job
+
+
+def _return_to_queue(job, **fields):
+    # Пока задача выполнялась, для того же объекта могла появиться новая ожидающая - тогда старая не нужна
+    try:
+        with transaction.atomic():
+            RatingJob.objects.filter(id=job.id).update(status=RatingJob.STATUS_PENDING, updated_at=timezone.now(), **fields)
+    except IntegrityError:
+        RatingJob.objects.filter(id=job.id).delete()
+
+
+def run_job(job, max_attempts):
+    """Выполняет задачу: при успехе удаляет ее, при ошибке откладывает повтор или помечает как failed"""
+    handler = import_string(HANDLERS[job.kind])
+    try:
+        with transaction.atomic():
+            handler(job.object_id)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= max_attempts:
+            RatingJob.objects.filter(id=job.id).update(
+                status=RatingJob.STATUS_FAILED, last_error=error, updated_at=timezone.now(),
+            )
+        else:
+            delay = min(RETRY_BASE_DELAY * 2 ** (job.attempts - 1), RETRY_MAX_DELAY)
+            _return_to_queue(job, last_error=error, run_after=timezone.now() + timedelta(seconds=delay))
+        return False
+
+    RatingJob.objects.filter(id=job.id).delete()
+    return True
+
+
+def requeue_stale_jobs():
+    """Возвращает в очередь задачи, которые остались в running после падения воркера"""
+    stale = RatingJob.objects.filter(
+        status=RatingJob.STATUS_RUNNING, updated_at__lt=timezone.now() - STALE_RUNNING_AFTER,
+    )
+    count = 0
+    for job in stale:
+        _return_to_queue(job)
+        count += 1
+    return count
+
+
+def backlog():
+    """Размер очереди: {статус: количество} плюс сколько задач уже можно выполнять"""
+    stats = {status: 0 for status, _ in RatingJob.STATUSES}
+    stats.update(
+        RatingJob.objects.values_list('status').annotate(count=Count('id')).order_by()
+    )
+    stats['ready'] = RatingJob.objects.filter(
+        status=RatingJob.STATUS_PENDING, run_after__lte=timezone.now()
+    ).count()
+    return stats
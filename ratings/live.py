@@ -0,0 +1,249 @@
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import GameResult
+from .signals import tournament_recalculated
+
+
+# Live-табло турнира: после каждого пересчета мест считаем таблицу один раз
+# и рассылаем изменения всем подключенным зрителям через брокер.
+
+SNAPSHOT_KEY = 'ratings:live:{tournament_id}'
+# Отдельный кеш для таблиц и сообщений (CACHES['live']): их много, и в общем кеше они вытесняли бы чужие ключи
+LIVE_CACHE_ALIAS = 'live'
+# Сколько сообщений может накопиться у медленного зрителя, прежде чем старые начнут отбрасываться
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+def channel_name(tournament_id):
+    return f'tournament:{tournament_id}'
+
+
+def live_cache_alias():
+    return LIVE_CACHE_ALIAS if LIVE_CACHE_ALIAS in settings.CACHES else DEFAULT_CACHE_ALIAS
+
+
+class Broker:
+    """
+    Интерфейс брокера сообщений.
+    publish вызывается из синхронного кода (сигналы), subscribe - из асинхронного SSE-view.
+    process_local - сообщения видны только подписчикам того же процесса: пересчеты из воркера очереди
+    до зрителей не дойдут.
+    """
+
+    process_local = False
+
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    async def subscribe(self, channel, heartbeat=None):
+        """
+        Асинхронный генератор сообщений канала.
+        Сразу после подписки отдает None, дальше - None раз в heartbeat секунд без сообщений.
+        """
+        raise NotImplementedError
+        yield
+
+
+class LocalBroker(Broker):
+    """
+    Брокер внутри одного процесса: годится только вместе с RATINGS_JOBS_EAGER = True (пересчет идет в том же
+    процессе, что и SSE) и для локальной проверки
+    """
+
+    process_local = True
+
+    def __init__(self, **options):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._put, queue, message)
+
+    @staticmethod
+    def _put(queue, message):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+    async def subscribe(self, channel, heartbeat=None):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE))
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscriber)
+        try:
+            yield None
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber[1].get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                self._subscribers.get(channel, set()).discard(subscriber)
+
+
+class CacheBroker(Broker):
+    """
+    Брокер через общий кеш Django (по умолчанию CACHES['live'], без него - default): воркер очереди кладет
+    сообщение под следующим номером канала, SSE-view раз в poll_interval секунд забирает новые номера. Работает между процессами, если кеш общий
+    (файловый на одном сервере, Redis, Memcached). С LocMemCache сообщения остаются в процессе.
+    Файловый кеш увеличивает номер не атомарно: два воркера, одновременно пересчитавшие один турнир,
+    могут затереть сообщение друг друга - зритель получит изменения со следующим пересчетом.
+    """
+
+    SEQUENCE_KEY = 'ratings:live:seq:{channel}'
+    MESSAGE_KEY = 'ratings:live:msg:{channel}:{number}'
+
+    def __init__(self, cache_alias=None, poll_interval=0.5, message_timeout=60, **options):
+        self.cache_alias = cache_alias or live_cache_alias()
+        self.poll_interval = poll_interval
+        self.message_timeout = message_timeout
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    @property
+    def process_local(self):
+        return isinstance(self.cache, (LocMemCache, DummyCache))
+
+    def publish(self, channel, message):
+        key = self.SEQUENCE_KEY.format(channel=channel)
+        self.cache.add(key, 0, timeout=None)
+        try:
+            number = self.cache.incr(key)
+        except ValueError:
+            # Номер пропал из кеша (очистка) - начинаем заново, подписчики увидят номер меньше своего
+            self.cache.set(key, 1, timeout=None)
+            number = 1
+        self.cache.set(self.MESSAGE_KEY.format(channel=channel, number=number), message, self.message_timeout)
+
+    async def subscribe(self, channel, heartbeat=None):
+        key = self.SEQUENCE_KEY.format(channel=channel)
+        last = await self.cache.aget(key, 0)
+        loop = asyncio.get_running_loop()
+        idle_since = loop.time()
+        yield None
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            number = await self.cache.aget(key, 0)
+            if number < last:
+                last = 0
+            for current in range(last + 1, number + 1):
+                message = await self.cache.aget(self.MESSAGE_KEY.format(channel=channel, number=current))
+                if message is not None:
+                    idle_since = loop.time()
+                    yield message
+            last = number
+            if heartbeat is not None and loop.time() - idle_since >= heartbeat:
+                idle_since = loop.time()
+                yield None
+
+
+class RedisBroker(Broker):
+    """Брокер на Redis pub/sub для нескольких воркеров. Нужен пакет redis (pip install redis)"""
+
+    def __init__(self, url='redis://localhost:6379/0', **options):
+        import redis
+        import redis.asyncio
+
+        self.url = url
+        self._client = redis.Redis.from_url(url)
+        self._async_module = redis.asyncio
+
+    def publish(self, channel, message):
+        self._client.publish(channel, json.dumps(message))
+
+    async def subscribe(self, channel, heartbeat=None):
+        client = self._async_module.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(channel)
+        try:
+            yield None
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=heartbeat)
+                yield json.loads(message['data']) if message else None
+        finally:
+            await pubsub.unsubscribe(channel)
+            await pubsub.aclose()
+            await client.aclose()
+
+
+DEFAULT_BROKER = 'ratings.live.CacheBroker'
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Брокер из настройки RATINGS_LIVE_BROKER (по умолчанию CacheBroker), один на процесс"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_class = import_string(getattr(settings, 'RATINGS_LIVE_BROKER', DEFAULT_BROKER))
+                _broker = broker_class(**getattr(settings, 'RATINGS_LIVE_BROKER_OPTIONS', {}))
+    return _broker
+
+
+def get_standings(tournament_id):
+    """Таблица турнира: команда, итог, место"""
+    return [
+        {'team_id': team_id, 'team': team_name, 'total': total, 'place': place}
+        for team_id, team_name, total, place in GameResult.objects.filter(
+            tournament_id=tournament_id
+        ).order_by('place', 'team__name').values_list('team_id', 'team__name', 'total_points', 'place')
+    ]
+
+
+def get_cached_standings(tournament_id):
+    return caches[live_cache_alias()].get(SNAPSHOT_KEY.format(tournament_id=tournament_id))
+
+
+def publish_standings(tournament_id):
+    """Пересчитывает таблицу один раз и рассылает зрителям только изменившиеся строки"""
+    cache = caches[live_cache_alias()]
+    key = SNAPSHOT_KEY.format(tournament_id=tournament_id)
+    # Таблица могла пропасть из кеша (вытеснение) - тогда зрители получат все строки заново
+    previous = {row['team_id']: row for row in cache.get(key) or []}
+    standings = get_standings(tournament_id)
+    cache.set(key, standings, timeout=None)
+
+    current_ids = {row['team_id'] for row in standings}
+    changes = [row for row in standings if previous.get(row['team_id']) != row]
+    removed = [team_id for team_id in previous if team_id not in current_ids]
+    if changes or removed:
+        get_broker().publish(channel_name(tournament_id), {'changes': changes, 'removed': removed})
+
+
+def check_broker():
+    """
+    Пересчеты идут в воркере очереди (RATINGS_JOBS_EAGER = False): брокер должен доставлять сообщения
+    в другие процессы, иначе live-табло молча перестанет обновляться. Возвращает текст ошибки или None
+    """
+    if getattr(settings, 'RATINGS_JOBS_EAGER', False):
+        return None
+    broker = get_broker()
+    if broker.process_local:
+        return (
+            f'Брокер live-табло {type(broker).__name__} работает внутри одного процесса, а пересчеты идут '
+            f'в воркере: зрители не получат изменений. Нужен CacheBroker с общим кешем (не LocMemCache) '
+            f'или RedisBroker в RATINGS_LIVE_BROKER, либо RATINGS_JOBS_EAGER = True'
+        )
+    return None
+
+
+@receiver(tournament_recalculated)
+def publish_on_recalculation(sender, tournament_id, **kwargs):
+    publish_standings(tournament_id)
@@ -0,0 +1,368 @@
+"""
+Нагрузочный прогон для manage.py load_test: виртуальные клиенты в потоках повторяют смесь запросов зрителей
+(смена фильтров таблицы, листание страниц, карточки команд и игр) и сохранения результатов в админке,
+которые запускают ratings.signals. Сервер (WSGI или ASGI) команда запускает отдельным процессом с
+RATINGS_QUERY_HEADERS=1, поэтому число SQL-запросов каждого ответа приходит в заголовках.
+
+Клиент закрытый: следующий запрос уходит сразу после ответа на предыдущий (плюс --think-ms), так что
+число клиентов - это число одновременных запросов к серверу.
+"""
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from html.parser import HTMLParser
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPErrorProcessor, Request, build_opener
+
+from django.conf import settings
+from django.db.models import Max, Min
+
+from .models import City, GameResult, Team, Tournament, TournamentSeries
+from .profiling import QUERIES_HEADER, QUERIES_TIME_HEADER, percentile
+from .rankings import SORT_FIELDS
+from .utils import ALL_CITIES
+
+
+# Доли сценариев по умолчанию: на один просмотр таблицы примерно одна карточка, правки редкие
+DEFAULT_MIX = {'filter': 40, 'page': 20, 'team': 20, 'game': 15, 'admin': 5}
+# Под какими адресами сценарии попадают в отчет
+ENDPOINTS = {
+    'filter': 'index',
+    'page': 'index:page',
+    'team': 'team_modal',
+    'game': 'game_modal',
+}
+ADMIN_FORM = 'admin:form'
+ADMIN_SAVE = 'admin:save'
+
+REQUEST_TIMEOUT = 30
+_CSRF_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+def parse_mix(value):
+    """'filter=50,team=30,admin=0' -> {'filter': 50, 'team': 30, 'admin': 0}; не названные сценарии - 0"""
+    mix = dict.fromkeys(DEFAULT_MIX, 0)
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in mix or not weight.strip().isdigit():
+            raise ValueError(f'Непонятная доля "{part}": нужно имя=вес, имена: {", ".join(DEFAULT_MIX)}')
+        mix[name] = int(weight)
+    if not any(mix.values()):
+        raise ValueError('Все доли нулевые')
+    return mix
+
+
+class Targets:
+    """Что запрашивать: id и названия из той же базы, с которой работает сервер"""
+
+    def __init__(self):
+        self.cities = list(City.objects.values_list('name', flat=True))
+        self.series = list(TournamentSeries.objects.values_list('name', flat=True))
+        self.team_ids = list(Team.objects.values_list('id', flat=True))
+        self.tournament_ids = list(Tournament.objects.values_list('id', flat=True))
+        # Для правок - результаты, у которых есть очки по темам (их и меняет админка)
+        self.result_ids = list(
+            GameResult.objects.filter(topicresult__isnull=False).values_list('id', flat=True).distinct()[:5000]
+        )
+        dates = Tournament.objects.aggregate(first=Min('date'), last=Max('date'))
+        self.first_date, self.last_date = dates['first'], dates['last']
+
+    @property
+    def empty(self):
+        return not self.team_ids or not self.tournament_ids
+
+    def filter_params(self, rng):
+        params = {'format': 'json', 'active_tab': rng.choice(['teams', 'teams', 'games'])}
+        params['city'] = rng.choice([*self.cities, ALL_CITIES])
+        if rng.random() < 0.5:
+            params['team_sort'] = rng.choice(list(SORT_FIELDS))
+        if rng.random() < 0.3 and self.series:
+            params['game_series'] = rng.choice(self.series)
+        if rng.random() < 0.2 and self.first_date:
+            start = self.first_date + (self.last_date - self.first_date) * rng.random() / 2
+            params['date_from'] = start.isoformat()
+            params['date_to'] = self.last_date.isoformat()
+        return params
+
+
+class FormParser(HTMLParser):
+    """Поля формы админки как их отправил бы браузер: input, выбранные option, textarea"""
+
+    def __init__(self):
+        super().__init__()
+        self.fields = []
+        self._select = None
+        self._select_value = None
+        self._textarea = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        name = attrs.get('name')
+        if tag == 'input' and name:
+            kind = attrs.get('type', 'text')
+            if kind in ('submit', 'button', 'image', 'file', 'reset'):
+                return
+            if kind in ('checkbox', 'radio') and 'checked' not in attrs:
+                return
+            self.fields.append([name, attrs.get('value') or ('on' if kind == 'checkbox' else '')])
+        elif tag == 'select' and name:
+            self._select, self._select_value = name, None
+        elif tag == 'option' and self._select:
+            # Без selected браузер отправляет первый option
+            if 'selected' in attrs or self._select_value is None:
+                self._select_value = attrs.get('value', '')
+        elif tag == 'textarea' and name:
+            self._textarea = [name, '']
+
+    def handle_data(self, data):
+        if self._textarea:
+            self._textarea[1] += data
+
+    def handle_endtag(self, tag):
+        if tag == 'select' and self._select:
+            self.fields.append([self._select, self._select_value or ''])
+            self._select = None
+        elif tag == 'textarea' and self._textarea:
+            self.fields.append(self._textarea)
+            self._textarea = None
+
+
+class NoRedirects(HTTPErrorProcessor):
+    """Ответ 302 после сохранения в админке - это успех, а не повод идти по ссылке"""
+
+    def http_response(self, request, response):
+        return response
+
+    https_response = http_response
+
+
+class Stats:
+    """Замеры одной ступени: по каждому адресу время ответов, ошибки, число и время SQL-запросов"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_samples = {}
+        self.queries = defaultdict(list)
+        self.db_ms = defaultdict(list)
+
+    def add(self, endpoint, duration_ms, ok, queries=None, db_ms=None, error=None):
+        with self.lock:
+            self.durations[endpoint].append(duration_ms)
+            if not ok:
+                self.errors[endpoint] += 1
+                self.error_samples.setdefault(endpoint, error)
+            if queries is not None:
+                self.queries[endpoint].append(queries)
+                self.db_ms[endpoint].append(db_ms)
+
+    def summary(self, seconds):
+        rows = []
+        for endpoint in sorted(self.durations):
+            durations = self.durations[endpoint]
+            queries = self.queries[endpoint]
+            rows.append({
+                'endpoint': endpoint,
+                'requests': len(durations),
+                'rps': len(durations) / seconds,
+                'p50': percentile(durations, 0.5),
+                'p90': percentile(durations, 0.9),
+                'p99': percentile(durations, 0.99),
+                'max': max(durations),
+                'error_rate': self.errors[endpoint] / len(durations),
+                'queries': sum(queries) / len(queries) if queries else None,
+                'db_ms': sum(self.db_ms[endpoint]) / len(queries) if queries else None,
+                'first_error': self.error_samples.get(endpoint),
+            })
+        return rows
+
+
+class Client:
+    """Один виртуальный зритель (или редактор): свои cookie и сессия админки"""
+
+    def __init__(self, base_url, targets, mix, stats, rng, admin_credentials, think_ms):
+        self.base_url = base_url.rstrip('/')
+        self.targets = targets
+        self.scenarios = list(mix)
+        self.weights = list(mix.values())
+        self.stats = stats
+        self.rng = rng
+        self.admin_credentials = admin_credentials
+        self.think = think_ms / 1000
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()), NoRedirects())
+        self.logged_in = False
+        # Текущие фильтры таблицы: "page" листает их
+        self.params = targets.filter_params(rng)
+        self.page = 1
+
+    def run(self, stop_at):
+        while time.monotonic() < stop_at:
+            scenario = self.rng.choices(self.scenarios, self.weights)[0]
+            getattr(self, f'do_{scenario}')()
+            if self.think:
+                time.sleep(self.think)
+
+    def request(self, endpoint, path, data=None):
+        """Запрос с замером; возвращает (статус, тело) или (None, None) при сетевой ошибке"""
+        body = urlencode(data).encode() if data is not None else None
+        request = Request(self.base_url + path, data=body, headers={'Referer': self.base_url + path})
+        start = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=REQUEST_TIMEOUT) as response:
+                status, content, headers = response.status, response.read(), response.headers
+        except HTTPError as error:
+            status, content, headers = error.code, error.read(), error.headers
+        except (URLError, OSError) as error:
+            self.stats.add(endpoint, (time.perf_counter() - start) * 1000, False, error=str(error))
+            return None, None
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        queries = headers.get(QUERIES_HEADER)
+        ok = status < 400 if endpoint != ADMIN_SAVE else status == 302
+        self.stats.add(
+            endpoint, duration_ms, ok,
+            int(queries) if queries is not None else None,
+            float(headers.get(QUERIES_TIME_HEADER, 0)) if queries is not None else None,
+            error=None if ok else f'HTTP {status}',
+        )
+        return status, content.decode('utf-8', 'replace')
+
+    def do_filter(self):
+        self.params = self.targets.filter_params(self.rng)
+        self.page = 1
+        self.request(ENDPOINTS['filter'], '/?' + urlencode(self.params))
+
+    def do_page(self):
+        self.page = self.page + 1 if self.page < 5 else 1
+        self.request(ENDPOINTS['page'], '/?' + urlencode({**self.params, 'page': self.page}))
+
+    def do_team(self):
+        team_id = self.rng.choice(self.targets.team_ids)
+        # Карточка открывается с фильтрами таблицы, как в loadTeamModal (app.js)
+        params = {
+            key: self.params[key]
+            for key in ('game_series', 'date_from', 'date_to', 'active_tab', 'city') if key in self.params
+        }
+        self.request(ENDPOINTS['team'], f'/team/{team_id}/modal/?' + urlencode(params))
+
+    def do_game(self):
+        self.request(ENDPOINTS['game'], f'/game/{self.rng.choice(self.targets.tournament_ids)}/modal/')
+
+    def login(self):
+        status, content = self.request(ADMIN_FORM, '/admin/login/')
+        match = _CSRF_RE.search(content or '')
+        if not match:
+            return False
+        username, password = self.admin_credentials
+        status, _ = self.request(ADMIN_FORM, '/admin/login/?next=/admin/', {
+            'csrfmiddlewaretoken': match.group(1), 'username': username, 'password': password, 'next': '/admin/',
+        })
+        self.logged_in = status == 302
+        return self.logged_in
+
+    def do_admin(self):
+        """Открывает результат в админке, меняет очки одной темы и сохраняет - как редактор на игре"""
+        if not self.targets.result_ids or (not self.logged_in and not self.login()):
+            return
+        path = f'/admin/ratings/gameresult/{self.rng.choice(self.targets.result_ids)}/change/'
+        status, content = self.request(ADMIN_FORM, path)
+        if status != 200:
+            return
+        parser = FormParser()
+        parser.feed(content)
+        fields = parser.fields
+        # Только сохраненные темы: у пустых строк инлайна нет id
+        saved = {name[:-len('-id')] for name, value in fields if re.fullmatch(r'topicresult_set-\d+-id', name) and value}
+        points = [field for field in fields if field[0].endswith('-points') and field[0][:-len('-points')] in saved]
+        if not points:
+            return
+        self.rng.choice(points)[1] = str(self.rng.randrange(11) / 2)
+        self.request(ADMIN_SAVE, path, [tuple(field) for field in fields])
+
+
+def run_step(base_url, targets, mix, clients, seconds, seed, admin_credentials, think_ms=0):
+    """Одна ступень: clients потоков в течение seconds секунд. Возвращает Stats"""
+    stats = Stats()
+    stop_at = time.monotonic() + seconds
+    threads = [
+        threading.Thread(
+            target=Client(base_url, targets, mix, stats, random.Random(seed * 1000 + number),
+                          admin_credentials, think_ms).run,
+            args=(stop_at,), daemon=True,
+        )
+        for number in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    """Сервер приложения отдельным процессом: команда запуска - шаблон с {host}, {port} и {python}"""
+
+    def __init__(self, command, host='127.0.0.1', port=None, log_path=None):
+        self.host = host
+        self.port = port or free_port()
+        self.command = command.format(host=self.host, port=self.port, python=sys.executable).split()
+        self.log_path = log_path
+        self.process = None
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def start(self, ready_timeout=60):
+        """ready_timeout=None - не ждать ответа по HTTP (воркер очереди)"""
+        env = {**os.environ, 'RATINGS_QUERY_HEADERS': '1'}
+        log = open(self.log_path, 'ab') if self.log_path else subprocess.DEVNULL
+        try:
+            self.process = subprocess.Popen(
+                self.command, cwd=settings.BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+            )
+        finally:
+            if self.log_path:
+                log.close()
+
+        if ready_timeout is None:
+            return
+        deadline = time.monotonic() + ready_timeout
+        opener = build_opener(NoRedirects())
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Сервер завершился с кодом {self.process.returncode}: {" ".join(self.command)}')
+            try:
+                with opener.open(self.url + '/search/suggest/', timeout=2) as response:
+                    if response.status < 500:
+                        return
+            except (URLError, OSError):
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f'Сервер не ответил за {ready_timeout} с: {" ".join(self.command)}')
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
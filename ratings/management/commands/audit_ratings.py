@@ -0,0 +1,165 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Sum
+
+from ratings import changelog
+from ratings.management.parallel import chunks, init_worker
+from ratings.models import ChangeConsumer, GameResult, TopicResult, Tournament, pack_topic_scores
+from ratings.signals import calculate_places, recalculate_tournament
+
+
+# Сколько турниров проверяет один процесс за раз
+CHUNK_SIZE = 200
+# Погрешность сравнения float total_points
+EPSILON = 1e-6
+# Потребитель журнала изменений (ratings/changelog.py) для --changed
+CONSUMER = 'audit_ratings'
+
+
+def expected_values(tournament_ids, results_qs=None):
+    """
+    Считает правильные total_points (темы + черный ящик), места и topic_scores для результатов турниров.
+    Возвращает (результаты, {result_id: (total_points, place, topic_scores)}).
+    """
+    topic_sums = dict(
+        TopicResult.objects.filter(game_result__tournament_id__in=tournament_ids)
+        .values('game_result_id').annotate(total=Sum('points')).order_by()
+        .values_list('game_result_id', 'total')
+    )
+    if results_qs is None:
+        results_qs = GameResult.objects.filter(tournament_id__in=tournament_ids)
+    results = list(results_qs.only('id', 'tournament_id', 'team_id', 'black_box_points', 'total_points', 'place', 'topic_scores'))
+    topic_scores = pack_topic_scores(results)
+
+    by_tournament = defaultdict(list)
+    totals = {}
+    for result in results:
+        topics = topic_sums.get(result.id) or Decimal('0.0')
+        totals[result.id] = float(topics) + float(result.black_box_points or Decimal('0.0'))
+        by_tournament[result.tournament_id].append(result.id)
+
+    expected = {}
+    for result_ids in by_tournament.values():
+        result_ids.sort(key=lambda result_id: -totals[result_id])
+        places = calculate_places([totals[result_id] for result_id in result_ids])
+        for result_id, place in zip(result_ids, places):
+            expected[result_id] = (totals[result_id], place, topic_scores[result_id])
+    return results, expected
+
+
+def find_divergences(results, expected):
+    divergences = []
+    for result in results:
+        total, place, topic_scores = expected[result.id]
+        if abs(result.total_points - total) > EPSILON:
+            divergences.append((result.tournament_id, result.id, result.team_id, 'total_points', result.total_points, total))
+        if result.place != place:
+            divergences.append((result.tournament_id, result.id, result.team_id, 'place', result.place, place))
+        if result.topic_scores != topic_scores:
+            divergences.append((result.tournament_id, result.id, result.team_id, 'topic_scores', result.topic_scores, topic_scores))
+    return divergences
+
+
+def audit_chunk(tournament_ids):
+    """Проверяет пачку турниров (только чтение, выполняется в процессах пула)"""
+    results, expected = expected_values(tournament_ids)
+    return find_divergences(results, expected)
+
+
+def repair_tournaments(tournament_ids):
+    """
+    Исправляет турниры тем же recalculate_tournament, что и воркер очереди: вместе с итогами и местами
+    обновляются журнал, места команд, пояса, рекорды, сложность тем, сводки сезонов и зачет серий
+    """
+    fixed_count = 0
+    for tournament_id in tournament_ids:
+        with transaction.atomic():
+            # Считаем заново под блокировкой: пока шла проверка, данные могли измениться
+            list(GameResult.objects.select_for_update().filter(tournament_id=tournament_id).values_list('id'))
+            fixed_count += len(recalculate_tournament(tournament_id))
+    return fixed_count
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет денормализованные GameResult.total_points, place и topic_scores с TopicResult и черным ящиком. '
+        'С --repair пересчитывает турниры с расхождениями так же, как воркер очереди.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='Исправить найденные расхождения')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Количество процессов')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Турниров на одну задачу процесса')
+        parser.add_argument('--changed', action='store_true',
+                            help='Только турниры, измененные после прошлого запуска с --changed (по журналу изменений); '
+                                 'первый запуск проверяет все')
+
+    def handle(self, *args, **options):
+        if options['changed'] and ChangeConsumer.objects.filter(name=CONSUMER).exists():
+            checked, divergences, fixed = self.audit_changes(options)
+        else:
+            # Номер журнала до проверки: все, что изменится во время нее, проверит следующий запуск с --changed
+            position = changelog.head()
+            tournament_ids = list(Tournament.objects.order_by('id').values_list('id', flat=True))
+            divergences, fixed = self.audit(tournament_ids, options)
+            checked = len(tournament_ids)
+            if options['changed'] and (options['repair'] or not divergences):
+                changelog.register(CONSUMER, from_head=False)
+                changelog.ack(CONSUMER, position)
+
+        for tournament_id, result_id, team_id, field, stored, expected in sorted(divergences):
+            self.stdout.write(
+                f'Турнир {tournament_id}, результат {result_id} (команда {team_id}): '
+                f'{field} = {stored}, должно быть {expected}'
+            )
+
+        summary = (
+            f'Проверено турниров: {checked}, расхождений: {len(divergences)} '
+            f'в {len({row[0] for row in divergences})} турнирах'
+        )
+        if options['repair']:
+            summary += f', исправлено результатов: {fixed}'
+        style = self.style.SUCCESS if not divergences or options['repair'] else self.style.WARNING
+        self.stdout.write(style(summary))
+
+    def audit(self, tournament_ids, options):
+        """Проверяет турниры (и исправляет с --repair): (расхождения, исправлено результатов)"""
+        tasks = list(chunks(tournament_ids, options['chunk_size']))
+        if options['workers'] > 1 and len(tasks) > 1:
+            # Соединения с БД нельзя наследовать в дочерние процессы
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker) as pool:
+                outcomes = list(pool.map(audit_chunk, tasks))
+        else:
+            outcomes = [audit_chunk(chunk) for chunk in tasks]
+
+        divergences = [row for chunk_divergences in outcomes for row in chunk_divergences]
+        fixed = 0
+        if options['repair'] and divergences:
+            # Исправления пишет один процесс, чтобы параллельные записи не мешали друг другу
+            fixed = repair_tournaments(sorted({row[0] for row in divergences}))
+        return divergences, fixed
+
+    def audit_changes(self, options):
+        """
+        Турниры из журнала изменений после прошлого запуска, пачками. Позиция в журнале сдвигается после
+        проверки пачки; если расхождения найдены без --repair - не сдвигается, и следующий запуск их покажет снова
+        """
+        checked = set()
+        divergences = []
+        fixed = 0
+        for batch in changelog.batches(CONSUMER):
+            tournament_ids = sorted(changelog.changed_tournaments(batch) - checked)
+            batch_divergences, batch_fixed = self.audit(tournament_ids, options)
+            checked.update(tournament_ids)
+            divergences += batch_divergences
+            fixed += batch_fixed
+            if batch_divergences and not options['repair']:
+                break
+            changelog.ack(CONSUMER, batch[-1].seq)
+        return len(checked), divergences, fixed
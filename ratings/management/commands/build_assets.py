@@ -0,0 +1,111 @@
+import logging
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+# Инструменты сборки необязательны (requirements-build.txt): без них шаг пропускается с предупреждением
+try:
+    from fontTools import subset as font_subset
+except ImportError:
+    font_subset = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+FONTS_DIR = Path(settings.BASE_DIR) / 'static' / 'deps' / 'fonts'
+IMAGES_DIR = Path(settings.BASE_DIR) / 'static' / 'deps' / 'img'
+MANIFEST_STORAGE = 'ratings.storage.OptimizedManifestStaticFilesStorage'
+
+# Латиница, кириллица и типографские знаки - все, что встречается на сайте
+FONT_UNICODES = (
+    'U+0000-00FF, U+0131, U+0152-0153, U+02BB-02BC, U+02C6, U+02DA, U+02DC, '
+    'U+0400-045F, U+0490-0491, U+04B0-04B1, U+2000-206F, U+2074, U+20AC, '
+    'U+2116, U+2122, U+2191, U+2193, U+2212, U+2215, U+FEFF, U+FFFD'
+)
+
+# Ширины адаптивных вариантов картинок (фон растягивается на 170%, поэтому варианты крупные)
+IMAGE_WIDTHS = [1200, 2400]
+IMAGE_QUALITY = {'webp': 70, 'jpeg': 75}
+# Уже сгенерированные варианты (qwiz-1200.jpg) повторно не обрабатываем
+VARIANT_RE = re.compile(r'-\d+$')
+
+
+class Command(BaseCommand):
+    help = (
+        'Собирает статику для продакшена: WOFF2-подмножества шрифтов (кириллица + латиница), '
+        'сжатые адаптивные варианты картинок, затем collectstatic с минификацией, хешами и .gz/.br.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-fonts', action='store_true', help='Не пересобирать шрифты')
+        parser.add_argument('--skip-images', action='store_true', help='Не пересобирать картинки')
+        parser.add_argument('--no-collect', action='store_true', help='Не запускать collectstatic')
+
+    def handle(self, *args, **options):
+        if not options['skip_fonts']:
+            self.build_fonts()
+        if not options['skip_images']:
+            self.build_images()
+        if not options['no_collect']:
+            if settings.STORAGES['staticfiles']['BACKEND'] != MANIFEST_STORAGE:
+                self.stderr.write('STATIC_MANIFEST=1 не задан: collectstatic соберет статику без хешей, минификации и .gz/.br')
+            call_command('collectstatic', interactive=False, verbosity=options['verbosity'])
+
+    def build_fonts(self):
+        if font_subset is None:
+            self.stderr.write('fontTools не установлен (pip install -r requirements-build.txt), шрифты пропущены')
+            return
+        # fontTools очень подробно пишет в лог про каждую таблицу шрифта
+        logging.getLogger('fontTools').setLevel(logging.ERROR)
+
+        for source in sorted(FONTS_DIR.glob('*.otf')):
+            target = source.with_suffix('.woff2')
+            subset_options = font_subset.Options()
+            subset_options.flavor = 'woff2'
+            subset_options.layout_features = ['*']
+            subset_options.name_IDs = ['*']
+            subset_options.notdef_outline = True
+
+            font = font_subset.load_font(str(source), subset_options)
+            subsetter = font_subset.Subsetter(subset_options)
+            subsetter.populate(unicodes=font_subset.parse_unicodes(FONT_UNICODES))
+            subsetter.subset(font)
+            font_subset.save_font(font, str(target), subset_options)
+            self._report(source, target)
+
+    def build_images(self):
+        if Image is None:
+            self.stderr.write('Pillow не установлен (pip install -r requirements-build.txt), картинки пропущены')
+            return
+
+        sources = [
+            path for path in sorted(IMAGES_DIR.iterdir())
+            if path.suffix.lower() in ('.jpg', '.jpeg', '.png') and not VARIANT_RE.search(path.stem)
+        ]
+        for source in sources:
+            with Image.open(source) as image:
+                image = image.convert('RGB')
+                for width in IMAGE_WIDTHS:
+                    if width >= image.width:
+                        continue
+                    height = round(image.height * width / image.width)
+                    resized = image.resize((width, height), Image.LANCZOS)
+
+                    webp_target = source.with_name(f'{source.stem}-{width}.webp')
+                    resized.save(webp_target, 'WEBP', quality=IMAGE_QUALITY['webp'], method=6)
+                    self._report(source, webp_target)
+
+                    jpeg_target = source.with_name(f'{source.stem}-{width}.jpg')
+                    resized.save(jpeg_target, 'JPEG', quality=IMAGE_QUALITY['jpeg'], optimize=True, progressive=True)
+                    self._report(source, jpeg_target)
+
+    def _report(self, source, target):
+        self.stdout.write(
+            f'{source.name} ({source.stat().st_size // 1024} КБ) -> {target.name} ({target.stat().st_size // 1024} КБ)'
+        )
@@ -0,0 +1,228 @@
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from ratings.management.parallel import chunks, init_worker
+from ratings.models import (
+    BeltPromotion, City, CityStats, GameResult, Team, TeamRecord, TeamStats, Topic, TopicDifficulty, Tournament,
+    TournamentSeries, TournamentTopic,
+)
+from ratings.team_matrix import get_team_matrix
+from ratings.utils import DEFAULT_CITY
+from ratings.views import ITEMS_PER_PAGE
+
+
+# Сколько объектов отдается одному процессу за раз
+CHUNK_SIZE = 50
+MANIFEST_NAME = 'manifest.json'
+
+
+def _render(path, params=None):
+    """Рендерит страницу тем же view, что обслуживает запрос, и возвращает HTML"""
+    request = RequestFactory().get(path, params or {})
+    match = resolve(path)
+    response = match.func(request, *match.args, **match.kwargs)
+    return response.content
+
+
+def _write(output_dir, relative_path, content):
+    # Пишем во временный файл и подменяем атомарно, чтобы nginx не отдал половину страницы
+    target = Path(output_dir) / relative_path
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(target.name + '.tmp')
+    tmp.write_bytes(content)
+    os.replace(tmp, target)
+
+
+def team_snapshot_path(team_id):
+    return f'team/{team_id}/modal/index.html'
+
+
+def game_snapshot_path(tournament_id):
+    return f'game/{tournament_id}/modal/index.html'
+
+
+def render_teams(team_ids, output_dir):
+    # Карточка команды рендерится без фильтров серии/дат; город таблицы карточка не учитывает
+    existing = set(Team.objects.filter(id__in=team_ids).values_list('id', flat=True))
+    for team_id in team_ids:
+        if team_id not in existing:
+            continue
+        path = reverse('ratings:team_modal', args=[team_id])
+        _write(output_dir, team_snapshot_path(team_id), _render(path))
+    return len(team_ids)
+
+
+def render_games(tournament_ids, output_dir):
+    for tournament_id in tournament_ids:
+        path = reverse('ratings:game_modal', args=[tournament_id])
+        _write(output_dir, game_snapshot_path(tournament_id), _render(path))
+    return len(tournament_ids)
+
+
+def render_index(output_dir):
+    """Главная страница по умолчанию и все страницы таблиц команд и игр"""
+    path = reverse('ratings:index')
+    _write(output_dir, 'index.html', _render(path))
+
+    pages = {
+        'teams': Team.objects.filter(city__name=DEFAULT_CITY).count(),
+        'games': Tournament.objects.filter(city__name=DEFAULT_CITY).count(),
+    }
+    rendered = 1
+    for tab, count in pages.items():
+        for page in range(1, max(1, math.ceil(count / ITEMS_PER_PAGE)) + 1):
+            params = {'active_tab': tab, 'page': page}
+            _write(output_dir, f'pages/{tab}/{page}.html', _render(path, params))
+            rendered += 1
+    return rendered
+
+
+# === ВЕРСИИ ДАННЫХ ===
+# Для каждой команды и турнира считаем отпечаток всех данных, которые попадают в их карточки.
+# Отпечаток изменился -> карточку нужно перерисовать.
+
+def _digest(hashes, key, *values):
+    hashes.setdefault(key, hashlib.blake2b(digest_size=16)).update(repr(values).encode())
+
+
+def _stored_rows(model, order_by):
+    """Строки сохраненной таблицы без updated_at: пересчет, не изменивший данных, не меняет отпечаток"""
+    fields = [field.attname for field in model._meta.concrete_fields if field.name != 'updated_at']
+    return fields, model.objects.values_list(*fields).order_by(*order_by)
+
+
+def compute_versions():
+    teams = {}
+    tournaments = {}
+
+    for row in Team.objects.values_list('id', 'name', 'city__name').order_by('id'):
+        _digest(teams, row[0], row)
+
+    for row in Tournament.objects.values_list(
+        'id', 'name', 'date', 'city__name', 'series__name'
+    ).order_by('id'):
+        _digest(tournaments, row[0], row)
+
+    for row in TournamentTopic.objects.values_list(
+        'tournament_id', 'order', 'topic_id', 'topic__short_name', 'topic__full_name'
+    ).order_by('tournament_id', 'order', 'topic_id'):
+        _digest(tournaments, row[0], row)
+
+    # Очки по темам берем из упакованного GameResult.topic_scores, без JOIN с TopicResult
+    for row in GameResult.objects.values_list(
+        'id', 'tournament_id', 'team_id', 'team__name', 'black_box_answer',
+        'black_box_points', 'total_points', 'place', 'topic_scores',
+        'tournament__date', 'tournament__name', 'tournament__city__name',
+        'tournament__series__name', 'tournament__series__display_order',
+        'tournament__series__tournament_type',
+    ).order_by('id'):
+        _digest(tournaments, row[1], row)
+        _digest(teams, row[2], row)
+
+    # Карточка показывает и то, что зависит от других команд, но хранится по команде: места в городе и общие
+    # (TeamStats), рекорды и историю поясов. Строка команды меняется, когда ее сдвинули чужие игры
+    for model in (TeamStats, TeamRecord, BeltPromotion):
+        fields, rows = _stored_rows(model, ['team_id', 'pk'])
+        team_index = fields.index('team_id')
+        for row in rows.iterator(chunk_size=5000):
+            _digest(teams, row[team_index], row)
+
+    # Похожие команды и процентили - из матрицы build_team_matrix, с названиями соседей
+    matrix = get_team_matrix()
+    if matrix is not None:
+        names = dict(Team.objects.values_list('id', 'name'))
+        for team_id in list(teams):
+            profile = matrix.profile(team_id)
+            if profile:
+                _digest(teams, team_id, profile, [names.get(neighbour) for neighbour, _ in profile['similar']])
+
+    # Общее для всех карточек: названия тем в радаре и сложность тем за все время (z-оценки радара без фильтров).
+    # Сложность сдвигается с каждой сыгранной игрой - тогда перерисовываются все карточки команд
+    shared = (
+        list(Topic.objects.values_list('id', 'short_name', 'full_name').order_by('id')),
+        list(TopicDifficulty.objects.filter(scope=TopicDifficulty.SCOPE_ALL).values_list(
+            'topic_id', 'games_count', 'points_sum', 'points_sq_sum',
+        ).order_by('topic_id')),
+    )
+    for team_id in teams:
+        _digest(teams, team_id, shared)
+
+    teams = {str(key): value.hexdigest() for key, value in teams.items()}
+    tournaments = {str(key): value.hexdigest() for key, value in tournaments.items()}
+
+    # Главная зависит от всего сразу, плюс от справочников для выпадающих списков
+    index = hashlib.blake2b(digest_size=16)
+    index.update(repr(sorted(teams.items())).encode())
+    index.update(repr(sorted(tournaments.items())).encode())
+    index.update(repr(list(City.objects.values_list('id', 'name').order_by('id'))).encode())
+    index.update(repr(list(TournamentSeries.objects.values_list('id', 'name').order_by('id'))).encode())
+    # Сравнение городов по силе над таблицей
+    index.update(repr(list(_stored_rows(CityStats, ['city_id'])[1])).encode())
+
+    return {'index': index.hexdigest(), 'teams': teams, 'tournaments': tournaments}
+
+
+class Command(BaseCommand):
+    help = (
+        'Пререндерит главную, карточки команд и карточки игр в статическую папку для nginx. '
+        'Повторный запуск перерисовывает только изменившиеся команды и турниры.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=str(settings.STATIC_SITE_ROOT), help='Папка для статических страниц')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Количество процессов рендера')
+        parser.add_argument('--force', action='store_true', help='Перерисовать все, игнорируя версии')
+
+    def handle(self, *args, **options):
+        output_dir = Path(options['output'])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path = output_dir / MANIFEST_NAME
+
+        previous = {'index': None, 'teams': {}, 'tournaments': {}}
+        if manifest_path.exists() and not options['force']:
+            previous = json.loads(manifest_path.read_text(encoding='utf-8'))
+
+        current = compute_versions()
+
+        changed_teams = [int(key) for key, value in current['teams'].items() if previous['teams'].get(key) != value]
+        changed_games = [int(key) for key, value in current['tournaments'].items() if previous['tournaments'].get(key) != value]
+        index_changed = previous['index'] != current['index']
+
+        # Удаляем карточки команд и турниров, которых больше нет
+        for key in set(previous['teams']) - set(current['teams']):
+            (output_dir / team_snapshot_path(key)).unlink(missing_ok=True)
+        for key in set(previous['tournaments']) - set(current['tournaments']):
+            (output_dir / game_snapshot_path(key)).unlink(missing_ok=True)
+
+        tasks = [(render_teams, chunk) for chunk in chunks(changed_teams, CHUNK_SIZE)]
+        tasks += [(render_games, chunk) for chunk in chunks(changed_games, CHUNK_SIZE)]
+
+        if options['workers'] > 1 and len(tasks) > 1:
+            # Соединения с БД нельзя наследовать в дочерние процессы
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker) as pool:
+                futures = [pool.submit(func, chunk, str(output_dir)) for func, chunk in tasks]
+                for future in futures:
+                    future.result()
+        else:
+            for func, chunk in tasks:
+                func(chunk, str(output_dir))
+
+        pages = render_index(output_dir) if index_changed else 0
+
+        manifest_path.write_text(json.dumps(current), encoding='utf-8')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Команд: {len(changed_teams)}, игр: {len(changed_games)}, страниц главной: {pages} '
+            f'(всего команд {len(current["teams"])}, игр {len(current["tournaments"])})'
+        ))
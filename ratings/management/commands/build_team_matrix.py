@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ratings import team_matrix
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит матрицу команда × тема (средние баллы) для активных команд, похожие команды и процентили '
+        'по темам, и сохраняет ее в RATINGS_ANALYTICS_DIR для карточек команд. Нужен NumPy.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--active-days', type=int, default=365,
+                            help='Активные команды - игравшие за последние N дней (0 - все)')
+        parser.add_argument('--neighbours', type=int, default=5, help='Сколько похожих команд хранить')
+        parser.add_argument('--output', default=None, help='Папка (по умолчанию RATINGS_ANALYTICS_DIR)')
+
+    def handle(self, *args, **options):
+        if team_matrix.np is None:
+            raise CommandError('NumPy не установлен: pip install -r requirements-analytics.txt')
+
+        started = time.perf_counter()
+        columns = team_matrix.collect_scores(options['active_days'])
+        loaded = time.perf_counter()
+        arrays = team_matrix.build_matrix(*columns, neighbours=options['neighbours'])
+        built = time.perf_counter()
+        path = team_matrix.save_matrix(arrays, options['output'])
+
+        teams, topics = arrays['averages'].shape
+        self.stdout.write(self.style.SUCCESS(
+            f'Команд: {teams}, тем: {topics}, оценок: {len(columns[0])}. '
+            f'Чтение из БД {loaded - started:.2f} с, расчет {built - loaded:.3f} с. Сохранено в {path}'
+        ))
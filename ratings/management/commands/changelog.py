@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ratings import changelog
+from ratings.models import ChangeConsumer
+
+
+class Command(BaseCommand):
+    help = (
+        'Журнал изменений результатов: размер и отставание потребителей. '
+        'С --prune удаляет старые записи, которые уже обработали все потребители.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prune', action='store_true', help='Удалить старые обработанные записи')
+        parser.add_argument('--retention-days', type=int, default=None,
+                            help='Сколько дней хранить записи (по умолчанию RATINGS_CHANGELOG_RETENTION_DAYS)')
+        parser.add_argument('--drop-consumer', default=None,
+                            help='Удалить потребителя, который больше не работает (иначе он держит журнал)')
+
+    def handle(self, *args, **options):
+        if options['drop_consumer']:
+            deleted, _ = ChangeConsumer.objects.filter(name=options['drop_consumer']).delete()
+            if not deleted:
+                raise CommandError(f'Потребителя "{options["drop_consumer"]}" нет')
+            self.stdout.write(f'Потребитель {options["drop_consumer"]} удален')
+
+        if options['prune']:
+            deleted = changelog.prune(options['retention_days'])
+            self.stdout.write(self.style.SUCCESS(f'Удалено записей: {deleted}'))
+
+        stats = changelog.stats()
+        self.stdout.write(f'Записей: {stats["entries"]}, номера {stats["first"]}..{stats["last"]}')
+        for name, last_seq, lag, updated_at in stats['consumers']:
+            self.stdout.write(f'  {name}: обработано до #{last_seq}, отставание {lag}, обновлен {updated_at:%Y-%m-%d %H:%M}')
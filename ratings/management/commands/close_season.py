@@ -0,0 +1,70 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ratings import seasons
+from ratings.models import Season
+
+
+class Command(BaseCommand):
+    help = (
+        'Закрывает сезон: собирает сводки команд по сериям и темам за его даты, дальше карточки команд берут '
+        'закрытые сезоны из сводок. Сезон заводится в админке или здесь через --start/--end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', nargs='?', help='Название сезона')
+        parser.add_argument('--start', type=date.fromisoformat, help='Начало сезона, ГГГГ-ММ-ДД (для нового сезона)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Конец сезона, ГГГГ-ММ-ДД (для нового сезона)')
+        parser.add_argument('--reopen', action='store_true', help='Открыть сезон и удалить его сводки')
+        parser.add_argument('--check', action='store_true', help='Сверить сводки закрытых сезонов с сырыми играми')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            divergences = seasons.find_divergences()
+            for name, kind, extra, missing in divergences:
+                self.stdout.write(f'{name}, {kind}: лишние {extra}, недостающие {missing}')
+            style = self.style.WARNING if divergences else self.style.SUCCESS
+            self.stdout.write(style(f'Расхождений: {len(divergences)}'))
+            return
+
+        if not options['name']:
+            for season in Season.objects.all():
+                state = f'закрыт {season.closed_at:%d.%m.%Y}' if season.is_closed else 'открыт'
+                self.stdout.write(f'{season.name}: {season.start_date} - {season.end_date}, {state}')
+            return
+
+        season = Season.objects.filter(name=options['name']).first()
+        if options['reopen']:
+            if season is None:
+                raise CommandError(f'Сезона "{options["name"]}" нет')
+            seasons.reopen(season)
+            self.stdout.write(self.style.SUCCESS(f'Сезон "{season.name}" открыт'))
+            return
+
+        if season is None:
+            if not options['start'] or not options['end']:
+                raise CommandError('Для нового сезона нужны --start и --end')
+            season = Season(name=options['name'], start_date=options['start'], end_date=options['end'])
+        elif options['start'] or options['end']:
+            if season.is_closed:
+                raise CommandError('Даты закрытого сезона не меняются: сначала --reopen')
+            season.start_date = options['start'] or season.start_date
+            season.end_date = options['end'] or season.end_date
+        if season.start_date > season.end_date:
+            raise CommandError('Сезон не может закончиться раньше, чем начался')
+        try:
+            # Новый сезон не остается в базе, если закрыть его не удалось
+            with transaction.atomic():
+                season.save()
+                seasons.close(season)
+        except ValueError as error:
+            raise CommandError(str(error))
+        season.refresh_from_db()
+        series_rows = season.series_summaries.count()
+        topic_rows = season.topic_summaries.count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Сезон "{season.name}" закрыт: турниров {len(season.tournaments)}, '
+            f'строк по сериям {series_rows}, по темам {topic_rows}'
+        ))
@@ -0,0 +1,150 @@
+import importlib.util
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ratings import loadtest
+from ratings.jobs import backlog
+
+
+SERVER_COMMANDS = {
+    # Встроенный многопоточный WSGI-сервер Django - есть везде, где есть сам проект
+    'wsgi': '{python} manage.py runserver {host}:{port} --noreload --skip-checks',
+    # pip install -r requirements-loadtest.txt
+    'asgi': '{python} -m uvicorn GroznyQuiz.asgi:application --host {host} --port {port} --no-access-log',
+}
+WORKER_COMMAND = '{python} manage.py run_rating_worker --sleep 0.2'
+
+
+
+def parse_clients(value):
+    try:
+        steps = [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        steps = []
+    if not steps or min(steps) < 1:
+        raise CommandError('--clients: числа через запятую, например 1,5,10,25')
+    return steps
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон: запускает сервер (WSGI и/или ASGI) на текущей базе и ступенями увеличивает число '
+        'одновременных клиентов. Клиенты повторяют смесь запросов: фильтры и страницы таблицы, карточки команд '
+        'и игр, сохранения результатов в админке. По каждой ступени и адресу - запросы в секунду, перцентили '
+        'времени ответа, доля ошибок и SQL-запросы. База: manage.py seed_load_data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=['wsgi', 'asgi', 'both'], default='wsgi', help='Какой сервер запускать')
+        parser.add_argument('--wsgi-cmd', default=SERVER_COMMANDS['wsgi'],
+                            help='Команда запуска WSGI-сервера ({python}, {host}, {port}), например gunicorn')
+        parser.add_argument('--asgi-cmd', default=SERVER_COMMANDS['asgi'], help='Команда запуска ASGI-сервера')
+        parser.add_argument('--worker', action='store_true',
+                            help='Запустить и воркер очереди пересчетов (иначе задачи после правок копятся)')
+        parser.add_argument('--url', default=None, help='Не запускать сервер, а нагружать уже работающий')
+        parser.add_argument('--clients', default='1,5,10,25', help='Ступени: число одновременных клиентов')
+        parser.add_argument('--duration', type=float, default=15, help='Длительность ступени, сек')
+        parser.add_argument('--warmup', type=float, default=3, help='Прогрев перед первой ступенью (в отчет не идет), сек')
+        parser.add_argument('--mix', default=','.join(f'{name}={weight}' for name, weight in loadtest.DEFAULT_MIX.items()),
+                            help='Доли сценариев: filter, page, team, game, admin')
+        parser.add_argument('--think-ms', type=int, default=0, help='Пауза клиента между запросами, мс')
+        parser.add_argument('--seed', type=int, default=1, help='Зерно: одна и та же последовательность запросов')
+        parser.add_argument('--admin-user', default='loadtest')
+        parser.add_argument('--admin-password', default='loadtest', help='Тот же, что у seed_load_data')
+        parser.add_argument('--server-log', default=None, help='Куда писать вывод сервера (по умолчанию никуда)')
+        parser.add_argument('--json', default=None, help='Сохранить результаты в файл для сравнения прогонов')
+
+    def handle(self, *args, **options):
+        steps = parse_clients(options['clients'])
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+        except ValueError as error:
+            raise CommandError(str(error))
+        targets = loadtest.Targets()
+        if targets.empty:
+            raise CommandError('В базе нет команд или турниров: сначала python manage.py seed_load_data')
+
+        variants = ['wsgi', 'asgi'] if options['server'] == 'both' else [options['server']]
+        if options['url']:
+            variants = ['external']
+        elif 'asgi' in variants and options['asgi_cmd'] == SERVER_COMMANDS['asgi'] \
+                and importlib.util.find_spec('uvicorn') is None:
+            raise CommandError('Для ASGI нужен uvicorn: pip install -r requirements-loadtest.txt (или --asgi-cmd)')
+
+        if settings.DEBUG and not options['url']:
+            self.stdout.write(self.style.WARNING(
+                'DEBUG = True: сервер работает с debug_toolbar и запоминает SQL-запросы, цифры будут хуже боевых. '
+                'Для честного прогона - настройки с DEBUG = False (--settings) и manage.py build_assets'
+            ))
+
+        credentials = (options['admin_user'], options['admin_password'])
+        report = {'mix': mix, 'duration': options['duration'], 'variants': {}}
+        for variant in variants:
+            server = None
+            if variant != 'external':
+                server = loadtest.Server(options[f'{variant}_cmd'], log_path=options['server_log'])
+                self.stdout.write(f'\n=== {variant.upper()}: {" ".join(server.command)}')
+                try:
+                    server.start()
+                except RuntimeError as error:
+                    raise CommandError(str(error))
+                url = server.url
+            else:
+                url = options['url']
+                self.stdout.write(f'\n=== {url}')
+            worker = None
+            if options['worker']:
+                worker = loadtest.Server(WORKER_COMMAND, log_path=options['server_log'])
+                worker.start(ready_timeout=None)
+            try:
+                report['variants'][variant] = self.run_variant(url, targets, mix, steps, credentials, options)
+            finally:
+                for process in (server, worker):
+                    if process:
+                        process.stop()
+
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'\nРезультаты: {os.path.abspath(options["json"])}')
+
+    def run_variant(self, url, targets, mix, steps, credentials, options):
+        if options['warmup']:
+            loadtest.run_step(url, targets, mix, steps[0], options['warmup'], options['seed'], credentials)
+        results = []
+        for clients in steps:
+            stats = loadtest.run_step(
+                url, targets, mix, clients, options['duration'], options['seed'] + clients, credentials,
+                options['think_ms'],
+            )
+            rows = stats.summary(options['duration'])
+            # Сохранения в админке ставят задачи пересчета: видно, успевает ли воркер
+            jobs = backlog()
+            results.append({'clients': clients, 'endpoints': rows, 'jobs': jobs})
+            self.print_step(clients, rows, jobs)
+        return results
+
+    def print_step(self, clients, rows, jobs):
+        total = sum(row['requests'] for row in rows)
+        errors = sum(row['requests'] * row['error_rate'] for row in rows)
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'\nКлиентов: {clients}, запросов: {total}, ошибок: {int(errors)}, '
+            f'очередь пересчетов: {jobs["pending"]} (готовы {jobs["ready"]}, с ошибкой {jobs["failed"]})'
+        ))
+        self.stdout.write(
+            f'{"адрес":<14}{"запр/с":>9}{"p50 мс":>9}{"p90 мс":>9}{"p99 мс":>9}{"max мс":>9}'
+            f'{"ошибки":>9}{"SQL":>7}{"БД мс":>8}'
+        )
+        for row in rows:
+            queries = f'{row["queries"]:.1f}' if row['queries'] is not None else '-'
+            db_ms = f'{row["db_ms"]:.1f}' if row['db_ms'] is not None else '-'
+            self.stdout.write(
+                f'{row["endpoint"]:<14}{row["rps"]:>9.1f}{row["p50"]:>9.0f}{row["p90"]:>9.0f}{row["p99"]:>9.0f}'
+                f'{row["max"]:>9.0f}{row["error_rate"]:>8.1%}{queries:>7}{db_ms:>8}'
+            )
+        for row in rows:
+            if row['first_error']:
+                self.stdout.write(self.style.WARNING(f'{row["endpoint"]}: {row["first_error"]}'))
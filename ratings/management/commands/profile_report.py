@@ -0,0 +1,137 @@
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+
+from ratings.profiling import TEMPLATE_PREFIX, iter_profiles, percentile, profiles_dir
+
+
+# Функции проекта, для которых показываем полное время (вместе с вызванными функциями)
+PROJECT_PREFIXES = ('ratings.', 'GroznyQuiz.')
+# Кадры самого профайлера есть в каждом стеке, их не показываем
+PROFILER_PREFIX = 'ratings.profiling:'
+
+
+class ViewStats:
+    def __init__(self):
+        self.durations = []
+        self.reasons = Counter()
+        self.by_params = defaultdict(list)
+        self.total_samples = 0
+        self.self_samples = Counter()
+        self.inclusive_samples = Counter()
+        self.template_samples = Counter()
+        # sql -> [запусков, мс]
+        self.sql = defaultdict(lambda: [0, 0.0])
+
+    def add(self, record):
+        self.durations.append(record['duration_ms'])
+        self.reasons[record['reason']] += 1
+        self.by_params[record['params']].append(record['duration_ms'])
+
+        for stack, count in record['samples'].items():
+            labels = stack.split(';')
+            self.total_samples += count
+            self.self_samples[labels[-1]] += count
+            # Рекурсивная функция в одном стеке считается один раз
+            for label in set(labels):
+                if label.startswith(TEMPLATE_PREFIX):
+                    self.template_samples[label[len(TEMPLATE_PREFIX):]] += count
+                elif label.startswith(PROJECT_PREFIXES) and not label.startswith(PROFILER_PREFIX):
+                    self.inclusive_samples[label] += count
+
+        for sql, count, total_ms in record['sql']:
+            self.sql[sql][0] += count
+            self.sql[sql][1] += total_ms
+
+
+class Command(BaseCommand):
+    help = (
+        'Сводка по профилям из SamplingProfilerMiddleware: самые горячие функции, SQL-запросы '
+        'и узлы шаблонов по каждому view, время по комбинациям фильтров и самые медленные запросы.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='Папка с профилями (по умолчанию RATINGS_PROFILER_DIR)')
+        parser.add_argument('--view', default=None, help='Только view, в имени которых есть эта строка (rating:index)')
+        parser.add_argument('--hours', type=float, default=None, help='Только профили за последние N часов')
+        parser.add_argument('--top', type=int, default=10, help='Сколько строк выводить в каждой таблице')
+        parser.add_argument('--slowest', type=int, default=10, help='Сколько самых медленных запросов показать')
+        parser.add_argument('--collapsed', default=None, help='Записать объединенные стеки в файл для flamegraph.pl')
+
+    def handle(self, *args, **options):
+        since = datetime.now() - timedelta(hours=options['hours']) if options['hours'] else None
+        views = defaultdict(ViewStats)
+        slowest = []
+        collapsed = Counter()
+
+        for record in iter_profiles(options['dir'], since):
+            if options['view'] and options['view'] not in record['view']:
+                continue
+            views[record['view']].add(record)
+            slowest.append(record)
+            if options['collapsed']:
+                collapsed.update(record['samples'])
+
+        if not views:
+            self.stdout.write(f'Профилей нет в {options["dir"] or profiles_dir()}')
+            return
+
+        top = options['top']
+        for view, stats in sorted(views.items(), key=lambda item: -sum(item[1].durations)):
+            self.print_view(view, stats, top)
+
+        slowest.sort(key=lambda record: -record['duration_ms'])
+        self.stdout.write(self.style.MIGRATE_HEADING('Самые медленные запросы'))
+        for record in slowest[:options['slowest']]:
+            self.stdout.write(
+                f'  {record["duration_ms"]:>8.1f} мс  {record["started"]}  {record["view"]}  '
+                f'{record["params"] or "-"}  ({record["status"]}, SQL: {sum(row[1] for row in record["sql"])})'
+            )
+
+        if options['collapsed']:
+            with open(options['collapsed'], 'w', encoding='utf-8') as fh:
+                for stack, count in collapsed.most_common():
+                    fh.write(f'{stack} {count}\n')
+            self.stdout.write(self.style.SUCCESS(f'Стеки записаны в {options["collapsed"]}'))
+
+    def print_view(self, view, stats, top):
+        durations = stats.durations
+        reasons = ', '.join(f'{reason}: {count}' for reason, count in stats.reasons.items())
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{view}: {len(durations)} запросов ({reasons}), '
+            f'p50 {percentile(durations, 0.5):.0f} мс, p95 {percentile(durations, 0.95):.0f} мс, '
+            f'max {max(durations):.0f} мс'
+        ))
+
+        def share(count):
+            if not stats.total_samples:
+                return '  0.0%'
+            return f'{count * 100 / stats.total_samples:5.1f}%'
+
+        self.stdout.write('  Фильтры (среднее время):')
+        by_params = sorted(stats.by_params.items(), key=lambda item: -sum(item[1]) / len(item[1]))
+        for params, values in by_params[:top]:
+            self.stdout.write(f'    {sum(values) / len(values):>8.1f} мс  x{len(values):<4} {params or "-"}')
+
+        self.stdout.write('  Собственное время функций:')
+        for label, count in stats.self_samples.most_common(top):
+            self.stdout.write(f'    {share(count)}  {label}')
+
+        if stats.inclusive_samples:
+            self.stdout.write('  Полное время функций проекта:')
+            for label, count in stats.inclusive_samples.most_common(top):
+                self.stdout.write(f'    {share(count)}  {label}')
+
+        if stats.template_samples:
+            self.stdout.write('  Узлы шаблонов:')
+            for label, count in stats.template_samples.most_common(top):
+                self.stdout.write(f'    {share(count)}  {label}')
+
+        if stats.sql:
+            self.stdout.write('  SQL (суммарное время, запусков на запрос):')
+            queries = sorted(stats.sql.items(), key=lambda item: -item[1][1])
+            for sql, (count, total_ms) in queries[:top]:
+                self.stdout.write(
+                    f'    {total_ms:>8.1f} мс  x{count / len(durations):<6.1f} {" ".join(sql.split())[:160]}'
+                )
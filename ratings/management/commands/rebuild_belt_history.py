@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ratings import belts
+
+
+class Command(BaseCommand):
+    help = (
+        'Восстанавливает события смены поясов (BeltPromotion) по всем играм: команды проходят турниры по дате '
+        'и копят очки. Все записанные события заменяются, время события - дата турнира.'
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        events = belts.rebuild_history()
+        self.stdout.write(self.style.SUCCESS(f'Событий смены поясов: {events}, {time.perf_counter() - started:.2f} с'))
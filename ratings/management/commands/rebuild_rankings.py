@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from ratings import rankings
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает статистику и места всех команд (TeamStats) и итоги городов (CityStats) с нуля. '
+        'С --check только сверяет сохраненные места с пересчитанными.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Только проверить, ничего не меняя')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            divergences = rankings.find_divergences()
+            for kind, object_id, field, stored, expected in divergences:
+                label = 'Команда' if kind == 'team' else 'Город'
+                self.stdout.write(f'{label} {object_id}: {field} = {stored}, должно быть {expected}')
+            style = self.style.WARNING if divergences else self.style.SUCCESS
+            self.stdout.write(style(f'Расхождений: {len(divergences)}'))
+            return
+
+        teams = rankings.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитаны места {teams} команд'))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ratings import records
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает серии и рекорды команд (TeamRecord) по всем играм с нуля. '
+        'С --check только сверяет сохраненное с пересчитанным.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Только проверить, ничего не меняя')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            divergences = records.find_divergences()
+            for team_id, field, stored, expected in divergences:
+                self.stdout.write(f'Команда {team_id}, {field}: {stored}, должно быть {expected}')
+            style = self.style.WARNING if divergences else self.style.SUCCESS
+            self.stdout.write(style(f'Расхождений: {len(divergences)}'))
+            return
+
+        started = time.perf_counter()
+        rows = records.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(f'Строк рекордов: {rows}, {time.perf_counter() - started:.2f} с'))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ratings import standings
+from ratings.models import SeriesStanding, TournamentSeries
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает зачет всех серий по всем сезонам (SeriesStanding) с нуля. '
+        'С --check только сверяет сохраненное с пересчитанным.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Только проверить, ничего не меняя')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            divergences = standings.find_divergences()
+            for name, kind, extra, missing in divergences:
+                self.stdout.write(f'{name}, {kind}: лишние {extra}, недостающие {missing}')
+            style = self.style.WARNING if divergences else self.style.SUCCESS
+            self.stdout.write(style(f'Расхождений: {len(divergences)}'))
+            return
+
+        started = time.perf_counter()
+        for series_id in TournamentSeries.objects.order_by('id').values_list('id', flat=True):
+            standings.refresh_series(series_id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Строк зачета: {SeriesStanding.objects.count()}, {time.perf_counter() - started:.2f} с'
+        ))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ratings import difficulty
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает сложность тем (TopicDifficulty) целиком по topic_scores всех результатов. '
+        'Обычно не нужен: задача пересчета турнира обновляет ее сама.'
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rows = difficulty.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(
+            f'Строк сложности тем: {rows}, {time.perf_counter() - started:.2f} с'
+        ))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ratings import topic_leaders
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает статистику команд по темам (TeamTopicStat) и списки лидеров тем (TopicLeaderboard) '
+        'с нуля. С --check только сверяет сохраненное с пересчитанным.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Только проверить, ничего не меняя')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            divergences = topic_leaders.find_divergences()
+            for kind, key, stored, expected in divergences:
+                label = 'Команда/тема' if kind == 'stat' else 'Список тема/город/сортировка'
+                self.stdout.write(f'{label} {key}: {stored}, должно быть {expected}')
+            style = self.style.WARNING if divergences else self.style.SUCCESS
+            self.stdout.write(style(f'Расхождений: {len(divergences)}'))
+            return
+
+        started = time.perf_counter()
+        rows, boards = topic_leaders.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(
+            f'Строк статистики по темам: {rows}, списков лидеров: {boards}, {time.perf_counter() - started:.2f} с'
+        ))
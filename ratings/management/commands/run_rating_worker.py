@@ -0,0 +1,73 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from ratings.jobs import backlog, claim_job, requeue_stale_jobs, run_job
+from ratings.live import check_broker
+
+
+class Command(BaseCommand):
+    help = (
+        'Воркер очереди пересчетов: итоги и места турниров после сохранений в админке. Воркеров может быть '
+        'несколько, но задачи команд блокируют все города (общая таблица мест) и выполняются по одной.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Выполнить все готовые задачи и выйти')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Пауза между проверками пустой очереди, сек')
+        parser.add_argument('--max-attempts', type=int, default=5, help='Сколько раз пробовать задачу до статуса failed')
+        parser.add_argument('--report-every', type=float, default=60.0, help='Как часто печатать размер очереди, сек')
+        parser.add_argument('--stats', action='store_true', help='Только показать размер очереди')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.print_backlog()
+            return
+
+        error = check_broker()
+        if error:
+            raise CommandError(error)
+
+        self.stopping = False
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f'Возвращено в очередь брошенных задач: {requeued}')
+        self.print_backlog()
+
+        done = failed = 0
+        last_report = time.monotonic()
+        while not self.stopping:
+            close_old_connections()
+            job = claim_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+            elif run_job(job, options['max_attempts']):
+                done += 1
+            else:
+                failed += 1
+                self.stderr.write(f'Ошибка в задаче {job} (попытка {job.attempts})')
+
+            if time.monotonic() - last_report >= options['report_every']:
+                self.stdout.write(f'Выполнено: {done}, с ошибкой: {failed}')
+                self.print_backlog()
+                last_report = time.monotonic()
+
+        self.stdout.write(self.style.SUCCESS(f'Выполнено: {done}, с ошибкой: {failed}'))
+
+    def stop(self, signum, frame):
+        # Дорабатываем текущую задачу и выходим
+        self.stopping = True
+
+    def print_backlog(self):
+        stats = backlog()
+        self.stdout.write(
+            f'Очередь: готово к выполнению {stats["ready"]}, ожидает {stats["pending"]}, '
+            f'выполняется {stats["running"]}, с ошибкой {stats["failed"]}'
+        )
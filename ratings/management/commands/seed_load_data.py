@@ -0,0 +1,169 @@
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from ratings import belts, difficulty, rankings, records, reference, search_index, topic_leaders
+from ratings.models import City, GameResult, Team, Topic, TopicResult, Tournament, TournamentSeries, TournamentTopic
+from ratings.signals import calculate_places
+from ratings.utils import DEFAULT_CITY
+
+
+CITY_NAMES = [DEFAULT_CITY, 'Москва', 'Казань', 'Махачкала', 'Нальчик', 'Владикавказ', 'Ставрополь', 'Ростов-на-Дону']
+SERIES = [
+    ('Лига', 'regular'),
+    ('Кубок', 'cup'),
+    ('Синхрон', 'regular'),
+    ('Студенческая лига', 'regular'),
+    ('Кубок городов', 'cup'),
+]
+BLACK_BOX_POINTS = [Decimal('0'), Decimal('0'), Decimal('1'), Decimal('2'), Decimal('-1')]
+# Пароль по умолчанию известен всем, поэтому только для локальной базы: DEBUG или SQLite
+DEV_ADMIN_PASSWORD = 'loadtest'
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет пустую базу случайными городами, командами и турнирами для manage.py load_test '
+        'и пересчитывает все сохраненные таблицы. Сигналы не срабатывают: результаты пишутся пачками.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cities', type=int, default=4, help=f'Городов (до {len(CITY_NAMES)})')
+        parser.add_argument('--teams', type=int, default=400, help='Команд')
+        parser.add_argument('--tournaments', type=int, default=300, help='Турниров')
+        parser.add_argument('--teams-per-game', type=int, default=25, help='Команд в турнире (не больше, чем в городе)')
+        parser.add_argument('--topics', type=int, default=30, help='Тем в справочнике')
+        parser.add_argument('--topics-per-game', type=int, default=7, help='Тем в турнире')
+        parser.add_argument('--seed', type=int, default=1, help='Зерно генератора: одна и та же база при повторе')
+        parser.add_argument('--admin-user', default='loadtest', help='Суперпользователь для сохранений в админке')
+        parser.add_argument(
+            '--admin-password',
+            help=f'Пароль суперпользователя. Без него - "{DEV_ADMIN_PASSWORD}", но только при DEBUG или на SQLite',
+        )
+
+    def handle(self, *args, **options):
+        if Team.objects.exists() or Tournament.objects.exists():
+            raise CommandError('В базе уже есть команды или турниры: seed_load_data заполняет только пустую базу')
+        if not 1 <= options['cities'] <= len(CITY_NAMES):
+            raise CommandError(f'--cities: от 1 до {len(CITY_NAMES)}')
+        if options['topics_per_game'] > options['topics']:
+            raise CommandError('--topics-per-game больше, чем --topics')
+        password = options['admin_password']
+        if not password:
+            if not (settings.DEBUG or connection.vendor == 'sqlite'):
+                raise CommandError(
+                    'Суперпользователь с известным паролем создается только при DEBUG или на SQLite: '
+                    'укажите --admin-password'
+                )
+            password = DEV_ADMIN_PASSWORD
+
+        started = time.perf_counter()
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            results_count = self.seed(rng, options)
+        self.stdout.write(f'Результатов: {results_count}, {time.perf_counter() - started:.1f} с')
+
+        # Сохраненные таблицы - как после обычных пересчетов
+        for label, rebuild in [
+            ('Сложность тем', difficulty.rebuild_all),
+            ('Места команд', rankings.rebuild_all),
+            ('Лидеры тем', topic_leaders.rebuild_all),
+            ('Рекорды', records.rebuild_all),
+            ('История поясов', belts.rebuild_history),
+        ]:
+            step = time.perf_counter()
+            rebuild()
+            self.stdout.write(f'{label}: {time.perf_counter() - step:.1f} с')
+        reference.bump_version()
+        search_index.bump_version()
+
+        user, created = get_user_model().objects.get_or_create(
+            username=options['admin_user'], defaults={'is_staff': True, 'is_superuser': True},
+        )
+        # Пароль существующего пользователя меняем, только если он задан явно
+        if created or options['admin_password']:
+            user.set_password(password)
+            user.save()
+        shown = password if not options['admin_password'] else '--admin-password'
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.perf_counter() - started:.1f} с, админка: {options["admin_user"]} / {shown}'
+        ))
+
+    def seed(self, rng, options):
+        cities = City.objects.bulk_create([City(name=name) for name in CITY_NAMES[:options['cities']]])
+        series = TournamentSeries.objects.bulk_create([
+            TournamentSeries(name=name, tournament_type=tournament_type, display_order=order)
+            for order, (name, tournament_type) in enumerate(SERIES)
+        ])
+        topics = Topic.objects.bulk_create([
+            Topic(full_name=f'Тема {number}', short_name=f'Т{number}') for number in range(1, options['topics'] + 1)
+        ])
+        # Половина команд - в городе по умолчанию, как на настоящем сайте
+        teams = Team.objects.bulk_create([
+            Team(name=f'Команда {number}', city=cities[0] if number % 2 or len(cities) == 1 else rng.choice(cities[1:]))
+            for number in range(1, options['teams'] + 1)
+        ])
+        teams_by_city = defaultdict(list)
+        for team in teams:
+            teams_by_city[team.city_id].append(team)
+        # Сила команды: сильные чаще набирают много очков, у таблиц есть лидеры
+        strength = {team.id: rng.uniform(0.2, 0.9) for team in teams}
+
+        first_day = date.today() - timedelta(days=2 * 365)
+        tournaments = Tournament.objects.bulk_create([
+            Tournament(
+                series=rng.choice(series), name=f'Игра {number}',
+                date=first_day + timedelta(days=number * 2 * 365 // options['tournaments']),
+                city=rng.choice(cities) if number % 3 == 0 else cities[0],
+            )
+            for number in range(1, options['tournaments'] + 1)
+        ])
+
+        tournament_topics = {}
+        for tournament in tournaments:
+            tournament_topics[tournament.id] = rng.sample(topics, options['topics_per_game'])
+        TournamentTopic.objects.bulk_create([
+            TournamentTopic(tournament=tournament, topic=topic, order=order)
+            for tournament in tournaments
+            for order, topic in enumerate(tournament_topics[tournament.id], start=1)
+        ], batch_size=5000)
+
+        results, points = [], []
+        for tournament in tournaments:
+            city_teams = teams_by_city[tournament.city_id]
+            players = rng.sample(city_teams, min(options['teams_per_game'], len(city_teams)))
+            rows = []
+            for team in players:
+                # Очки за тему: 0-5 с шагом 0.5
+                topic_points = [
+                    Decimal(sum(rng.random() < strength[team.id] for _ in range(10))) / 2
+                    for _ in tournament_topics[tournament.id]
+                ]
+                black_box = rng.choice(BLACK_BOX_POINTS)
+                rows.append((team, topic_points, black_box, float(sum(topic_points)) + float(black_box)))
+            # Итоги, места и topic_scores считаем здесь же - так же, как recalculate_tournament
+            rows.sort(key=lambda row: -row[3])
+            places = calculate_places([row[3] for row in rows])
+            for (team, topic_points, black_box, total), place in zip(rows, places):
+                results.append(GameResult(
+                    tournament=tournament, team=team, black_box_points=black_box, total_points=total, place=place,
+                    topic_scores=[
+                        [topic.id, float(value)] for topic, value in zip(tournament_topics[tournament.id], topic_points)
+                    ],
+                ))
+                points.append(topic_points)
+        GameResult.objects.bulk_create(results, batch_size=2000)
+
+        TopicResult.objects.bulk_create([
+            TopicResult(game_result=result, topic=topic, points=value)
+            for result, topic_points in zip(results, points)
+            for topic, value in zip(tournament_topics[result.tournament_id], topic_points)
+        ], batch_size=5000)
+        return len(results)
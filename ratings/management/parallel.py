@@ -0,0 +1,17 @@
+import os
+
+import django
+
+
+# Общие помощники для команд, которые раздают работу пулу процессов
+
+
+def init_worker():
+    # При запуске процессов через spawn (Windows) Django нужно поднять заново
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'GroznyQuiz.settings')
+    django.setup()
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
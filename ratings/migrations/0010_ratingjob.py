@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:25
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0009_remove_team_power'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('tournament', 'Пересчет итогов и мест турнира')], max_length=20, verbose_name='Тип задачи')),
+                ('object_id', models.PositiveBigIntegerField(verbose_name='ID объекта')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('running', 'Выполняется'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Попыток')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Последняя ошибка')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Выполнить после')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлена')),
+            ],
+            options={
+                'verbose_name': 'Задача пересчета',
+                'verbose_name_plural': 'Задачи пересчета',
+                'indexes': [models.Index(fields=['status', 'run_after'], name='rating_job_queue_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('kind', 'object_id'), name='unique_pending_rating_job')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:35
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def fill_topic_scores(apps, schema_editor):
+    # Та же логика, что в ratings.models.pack_topic_scores, но на исторических моделях
+    GameResult = apps.get_model('ratings', 'GameResult')
+    TournamentTopic = apps.get_model('ratings', 'TournamentTopic')
+    TopicResult = apps.get_model('ratings', 'TopicResult')
+
+    topic_order = defaultdict(list)
+    for tournament_id, topic_id in TournamentTopic.objects.order_by('tournament_id', 'order', 'id').values_list('tournament_id', 'topic_id'):
+        topic_order[tournament_id].append(topic_id)
+
+    points = defaultdict(dict)
+    for game_result_id, topic_id, value in TopicResult.objects.values_list('game_result_id', 'topic_id', 'points'):
+        points[game_result_id][topic_id] = float(value)
+
+    results = list(GameResult.objects.only('id', 'tournament_id'))
+    for result in results:
+        result.topic_scores = [[topic_id, points[result.id].get(topic_id)] for topic_id in topic_order[result.tournament_id]]
+    GameResult.objects.bulk_update(results, ['topic_scores'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0010_ratingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameresult',
+            name='topic_scores',
+            field=models.JSONField(blank=True, default=list, editable=False, verbose_name='Очки по темам'),
+        ),
+        migrations.RunPython(fill_topic_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:40
+
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_topic_difficulty(apps, schema_editor):
+    # Та же логика, что в ratings.difficulty.rebuild_all, но на исторических моделях
+    GameResult = apps.get_model('ratings', 'GameResult')
+    TopicDifficulty = apps.get_model('ratings', 'TopicDifficulty')
+
+    # (scope, object_id, topic_id) -> [series_id, games_count, points_sum, points_sq_sum, histogram]
+    stats = {}
+    for tournament_id, series_id, topic_scores in GameResult.objects.values_list(
+        'tournament_id', 'tournament__series_id', 'topic_scores'
+    ).iterator(chunk_size=5000):
+        for topic_id, points in topic_scores:
+            if points is None:
+                continue
+            for key, key_series_id in (
+                (('tournament', tournament_id, topic_id), series_id),
+                (('series', series_id, topic_id), series_id),
+                (('all', 0, topic_id), None),
+            ):
+                entry = stats.setdefault(key, [key_series_id, 0, 0.0, 0.0, Counter()])
+                entry[1] += 1
+                entry[2] += points
+                entry[3] += points * points
+                entry[4][str(float(points))] += 1
+
+    TopicDifficulty.objects.bulk_create(
+        [
+            TopicDifficulty(
+                scope=scope, object_id=object_id, topic_id=topic_id, series_id=series_id,
+                games_count=games_count, points_sum=points_sum, points_sq_sum=points_sq_sum, histogram=dict(histogram),
+            )
+            for (scope, object_id, topic_id), (series_id, games_count, points_sum, points_sq_sum, histogram) in stats.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0011_gameresult_topic_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicDifficulty',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('tournament', 'Турнир'), ('series', 'Серия'), ('all', 'Все турниры')], max_length=10, verbose_name='Разрез')),
+                ('object_id', models.PositiveBigIntegerField(default=0, verbose_name='ID объекта')),
+                ('series_id', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='ID серии')),
+                ('games_count', models.PositiveIntegerField(default=0, verbose_name='Сыграно')),
+                ('points_sum', models.FloatField(default=0.0, verbose_name='Сумма очков')),
+                ('points_sq_sum', models.FloatField(default=0.0, verbose_name='Сумма квадратов очков')),
+                ('histogram', models.JSONField(blank=True, default=dict, verbose_name='Распределение очков')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.topic', verbose_name='Тема')),
+            ],
+            options={
+                'verbose_name': 'Сложность темы',
+                'verbose_name_plural': 'Сложность тем',
+                'unique_together': {('scope', 'object_id', 'topic')},
+            },
+        ),
+        migrations.RunPython(fill_topic_difficulty, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, Count, F, FloatField, Q, Sum, When
+from django.db.models.functions import Coalesce
+
+
+def fill_team_stats(apps, schema_editor):
+    # Та же логика, что в ratings.rankings.expected_rows (и TeamQuerySet.with_stats), но на исторических моделях
+    Team = apps.get_model('ratings', 'Team')
+    TeamStats = apps.get_model('ratings', 'TeamStats')
+
+    teams = Team.objects.annotate(
+        games_played_count=Count('gameresult', distinct=True),
+        wins_count=Count('gameresult', filter=Q(gameresult__place=1), distinct=True),
+        total_points_sum=Coalesce(Sum('gameresult__total_points', distinct=True), 0.0, output_field=FloatField()),
+    ).annotate(
+        avg_points=Case(
+            When(games_played_count=0, then=0.0),
+            default=F('total_points_sum') / F('games_played_count'),
+            output_field=FloatField(),
+        )
+    ).values('id', 'city_id', 'games_played_count', 'wins_count', 'total_points_sum', 'avg_points')
+
+    by_city = {}
+    for stats in teams:
+        by_city.setdefault(stats['city_id'], []).append(stats)
+
+    rows = []
+    for city_id, city_teams in by_city.items():
+        places = {stats['id']: {} for stats in city_teams}
+        for value_field, prefix in (('total_points_sum', 'points'), ('wins_count', 'wins'), ('avg_points', 'avg')):
+            ordered = sorted(city_teams, key=lambda stats: (-stats[value_field], stats['id']))
+            rank = 0
+            for position, stats in enumerate(ordered, start=1):
+                if position == 1 or stats[value_field] != ordered[position - 2][value_field]:
+                    rank = position
+                places[stats['id']][f'{prefix}_rank'] = rank
+                places[stats['id']][f'{prefix}_position'] = position
+        for stats in city_teams:
+            rows.append(TeamStats(
+                team_id=stats['id'], city_id=city_id, games_played_count=stats['games_played_count'],
+                wins_count=stats['wins_count'], total_points_sum=stats['total_points_sum'],
+                avg_points=stats['avg_points'], **places[stats['id']],
+            ))
+    TeamStats.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0013_changelog'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ratingjob',
+            name='kind',
+            field=models.CharField(choices=[('tournament', 'Пересчет итогов и мест турнира'), ('team', 'Пересчет статистики и места команды')], max_length=20, verbose_name='Тип задачи'),
+        ),
+        migrations.CreateModel(
+            name='TeamStats',
+            fields=[
+                ('team', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='stats', serialize=False, to='ratings.team', verbose_name='Команда')),
+                ('city_id', models.PositiveBigIntegerField(verbose_name='ID города')),
+                ('games_played_count', models.PositiveIntegerField(default=0, verbose_name='Игр сыграно')),
+                ('wins_count', models.PositiveIntegerField(default=0, verbose_name='Побед')),
+                ('total_points_sum', models.FloatField(default=0.0, verbose_name='Очки')),
+                ('avg_points', models.FloatField(default=0.0, verbose_name='Ср. балл')),
+                ('points_rank', models.PositiveIntegerField(default=0, verbose_name='Место по очкам')),
+                ('points_position', models.PositiveIntegerField(default=0, verbose_name='Строка по очкам')),
+                ('wins_rank', models.PositiveIntegerField(default=0, verbose_name='Место по победам')),
+                ('wins_position', models.PositiveIntegerField(default=0, verbose_name='Строка по победам')),
+                ('avg_rank', models.PositiveIntegerField(default=0, verbose_name='Место по ср. баллу')),
+                ('avg_position', models.PositiveIntegerField(default=0, verbose_name='Строка по ср. баллу')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Статистика команды',
+                'verbose_name_plural': 'Статистика команд',
+                'indexes': [models.Index(fields=['city_id', 'points_position'], name='team_stats_points_idx'), models.Index(fields=['city_id', 'wins_position'], name='team_stats_wins_idx'), models.Index(fields=['city_id', 'avg_position'], name='team_stats_avg_idx')],
+            },
+        ),
+        migrations.RunPython(fill_team_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,113 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_global_ranks(apps, schema_editor):
+    # Та же логика, что в ratings.rankings.expected_rows/expected_cities, но по уже посчитанным строкам TeamStats
+    TeamStats = apps.get_model('ratings', 'TeamStats')
+    CityStats = apps.get_model('ratings', 'CityStats')
+
+    rows = list(TeamStats.objects.all())
+    for value_field, prefix in (('total_points_sum', 'points'), ('wins_count', 'wins'), ('avg_points', 'avg')):
+        ordered = sorted(rows, key=lambda row: (-getattr(row, value_field), row.team_id))
+        rank = 0
+        for position, row in enumerate(ordered, start=1):
+            if position == 1 or getattr(row, value_field) != getattr(ordered[position - 2], value_field):
+                rank = position
+            setattr(row, f'global_{prefix}_rank', rank)
+            setattr(row, f'global_{prefix}_position', position)
+    TeamStats.objects.bulk_update(rows, [
+        f'global_{prefix}_{kind}' for prefix in ('points', 'wins', 'avg') for kind in ('rank', 'position')
+    ], batch_size=1000)
+
+    top_teams = getattr(settings, 'RATINGS_CITY_TOP_TEAMS', 10)
+    cities, best = {}, {}
+    for row in rows:
+        city = cities.setdefault(row.city_id, CityStats(city_id=row.city_id))
+        city.teams_count += 1
+        city.active_teams_count += 1 if row.games_played_count else 0
+        city.games_played_count += row.games_played_count
+        city.total_points_sum += row.total_points_sum
+        if row.points_position <= top_teams:
+            best.setdefault(row.city_id, []).append(row.total_points_sum)
+    for city_id, city in cities.items():
+        city.top_points_avg = sum(best[city_id]) / len(best[city_id])
+    ordered = sorted(cities.values(), key=lambda city: (-city.top_points_avg, city.city_id))
+    for position, city in enumerate(ordered, start=1):
+        if position == 1 or city.top_points_avg != ordered[position - 2].top_points_avg:
+            rank = position
+        city.strength_rank = rank
+    CityStats.objects.bulk_create(cities.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0014_teamstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CityStats',
+            fields=[
+                ('city', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='ratings.city', verbose_name='Город')),
+                ('teams_count', models.PositiveIntegerField(default=0, verbose_name='Команд')),
+                ('active_teams_count', models.PositiveIntegerField(default=0, verbose_name='Играющих команд')),
+                ('games_played_count', models.PositiveIntegerField(default=0, verbose_name='Игр сыграно командами')),
+                ('total_points_sum', models.FloatField(default=0.0, verbose_name='Очки')),
+                ('top_points_avg', models.FloatField(default=0.0, verbose_name='Сила')),
+                ('strength_rank', models.PositiveIntegerField(default=0, verbose_name='Место по силе')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Статистика города',
+                'verbose_name_plural': 'Статистика городов',
+            },
+        ),
+        migrations.AddField(
+            model_name='teamstats',
+            name='global_avg_position',
+            field=models.PositiveIntegerField(default=0, verbose_name='Общая строка по ср. баллу'),
+        ),
+        migrations.AddField(
+            model_name='teamstats',
+            name='global_avg_rank',
+            field=models.PositiveIntegerField(default=0, verbose_name='Общее место по ср. баллу'),
+        ),
+        migrations.AddField(
+            model_name='teamstats',
+            name='global_points_position',
+            field=models.PositiveIntegerField(default=0, verbose_name='Общая строка по очкам'),
+        ),
+        migrations.AddField(
+            model_name='teamstats',
+            name='global_points_rank',
+            field=models.PositiveIntegerField(default=0, verbose_name='Общее место по очкам'),
+        ),
+        migrations.AddField(
+            model_name='teamstats',
+            name='global_wins_position',
+            field=models.PositiveIntegerField(default=0, verbose_name='Общая строка по победам'),
+        ),
+        migrations.AddField(
+            model_name='teamstats',
+            name='global_wins_rank',
+            field=models.PositiveIntegerField(default=0, verbose_name='Общее место по победам'),
+        ),
+        migrations.AddIndex(
+            model_name='teamstats',
+            index=models.Index(fields=['global_points_position'], name='team_stats_global_points_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teamstats',
+            index=models.Index(fields=['global_wins_position'], name='team_stats_global_wins_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teamstats',
+            index=models.Index(fields=['global_avg_position'], name='team_stats_global_avg_idx'),
+        ),
+        migrations.RunPython(fill_global_ranks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:57
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_topic_leaders(apps, schema_editor):
+    # Та же логика, что в ratings.topic_leaders.expected_stats/expected_boards, но на исторических моделях
+    GameResult = apps.get_model('ratings', 'GameResult')
+    Team = apps.get_model('ratings', 'Team')
+    Topic = apps.get_model('ratings', 'Topic')
+    TeamTopicStat = apps.get_model('ratings', 'TeamTopicStat')
+    TopicLeaderboard = apps.get_model('ratings', 'TopicLeaderboard')
+
+    top_k = getattr(settings, 'RATINGS_TOPIC_TOP_K', 100)
+    min_games = getattr(settings, 'RATINGS_TOPIC_MIN_GAMES', 3)
+    cities = dict(Team.objects.values_list('id', 'city_id'))
+    topic_ids = set(Topic.objects.values_list('id', flat=True))
+
+    # (team_id, topic_id) -> [игр, сумма очков]
+    totals = defaultdict(lambda: [0, 0.0])
+    for team_id, topic_scores in GameResult.objects.order_by('id').values_list('team_id', 'topic_scores').iterator(chunk_size=5000):
+        for topic_id, points in topic_scores:
+            if points is not None and topic_id in topic_ids and team_id in cities:
+                totals[(team_id, topic_id)][0] += 1
+                totals[(team_id, topic_id)][1] += points
+
+    rows = []
+    candidates = defaultdict(list)
+    for (team_id, topic_id), (games_count, points_sum) in totals.items():
+        avg_points = points_sum / games_count
+        rows.append(TeamTopicStat(
+            team_id=team_id, topic_id=topic_id, city_id=cities[team_id], games_count=games_count,
+            points_sum=points_sum, avg_points=avg_points,
+        ))
+        for city_id in (cities[team_id], 0):
+            if games_count >= min_games:
+                candidates[(topic_id, city_id, 'avg')].append([team_id, avg_points, games_count])
+            candidates[(topic_id, city_id, 'total')].append([team_id, points_sum, games_count])
+    TeamTopicStat.objects.bulk_create(rows, batch_size=1000)
+    TopicLeaderboard.objects.bulk_create(
+        [
+            TopicLeaderboard(
+                topic_id=topic_id, city_id=city_id, kind=kind,
+                entries=sorted(entries, key=lambda entry: (-entry[1], entry[0]))[:top_k],
+            )
+            for (topic_id, city_id, kind), entries in candidates.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0015_citystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamTopicStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city_id', models.PositiveBigIntegerField(verbose_name='ID города')),
+                ('games_count', models.PositiveIntegerField(default=0, verbose_name='Игр')),
+                ('points_sum', models.FloatField(default=0.0, verbose_name='Очки')),
+                ('avg_points', models.FloatField(default=0.0, verbose_name='Ср. балл')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+                ('team', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='topic_stats', to='ratings.team', verbose_name='Команда')),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.topic', verbose_name='Тема')),
+            ],
+            options={
+                'verbose_name': 'Статистика команды по теме',
+                'verbose_name_plural': 'Статистика команд по темам',
+                'indexes': [models.Index(fields=['topic', 'city_id', '-avg_points'], name='team_topic_city_avg_idx'), models.Index(fields=['topic', 'city_id', '-points_sum'], name='team_topic_city_total_idx'), models.Index(fields=['topic', '-avg_points'], name='team_topic_avg_idx'), models.Index(fields=['topic', '-points_sum'], name='team_topic_total_idx')],
+                'unique_together': {('team', 'topic')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TopicLeaderboard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city_id', models.PositiveBigIntegerField(verbose_name='ID города')),
+                ('kind', models.CharField(choices=[('avg', 'По среднему баллу'), ('total', 'По сумме очков')], max_length=10, verbose_name='Сортировка')),
+                ('entries', models.JSONField(blank=True, default=list, verbose_name='Лидеры')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.topic', verbose_name='Тема')),
+            ],
+            options={
+                'verbose_name': 'Лидеры темы',
+                'verbose_name_plural': 'Лидеры тем',
+                'unique_together': {('topic', 'city_id', 'kind')},
+            },
+        ),
+        migrations.RunPython(fill_topic_leaders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.5 on 2026-10-19 12:01
+
+from datetime import datetime, time
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_belt_history(apps, schema_editor):
+    # Та же логика, что в ratings.belts.expected_history, но на исторических моделях.
+    # Таблица поясов - константа кода, ее берем из текущих моделей
+    from ratings.models import BELT_SYSTEM, get_belt_info
+
+    GameResult = apps.get_model('ratings', 'GameResult')
+    Team = apps.get_model('ratings', 'Team')
+    BeltPromotion = apps.get_model('ratings', 'BeltPromotion')
+
+    levels = [
+        (belt_index, stripes)
+        for belt_index, belt in enumerate(BELT_SYSTEM)
+        for stripes in range(len(belt['levels']))
+    ]
+    level_index = {level: index for index, level in enumerate(levels)}
+
+    def level_of(score):
+        info = get_belt_info(round(score or 0, 6))
+        return level_index[(info['belt_index'], info['stripes_count'])]
+
+    cities = dict(Team.objects.values_list('id', 'city_id'))
+    state = {}
+    events = []
+    results = GameResult.objects.order_by('tournament__date', 'tournament_id').values_list(
+        'team_id', 'tournament_id', 'tournament__date', 'total_points',
+    )
+    for team_id, tournament_id, date, points in results.iterator(chunk_size=5000):
+        if team_id not in cities:
+            continue
+        total, level = state.get(team_id, (0.0, level_of(0)))
+        total += points
+        new_level = level_of(total)
+        if new_level != level:
+            events.append(BeltPromotion(
+                team_id=team_id, city_id=cities[team_id], tournament_id=tournament_id,
+                from_level=level, to_level=new_level, total_points=total,
+                created_at=timezone.make_aware(datetime.combine(date, time.min)),
+            ))
+        state[team_id] = (total, new_level)
+    BeltPromotion.objects.bulk_create(events, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0016_topic_leaders'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BeltPromotion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city_id', models.PositiveBigIntegerField(verbose_name='ID города')),
+                ('tournament_id', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='ID турнира')),
+                ('from_level', models.PositiveSmallIntegerField(verbose_name='Был уровень')),
+                ('to_level', models.PositiveSmallIntegerField(verbose_name='Стал уровень')),
+                ('total_points', models.FloatField(verbose_name='Очки')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время')),
+                ('team', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='belt_promotions', to='ratings.team', verbose_name='Команда')),
+            ],
+            options={
+                'verbose_name': 'Смена пояса',
+                'verbose_name_plural': 'Смены поясов',
+                'ordering': ['-created_at', '-id'],
+                'indexes': [models.Index(fields=['city_id', '-created_at'], name='belt_promotion_city_idx'), models.Index(fields=['team', '-created_at'], name='belt_promotion_team_idx'), models.Index(fields=['-created_at'], name='belt_promotion_time_idx')],
+            },
+        ),
+        migrations.RunPython(fill_belt_history, migrations.RunPython.noop),
+    ]
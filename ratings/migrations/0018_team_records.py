@@ -0,0 +1,90 @@
+# Generated by Django 5.2.5 on 2026-10-19 12:05
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_team_records(apps, schema_editor):
+    # Та же логика, что в ratings.records.expected_rows (шаг _step), но на исторических моделях
+    GameResult = apps.get_model('ratings', 'GameResult')
+    Team = apps.get_model('ratings', 'Team')
+    TeamRecord = apps.get_model('ratings', 'TeamRecord')
+
+    streaks = [
+        ('win_streak', 'longest_win_streak', lambda place, black_box: place == 1),
+        ('podium_streak', 'longest_podium_streak', lambda place, black_box: 1 <= place <= 3),
+        ('black_box_streak', 'longest_black_box_streak', lambda place, black_box: black_box > 0),
+    ]
+    state_fields = [field for streak in streaks for field in streak[:2]] + ['best_total_points', 'best_total_tournament_id']
+
+    def step(state, tournament_id, series_id, place, points, black_box):
+        state = {**state, 'series_best': dict(state['series_best'])}
+        for streak, longest, hit in streaks:
+            state[streak] = state[streak] + 1 if hit(place, black_box) else 0
+            state[longest] = max(state[longest], state[streak])
+        if state['best_total_tournament_id'] is None or points > state['best_total_points']:
+            state['best_total_points'], state['best_total_tournament_id'] = points, tournament_id
+        best = state['series_best'].get(str(series_id))
+        if best is None or points > best[0]:
+            state['series_best'][str(series_id)] = [points, tournament_id]
+        return state
+
+    games = defaultdict(list)
+    results = GameResult.objects.order_by('tournament__date', 'tournament_id').values_list(
+        'team_id', 'tournament_id', 'tournament__series_id', 'place', 'total_points', 'black_box_points', 'tournament__date',
+    )
+    for team_id, *game in results.iterator(chunk_size=5000):
+        games[team_id].append(game)
+
+    rows = []
+    for team_id, city_id in Team.objects.values_list('id', 'city_id'):
+        state = base = {**dict.fromkeys(state_fields, 0), 'best_total_points': 0.0, 'best_total_tournament_id': None, 'series_best': {}}
+        row = TeamRecord(team_id=team_id, city_id=city_id, games_count=len(games[team_id]))
+        for *game, date in games[team_id]:
+            base, state = state, step(state, *game)
+            row.last_date, row.last_tournament_id = date, game[0]
+        for field in state_fields:
+            setattr(row, field, state[field])
+        row.series_best, row.base = state['series_best'], base
+        rows.append(row)
+    TeamRecord.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0017_belt_promotions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamRecord',
+            fields=[
+                ('team', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='records', serialize=False, to='ratings.team', verbose_name='Команда')),
+                ('city_id', models.PositiveBigIntegerField(verbose_name='ID города')),
+                ('games_count', models.PositiveIntegerField(default=0, verbose_name='Игр')),
+                ('last_date', models.DateField(blank=True, null=True, verbose_name='Дата последней игры')),
+                ('last_tournament_id', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='ID последнего турнира')),
+                ('win_streak', models.PositiveIntegerField(default=0, verbose_name='Побед подряд сейчас')),
+                ('longest_win_streak', models.PositiveIntegerField(default=0, verbose_name='Побед подряд')),
+                ('podium_streak', models.PositiveIntegerField(default=0, verbose_name='Призовых мест подряд сейчас')),
+                ('longest_podium_streak', models.PositiveIntegerField(default=0, verbose_name='Призовых мест подряд')),
+                ('black_box_streak', models.PositiveIntegerField(default=0, verbose_name='Черных ящиков подряд сейчас')),
+                ('longest_black_box_streak', models.PositiveIntegerField(default=0, verbose_name='Черных ящиков подряд')),
+                ('best_total_points', models.FloatField(default=0.0, verbose_name='Лучший результат')),
+                ('best_total_tournament_id', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='ID турнира рекорда')),
+                ('series_best', models.JSONField(blank=True, default=dict, verbose_name='Лучшее по сериям')),
+                ('base', models.JSONField(blank=True, default=dict, verbose_name='Состояние до последней игры')),
+                ('needs_replay', models.BooleanField(default=False, verbose_name='Нужен пересчет')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Рекорды команды',
+                'verbose_name_plural': 'Рекорды команд',
+                'indexes': [models.Index(fields=['city_id', '-longest_win_streak'], name='team_record_win_idx'), models.Index(fields=['city_id', '-longest_podium_streak'], name='team_record_podium_idx'), models.Index(fields=['city_id', '-longest_black_box_streak'], name='team_record_black_box_idx'), models.Index(fields=['city_id', '-best_total_points'], name='team_record_total_idx'), models.Index(fields=['city_id', '-win_streak'], name='team_record_current_win_idx')],
+            },
+        ),
+        migrations.RunPython(fill_team_records, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.5 on 2026-10-19 12:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0018_team_records'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Season',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Название')),
+                ('start_date', models.DateField(verbose_name='Начало')),
+                ('end_date', models.DateField(verbose_name='Конец')),
+                ('closed_at', models.DateTimeField(blank=True, null=True, verbose_name='Закрыт')),
+                ('tournaments', models.JSONField(blank=True, default=dict, editable=False, verbose_name='Турниры сводок')),
+            ],
+            options={
+                'verbose_name': 'Сезон',
+                'verbose_name_plural': 'Сезоны',
+                'ordering': ['-start_date'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='ratingjob',
+            name='kind',
+            field=models.CharField(choices=[('tournament', 'Пересчет итогов и мест турнира'), ('team', 'Пересчет статистики и места команды'), ('season', 'Пересчет сводок закрытого сезона')], max_length=20, verbose_name='Тип задачи'),
+        ),
+        migrations.CreateModel(
+            name='SeasonSeriesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('participations', models.PositiveIntegerField(default=0, verbose_name='Участий')),
+                ('wins', models.PositiveIntegerField(default=0, verbose_name='Побед')),
+                ('second_places', models.PositiveIntegerField(default=0, verbose_name='Вторых мест')),
+                ('third_places', models.PositiveIntegerField(default=0, verbose_name='Третьих мест')),
+                ('points_sum', models.FloatField(default=0.0, verbose_name='Очки')),
+                ('season', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series_summaries', to='ratings.season', verbose_name='Сезон')),
+                ('series', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.tournamentseries', verbose_name='Серия')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.team', verbose_name='Команда')),
+            ],
+            options={
+                'verbose_name': 'Итоги сезона в серии',
+                'verbose_name_plural': 'Итоги сезонов в сериях',
+                'unique_together': {('season', 'team', 'series')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SeasonTopicSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('games_count', models.PositiveIntegerField(default=0, verbose_name='Игр')),
+                ('points_sum', models.FloatField(default=0.0, verbose_name='Очки')),
+                ('season', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='topic_summaries', to='ratings.season', verbose_name='Сезон')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.team', verbose_name='Команда')),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.topic', verbose_name='Тема')),
+            ],
+            options={
+                'verbose_name': 'Итоги сезона по теме',
+                'verbose_name_plural': 'Итоги сезонов по темам',
+                'unique_together': {('season', 'team', 'topic')},
+            },
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.5 on 2026-10-19 12:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def enqueue_standings(apps, schema_editor):
+    # Зачет собирает задача серии (ratings.standings.refresh_series) - ставим ее всем сериям, у которых есть турниры
+    Season = apps.get_model('ratings', 'Season')
+    Tournament = apps.get_model('ratings', 'Tournament')
+    RatingJob = apps.get_model('ratings', 'RatingJob')
+    if not Season.objects.exists():
+        return
+    series_ids = Tournament.objects.order_by().values_list('series_id', flat=True).distinct()
+    RatingJob.objects.bulk_create([RatingJob(kind='standings', object_id=series_id) for series_id in sorted(series_ids)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0019_seasons'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tournamentseries',
+            name='best_of',
+            field=models.PositiveIntegerField(blank=True, help_text='Пусто - все игры сезона', null=True, verbose_name='Лучших игр в зачете'),
+        ),
+        migrations.AlterField(
+            model_name='ratingjob',
+            name='kind',
+            field=models.CharField(choices=[('tournament', 'Пересчет итогов и мест турнира'), ('team', 'Пересчет статистики и места команды'), ('season', 'Пересчет сводок закрытого сезона'), ('standings', 'Пересчет зачета серии по сезонам')], max_length=20, verbose_name='Тип задачи'),
+        ),
+        migrations.CreateModel(
+            name='SeriesStanding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(verbose_name='Место')),
+                ('points', models.FloatField(default=0.0, verbose_name='Очки зачета')),
+                ('total_points', models.FloatField(default=0.0, verbose_name='Очки в играх')),
+                ('progression', models.PositiveIntegerField(default=0, verbose_name='Этап')),
+                ('games_count', models.PositiveIntegerField(default=0, verbose_name='Игр')),
+                ('counted_count', models.PositiveIntegerField(default=0, verbose_name='Игр в зачете')),
+                ('wins', models.PositiveIntegerField(default=0, verbose_name='Побед')),
+                ('best_place', models.PositiveIntegerField(blank=True, null=True, verbose_name='Лучшее место')),
+                ('results', models.JSONField(blank=True, default=list, verbose_name='Игры')),
+                ('season', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.season', verbose_name='Сезон')),
+                ('series', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.tournamentseries', verbose_name='Серия')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.team', verbose_name='Команда')),
+            ],
+            options={
+                'verbose_name': 'Строка зачета серии',
+                'verbose_name_plural': 'Зачеты серий по командам',
+                'indexes': [models.Index(fields=['season', 'series', 'position'], name='series_standing_idx')],
+                'unique_together': {('season', 'series', 'team')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SeriesStandingTable',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tournaments', models.JSONField(blank=True, default=dict, editable=False, verbose_name='Турниры зачета')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлен')),
+                ('season', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='standing_tables', to='ratings.season', verbose_name='Сезон')),
+                ('series', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.tournamentseries', verbose_name='Серия')),
+            ],
+            options={
+                'verbose_name': 'Зачет серии',
+                'verbose_name_plural': 'Зачеты серий',
+                'unique_together': {('season', 'series')},
+            },
+        ),
+        migrations.RunPython(enqueue_standings, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,10 @@
+from collections import defaultdict
 from django.db import models
 from django.core.exceptions import ValidationError
 from django.db.models import Count, Q, Sum, F, Max, FloatField, Window, When, Case
 from decimal import Decimal
 from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 
 #Расчеты для таблицы команд(teams.hmtl)
@@ -50,6 +52,10 @@ class TournamentSeries(models.Model):
         default='regular', 
         verbose_name="Тип турнира"
     )
+    # Зачет серии за сезон (ratings/standings.py): сколько лучших игр команды идут в зачет
+    best_of = models.PositiveIntegerField(
+        null=True, blank=True, verbose_name="Лучших игр в зачете", help_text="Пусто - все игры сезона",
+    )
     
     class Meta:
         verbose_name = "Серия турниров"
@@ -128,16 +134,9 @@ class Team(models.Model):
 
     # Подсчеты для секции "Достижения"
     def get_series_stats(self):
-        return self.gameresult_set.values(
-            'tournament__series__name',
-            'tournament__series__display_order',
-            'tournament__series__tournament_type',
-        ).annotate(
-            participations=Count('id'),
-            wins=Count('id', filter=Q(place=1)),
-            second_places=Count('id', filter=Q(place=2)),
-            third_places=Count('id', filter=Q(place=3)),
-        ).order_by('tournament__series__display_order') 
+        # Игры закрытых сезонов берутся из сводок, по сырым результатам считаются только остальные (ratings/seasons.py)
+        from .seasons import series_stats
+        return series_stats(self.id)
 
         
     # Рассчет среднего балла по темам
@@ -148,39 +147,34 @@ class Team(models.Model):
         - counts: количество игр по каждой теме {topic_id: games_count}
         - best_topic: информация о лучшей теме по среднему баллу
         """
-        # 1. Получаем все результаты команды по темам (ВСЕ или ОТФИЛЬТРОВАННЫЕ)
+        # 1. Получаем все игры команды (ВСЕ или ОТФИЛЬТРОВАННЫЕ) - очки по темам уже упакованы в topic_scores
+        topic_stats = {}
         if results_qs is None:
-            # Если не передан QuerySet, берем все игры команды
-            topic_results = (
-                TopicResult.objects
-                .filter(game_result__team=self)
-                .select_related('topic')
-                .values('topic_id', 'topic__short_name', 'topic__full_name', 'points')
-            )
-        else:
-            # ★ ЕСЛИ ПЕРЕДАН QuerySet - ФИЛЬТРУЕМ ПО НЕМУ ★
-            topic_results = (
-                TopicResult.objects
-                .filter(game_result__in=results_qs)  # Фильтруем по переданным играм
-                .select_related('topic')
-                .values('topic_id', 'topic__short_name', 'topic__full_name', 'points')
-            )
+            # Если не передан QuerySet, берем все игры команды: закрытые сезоны - из сводок, остальное - сырые игры
+            from .seasons import frozen_topic_stats, live_results
+            topic_stats = frozen_topic_stats(self.id)
+            results_qs = live_results(self.gameresult_set.all())
         
-        # 2. Группируем данные по темам (остальное без изменений)
-        topic_stats = {}
-        for result in topic_results:
-            topic_id = result['topic_id']
-            if topic_id not in topic_stats:
-                topic_stats[topic_id] = {
-                    'points_sum': 0,
-                    'games_count': 0,
-                    'short_name': result['topic__short_name'],
-                    'full_name': result['topic__full_name']
-                }
-            # Накопление суммы баллов
-            topic_stats[topic_id]['points_sum'] += float(result['points'])
-            # Увеличение счетчика игр 
-            topic_stats[topic_id]['games_count'] += 1
+        # 2. Группируем данные по темам
+        for topic_scores in results_qs.values_list('topic_scores', flat=True):
+            for topic_id, points in topic_scores:
+                if points is None:
+                    continue
+                if topic_id not in topic_stats:
+                    topic_stats[topic_id] = {'points_sum': 0, 'games_count': 0}
+                # Накопление суммы баллов
+                topic_stats[topic_id]['points_sum'] += points
+                # Увеличение счетчика игр 
+                topic_stats[topic_id]['games_count'] += 1
+
+        # Названия тем из справочника в памяти (импорт здесь: reference.py сам импортирует модели)
+        from .reference import get_reference_data
+        topics_by_id = get_reference_data().topics_by_id
+        # Тему могли удалить, а вектор еще не пересобран
+        topic_stats = {topic_id: stats for topic_id, stats in topic_stats.items() if topic_id in topics_by_id}
+        for topic_id, stats in topic_stats.items():
+            stats['short_name'] = topics_by_id[topic_id].short_name
+            stats['full_name'] = topics_by_id[topic_id].full_name
         
         # 3. Рассчитываем средние баллы
         averages = {}
@@ -223,6 +217,9 @@ class GameResult(models.Model):
     total_points = models.FloatField(default=0.0, verbose_name="Всего очков")
     # Сигналы подсчитывают points
     place = models.PositiveIntegerField(default=0, verbose_name="Место в турнире")
+    # Копия TopicResult для чтения: [[topic_id, очки или None], ...] в порядке тем турнира.
+    # Источник правды - TopicResult, вектор пересобирает recalculate_tournament (см. pack_topic_scores)
+    topic_scores = models.JSONField(default=list, blank=True, editable=False, verbose_name="Очки по темам")
 
 
     class Meta:
@@ -230,25 +227,46 @@ class GameResult(models.Model):
         verbose_name_plural = "Результаты игры"
         unique_together = ['tournament', 'team']
 
-    #Функции для game_modal
+    #Функции для game_modal (считаются по topic_scores, без запросов)
+    def _played_topic_points(self):
+        return [Decimal(str(points)) for _, points in self.topic_scores if points is not None]
+
     def points_before_black_box(self):
         #Очки до черного ящика
-        result = self.topicresult_set.filter(
-            topic__tournamenttopic__tournament=self.tournament
-        ).aggregate(total=Coalesce(Sum('points'), Decimal('0.0')))
-        return result['total']
+        return sum(self._played_topic_points(), Decimal('0.0'))
     
     @property
     def first_three_topics_points(self):
-        # Очки за первые три темы турнира
-        qs = self.topicresult_set.filter(
-            topic__tournamenttopic__tournament=self.tournament
-        ).select_related('topic').order_by('topic__tournamenttopic__order')[:3]
-        return sum((tr.points or Decimal('0.0')) for tr in qs)
+        # Очки за первые три сыгранные темы турнира
+        return sum(self._played_topic_points()[:3], Decimal('0.0'))
 
     def __str__(self):
         return f"{self.team} - {self.tournament}"
 
+def pack_topic_scores(results):
+    """
+    Собирает topic_scores для результатов (нужны id и tournament_id) за два запроса.
+    Возвращает {game_result_id: [[topic_id, очки или None], ...]} в порядке тем турнира.
+    """
+    tournament_ids = {result.tournament_id for result in results}
+    topic_order = defaultdict(list)
+    for tournament_id, topic_id in TournamentTopic.objects.filter(
+        tournament_id__in=tournament_ids
+    ).order_by('tournament_id', 'order', 'id').values_list('tournament_id', 'topic_id'):
+        topic_order[tournament_id].append(topic_id)
+
+    points = defaultdict(dict)
+    for game_result_id, topic_id, value in TopicResult.objects.filter(
+        game_result__tournament_id__in=tournament_ids
+    ).values_list('game_result_id', 'topic_id', 'points'):
+        points[game_result_id][topic_id] = float(value)
+
+    return {
+        result.id: [[topic_id, points[result.id].get(topic_id)] for topic_id in topic_order[result.tournament_id]]
+        for result in results
+    }
+
+
 # Результаты по теме
 class TopicResult(models.Model):
     game_result = models.ForeignKey(GameResult, on_delete=models.CASCADE, verbose_name="Результат игры")
@@ -262,16 +280,512 @@ class TopicResult(models.Model):
     
     #Проверяем, не добавил ли администратор лишние темы для GameResults конкретного турнира
     def clean(self):
-        if self.game_result and self.topic:
-            if not self.game_result.tournament.topics.filter(id=self.topic.id).exists():
-                raise ValidationError(
-                    f'Тема "{self.topic}" не входит в список тем турнира "{self.game_result.tournament}"'
-                )
+        # game_result может быть еще не сохранен (новый результат в админке), поэтому берем объект, а не game_result_id
+        game_result = getattr(self, 'game_result', None)
+        if game_result is None or not game_result.tournament_id or not self.topic_id:
+            return
+        # Инлайн-формсет в админке проставляет один набор тем на все строки, чтобы не делать запрос на каждую
+        allowed_topic_ids = getattr(self, 'allowed_topic_ids', None)
+        if allowed_topic_ids is None:
+            allowed_topic_ids = set(
+                TournamentTopic.objects.filter(tournament_id=game_result.tournament_id).values_list('topic_id', flat=True)
+            )
+        if self.topic_id not in allowed_topic_ids:
+            raise ValidationError(
+                f'Тема "{self.topic}" не входит в список тем турнира "{game_result.tournament}"'
+            )
     
     def __str__(self):
         return f"{self.game_result} - {self.topic}: {self.points}"
 
 
+# Сложность тем: распределение очков по теме в турнире, в серии и за все время (см. ratings/difficulty.py).
+# Суммы и гистограмма складываются, поэтому итоги серии и всего сайта обновляются разницей при пересчете турнира
+class TopicDifficulty(models.Model):
+    SCOPE_TOURNAMENT = 'tournament'
+    SCOPE_SERIES = 'series'
+    SCOPE_ALL = 'all'
+    SCOPES = [
+        (SCOPE_TOURNAMENT, 'Турнир'),
+        (SCOPE_SERIES, 'Серия'),
+        (SCOPE_ALL, 'Все турниры'),
+    ]
+
+    scope = models.CharField(max_length=10, choices=SCOPES, verbose_name="Разрез")
+    # id турнира или серии; 0 для разреза "Все турниры"
+    object_id = models.PositiveBigIntegerField(default=0, verbose_name="ID объекта")
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, verbose_name="Тема")
+    # Для строк турнира - серия, в которую он входил при расчете (чтобы снять его вклад, если серию сменили)
+    series_id = models.PositiveBigIntegerField(null=True, blank=True, verbose_name="ID серии")
+    games_count = models.PositiveIntegerField(default=0, verbose_name="Сыграно")
+    points_sum = models.FloatField(default=0.0, verbose_name="Сумма очков")
+    points_sq_sum = models.FloatField(default=0.0, verbose_name="Сумма квадратов очков")
+    # {"2.5": сколько раз команды набрали 2.5, ...}
+    histogram = models.JSONField(default=dict, blank=True, verbose_name="Распределение очков")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
+
+    class Meta:
+        verbose_name = "Сложность темы"
+        verbose_name_plural = "Сложность тем"
+        unique_together = ['scope', 'object_id', 'topic']
+
+    @property
+    def mean(self):
+        return self.points_sum / self.games_count if self.games_count else 0.0
+
+    @property
+    def stdev(self):
+        if not self.games_count:
+            return 0.0
+        variance = self.points_sq_sum / self.games_count - self.mean ** 2
+        # Погрешность float на одинаковых значениях может дать -1e-16
+        return max(variance, 0.0) ** 0.5
+
+    def percentile(self, fraction):
+        """Очки, которых не достигли fraction команд (по гистограмме)"""
+        if not self.games_count:
+            return None
+        target = fraction * self.games_count
+        seen = 0
+        for points, count in sorted(self.histogram.items(), key=lambda item: float(item[0])):
+            seen += count
+            if seen >= target:
+                return float(points)
+        return None
+
+    def __str__(self):
+        return f"{self.topic} ({self.get_scope_display()} #{self.object_id})"
+
+
+
+# Очередь пересчетов: сигналы только ставят задачу, считает ее manage.py run_rating_worker
+class RatingJob(models.Model):
+    KIND_TOURNAMENT = 'tournament'
+    KIND_TEAM = 'team'
+    KIND_SEASON = 'season'
+    KIND_STANDINGS = 'standings'
+    KINDS = [
+        (KIND_TOURNAMENT, 'Пересчет итогов и мест турнира'),
+        (KIND_TEAM, 'Пересчет статистики и места команды'),
+        (KIND_SEASON, 'Пересчет сводок закрытого сезона'),
+        (KIND_STANDINGS, 'Пересчет зачета серии по сезонам'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_FAILED = 'failed'
+    STATUSES = [
+        (STATUS_PENDING, 'Ожидает'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KINDS, verbose_name="Тип задачи")
+    object_id = models.PositiveBigIntegerField(verbose_name="ID объекта")
+    status = models.CharField(max_length=10, choices=STATUSES, default=STATUS_PENDING, verbose_name="Статус")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток")
+    last_error = models.TextField(blank=True, default='', verbose_name="Последняя ошибка")
+    run_after = models.DateTimeField(default=timezone.now, verbose_name="Выполнить после")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создана")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлена")
+
+    class Meta:
+        verbose_name = "Задача пересчета"
+        verbose_name_plural = "Задачи пересчета"
+        constraints = [
+            # Для одного турнира (команды) в очереди не больше одной ожидающей задачи
+            models.UniqueConstraint(
+                fields=['kind', 'object_id'],
+                condition=Q(status='pending'),
+                name='unique_pending_rating_job',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='rating_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.object_id} ({self.get_status_display()})"
+
+
+# Статистика команды (как в TeamQuerySet.with_stats) и ее место в городе по каждой сортировке таблицы.
+# rank - место с учетом дележа (1, 2, 2, 4), position - номер строки в таблице (при равенстве раньше меньший id).
+# Обновляется задачей команды в ratings/rankings.py: сдвигаются только строки между старым и новым местом
+class TeamStats(models.Model):
+    # Без внешнего ключа в БД: после удаления команды строка нужна задаче, чтобы сдвинуть места остальных
+    team = models.OneToOneField(
+        Team, on_delete=models.DO_NOTHING, db_constraint=False, primary_key=True,
+        related_name='stats', verbose_name="Команда",
+    )
+    # Город на момент расчета (чтобы убрать команду из таблицы старого города при переезде)
+    city_id = models.PositiveBigIntegerField(verbose_name="ID города")
+    games_played_count = models.PositiveIntegerField(default=0, verbose_name="Игр сыграно")
+    wins_count = models.PositiveIntegerField(default=0, verbose_name="Побед")
+    total_points_sum = models.FloatField(default=0.0, verbose_name="Очки")
+    avg_points = models.FloatField(default=0.0, verbose_name="Ср. балл")
+    points_rank = models.PositiveIntegerField(default=0, verbose_name="Место по очкам")
+    points_position = models.PositiveIntegerField(default=0, verbose_name="Строка по очкам")
+    wins_rank = models.PositiveIntegerField(default=0, verbose_name="Место по победам")
+    wins_position = models.PositiveIntegerField(default=0, verbose_name="Строка по победам")
+    avg_rank = models.PositiveIntegerField(default=0, verbose_name="Место по ср. баллу")
+    avg_position = models.PositiveIntegerField(default=0, verbose_name="Строка по ср. баллу")
+    # Те же места в общей таблице всех городов
+    global_points_rank = models.PositiveIntegerField(default=0, verbose_name="Общее место по очкам")
+    global_points_position = models.PositiveIntegerField(default=0, verbose_name="Общая строка по очкам")
+    global_wins_rank = models.PositiveIntegerField(default=0, verbose_name="Общее место по победам")
+    global_wins_position = models.PositiveIntegerField(default=0, verbose_name="Общая строка по победам")
+    global_avg_rank = models.PositiveIntegerField(default=0, verbose_name="Общее место по ср. баллу")
+    global_avg_position = models.PositiveIntegerField(default=0, verbose_name="Общая строка по ср. баллу")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
+
+    class Meta:
+        verbose_name = "Статистика команды"
+        verbose_name_plural = "Статистика команд"
+        indexes = [
+            models.Index(fields=['city_id', 'points_position'], name='team_stats_points_idx'),
+            models.Index(fields=['city_id', 'wins_position'], name='team_stats_wins_idx'),
+            models.Index(fields=['city_id', 'avg_position'], name='team_stats_avg_idx'),
+            models.Index(fields=['global_points_position'], name='team_stats_global_points_idx'),
+            models.Index(fields=['global_wins_position'], name='team_stats_global_wins_idx'),
+            models.Index(fields=['global_avg_position'], name='team_stats_global_avg_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.team_id}: {self.points_rank} место"
+
+
+# Итоги города для сравнения городов (ratings/rankings.py); строка есть только у городов с командами
+class CityStats(models.Model):
+    city = models.OneToOneField(
+        City, on_delete=models.CASCADE, primary_key=True, related_name='stats', verbose_name="Город",
+    )
+    teams_count = models.PositiveIntegerField(default=0, verbose_name="Команд")
+    active_teams_count = models.PositiveIntegerField(default=0, verbose_name="Играющих команд")
+    games_played_count = models.PositiveIntegerField(default=0, verbose_name="Игр сыграно командами")
+    total_points_sum = models.FloatField(default=0.0, verbose_name="Очки")
+    # Сила города - средние очки лучших команд (RATINGS_CITY_TOP_TEAMS), не зависит от числа слабых команд
+    top_points_avg = models.FloatField(default=0.0, verbose_name="Сила")
+    strength_rank = models.PositiveIntegerField(default=0, verbose_name="Место по силе")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
+
+    class Meta:
+        verbose_name = "Статистика города"
+        verbose_name_plural = "Статистика городов"
+
+    def __str__(self):
+        return f"{self.city_id}: {self.strength_rank} место"
+
+    @property
+    def avg_team_points(self):
+        return self.total_points_sum / self.active_teams_count if self.active_teams_count else 0.0
+
+
+# Очки и число игр команды по теме (из topic_scores) для лидеров по темам (ratings/topic_leaders.py)
+class TeamTopicStat(models.Model):
+    # Без внешнего ключа в БД, как у TeamStats: после удаления команды строки нужны задаче
+    team = models.ForeignKey(
+        Team, on_delete=models.DO_NOTHING, db_constraint=False, related_name='topic_stats', verbose_name="Команда",
+    )
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, verbose_name="Тема")
+    city_id = models.PositiveBigIntegerField(verbose_name="ID города")
+    games_count = models.PositiveIntegerField(default=0, verbose_name="Игр")
+    points_sum = models.FloatField(default=0.0, verbose_name="Очки")
+    avg_points = models.FloatField(default=0.0, verbose_name="Ср. балл")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
+
+    class Meta:
+        verbose_name = "Статистика команды по теме"
+        verbose_name_plural = "Статистика команд по темам"
+        unique_together = ('team', 'topic')
+        indexes = [
+            models.Index(fields=['topic', 'city_id', '-avg_points'], name='team_topic_city_avg_idx'),
+            models.Index(fields=['topic', 'city_id', '-points_sum'], name='team_topic_city_total_idx'),
+            models.Index(fields=['topic', '-avg_points'], name='team_topic_avg_idx'),
+            models.Index(fields=['topic', '-points_sum'], name='team_topic_total_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.team_id} / {self.topic_id}: {self.avg_points:.2f}"
+
+
+# Первые RATINGS_TOPIC_TOP_K команд темы в городе (city_id = 0 - среди всех городов) одним списком
+class TopicLeaderboard(models.Model):
+    KIND_AVG = 'avg'
+    KIND_TOTAL = 'total'
+    KINDS = [
+        (KIND_AVG, 'По среднему баллу'),
+        (KIND_TOTAL, 'По сумме очков'),
+    ]
+
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, verbose_name="Тема")
+    city_id = models.PositiveBigIntegerField(verbose_name="ID города")
+    kind = models.CharField(max_length=10, choices=KINDS, verbose_name="Сортировка")
+    # [[team_id, значение, игр], ...] по убыванию значения, при равенстве - по team_id
+    entries = models.JSONField(default=list, blank=True, verbose_name="Лидеры")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
+
+    class Meta:
+        verbose_name = "Лидеры темы"
+        verbose_name_plural = "Лидеры тем"
+        unique_together = ('topic', 'city_id', 'kind')
+
+    def __str__(self):
+        return f"{self.topic_id} / {self.city_id} / {self.kind}"
+
+
+# Переход команды на другой пояс или полоску (ratings/belts.py); уровень - номер в belts.LEVELS
+class BeltPromotion(models.Model):
+    # Без внешнего ключа в БД: события пишутся и при каскадном удалении команды, их убирает задача команды
+    team = models.ForeignKey(
+        Team, on_delete=models.DO_NOTHING, db_constraint=False, related_name='belt_promotions', verbose_name="Команда",
+    )
+    # Город на момент события - лента города не меняется, если команда переехала
+    city_id = models.PositiveBigIntegerField(verbose_name="ID города")
+    # Турнир, после которого сменился уровень (как в журнале изменений - просто номер, турнир могли удалить)
+    tournament_id = models.PositiveBigIntegerField(null=True, blank=True, verbose_name="ID турнира")
+    from_level = models.PositiveSmallIntegerField(verbose_name="Был уровень")
+    to_level = models.PositiveSmallIntegerField(verbose_name="Стал уровень")
+    total_points = models.FloatField(verbose_name="Очки")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Время")
+
+    class Meta:
+        verbose_name = "Смена пояса"
+        verbose_name_plural = "Смены поясов"
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['city_id', '-created_at'], name='belt_promotion_city_idx'),
+            models.Index(fields=['team', '-created_at'], name='belt_promotion_team_idx'),
+            models.Index(fields=['-created_at'], name='belt_promotion_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.team_id}: {self.from_level} -> {self.to_level}"
+
+    @property
+    def is_promotion(self):
+        return self.to_level > self.from_level
+
+    @property
+    def from_name(self):
+        from .belts import level_name
+        return level_name(self.from_level)
+
+    @property
+    def to_name(self):
+        from .belts import level_name
+        return level_name(self.to_level)
+
+    @property
+    def new_belt(self):
+        """Сменился сам пояс, а не только число полосок"""
+        from .belts import LEVELS
+        return LEVELS[self.from_level][0] != LEVELS[self.to_level][0]
+
+    @property
+    def belt_color(self):
+        from .belts import LEVELS
+        return BELT_SYSTEM[LEVELS[self.to_level][0]]['color']
+
+
+# Рекорды и серии команды по играм в порядке дат (ratings/records.py).
+# base - то же состояние до последней игры: правка последнего турнира пересчитывает только его
+class TeamRecord(models.Model):
+    # Без внешнего ключа в БД, как у TeamStats: строку удаленной команды убирает задача команды
+    team = models.OneToOneField(
+        Team, on_delete=models.DO_NOTHING, db_constraint=False, primary_key=True,
+        related_name='records', verbose_name="Команда",
+    )
+    city_id = models.PositiveBigIntegerField(verbose_name="ID города")
+    games_count = models.PositiveIntegerField(default=0, verbose_name="Игр")
+    # Последняя учтенная игра: турниры идут по (дата, id)
+    last_date = models.DateField(null=True, blank=True, verbose_name="Дата последней игры")
+    last_tournament_id = models.PositiveBigIntegerField(null=True, blank=True, verbose_name="ID последнего турнира")
+    win_streak = models.PositiveIntegerField(default=0, verbose_name="Побед подряд сейчас")
+    longest_win_streak = models.PositiveIntegerField(default=0, verbose_name="Побед подряд")
+    podium_streak = models.PositiveIntegerField(default=0, verbose_name="Призовых мест подряд сейчас")
+    longest_podium_streak = models.PositiveIntegerField(default=0, verbose_name="Призовых мест подряд")
+    black_box_streak = models.PositiveIntegerField(default=0, verbose_name="Черных ящиков подряд сейчас")
+    longest_black_box_streak = models.PositiveIntegerField(default=0, verbose_name="Черных ящиков подряд")
+    best_total_points = models.FloatField(default=0.0, verbose_name="Лучший результат")
+    best_total_tournament_id = models.PositiveBigIntegerField(null=True, blank=True, verbose_name="ID турнира рекорда")
+    # {series_id: [очки, tournament_id]} - лучший результат в каждой серии
+    series_best = models.JSONField(default=dict, blank=True, verbose_name="Лучшее по сериям")
+    base = models.JSONField(default=dict, blank=True, verbose_name="Состояние до последней игры")
+    # Изменилась не последняя игра - задача команды переиграет ее историю целиком
+    needs_replay = models.BooleanField(default=False, verbose_name="Нужен пересчет")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
+
+    class Meta:
+        verbose_name = "Рекорды команды"
+        verbose_name_plural = "Рекорды команд"
+        indexes = [
+            models.Index(fields=['city_id', '-longest_win_streak'], name='team_record_win_idx'),
+            models.Index(fields=['city_id', '-longest_podium_streak'], name='team_record_podium_idx'),
+            models.Index(fields=['city_id', '-longest_black_box_streak'], name='team_record_black_box_idx'),
+            models.Index(fields=['city_id', '-best_total_points'], name='team_record_total_idx'),
+            models.Index(fields=['city_id', '-win_streak'], name='team_record_current_win_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.team_id}: {self.longest_win_streak} побед подряд"
+
+
+# Сезон - диапазон дат турниров. Закрытый сезон (manage.py close_season) хранит сводки команд по сериям
+# и темам, и карточка команды не перебирает его игры (ratings/seasons.py)
+class Season(models.Model):
+    name = models.CharField(max_length=100, unique=True, verbose_name="Название")
+    start_date = models.DateField(verbose_name="Начало")
+    end_date = models.DateField(verbose_name="Конец")
+    closed_at = models.DateTimeField(null=True, blank=True, verbose_name="Закрыт")
+    # {tournament_id: число результатов} на момент сводок: по нему видно, что турнир сезона изменился
+    tournaments = models.JSONField(default=dict, blank=True, editable=False, verbose_name="Турниры сводок")
+
+    class Meta:
+        verbose_name = "Сезон"
+        verbose_name_plural = "Сезоны"
+        ordering = ['-start_date']
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        if self.start_date and self.end_date and self.start_date > self.end_date:
+            raise ValidationError("Сезон не может закончиться раньше, чем начался")
+
+    @property
+    def is_closed(self):
+        return self.closed_at is not None
+
+
+# Итоги команды в серии за закрытый сезон (как в Team.get_series_stats)
+class SeasonSeriesSummary(models.Model):
+    season = models.ForeignKey(Season, on_delete=models.CASCADE, related_name='series_summaries', verbose_name="Сезон")
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, verbose_name="Команда")
+    series = models.ForeignKey(TournamentSeries, on_delete=models.CASCADE, verbose_name="Серия")
+    participations = models.PositiveIntegerField(default=0, verbose_name="Участий")
+    wins = models.PositiveIntegerField(default=0, verbose_name="Побед")
+    second_places = models.PositiveIntegerField(default=0, verbose_name="Вторых мест")
+    third_places = models.PositiveIntegerField(default=0, verbose_name="Третьих мест")
+    points_sum = models.FloatField(default=0.0, verbose_name="Очки")
+
+    class Meta:
+        verbose_name = "Итоги сезона в серии"
+        verbose_name_plural = "Итоги сезонов в сериях"
+        unique_together = ('season', 'team', 'series')
+
+    def __str__(self):
+        return f"{self.season_id} / {self.team_id} / {self.series_id}"
+
+
+# Очки и число игр команды по теме за закрытый сезон (как в Team.get_topic_statistics)
+class SeasonTopicSummary(models.Model):
+    season = models.ForeignKey(Season, on_delete=models.CASCADE, related_name='topic_summaries', verbose_name="Сезон")
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, verbose_name="Команда")
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, verbose_name="Тема")
+    games_count = models.PositiveIntegerField(default=0, verbose_name="Игр")
+    points_sum = models.FloatField(default=0.0, verbose_name="Очки")
+
+    class Meta:
+        verbose_name = "Итоги сезона по теме"
+        verbose_name_plural = "Итоги сезонов по темам"
+        unique_together = ('season', 'team', 'topic')
+
+    def __str__(self):
+        return f"{self.season_id} / {self.team_id} / {self.topic_id}"
+
+
+# Зачет серии за сезон собран по этим турнирам (ratings/standings.py). Строк немного - сезоны на серии
+class SeriesStandingTable(models.Model):
+    season = models.ForeignKey(Season, on_delete=models.CASCADE, related_name='standing_tables', verbose_name="Сезон")
+    series = models.ForeignKey(TournamentSeries, on_delete=models.CASCADE, verbose_name="Серия")
+    # {tournament_id: число результатов}, как Season.tournaments: по нему видно, что турнир серии изменился
+    tournaments = models.JSONField(default=dict, blank=True, editable=False, verbose_name="Турниры зачета")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлен")
+
+    class Meta:
+        verbose_name = "Зачет серии"
+        verbose_name_plural = "Зачеты серий"
+        unique_together = ('season', 'series')
+
+    def __str__(self):
+        return f"{self.season_id} / {self.series_id}"
+
+
+# Строка зачета серии за сезон: очки за места в лучших best_of играх, у кубков - еще пройденный этап.
+# Страница зачета - одно чтение по индексу (сезон, серия, место)
+class SeriesStanding(models.Model):
+    season = models.ForeignKey(Season, on_delete=models.CASCADE, verbose_name="Сезон")
+    series = models.ForeignKey(TournamentSeries, on_delete=models.CASCADE, verbose_name="Серия")
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, verbose_name="Команда")
+    position = models.PositiveIntegerField(verbose_name="Место")
+    points = models.FloatField(default=0.0, verbose_name="Очки зачета")
+    # Сумма набранных очков в зачетных играх - при равенстве очков зачета
+    total_points = models.FloatField(default=0.0, verbose_name="Очки в играх")
+    # Номер последнего этапа кубка, до которого дошла команда (у обычных серий 0)
+    progression = models.PositiveIntegerField(default=0, verbose_name="Этап")
+    games_count = models.PositiveIntegerField(default=0, verbose_name="Игр")
+    counted_count = models.PositiveIntegerField(default=0, verbose_name="Игр в зачете")
+    wins = models.PositiveIntegerField(default=0, verbose_name="Побед")
+    best_place = models.PositiveIntegerField(null=True, blank=True, verbose_name="Лучшее место")
+    # [[tournament_id, место, очки зачета, идет ли в зачет], ...] по дате
+    results = models.JSONField(default=list, blank=True, verbose_name="Игры")
+
+    class Meta:
+        verbose_name = "Строка зачета серии"
+        verbose_name_plural = "Зачеты серий по командам"
+        unique_together = ('season', 'series', 'team')
+        indexes = [
+            models.Index(fields=['season', 'series', 'position'], name='series_standing_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.season_id} / {self.series_id} / {self.team_id}"
+
+
+# Журнал изменений результатов для производных структур (см. ratings/changelog.py).
+# Пишется в той же транзакции, что и само изменение; seq только растет
+class ChangeLogEntry(models.Model):
+    ACTION_CREATE = 'create'
+    ACTION_UPDATE = 'update'
+    ACTION_DELETE = 'delete'
+    ACTIONS = [
+        (ACTION_CREATE, 'Создание'),
+        (ACTION_UPDATE, 'Изменение'),
+        (ACTION_DELETE, 'Удаление'),
+    ]
+
+    seq = models.BigAutoField(primary_key=True, verbose_name="Номер")
+    # Имя модели в нижнем регистре: gameresult, topicresult, tournamenttopic, tournament
+    model = models.CharField(max_length=30, verbose_name="Модель")
+    object_id = models.PositiveBigIntegerField(verbose_name="ID объекта")
+    action = models.CharField(max_length=10, choices=ACTIONS, verbose_name="Действие")
+    # Турнир, к которому относится изменение: большинству потребителей нужен только он
+    tournament_id = models.PositiveBigIntegerField(null=True, blank=True, verbose_name="ID турнира")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Время")
+
+    class Meta:
+        verbose_name = "Изменение"
+        verbose_name_plural = "Журнал изменений"
+        ordering = ['seq']
+
+    def __str__(self):
+        return f"#{self.seq} {self.model} {self.object_id} {self.action}"
+
+
+# Позиция потребителя журнала: до какого seq изменения уже обработаны
+class ChangeConsumer(models.Model):
+    name = models.CharField(max_length=100, unique=True, verbose_name="Потребитель")
+    last_seq = models.PositiveBigIntegerField(default=0, verbose_name="Обработано до")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
+
+    class Meta:
+        verbose_name = "Потребитель журнала"
+        verbose_name_plural = "Потребители журнала"
+
+    def __str__(self):
+        return f"{self.name} (#{self.last_seq})"
+
+
 
 BELT_SYSTEM = [
     {
@@ -360,7 +874,7 @@ BELT_SYSTEM = [
 # Функция определения пояса
 def get_belt_info(score):
     score = score or 0 #Защита от None
-    for belt in BELT_SYSTEM:
+    for belt_index, belt in enumerate(BELT_SYSTEM):
         if belt['min_score'] <= score < belt['max_score']: # Находим тот пояс, в диапазон которого попадает количество очков.
             for level in belt['levels']:
                 if level['min'] <= score < level['max']: # Определяем количество линий (полосок) на поясе
@@ -368,6 +882,7 @@ def get_belt_info(score):
                     
                     return {
                         'belt_name': belt['name'],
+                        'belt_index': belt_index,  # Номер пояса в BELT_SYSTEM (для JSON-таблиц)
                         'belt_color': belt['color'],
                         'level_name': level['name'],
                         'current_score': score,
@@ -380,6 +895,7 @@ def get_belt_info(score):
     # Для максимального уровня
     return {
         'belt_name': BELT_SYSTEM[-1]['name'],
+        'belt_index': len(BELT_SYSTEM) - 1,
         'belt_color': BELT_SYSTEM[-1]['color'],
         'level_name': BELT_SYSTEM[-1]['levels'][-1]['name'],
         'current_score': score,
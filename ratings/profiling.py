@@ -0,0 +1,329 @@
+"""
+Сэмплирующий профайлер для продакшена.
+
+Пока запрос выполняется, фоновый поток раз в RATINGS_PROFILER_INTERVAL секунд снимает стек потока запроса
+(sys._current_frames) - только у доли запросов RATINGS_PROFILER_SAMPLE_RATE. У остальных замеряется время,
+и запросы дольше RATINGS_PROFILER_SLOW_MS сохраняются без стеков. Профили пишутся в
+RATINGS_PROFILER_DIR почасовыми файлами .jsonl.gz, старые файлы удаляются. Отчет: python manage.py profile_report
+
+QueryCountMiddleware (RATINGS_QUERY_HEADERS = True) отдает число SQL-запросов и их время в заголовках ответа -
+по ним manage.py load_test считает нагрузку на БД по каждому адресу.
+"""
+import gzip
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from datetime import datetime
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+# Параметры фильтров, по которым группируются профили. Значения поиска и дат не храним - только факт, что они заданы
+FILTER_PARAMS = ['active_tab', 'city', 'game_series', 'team_sort', 'format', 'page', 'search', 'date_from', 'date_to']
+MASKED_PARAMS = {'search', 'date_from', 'date_to'}
+
+# Префикс стека для узлов шаблонов: "tpl:ratings/includes/teams.html:17 ForNode"
+TEMPLATE_PREFIX = 'tpl:'
+FILE_PREFIX = 'profiles-'
+# Адреса, которые не профилируем и не замеряем
+DEFAULT_SKIP_PATHS = ['/static/', '/media/', '/__debug__/']
+
+_IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def profiles_dir():
+    return Path(_setting('RATINGS_PROFILER_DIR', Path(settings.BASE_DIR) / 'profiles'))
+
+
+def normalize_params(query_dict):
+    """Приводит фильтры запроса к тегу вида 'active_tab=games&city=Грозный&search=*'"""
+    parts = []
+    for key in FILTER_PARAMS:
+        value = query_dict.get(key)
+        if not value:
+            continue
+        if key in MASKED_PARAMS:
+            value = '*'
+        elif key == 'page':
+            value = '1' if value == '1' else '>1'
+        parts.append(f'{key}={value}')
+    return '&'.join(parts)
+
+
+def normalize_sql(sql):
+    # IN (%s, %s, %s) с разным числом параметров - один и тот же запрос
+    return _IN_LIST_RE.sub('IN (...)', sql)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', '?')
+    if code.co_name == 'render_annotated' and module == 'django.template.base':
+        node = frame.f_locals.get('self')
+        origin = getattr(node, 'origin', None)
+        token = getattr(node, 'token', None)
+        template_name = getattr(origin, 'template_name', None) or '?'
+        lineno = getattr(token, 'lineno', '?')
+        return f'{TEMPLATE_PREFIX}{template_name}:{lineno} {type(node).__name__}'
+    return f'{module}:{code.co_name}'
+
+
+def collapse_stack(frame):
+    """Стек от корня к листу в формате collapsed stacks (как для flamegraph.pl): 'a;b;c'"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+class RequestProfile:
+    def __init__(self, request):
+        self.thread_id = threading.get_ident()
+        self.method = request.method
+        self.path = request.path
+        self.params = normalize_params(request.GET)
+        self.started = time.time()
+        self.samples = {}
+        # normalized sql -> [количество, суммарное время в мс]
+        self.queries = {}
+        # async-view: профиль не сохраняется
+        self.skipped = False
+
+    def add_sample(self, stack):
+        self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            entry = self.queries.setdefault(normalize_sql(sql), [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def as_dict(self, view, status, duration_ms, reason):
+        return {
+            'view': view,
+            'params': self.params,
+            'method': self.method,
+            'path': self.path,
+            'status': status,
+            'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'duration_ms': round(duration_ms, 1),
+            'reason': reason,
+            'interval_ms': round(_setting('RATINGS_PROFILER_INTERVAL', 0.005) * 1000, 2),
+            'samples': self.samples,
+            'sql': [[sql, count, round(total, 2)] for sql, (count, total) in self.queries.items()],
+        }
+
+
+class Sampler:
+    """Один фоновый поток на процесс снимает стеки всех профилируемых запросов"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.active = {}
+        self.lock = threading.Lock()
+        # start() будит поток, который ждет первого профиля
+        self.wakeup = threading.Condition(self.lock)
+        self.thread = None
+
+    def start(self, profile):
+        with self.lock:
+            self.active[profile.thread_id] = profile
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='ratings-profiler', daemon=True)
+                self.thread.start()
+            self.wakeup.notify()
+
+    def stop(self, profile):
+        with self.lock:
+            self.active.pop(profile.thread_id, None)
+
+    def _run(self):
+        while True:
+            # Пока профилируемых запросов нет, поток спит до start(), а не просыпается каждые interval
+            with self.lock:
+                while not self.active:
+                    self.wakeup.wait()
+            time.sleep(self.interval)
+            # Снимаем стеки под блокировкой: после stop() профиль запроса больше не меняется
+            with self.lock:
+                if not self.active:
+                    continue
+                frames = sys._current_frames()
+                for profile in self.active.values():
+                    frame = frames.get(profile.thread_id)
+                    if frame is not None:
+                        profile.add_sample(collapse_stack(frame))
+                del frames
+
+
+class ProfileStore:
+    """Почасовые файлы profiles-<ГГГГММДДЧЧ>-<pid>.jsonl.gz; у каждого процесса свои файлы, чтобы не смешивать записи"""
+
+    def __init__(self, directory, max_files):
+        self.directory = Path(directory)
+        self.max_files = max_files
+        self.lock = threading.Lock()
+
+    def save(self, record):
+        line = (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+        name = f'{FILE_PREFIX}{datetime.now():%Y%m%d%H}-{os.getpid()}.jsonl.gz'
+        with self.lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / name
+            is_new = not path.exists()
+            # Каждая запись - отдельный gzip-member, gzip.open читает их подряд
+            with gzip.open(path, 'ab') as fh:
+                fh.write(line)
+            if is_new:
+                self.rotate()
+
+    def rotate(self):
+        files = sorted(self.directory.glob(f'{FILE_PREFIX}*.jsonl.gz'))
+        for old in files[:max(0, len(files) - self.max_files)]:
+            old.unlink(missing_ok=True)
+
+
+def iter_profiles(directory=None, since=None):
+    """Читает сохраненные профили; since - datetime, более старые пропускаются"""
+    directory = Path(directory or profiles_dir())
+    for path in sorted(directory.glob(f'{FILE_PREFIX}*.jsonl.gz')):
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as fh:
+                for line in fh:
+                    record = json.loads(line)
+                    if since is None or datetime.fromisoformat(record['started']) >= since:
+                        yield record
+        except (OSError, EOFError, ValueError):
+            # Файл, который сейчас дописывается другим процессом, может быть обрезан
+            continue
+
+
+class SamplingProfilerMiddleware:
+    """
+    Профилирует долю запросов в продакшене; включается RATINGS_PROFILER_ENABLED = True.
+    Стеки снимаются только у RATINGS_PROFILER_SAMPLE_RATE запросов и только у синхронных view: async-view
+    (live_stream под ASGI) выполняется в другом потоке, и стеки по идентификатору потока были бы чужими.
+    Остальные запросы только замеряются: если запрос медленнее RATINGS_PROFILER_SLOW_MS, сохраняется запись
+    без стеков и SQL - видно, какие адреса медленные, а профиль наберется с выборкой.
+    """
+
+    def __init__(self, get_response):
+        if not _setting('RATINGS_PROFILER_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        rate = _setting('RATINGS_PROFILER_SAMPLE_RATE', 0.01)
+        # Целое больше 1 - прежний формат "каждый N-й запрос"
+        self.sample_rate = 1 / rate if rate > 1 else max(0.0, rate)
+        self.slow_ms = _setting('RATINGS_PROFILER_SLOW_MS', 500)
+        self.skip_paths = tuple(_setting('RATINGS_PROFILER_SKIP_PATHS', DEFAULT_SKIP_PATHS))
+        self.sampler = Sampler(_setting('RATINGS_PROFILER_INTERVAL', 0.005))
+        self.store = ProfileStore(profiles_dir(), _setting('RATINGS_PROFILER_MAX_FILES', 168))
+
+    def __call__(self, request):
+        if request.path.startswith(self.skip_paths):
+            return self.get_response(request)
+
+        profile = RequestProfile(request) if random.random() < self.sample_rate else None
+        request._ratings_profile = profile
+        start = time.perf_counter()
+        if profile is None:
+            response = self.get_response(request)
+        else:
+            try:
+                with ExitStack() as stack:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(profile.execute_wrapper))
+                    response = self.get_response(request)
+            finally:
+                self.sampler.stop(profile)
+
+        duration_ms = (time.perf_counter() - start) * 1000
+        # Потоковые ответы (SSE) не профилируем: их время - это время жизни соединения
+        if getattr(response, 'streaming', False) or (profile is not None and profile.skipped):
+            return response
+
+        slow = duration_ms >= self.slow_ms
+        if profile is not None or slow:
+            match = getattr(request, 'resolver_match', None)
+            view = match.view_name if match else request.path
+            record = (profile or RequestProfile(request)).as_dict(
+                view, response.status_code, duration_ms, 'sampled' if profile is not None else 'slow',
+            )
+            self.store.save(record)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Стеки начинаем снимать, когда известен view: async-view не профилируем
+        profile = getattr(request, '_ratings_profile', None)
+        if profile is not None:
+            if iscoroutinefunction(view_func):
+                profile.skipped = True
+            else:
+                self.sampler.start(profile)
+        return None
+
+
+# Заголовки ответа с нагрузкой на БД для manage.py load_test
+QUERIES_HEADER = 'X-DB-Queries'
+QUERIES_TIME_HEADER = 'X-DB-Time-Ms'
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.total_ms += (time.perf_counter() - start) * 1000
+
+
+class QueryCountMiddleware:
+    """Число SQL-запросов запроса и их время в заголовках ответа; включается RATINGS_QUERY_HEADERS = True"""
+
+    def __init__(self, get_response):
+        if not _setting('RATINGS_QUERY_HEADERS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter.execute_wrapper))
+            response = self.get_response(request)
+        # У потоковых ответов (SSE) запросы идут уже после выхода из middleware
+        if not getattr(response, 'streaming', False):
+            response[QUERIES_HEADER] = str(counter.count)
+            response[QUERIES_TIME_HEADER] = f'{counter.total_ms:.1f}'
+        return response
@@ -0,0 +1,395 @@
+"""
+Места команд в таблицах городов и в общей таблице всех городов без сортировки всей таблицы на каждый запрос.
+
+TeamStats хранит для каждой команды те же числа, что TeamQuerySet.with_stats, и по каждой сортировке таблицы
+место (rank, с дележом) и номер строки (position; при равных значениях раньше команда с меньшим id - так же
+сортирует index) - в своем городе и среди всех команд. Когда статистика команды меняется, задача очереди
+(RatingJob.KIND_TEAM) пересчитывает только ее и сдвигает на единицу места команд, оказавшихся между старым
+и новым местом. Общую таблицу задевает любая команда, поэтому задачи команд блокируют все строки City
+и выполняются по одной.
+
+CityStats - итоги городов (число команд, очки, сила) для сравнения городов; их меняет та же задача.
+Страница таблицы без фильтров - диапазон номеров строк (RankedTeams): ее цена не зависит от числа команд.
+
+Полный пересчет: python manage.py rebuild_rankings
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, F, Q, Sum
+
+from . import belts, records, topic_leaders
+from .models import City, CityStats, Team, TeamStats
+
+
+# team_sort из index -> (поле значения, поле места, поле номера строки) в таблице города
+SORT_FIELDS = {
+    'points': ('total_points_sum', 'points_rank', 'points_position'),
+    'wins': ('wins_count', 'wins_rank', 'wins_position'),
+    'avg': ('avg_points', 'avg_rank', 'avg_position'),
+}
+# То же в общей таблице всех городов
+GLOBAL_SORT_FIELDS = {
+    'points': ('total_points_sum', 'global_points_rank', 'global_points_position'),
+    'wins': ('wins_count', 'global_wins_rank', 'global_wins_position'),
+    'avg': ('avg_points', 'global_avg_rank', 'global_avg_position'),
+}
+STAT_FIELDS = ['games_played_count', 'wins_count', 'total_points_sum', 'avg_points']
+# Итоги города, которые складываются из чисел команд
+CITY_SUM_FIELDS = ['teams_count', 'active_teams_count', 'games_played_count', 'total_points_sum']
+
+
+def sort_key(team_sort):
+    """team_sort из запроса -> ключ SORT_FIELDS (как в index: все, кроме wins и avg, - по очкам)"""
+    return team_sort if team_sort in SORT_FIELDS else 'points'
+
+
+def team_order(team_sort):
+    """order_by для таблицы команд, совпадающий с position"""
+    value_field = SORT_FIELDS[sort_key(team_sort)][0]
+    return [f'-{value_field}', 'id']
+
+
+def top_teams():
+    """Сколько лучших команд города считается в его силе"""
+    return getattr(settings, 'RATINGS_CITY_TOP_TEAMS', 10)
+
+
+def _current_stats(team_id):
+    return Team.objects.filter(id=team_id).with_stats().values('city_id', *STAT_FIELDS).first()
+
+
+def _lock_cities():
+    # Одинаковый порядок блокировок во всех воркерах - без взаимных блокировок
+    list(City.objects.select_for_update().order_by('id').values_list('id'))
+
+
+def _before(value_field, value, team_id):
+    """Команды, которые в таблице стоят выше строки (value, team_id)"""
+    return Q(**{f'{value_field}__gt': value}) | Q(**{value_field: value, 'team_id__lt': team_id})
+
+
+def _remove(others, row, tables):
+    for value_field, rank_field, position_field in tables.values():
+        value = getattr(row, value_field)
+        others.filter(**{f'{position_field}__gt': getattr(row, position_field)}).update(
+            **{position_field: F(position_field) - 1}
+        )
+        others.filter(**{f'{value_field}__lt': value}).update(**{rank_field: F(rank_field) - 1})
+
+
+def _insert(others, row, tables):
+    for value_field, rank_field, position_field in tables.values():
+        value = getattr(row, value_field)
+        position = others.filter(_before(value_field, value, row.team_id)).count() + 1
+        others.filter(**{f'{position_field}__gte': position}).update(**{position_field: F(position_field) + 1})
+        others.filter(**{f'{value_field}__lt': value}).update(**{rank_field: F(rank_field) + 1})
+        setattr(row, position_field, position)
+        setattr(row, rank_field, others.filter(**{f'{value_field}__gt': value}).count() + 1)
+
+
+def _move(others, row, stats, tables):
+    """Команда осталась в таблице, изменились числа: сдвигаем только строки между старым и новым местом"""
+    for value_field, rank_field, position_field in tables.values():
+        old_value, new_value = getattr(row, value_field), stats[value_field]
+        if old_value == new_value:
+            continue
+        old_position = getattr(row, position_field)
+        new_position = others.filter(_before(value_field, new_value, row.team_id)).count() + 1
+        if new_position < old_position:
+            others.filter(**{f'{position_field}__range': (new_position, old_position - 1)}).update(
+                **{position_field: F(position_field) + 1}
+            )
+        elif new_position > old_position:
+            others.filter(**{f'{position_field}__range': (old_position + 1, new_position)}).update(
+                **{position_field: F(position_field) - 1}
+            )
+
+        # Место остальных меняется, только если команда обогнала их или отстала от них
+        if new_value > old_value:
+            others.filter(**{f'{value_field}__gte': old_value, f'{value_field}__lt': new_value}).update(
+                **{rank_field: F(rank_field) + 1}
+            )
+        else:
+            others.filter(**{f'{value_field}__gte': new_value, f'{value_field}__lt': old_value}).update(
+                **{rank_field: F(rank_field) - 1}
+            )
+        setattr(row, position_field, new_position)
+        setattr(row, rank_field, others.filter(**{f'{value_field}__gt': new_value}).count() + 1)
+
+
+def _city_share(stats):
+    """Вклад команды в итоги ее города (stats - словарь или строка TeamStats)"""
+    get = stats.get if isinstance(stats, dict) else lambda field: getattr(stats, field)
+    return {
+        'teams_count': 1,
+        'active_teams_count': 1 if get('games_played_count') else 0,
+        'games_played_count': get('games_played_count'),
+        'total_points_sum': get('total_points_sum'),
+    }
+
+
+def refresh_team_stats(team_id):
+    """Пересчитывает статистику команды, ее места и итоги города. Выполняется в транзакции задачи"""
+    stats = _current_stats(team_id)
+    _lock_cities()
+    # Читаем под блокировкой: другой воркер мог успеть сдвинуть места
+    row = TeamStats.objects.filter(team_id=team_id).first()
+    if row is None and stats is None:
+        return False
+    if row is not None and stats is not None and row.city_id == stats['city_id']:
+        if all(getattr(row, field) == stats[field] for field in STAT_FIELDS):
+            return False
+
+    everyone = TeamStats.objects.exclude(team_id=team_id)
+    city_deltas = defaultdict(lambda: dict.fromkeys(CITY_SUM_FIELDS, 0))
+    if row is not None:
+        for field, value in _city_share(row).items():
+            city_deltas[row.city_id][field] -= value
+    if stats is not None:
+        for field, value in _city_share(stats).items():
+            city_deltas[stats['city_id']][field] += value
+
+    if row is None:
+        row = TeamStats(team_id=team_id, city_id=stats['city_id'], **{field: stats[field] for field in STAT_FIELDS})
+        _insert(everyone.filter(city_id=row.city_id), row, SORT_FIELDS)
+        _insert(everyone, row, GLOBAL_SORT_FIELDS)
+        row.save(force_insert=True)
+    elif stats is None:
+        # Команда удалена
+        _remove(everyone.filter(city_id=row.city_id), row, SORT_FIELDS)
+        _remove(everyone, row, GLOBAL_SORT_FIELDS)
+        row.delete()
+    else:
+        moved = row.city_id != stats['city_id']
+        if moved:
+            # Переезд: уходим из таблицы старого города, в таблицу нового встаем уже с новыми числами
+            _remove(everyone.filter(city_id=row.city_id), row, SORT_FIELDS)
+        else:
+            _move(everyone.filter(city_id=row.city_id), row, stats, SORT_FIELDS)
+        _move(everyone, row, stats, GLOBAL_SORT_FIELDS)
+        row.city_id = stats['city_id']
+        for field in STAT_FIELDS:
+            setattr(row, field, stats[field])
+        if moved:
+            _insert(everyone.filter(city_id=row.city_id), row, SORT_FIELDS)
+        row.save()
+
+    _update_cities(city_deltas)
+    return True
+
+
+def refresh_team(team_id):
+    """Обработчик задачи команды (RatingJob.KIND_TEAM): места в таблицах, лидеры по темам, пояса и рекорды"""
+    with transaction.atomic():
+        changed = refresh_team_stats(team_id)
+        changed = topic_leaders.refresh_team(team_id) or changed
+        changed = records.refresh_team(team_id) or changed
+        return belts.forget_deleted_team(team_id) or changed
+
+
+def _update_cities(city_deltas):
+    """Прибавляет разницу к итогам городов, пересчитывает их силу и места городов"""
+    rows = CityStats.objects.in_bulk(list(city_deltas))
+    existing = set(City.objects.filter(id__in=list(city_deltas)).values_list('id', flat=True))
+    for city_id, delta in city_deltas.items():
+        if city_id not in existing:
+            # Город удален вместе со строкой итогов
+            continue
+        row = rows.get(city_id) or CityStats(city_id=city_id)
+        for field, value in delta.items():
+            setattr(row, field, getattr(row, field) + value)
+        if row.teams_count <= 0:
+            if city_id in rows:
+                row.delete()
+            continue
+        # Лучшие команды - первые строки таблицы города по очкам, это диапазон индекса
+        row.top_points_avg = TeamStats.objects.filter(
+            city_id=city_id, points_position__lte=top_teams(),
+        ).aggregate(value=Avg('total_points_sum'))['value'] or 0.0
+        row.save()
+    _rank_cities()
+
+
+def _rank_cities():
+    """Места городов по силе (городов десятки - просто сортируем)"""
+    rows = sorted(CityStats.objects.all(), key=lambda row: (-row.top_points_avg, row.city_id))
+    changed = []
+    for rank, row in zip(_ranks([row.top_points_avg for row in rows]), rows):
+        if row.strength_rank != rank:
+            row.strength_rank = rank
+            changed.append(row)
+    if changed:
+        CityStats.objects.bulk_update(changed, ['strength_rank'])
+
+
+def _ranks(values):
+    """Места с дележом для значений, отсортированных по убыванию"""
+    ranks = []
+    for position, value in enumerate(values, start=1):
+        ranks.append(position if position == 1 or value != values[position - 2] else ranks[-1])
+    return ranks
+
+
+def _set_places(rows, teams, tables):
+    for value_field, rank_field, position_field in tables.values():
+        ordered = sorted(teams, key=lambda stats: (-stats[value_field], stats['id']))
+        ranks = _ranks([stats[value_field] for stats in ordered])
+        for position, (stats, rank) in enumerate(zip(ordered, ranks), start=1):
+            setattr(rows[stats['id']], position_field, position)
+            setattr(rows[stats['id']], rank_field, rank)
+
+
+def expected_rows():
+    """Все строки TeamStats, посчитанные с нуля: {team_id: TeamStats}"""
+    everyone = list(Team.objects.with_stats().values('id', 'city_id', *STAT_FIELDS))
+    rows = {
+        stats['id']: TeamStats(team_id=stats['id'], city_id=stats['city_id'], **{field: stats[field] for field in STAT_FIELDS})
+        for stats in everyone
+    }
+    by_city = defaultdict(list)
+    for stats in everyone:
+        by_city[stats['city_id']].append(stats)
+    for teams in by_city.values():
+        _set_places(rows, teams, SORT_FIELDS)
+    _set_places(rows, everyone, GLOBAL_SORT_FIELDS)
+    return rows
+
+
+def expected_cities(rows):
+    """Строки CityStats по строкам TeamStats: {city_id: CityStats}"""
+    cities, best = {}, defaultdict(list)
+    for row in rows.values():
+        city = cities.setdefault(row.city_id, CityStats(city_id=row.city_id))
+        for field, value in _city_share(row).items():
+            setattr(city, field, getattr(city, field) + value)
+        if row.points_position <= top_teams():
+            best[row.city_id].append(row.total_points_sum)
+    for city_id, city in cities.items():
+        # RATINGS_CITY_TOP_TEAMS = 0 - лучших команд нет, сила 0 (как в _update_cities)
+        city.top_points_avg = sum(best[city_id]) / len(best[city_id]) if best[city_id] else 0.0
+    ordered = sorted(cities.values(), key=lambda city: (-city.top_points_avg, city.city_id))
+    for rank, city in zip(_ranks([city.top_points_avg for city in ordered]), ordered):
+        city.strength_rank = rank
+    return cities
+
+
+def rebuild_all():
+    """Полный пересчет TeamStats и CityStats. Возвращает число команд"""
+    with transaction.atomic():
+        _lock_cities()
+        rows = expected_rows()
+        TeamStats.objects.all().delete()
+        TeamStats.objects.bulk_create(rows.values(), batch_size=1000)
+        CityStats.objects.all().delete()
+        CityStats.objects.bulk_create(expected_cities(rows).values())
+    return len(rows)
+
+
+def _differs(stored, expected):
+    # Итоги городов складываются по одной команде - у дробных сумм возможна ошибка округления
+    if isinstance(expected, float):
+        return abs(stored - expected) > 1e-6
+    return stored != expected
+
+
+def find_divergences():
+    """
+    Строки, у которых сохраненные числа или места не совпадают с пересчитанными:
+    [(что, id, поле, сохранено, должно быть), ...], что - 'team' или 'city'
+    """
+    team_fields = ['city_id', *STAT_FIELDS] + [
+        field for tables in (SORT_FIELDS, GLOBAL_SORT_FIELDS) for fields in tables.values() for field in fields[1:]
+    ]
+    city_fields = [*CITY_SUM_FIELDS, 'top_points_avg', 'strength_rank']
+    expected_teams = expected_rows()
+    checks = [
+        ('team', team_fields, expected_teams, {row.team_id: row for row in TeamStats.objects.all()}),
+        ('city', city_fields, expected_cities(expected_teams), {row.city_id: row for row in CityStats.objects.all()}),
+    ]
+
+    divergences = []
+    for kind, fields, expected, stored in checks:
+        for object_id in sorted(set(expected) | set(stored)):
+            if object_id not in stored or object_id not in expected:
+                divergences.append((kind, object_id, 'row', object_id in stored, object_id in expected))
+                continue
+            for field in fields:
+                stored_value, expected_value = getattr(stored[object_id], field), getattr(expected[object_id], field)
+                if _differs(stored_value, expected_value):
+                    divergences.append((kind, object_id, field, stored_value, expected_value))
+    return divergences
+
+
+def team_rank(team_id, team_sort=None, per_page=100, all_cities=False):
+    """
+    Место команды, номер строки и страница таблицы ее города или, с all_cities, общей таблицы
+    (None, если статистики еще нет)
+    """
+    row = TeamStats.objects.filter(team_id=team_id).first()
+    if row is None:
+        return None
+    key = sort_key(team_sort)
+    _, rank_field, position_field = (GLOBAL_SORT_FIELDS if all_cities else SORT_FIELDS)[key]
+    position = getattr(row, position_field)
+    return {
+        'team': team_id,
+        'city_id': row.city_id,
+        'sort': key,
+        'all_cities': all_cities,
+        'rank': getattr(row, rank_field),
+        'city_rank': getattr(row, SORT_FIELDS[key][1]),
+        'position': position,
+        'page': (position - 1) // per_page + 1,
+    }
+
+
+class RankedTeams:
+    """
+    Таблица команд для Paginator по сохраненным местам: страница - диапазон номеров строк (индекс по городу
+    и номеру строки), число строк - сумма CityStats.teams_count. Ни сортировки, ни COUNT по всем командам.
+    city_id = None - общая таблица всех городов.
+
+    Команды страницы - объекты Team с числами TeamStats и атрибутами rank (место в этой таблице)
+    и city_rank (место в таблице своего города).
+    """
+
+    def __init__(self, team_sort=None, city_id=None):
+        self.key = sort_key(team_sort)
+        self.city_id = city_id
+        tables = SORT_FIELDS if city_id is not None else GLOBAL_SORT_FIELDS
+        self.value_field, self.rank_field, self.position_field = tables[self.key]
+
+    def count(self):
+        cities = CityStats.objects.all()
+        if self.city_id is not None:
+            cities = cities.filter(city_id=self.city_id)
+        return cities.aggregate(teams=Sum('teams_count'))['teams'] or 0
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        rows = TeamStats.objects.filter(**{f'{self.position_field}__gt': start})
+        if index.stop is not None:
+            rows = rows.filter(**{f'{self.position_field}__lte': index.stop})
+        if self.city_id is not None:
+            rows = rows.filter(city_id=self.city_id)
+        return [self._team(row) for row in rows.select_related('team__city').order_by(self.position_field)]
+
+    def _team(self, row):
+        team = row.team
+        for field in STAT_FIELDS:
+            setattr(team, field, getattr(row, field))
+        team.rank = getattr(row, self.rank_field)
+        team.city_rank = getattr(row, SORT_FIELDS[self.key][1])
+        return team
+
+
+def city_table():
+    """Города с командами по силе: CityStats с городом"""
+    return list(CityStats.objects.select_related('city').order_by('strength_rank', 'city__name'))
@@ -0,0 +1,239 @@
+"""
+Рекорды команд: самые длинные серии побед, призовых мест и взятых черных ящиков, лучший результат в турнире
+и в каждой серии турниров. Игры команды идут по (дата турнира, id турнира).
+
+Состояние - небольшой словарь (STATE_FIELDS и series_best), одна игра - один шаг (_step). TeamRecord хранит
+состояние после всех игр и base - до последней. recalculate_tournament передает сюда измененные результаты:
+- турнир позже последней учтенной игры - новая игра, шаг от текущего состояния;
+- тот же турнир (результаты вводят по ходу вечера) - шаг заново от base;
+- более ранний турнир - строка помечается needs_replay, и задача команды переигрывает игры только этой команды.
+Удаление результата и правка турнира (могли сменить дату или серию) тоже помечают строки.
+
+Рекорды города - первые строки TeamRecord по индексам (город, значение), лучшие по сериям - из series_best
+строк города. Полный пересчет: python manage.py rebuild_records
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import GameResult, Team, TeamRecord, Tournament
+
+
+STATE_FIELDS = [
+    'win_streak', 'longest_win_streak', 'podium_streak', 'longest_podium_streak',
+    'black_box_streak', 'longest_black_box_streak', 'best_total_points', 'best_total_tournament_id',
+]
+ROW_FIELDS = [*STATE_FIELDS, 'series_best', 'base', 'city_id', 'games_count', 'last_date', 'last_tournament_id', 'needs_replay']
+# (текущая серия, самая длинная, условие)
+STREAKS = [
+    ('win_streak', 'longest_win_streak', lambda place, black_box: place == 1),
+    ('podium_streak', 'longest_podium_streak', lambda place, black_box: 1 <= place <= 3),
+    ('black_box_streak', 'longest_black_box_streak', lambda place, black_box: black_box > 0),
+]
+# Рекорды города: поле TeamRecord и подпись
+RECORD_KINDS = [
+    ('longest_win_streak', 'Побед подряд'),
+    ('longest_podium_streak', 'Призовых мест подряд'),
+    ('longest_black_box_streak', 'Черных ящиков подряд'),
+    ('best_total_points', 'Лучший результат в турнире'),
+    ('win_streak', 'Текущая серия побед'),
+]
+GAME_FIELDS = ['tournament_id', 'tournament__series_id', 'place', 'total_points', 'black_box_points']
+
+
+def top_records():
+    return getattr(settings, 'RATINGS_RECORDS_TOP', 10)
+
+
+def _initial():
+    return {**dict.fromkeys(STATE_FIELDS, 0), 'best_total_points': 0.0, 'best_total_tournament_id': None, 'series_best': {}}
+
+
+def _step(state, game):
+    """Состояние после еще одной игры: game - (tournament_id, series_id, place, total_points, black_box_points)"""
+    tournament_id, series_id, place, points, black_box = game
+    state = {**state, 'series_best': dict(state['series_best'])}
+    for streak, longest, hit in STREAKS:
+        state[streak] = state[streak] + 1 if hit(place, black_box) else 0
+        state[longest] = max(state[longest], state[streak])
+    # При равенстве рекорд остается за более ранней игрой
+    if state['best_total_tournament_id'] is None or points > state['best_total_points']:
+        state['best_total_points'], state['best_total_tournament_id'] = points, tournament_id
+    key = str(series_id)
+    best = state['series_best'].get(key)
+    if best is None or points > best[0]:
+        state['series_best'][key] = [points, tournament_id]
+    return state
+
+
+def _state_of(row):
+    return {**{field: getattr(row, field) for field in STATE_FIELDS}, 'series_best': row.series_best}
+
+
+def _apply(row, state, base):
+    for field in STATE_FIELDS:
+        setattr(row, field, state[field])
+    row.series_best = state['series_best']
+    row.base = base
+
+
+def _replayed(team_id, city_id, games):
+    """Строка TeamRecord по всем играм команды (games - в порядке дат, с датой последним элементом)"""
+    row = TeamRecord(team_id=team_id, city_id=city_id, games_count=len(games))
+    state = base = _initial()
+    for *game, date in games:
+        base, state = state, _step(state, game)
+        row.last_date, row.last_tournament_id = date, game[0]
+    _apply(row, state, base)
+    return row
+
+
+def _games(results, *fields):
+    """Игры в порядке дат: (*fields, *GAME_FIELDS, дата)"""
+    return results.order_by('tournament__date', 'tournament_id').values_list(*fields, *GAME_FIELDS, 'tournament__date')
+
+
+def apply_tournament(tournament_id, results):
+    """
+    Из recalculate_tournament: results - измененные GameResult турнира. Строки команд блокируются,
+    чтобы параллельные задачи одной команды не потеряли шаг
+    """
+    if not results:
+        return 0
+    tournament = Tournament.objects.filter(id=tournament_id).values('date', 'series_id').first()
+    if tournament is None:
+        # Турнир удален - строки пометил сигнал удаления результатов
+        return 0
+    key = (tournament['date'], tournament_id)
+    rows = {
+        row.team_id: row
+        for row in TeamRecord.objects.select_for_update().filter(
+            team_id__in=[result.team_id for result in results]
+        ).order_by('team_id')
+    }
+
+    now = timezone.now()
+    updated = []
+    for result in results:
+        row = rows.get(result.team_id)
+        if row is None or row.needs_replay:
+            # Строку соберет задача команды, она уже в очереди
+            continue
+        game = (tournament_id, tournament['series_id'], result.place, result.total_points, result.black_box_points)
+        if row.last_tournament_id is None or key > (row.last_date, row.last_tournament_id):
+            base = _state_of(row)
+            row.games_count += 1
+            row.last_date, row.last_tournament_id = key
+        elif key == (row.last_date, row.last_tournament_id):
+            base = row.base
+        else:
+            row.needs_replay = True
+            updated.append(row)
+            continue
+        _apply(row, _step(base, game), base)
+        row.updated_at = now
+        updated.append(row)
+    TeamRecord.objects.bulk_update(updated, [*ROW_FIELDS, 'updated_at'])
+    return len(updated)
+
+
+def mark_teams(team_ids):
+    """Изменилась не последняя игра команд - их историю переиграет задача команды"""
+    TeamRecord.objects.filter(team_id__in=team_ids).update(needs_replay=True)
+
+
+def mark_tournament(tournament_id):
+    """Турнир правили в админке: дата или серия могли измениться, порядок игр его команд - тоже"""
+    team_ids = list(GameResult.objects.filter(tournament_id=tournament_id).values_list('team_id', flat=True))
+    mark_teams(team_ids)
+    return team_ids
+
+
+def refresh_team(team_id):
+    """
+    Задача команды: переигрывает историю помеченной (или еще не посчитанной) команды, переносит строку
+    в новый город, убирает строку удаленной команды. Задачи команд уже идут по одной (rankings._lock_cities)
+    """
+    city_id = Team.objects.filter(id=team_id).values_list('city_id', flat=True).first()
+    row = TeamRecord.objects.select_for_update().filter(team_id=team_id).first()
+    if city_id is None:
+        if row is None:
+            return False
+        row.delete()
+        return True
+    if row is None or row.needs_replay:
+        new_row = _replayed(team_id, city_id, list(_games(GameResult.objects.filter(team_id=team_id))))
+        new_row.save(force_insert=row is None)
+        return True
+    if row.city_id != city_id:
+        row.city_id = city_id
+        row.save(update_fields=['city_id', 'updated_at'])
+        return True
+    return False
+
+
+def expected_rows():
+    """Все строки TeamRecord, посчитанные с нуля: {team_id: TeamRecord}"""
+    by_team = defaultdict(list)
+    for team_id, *game in _games(GameResult.objects.all(), 'team_id').iterator(chunk_size=5000):
+        by_team[team_id].append(game)
+    return {
+        team_id: _replayed(team_id, city_id, by_team.get(team_id, []))
+        for team_id, city_id in Team.objects.values_list('id', 'city_id')
+    }
+
+
+def rebuild_all():
+    """Полный пересчет TeamRecord. Возвращает число строк"""
+    rows = expected_rows()
+    with transaction.atomic():
+        TeamRecord.objects.all().delete()
+        TeamRecord.objects.bulk_create(rows.values(), batch_size=1000)
+    return len(rows)
+
+
+def find_divergences():
+    """Строки, которые не совпадают с пересчитанными: [(team_id, поле, сохранено, должно быть)]"""
+    expected = expected_rows()
+    stored = TeamRecord.objects.in_bulk()
+    divergences = []
+    for team_id in sorted(set(expected) | set(stored)):
+        if team_id not in stored or team_id not in expected:
+            divergences.append((team_id, 'row', team_id in stored, team_id in expected))
+            continue
+        for field in ROW_FIELDS:
+            stored_value, expected_value = getattr(stored[team_id], field), getattr(expected[team_id], field)
+            if stored_value != expected_value:
+                divergences.append((team_id, field, stored_value, expected_value))
+    return divergences
+
+
+def city_records(city_ids=None, limit=None):
+    """
+    Рекорды городов city_ids (None - всех городов): [(поле, подпись, [TeamRecord, ...])], первые строки по индексу.
+    Нулевые значения не показываем - это не рекорд
+    """
+    limit = limit or top_records()
+    rows = TeamRecord.objects.select_related('team', 'team__city')
+    if city_ids is not None:
+        rows = rows.filter(city_id__in=city_ids)
+    return [
+        (field, label, list(rows.filter(**{f'{field}__gt': 0}).order_by(f'-{field}', 'team_id')[:limit]))
+        for field, label in RECORD_KINDS
+    ]
+
+
+def series_records(city_ids=None):
+    """Лучший результат каждой серии среди команд городов: {series_id: (очки, team_id, tournament_id)}"""
+    rows = TeamRecord.objects.exclude(series_best={})
+    if city_ids is not None:
+        rows = rows.filter(city_id__in=city_ids)
+    best = {}
+    for team_id, series_best in rows.values_list('team_id', 'series_best').iterator(chunk_size=2000):
+        for series_id, (points, tournament_id) in series_best.items():
+            current = best.get(int(series_id))
+            if current is None or (-points, team_id) < (-current[0], current[1]):
+                best[int(series_id)] = (points, team_id, tournament_id)
+    return best
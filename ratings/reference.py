@@ -0,0 +1,106 @@
+import threading
+import uuid
+from collections import defaultdict, namedtuple
+from types import MappingProxyType
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+
+from .models import City, Season, Topic, TournamentSeries
+from .routers import read_from_primary
+
+
+# Справочники (города, серии, темы, сезоны) меняются только из админки, поэтому держим их в памяти процесса.
+# Версия лежит в общем кеше Django: админка ее меняет, и все воркеры перечитывают справочники.
+VERSION_KEY = 'ratings:reference_version'
+# Отдельный кеш для версий снимков (CACHES['versions']): общий кеш при переполнении удаляет случайные ключи
+VERSION_CACHE_ALIAS = 'versions'
+
+CityRef = namedtuple('CityRef', ['id', 'name'])
+SeriesRef = namedtuple('SeriesRef', ['id', 'name', 'display_order', 'tournament_type', 'best_of'])
+TopicRef = namedtuple('TopicRef', ['id', 'short_name', 'full_name'])
+SeasonRef = namedtuple('SeasonRef', ['id', 'name', 'start_date', 'end_date'])
+
+
+class ReferenceData:
+    """Неизменяемый снимок справочников с поиском по id и по названию"""
+
+    def __init__(self, version):
+        self.version = version
+
+        # Порядок такой же, как раньше был в запросах views
+        self.cities = tuple(CityRef(*row) for row in City.objects.order_by('name').values_list('id', 'name'))
+        self.series = tuple(SeriesRef(*row) for row in TournamentSeries.objects.order_by('id').values_list(
+            'id', 'name', 'display_order', 'tournament_type', 'best_of'
+        ))
+        self.topics = tuple(TopicRef(*row) for row in Topic.objects.order_by('full_name').values_list(
+            'id', 'short_name', 'full_name'
+        ))
+        # Новые сверху, как в админке
+        self.seasons = tuple(SeasonRef(*row) for row in Season.objects.order_by('-start_date').values_list(
+            'id', 'name', 'start_date', 'end_date'
+        ))
+
+        self.cities_by_id = MappingProxyType({city.id: city for city in self.cities})
+        # Название города не уникально: по имени - все id с этим названием
+        city_ids_by_name = defaultdict(tuple)
+        for city in self.cities:
+            city_ids_by_name[city.name] += (city.id,)
+        self.city_ids_by_name = MappingProxyType(dict(city_ids_by_name))
+        self.series_by_id = MappingProxyType({series.id: series for series in self.series})
+        self.series_ids_by_name = MappingProxyType({series.name: series.id for series in self.series})
+        self.topics_by_id = MappingProxyType({topic.id: topic for topic in self.topics})
+        self.seasons_by_id = MappingProxyType({season.id: season for season in self.seasons})
+
+
+class VersionedSnapshot:
+    """
+    Снимок данных в памяти процесса, версия которого лежит в общем кеше Django. bump_version (после коммита
+    изменений) записывает новую версию, и каждый процесс при следующем get() собирает снимок заново: loader(version).
+    Снимок всегда читается из default - см. routers.read_from_primary
+
+    Версия - случайная строка, а не счетчик: если ключ пропал из кеша, новая версия не совпадет
+    ни с одной прежней, и процесс со старым снимком его не оставит
+    """
+
+    def __init__(self, cache_key, loader):
+        self.cache_key = cache_key
+        self.loader = loader
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache():
+        alias = VERSION_CACHE_ALIAS if VERSION_CACHE_ALIAS in settings.CACHES else DEFAULT_CACHE_ALIAS
+        return caches[alias]
+
+    def get_version(self):
+        cache = self.cache()
+        version = cache.get(self.cache_key)
+        if version is None:
+            # Два процесса могли прийти сюда одновременно: остается версия того, кто записал первым
+            version = uuid.uuid4().hex
+            cache.add(self.cache_key, version, timeout=None)
+            version = cache.get(self.cache_key, version)
+        return version
+
+    def bump_version(self):
+        self.cache().set(self.cache_key, uuid.uuid4().hex, timeout=None)
+
+    def get(self):
+        version = self.get_version()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version != version:
+            with self._lock:
+                if self._snapshot is None or self._snapshot.version != version:
+                    with read_from_primary():
+                        self._snapshot = self.loader(version)
+                snapshot = self._snapshot
+        return snapshot
+
+
+_reference = VersionedSnapshot(VERSION_KEY, ReferenceData)
+get_version = _reference.get_version
+# Вызывается при сохранении справочников: все процессы перечитают данные при следующем обращении
+bump_version = _reference.bump_version
+get_reference_data = _reference.get
@@ -0,0 +1,104 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+
+# Публичные страницы рейтинга читают с реплики, все записи (админка, сигналы) идут в default.
+# После сохранения в админке браузер на короткое время "прилипает" к default,
+# чтобы сразу увидеть свои изменения, даже если реплика еще отстает.
+
+PRIMARY_ALIAS = 'default'
+STICKY_COOKIE = 'db_primary_until'
+
+# Разрешено ли текущему view читать с реплики
+_read_from_replica = ContextVar('read_from_replica', default=False)
+# Состояние текущего запроса: прилип ли он к default и были ли записи
+_request_state = ContextVar('db_request_state', default=None)
+
+
+def get_read_alias():
+    alias = getattr(settings, 'DATABASE_READ_ALIAS', PRIMARY_ALIAS)
+    return alias if alias in connections.databases else PRIMARY_ALIAS
+
+
+def use_read_replica(view):
+    """Декоратор для публичных view: все чтения внутри идут на реплику"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        state = _request_state.get()
+        if state is not None and state['sticky']:
+            return view(request, *args, **kwargs)
+        token = _read_from_replica.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _read_from_replica.reset(token)
+    return wrapper
+
+
+@contextmanager
+def read_from_primary():
+    """
+    Чтения внутри идут в default, даже в view с use_read_replica. Для снимков в памяти процесса
+    (reference.py, difficulty.py, search_index.py): версия меняется после коммита в default, и снимок,
+    прочитанный с отстающей реплики, остался бы под новой версией до следующего изменения
+    """
+    token = _read_from_replica.set(False)
+    try:
+        yield
+    finally:
+        _read_from_replica.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _read_from_replica.get():
+            return get_read_alias()
+        return PRIMARY_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Запоминаем, что запрос менял данные рейтинга - ответ поставит куку прилипания
+        state = _request_state.get()
+        if state is not None and model._meta.app_label == 'ratings':
+            state['wrote'] = True
+        return PRIMARY_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика содержит те же данные, что и default
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return True
+
+
+class PrimaryStickinessMiddleware:
+    """Включает чтение с default на DATABASE_STICKY_SECONDS после записи из этого браузера"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sticky_until = request.COOKIES.get(STICKY_COOKIE)
+        try:
+            sticky = float(sticky_until) > time.time()
+        except (TypeError, ValueError):
+            sticky = False
+
+        state = {'sticky': sticky, 'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+
+        if state['wrote']:
+            window = getattr(settings, 'DATABASE_STICKY_SECONDS', 15)
+            response.set_cookie(
+                STICKY_COOKIE, str(time.time() + window),
+                max_age=window, httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,146 @@
+"""
+Подсказки поиска: названия команд и турниров в памяти процесса, отсортированный список ключей и bisect.
+
+Название нормализуется так же, как запрос в utils.q_search (нижний регистр, пробелы схлопнуты). Ключи - название
+целиком и его хвосты с начала каждого слова, поэтому "кубок" находит и "Кубок Грозного", и "Зимний кубок".
+Ответ на запрос - bisect по спискам ключей и не больше limit шагов на вид, без обращений к БД.
+
+Версия, как у справочников (reference.VersionedSnapshot), лежит в общем кеше: сохранение или удаление команды или турнира
+ее меняет, и каждый процесс пересобирает индекс при следующем запросе.
+"""
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from .models import Team, Tournament
+from .reference import VersionedSnapshot
+
+
+VERSION_KEY = 'ratings:search_version'
+KIND_TEAM = 'team'
+KIND_TOURNAMENT = 'tournament'
+
+# extra - id города команды (название берется из справочника) или дата турнира
+Suggestion = namedtuple('Suggestion', ['kind', 'id', 'name', 'extra'])
+
+
+def normalize(text):
+    """Как в q_search: нижний регистр, одиночные пробелы"""
+    return ' '.join((text or '').lower().split())
+
+
+class _KindIndex:
+    """
+    Ключи одного вида (команды или турниры). Строки - номера названий в общем порядке (название, id):
+    head - названия целиком, по возрастанию ключа, поэтому совпадения с начала названия уже идут по алфавиту;
+    tail - хвосты с середины названия, для них разреженная таблица минимумов (sparse table): первые по алфавиту
+    из любого отрезка достаются за O(log) каждый, без просмотра всего отрезка
+    """
+
+    def __init__(self, heads, tails):
+        heads.sort()
+        tails.sort()
+        self.head_keys = tuple(key for key, _ in heads)
+        self.head_orders = array('l', (order for _, order in heads))
+        self.tail_keys = tuple(key for key, _ in tails)
+        self.tail_orders = array('l', (order for _, order in tails))
+        # levels[j][i] - позиция минимума в tail_orders[i:i + 2**j]
+        orders = self.tail_orders
+        self.levels = [array('l', range(len(orders)))]
+        width = 1
+        while 2 * width <= len(orders):
+            previous = self.levels[-1]
+            self.levels.append(array('l', (
+                previous[i] if orders[previous[i]] <= orders[previous[i + width]] else previous[i + width]
+                for i in range(len(orders) - 2 * width + 1)
+            )))
+            width *= 2
+
+    def _min_position(self, start, end):
+        level = (end - start).bit_length() - 1
+        left, right = self.levels[level][start], self.levels[level][end - (1 << level)]
+        return left if self.tail_orders[left] <= self.tail_orders[right] else right
+
+    def _tail_orders(self, start, end):
+        """Номера из tail_orders[start:end] по возрастанию (с повторами): куча отрезков с их минимумами"""
+        heap = []
+
+        def push(low, high):
+            if low < high:
+                position = self._min_position(low, high)
+                heapq.heappush(heap, (self.tail_orders[position], position, low, high))
+
+        push(start, end)
+        while heap:
+            order, position, low, high = heapq.heappop(heap)
+            yield order
+            push(low, position)
+            push(position + 1, high)
+
+    def suggest(self, query, limit):
+        """До limit номеров: сначала совпадения с начала названия, потом с середины, внутри - по алфавиту"""
+        found = []
+        start = bisect_left(self.head_keys, query)
+        # Все строки с префиксом query меньше query + максимальный символ
+        end = bisect_left(self.head_keys, query + '\U0010ffff', start)
+        found.extend(self.head_orders[start:min(end, start + limit)])
+        if len(found) < limit:
+            # Все совпадения с начала уже в found: с середины добираем только новые названия
+            seen = set(found)
+            start = bisect_left(self.tail_keys, query)
+            end = bisect_left(self.tail_keys, query + '\U0010ffff', start)
+            for order in self._tail_orders(start, end):
+                if order not in seen:
+                    seen.add(order)
+                    found.append(order)
+                    if len(found) >= limit:
+                        break
+        return found
+
+
+class SearchIndex:
+    """
+    Неизменяемый снимок: названия в порядке (название, id) и ключи каждого вида. Ответ - не больше limit
+    строк каждого вида, сколько бы названий ни начиналось с короткого запроса
+    """
+
+    def __init__(self, version):
+        self.version = version
+        items = [
+            Suggestion(KIND_TEAM, team_id, name, city_id)
+            for team_id, name, city_id in Team.objects.values_list('id', 'name', 'city_id')
+        ]
+        items += [
+            Suggestion(KIND_TOURNAMENT, tournament_id, name, date.isoformat())
+            for tournament_id, name, date in Tournament.objects.values_list('id', 'name', 'date')
+        ]
+        # Порядок выдачи внутри одного ранга: нормализованное название, потом вид и id
+        items.sort(key=lambda item: (normalize(item.name), item.kind, item.id))
+        self.items = tuple(items)
+
+        keys = {KIND_TEAM: ([], []), KIND_TOURNAMENT: ([], [])}
+        for order, item in enumerate(self.items):
+            heads, tails = keys[item.kind]
+            words = normalize(item.name).split(' ')
+            # Хвост с первого слова - все название: совпадение с начала названия ставим выше, с середины - ниже
+            heads.append((' '.join(words), order))
+            for position in range(1, len(words)):
+                tails.append((' '.join(words[position:]), order))
+        self.kinds = {kind: _KindIndex(heads, tails) for kind, (heads, tails) in keys.items()}
+
+    def suggest(self, query, limit=8):
+        """До limit команд и до limit турниров, чье название или слово названия начинается с запроса"""
+        query = normalize(query)
+        if not query:
+            return [], []
+        return tuple(
+            [self.items[order] for order in self.kinds[kind].suggest(query, limit)]
+            for kind in (KIND_TEAM, KIND_TOURNAMENT)
+        )
+
+
+_search = VersionedSnapshot(VERSION_KEY, SearchIndex)
+get_version = _search.get_version
+bump_version = _search.bump_version
+get_search_index = _search.get
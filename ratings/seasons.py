@@ -0,0 +1,202 @@
+"""
+Сезоны: закрытый сезон (manage.py close_season) хранит сводки команд - участия и места в каждой серии
+(SeasonSeriesSummary) и очки по темам (SeasonTopicSummary). Достижения и радар карточки команды складывают
+эти сводки с сырыми играми вне закрытых сезонов, поэтому число перебираемых строк не растет с историей.
+
+Сырые результаты остаются на месте: их читают карточка турнира, места, пояса и рекорды.
+Если после закрытия правят турнир сезона (или переносят турнир в сезон и из него), recalculate_tournament
+ставит задачу сезона (RatingJob.KIND_SEASON), и его сводки собираются заново.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .difficulty import collect_topic_stats
+from .jobs import enqueue
+from .models import GameResult, RatingJob, Season, SeasonSeriesSummary, SeasonTopicSummary, Topic, Tournament
+
+
+def closed_seasons():
+    return list(Season.objects.filter(closed_at__isnull=False).order_by('start_date'))
+
+
+def _in_seasons(seasons, prefix=''):
+    """Условие "турнир попадает в один из сезонов" (prefix - путь до турнира, например 'tournament__')"""
+    condition = Q(pk__in=[])
+    for season in seasons:
+        condition |= Q(**{f'{prefix}date__range': (season.start_date, season.end_date)})
+    return condition
+
+
+def live_results(results, seasons=None):
+    """Результаты вне закрытых сезонов - то, чего нет в сводках"""
+    seasons = closed_seasons() if seasons is None else seasons
+    if not seasons:
+        return results
+    return results.exclude(_in_seasons(seasons, 'tournament__'))
+
+
+def series_stats(team_id):
+    """
+    Участия и места команды по сериям, как раньше считал Team.get_series_stats по всем играм:
+    [{'tournament__series__name', ..._display_order, ..._tournament_type, participations, wins, second_places, third_places}]
+    """
+    series_fields = ['tournament__series__name', 'tournament__series__display_order', 'tournament__series__tournament_type']
+    count_fields = ['participations', 'wins', 'second_places', 'third_places']
+    stats = {}
+    live = live_results(GameResult.objects.filter(team_id=team_id)).values(*series_fields).annotate(
+        participations=Count('id'),
+        wins=Count('id', filter=Q(place=1)),
+        second_places=Count('id', filter=Q(place=2)),
+        third_places=Count('id', filter=Q(place=3)),
+    )
+    for row in live:
+        stats[row['tournament__series__name']] = row
+
+    frozen = SeasonSeriesSummary.objects.filter(team_id=team_id).values(
+        'series__name', 'series__display_order', 'series__tournament_type', *count_fields,
+    )
+    for row in frozen:
+        current = stats.setdefault(row['series__name'], {
+            'tournament__series__name': row['series__name'],
+            'tournament__series__display_order': row['series__display_order'],
+            'tournament__series__tournament_type': row['series__tournament_type'],
+            **dict.fromkeys(count_fields, 0),
+        })
+        for field in count_fields:
+            current[field] += row[field]
+    return sorted(stats.values(), key=lambda row: row['tournament__series__display_order'])
+
+
+def frozen_topic_stats(team_id):
+    """Очки и игры команды по темам за закрытые сезоны: {topic_id: {'points_sum', 'games_count'}}"""
+    stats = {}
+    for topic_id, points_sum, games_count in SeasonTopicSummary.objects.filter(team_id=team_id).values_list(
+        'topic_id', 'points_sum', 'games_count',
+    ):
+        current = stats.setdefault(topic_id, {'points_sum': 0, 'games_count': 0})
+        current['points_sum'] += points_sum
+        current['games_count'] += games_count
+    return stats
+
+
+def expected_summaries(season):
+    """Сводки сезона по его сырым играм: (строки по сериям, строки по темам, {tournament_id: число результатов})"""
+    results = GameResult.objects.filter(tournament__date__range=(season.start_date, season.end_date))
+    series_rows = [
+        SeasonSeriesSummary(season=season, team_id=row.pop('team_id'), series_id=row.pop('tournament__series_id'), **row)
+        for row in results.values('team_id', 'tournament__series_id').annotate(
+            participations=Count('id'),
+            wins=Count('id', filter=Q(place=1)),
+            second_places=Count('id', filter=Q(place=2)),
+            third_places=Count('id', filter=Q(place=3)),
+            points_sum=Sum('total_points'),
+        ).order_by()
+    ]
+
+    by_team = defaultdict(list)
+    for team_id, topic_scores in results.order_by('id').values_list('team_id', 'topic_scores').iterator(chunk_size=5000):
+        by_team[team_id].append(topic_scores)
+    # Удаленные темы еще могут остаться в topic_scores до пересборки
+    topic_ids = set(Topic.objects.values_list('id', flat=True))
+    topic_rows = [
+        SeasonTopicSummary(
+            season=season, team_id=team_id, topic_id=topic_id, games_count=stats.games_count, points_sum=stats.points_sum,
+        )
+        for team_id, topic_scores_list in by_team.items()
+        for topic_id, stats in collect_topic_stats(topic_scores_list).items()
+        if topic_id in topic_ids
+    ]
+
+    tournaments = {
+        str(tournament_id): count
+        for tournament_id, count in Tournament.objects.filter(date__range=(season.start_date, season.end_date))
+        .annotate(results_count=Count('gameresult')).values_list('id', 'results_count')
+    }
+    return series_rows, topic_rows, tournaments
+
+
+def freeze(season_id):
+    """Собирает сводки закрытого сезона заново. Обработчик задачи сезона (RatingJob.KIND_SEASON) и close_season"""
+    with transaction.atomic():
+        season = Season.objects.select_for_update().filter(id=season_id).first()
+        if season is None or not season.is_closed:
+            return False
+        series_rows, topic_rows, season.tournaments = expected_summaries(season)
+        SeasonSeriesSummary.objects.filter(season=season).delete()
+        SeasonTopicSummary.objects.filter(season=season).delete()
+        SeasonSeriesSummary.objects.bulk_create(series_rows, batch_size=1000)
+        SeasonTopicSummary.objects.bulk_create(topic_rows, batch_size=1000)
+        season.save(update_fields=['tournaments'])
+    return True
+
+
+def close(season):
+    """Закрывает сезон и собирает сводки. Сезоны не должны пересекаться, иначе игры посчитаются дважды"""
+    overlapping = Season.objects.filter(
+        closed_at__isnull=False, start_date__lte=season.end_date, end_date__gte=season.start_date,
+    ).exclude(id=season.id)
+    if overlapping.exists():
+        raise ValueError(f"Сезон пересекается с закрытым: {', '.join(str(other) for other in overlapping)}")
+    with transaction.atomic():
+        season.closed_at = season.closed_at or timezone.now()
+        season.save(update_fields=['closed_at'])
+        freeze(season.id)
+
+
+def reopen(season):
+    """Открывает сезон: сводки удаляются, его игры снова считаются по сырым результатам"""
+    with transaction.atomic():
+        SeasonSeriesSummary.objects.filter(season=season).delete()
+        SeasonTopicSummary.objects.filter(season=season).delete()
+        season.closed_at = None
+        season.tournaments = {}
+        season.save(update_fields=['closed_at', 'tournaments'])
+
+
+def check_tournament(tournament_id, changed, results_count):
+    """
+    Из recalculate_tournament: ставит пересчет закрытых сезонов, которых касается турнир - изменились его
+    результаты, их число или турнир перенесли в сезон или из него (в том числе удалили)
+    """
+    date = Tournament.objects.filter(id=tournament_id).values_list('date', flat=True).first()
+    stale = []
+    for season in closed_seasons():
+        inside = date is not None and season.start_date <= date <= season.end_date
+        frozen_count = season.tournaments.get(str(tournament_id))
+        if inside != (frozen_count is not None) or (inside and (changed or frozen_count != results_count)):
+            stale.append(season.id)
+    enqueue(RatingJob.KIND_SEASON, stale)
+    return stale
+
+
+def _series_key(row):
+    return (row.team_id, row.series_id, row.participations, row.wins, row.second_places, row.third_places,
+            round(row.points_sum, 6))
+
+
+def _topic_key(row):
+    return (row.team_id, row.topic_id, row.games_count, round(row.points_sum, 6))
+
+
+def find_divergences():
+    """
+    Закрытые сезоны, чьи сводки не совпадают с пересчитанными по сырым играм:
+    [(сезон, что, лишние сохраненные строки, недостающие строки)]
+    """
+    divergences = []
+    for season in closed_seasons():
+        series_rows, topic_rows, tournaments = expected_summaries(season)
+        checks = [
+            ('series', {_series_key(row) for row in SeasonSeriesSummary.objects.filter(season=season)},
+             {_series_key(row) for row in series_rows}),
+            ('topics', {_topic_key(row) for row in SeasonTopicSummary.objects.filter(season=season)},
+             {_topic_key(row) for row in topic_rows}),
+            ('tournaments', set(season.tournaments.items()), set(tournaments.items())),
+        ]
+        for kind, stored, expected in checks:
+            if stored != expected:
+                divergences.append((season.name, kind, sorted(stored - expected), sorted(expected - stored)))
+    return divergences
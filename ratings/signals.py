@@ -1,24 +1,24 @@
 from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
+from django.dispatch import Signal, receiver
 from decimal import Decimal
+from django.db import transaction
 from django.db.models import Sum
 from django.db.models.functions import Coalesce
 
-from .models import GameResult, TopicResult
+from .models import ChangeLogEntry, City, GameResult, RatingJob, Season, Team, Topic, TopicResult, Tournament, TournamentSeries, TournamentTopic, pack_topic_scores
+from . import belts, changelog, difficulty, records, search_index, seasons, standings
+from .jobs import enqueue, enqueue_teams, enqueue_tournament
+from .reference import bump_version
+
+
+# Отправляется после того, как итоги и места турнира пересчитаны (аргумент tournament_id).
+# На него подписываются производные структуры: live-табло и т.п.
+tournament_recalculated = Signal()
 
-# Функция для обновления total_points
-def update_game_result_total(game_result):
-    """Обновляет total_points для GameResult"""
-    points_before = game_result.topicresult_set.aggregate(
-        total=Coalesce(Sum('points'), Decimal('0.0'))
-    )['total']
-    
-    black_box = game_result.black_box_points or Decimal('0.0')
-    new_total = float(points_before) + float(black_box)
-    
-    if game_result.total_points != new_total:
-        game_result.total_points = new_total
-        game_result.save(update_fields=['total_points'])
+
+def notify_tournament_recalculated(tournament_id):
+    # Подписчики узнают о пересчете только после коммита, чтобы читать уже сохраненные данные
+    transaction.on_commit(lambda: tournament_recalculated.send(sender=GameResult, tournament_id=tournament_id))
 
 # Функция для расчета мест
 def calculate_places(points_list):
@@ -39,54 +39,136 @@ def calculate_places(points_list):
     
     return places
 
-# Функция для обновления мест в турнире
-def update_tournament_places(tournament):
-    """Обновляет поле place для всех GameResult в турнире"""
-    results = GameResult.objects.filter(tournament=tournament)\
-        .select_related('team')\
-        .order_by('-total_points')
-    
-    points_list = [result.total_points for result in results]
-    places = calculate_places(points_list)
-    
-    # Обновляем места для каждого результата
+# Полный пересчет турнира: total_points всех команд, места и topic_scores за пару запросов
+def recalculate_tournament(tournament_id):
+    """Пересчитывает total_points, place и topic_scores для всех GameResult турнира и сложность его тем"""
+    results = list(
+        GameResult.objects.filter(tournament_id=tournament_id)
+        .annotate(topics_sum=Coalesce(Sum('topicresult__points'), Decimal('0.0')))
+    )
+    old_values = {result.id: (result.total_points, result.place, result.topic_scores) for result in results}
+    topic_scores = pack_topic_scores(results)
+
+    for result in results:
+        result.total_points = float(result.topics_sum) + float(result.black_box_points or Decimal('0.0'))
+        result.topic_scores = topic_scores[result.id]
+
+    results.sort(key=lambda result: -result.total_points)
+    places = calculate_places([result.total_points for result in results])
     for result, place in zip(results, places):
-        if result.place != place:
-            result.place = place
-            # Сохраняем только поле place чтобы избежать рекурсии
-            GameResult.objects.filter(id=result.id).update(place=place)
+        result.place = place
+
+    changed = [
+        result for result in results
+        if old_values[result.id] != (result.total_points, result.place, result.topic_scores)
+    ]
+    if changed:
+        GameResult.objects.bulk_update(changed, ['total_points', 'place', 'topic_scores'])
+        # Итоги и места тоже изменения результата: потребители журнала увидят их после правок, которые их вызвали
+        changelog.record_many(GameResult, [(result.id, ChangeLogEntry.ACTION_UPDATE, tournament_id) for result in changed])
+        # Очки и победы этих команд изменились - пересчитываем их места в таблице (ratings/rankings.py)
+        enqueue_teams([result.team_id for result in changed])
+        # Очки команд изменились на разницу итогов - сменился ли пояс, видно без пересчета всей истории
+        belts.record_tournament(tournament_id, {
+            result.team_id: result.total_points - old_values[result.id][0] for result in changed
+        })
+        # Серии и рекорды: новая или последняя игра команды - один шаг, более ранняя - пересчет в задаче команды
+        records.apply_tournament(tournament_id, changed)
+
+    # Сложность тем: строки турнира и разница для итогов серии и всего сайта (None - турнир удален)
+    series_id = Tournament.objects.filter(id=tournament_id).values_list('series_id', flat=True).first()
+    difficulty.refresh_tournament(tournament_id, series_id, [result.topic_scores for result in results])
+    # Сводки закрытого сезона собираются заново, если турнир из него изменился (ratings/seasons.py)
+    seasons.check_tournament(tournament_id, changed, len(results))
+    # Зачет серии за сезон - если изменились места, число результатов или дата турнира (ratings/standings.py)
+    standings.check_tournament(tournament_id, changed, len(results))
+
+    notify_tournament_recalculated(tournament_id)
+    return changed
+
+def log_change(instance, tournament_id, signal, created=False):
+    # Запись в журнал изменений (ratings/changelog.py) в той же транзакции, что и само изменение
+    if signal is post_delete:
+        action = ChangeLogEntry.ACTION_DELETE
+    elif created:
+        action = ChangeLogEntry.ACTION_CREATE
+    else:
+        action = ChangeLogEntry.ACTION_UPDATE
+    changelog.record(instance, action, tournament_id)
 
-# Основные сигналы
+# Основные сигналы: сами ничего не считают, только пишут журнал и ставят пересчет турнира в очередь (ratings/jobs.py)
 @receiver(post_save, sender=TopicResult)
 @receiver(post_delete, sender=TopicResult)
-def update_on_topic_change(sender, instance, **kwargs):
-    """Обновляет все при изменении TopicResult"""
-    game_result = instance.game_result
-    tournament = game_result.tournament
-    
-    # 1. Обновляем total_points
-    update_game_result_total(game_result)
-    
-    # 2. Обновляем места во всем турнире
-    update_tournament_places(tournament)
+def update_on_topic_change(sender, instance, signal, created=False, **kwargs):
+    """Пересчет итогов и мест турнира при изменении TopicResult"""
+    tournament_id = GameResult.objects.filter(id=instance.game_result_id).values_list('tournament_id', flat=True).first()
+    log_change(instance, tournament_id, signal, created)
+    enqueue_tournament(tournament_id)
 
 @receiver(post_save, sender=GameResult)
 @receiver(post_delete, sender=GameResult)  
-def update_on_game_result_change(sender, instance, **kwargs):
-    """Обновляет места ВСЕХ команд турнира при изменении ЛЮБОГО GameResult"""
-    tournament = instance.tournament
-    
-    # Получаем ВСЕ результаты турнира и пересчитываем места
-    results = GameResult.objects.filter(tournament=tournament)\
-        .select_related('team')\
-        .order_by('-total_points')
-    
-    points_list = [result.total_points for result in results]
-    places = calculate_places(points_list)
-    
-    # Обновляем места для ВСЕХ результатов турнира
-    for result, place in zip(results, places):
-        if result.place != place:
-            result.place = place
-            # Сохраняем только поле place чтобы избежать рекурсии
-            GameResult.objects.filter(id=result.id).update(place=place)
\ No newline at end of file
+def update_on_game_result_change(sender, instance, signal, created=False, **kwargs):
+    """Пересчет мест ВСЕХ команд турнира при изменении ЛЮБОГО GameResult"""
+    log_change(instance, instance.tournament_id, signal, created)
+    enqueue_tournament(instance.tournament_id)
+    if signal is post_delete:
+        # Удаленная строка уже не попадет в пересчет турнира - понижение пояса записываем здесь
+        belts.record_result_deleted(instance)
+        records.mark_teams([instance.team_id])
+    # Число игр команды изменилось сразу, очки и места - после пересчета турнира
+    enqueue_teams([instance.team_id])
+
+# Состав или порядок тем турнира изменился - пересобираем topic_scores всех его результатов
+@receiver(post_save, sender=TournamentTopic)
+@receiver(post_delete, sender=TournamentTopic)
+def update_on_tournament_topic_change(sender, instance, signal, created=False, **kwargs):
+    log_change(instance, instance.tournament_id, signal, created)
+    enqueue_tournament(instance.tournament_id)
+
+# Турнир могли перенести в другую серию или удалить - сложность тем серий пересчитывается в задаче
+@receiver(post_save, sender=Tournament)
+@receiver(post_delete, sender=Tournament)
+def update_on_tournament_change(sender, instance, signal, created=False, **kwargs):
+    log_change(instance, instance.id, signal, created)
+    enqueue_tournament(instance.id)
+    if signal is post_save and not created:
+        # Дата или серия могли измениться - порядок игр и лучшие по сериям у команд турнира тоже
+        enqueue_teams(records.mark_tournament(instance.id))
+
+# Новая команда, переезд в другой город или удаление - места в таблицах городов
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+def update_on_team_change(sender, instance, **kwargs):
+    enqueue_teams([instance.id])
+
+# Справочники изменились в админке - меняем общую версию, все процессы перечитают их из БД
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+@receiver(post_save, sender=TournamentSeries)
+@receiver(post_delete, sender=TournamentSeries)
+@receiver(post_save, sender=Topic)
+@receiver(post_delete, sender=Topic)
+@receiver(post_save, sender=Season)
+@receiver(post_delete, sender=Season)
+def update_reference_version(sender, instance, **kwargs):
+    transaction.on_commit(bump_version)
+
+# Даты сезона или число лучших игр серии изменились - зачет собирается заново
+@receiver(post_save, sender=Season)
+def update_standings_on_season_change(sender, instance, update_fields=None, **kwargs):
+    # Закрытие сезона и его сводки (ratings/seasons.py) даты не трогают
+    if update_fields and not {'start_date', 'end_date'} & set(update_fields):
+        return
+    standings.enqueue_all()
+
+@receiver(post_save, sender=TournamentSeries)
+def update_standings_on_series_change(sender, instance, **kwargs):
+    enqueue(RatingJob.KIND_STANDINGS, [instance.id])
+
+# Название команды или турнира могло измениться - подсказки поиска пересоберутся во всех процессах
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+@receiver(post_save, sender=Tournament)
+@receiver(post_delete, sender=Tournament)
+def update_search_version(sender, instance, **kwargs):
+    transaction.on_commit(search_index.bump_version)
@@ -0,0 +1,202 @@
+"""
+Зачет серии за сезон (SeriesStanding): команда получает очки за место в каждой игре серии
+(RATINGS_STANDINGS_POINTS), в зачет идут лучшие TournamentSeries.best_of игр (пусто - все). При равенстве очков
+зачета выше тот, кто набрал больше очков в этих играх. В кубковой серии турниры сезона - этапы по дате, и сначала
+сравнивается этап, до которого дошла команда, потом очки.
+
+Зачет собирается задачей серии (RatingJob.KIND_STANDINGS) сразу по всем сезонам. recalculate_tournament ставит ее,
+когда у турнира серии изменились места или итоги, число результатов или дата, а также при переносе турнира в другую
+серию. SeriesStandingTable помнит, по каким турнирам собран зачет, - так же, как Season.tournaments у сводок.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from .jobs import enqueue
+from .models import GameResult, RatingJob, Season, SeriesStanding, SeriesStandingTable, Tournament, TournamentSeries
+
+
+# Очки за 1-е, 2-е, ... место; дальше - 0
+DEFAULT_PLACE_POINTS = [25, 20, 16, 13, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 1]
+
+
+def place_points(place):
+    table = getattr(settings, 'RATINGS_STANDINGS_POINTS', DEFAULT_PLACE_POINTS)
+    return table[place - 1] if 1 <= place <= len(table) else 0
+
+
+def _fingerprint(results_count, date):
+    """Что запоминаем о турнире зачета: число результатов и дата (от нее зависит порядок этапов кубка)"""
+    return [results_count, date.isoformat()]
+
+
+def expected_rows(season, series, tournaments, results):
+    """
+    Зачет серии за сезон по играм. tournaments - {tournament_id: дата} турниров серии в датах сезона,
+    results - [(team_id, tournament_id, place, total_points)] их результаты.
+    Возвращает (строки SeriesStanding по местам, {tournament_id: отпечаток} для SeriesStandingTable)
+    """
+    # Зависимость от signals.py только здесь: signals импортирует этот модуль
+    from .signals import calculate_places
+
+    cup = series.tournament_type == 'cup'
+    stages = {
+        tournament_id: number
+        for number, (_, tournament_id) in enumerate(sorted((date, tid) for tid, date in tournaments.items()), start=1)
+    }
+    counts = dict.fromkeys(tournaments, 0)
+    by_team = defaultdict(list)
+    for team_id, tournament_id, place, total_points in results:
+        counts[tournament_id] += 1
+        by_team[team_id].append((stages[tournament_id], tournament_id, place, total_points))
+
+    rows = []
+    for team_id, games in by_team.items():
+        games.sort()
+        scored = [
+            (tournament_id, place, place_points(place), total_points) for _, tournament_id, place, total_points in games
+        ]
+        # Лучшие игры: больше очков зачета, при равенстве - больше очков в игре, потом более ранняя
+        best = sorted(range(len(scored)), key=lambda index: (-scored[index][2], -scored[index][3], index))
+        counted = set(best[:series.best_of] if series.best_of else best)
+        places = [place for _, place, _, _ in scored if place > 0]
+        rows.append(SeriesStanding(
+            season=season, series=series, team_id=team_id, position=0,
+            points=float(sum(scored[index][2] for index in counted)),
+            total_points=round(sum(scored[index][3] for index in counted), 6),
+            progression=max(stage for stage, _, _, _ in games) if cup else 0,
+            games_count=len(scored),
+            counted_count=len(counted),
+            wins=places.count(1),
+            best_place=min(places) if places else None,
+            results=[
+                [tournament_id, place, points, index in counted]
+                for index, (tournament_id, place, points, _) in enumerate(scored)
+            ],
+        ))
+
+    rows.sort(key=lambda row: (-row.progression, -row.points, -row.total_points, row.team_id))
+    positions = calculate_places([(row.progression, row.points, row.total_points) for row in rows])
+    for row, position in zip(rows, positions):
+        row.position = position
+    fingerprints = {
+        str(tournament_id): _fingerprint(counts[tournament_id], date) for tournament_id, date in tournaments.items()
+    }
+    return rows, fingerprints
+
+
+def expected_tables(series):
+    """Зачет серии во всех сезонах, где у нее есть турниры: {season_id: (строки, отпечатки турниров)}"""
+    tournaments = dict(Tournament.objects.filter(series=series).values_list('id', 'date'))
+    results = defaultdict(list)
+    for team_id, tournament_id, place, total_points in GameResult.objects.filter(
+        tournament__series=series,
+    ).values_list('team_id', 'tournament_id', 'place', 'total_points').iterator(chunk_size=5000):
+        results[tournament_id].append((team_id, tournament_id, place, total_points))
+
+    tables = {}
+    for season in Season.objects.all():
+        inside = {
+            tournament_id: date for tournament_id, date in tournaments.items()
+            if season.start_date <= date <= season.end_date
+        }
+        if inside:
+            tables[season.id] = expected_rows(
+                season, series, inside, [result for tournament_id in inside for result in results[tournament_id]],
+            )
+    return tables
+
+
+def refresh_series(series_id):
+    """Обработчик задачи зачета (RatingJob.KIND_STANDINGS): зачет серии во всех сезонах собирается заново"""
+    with transaction.atomic():
+        # Блокировка серии: две задачи одной серии не пишут зачет одновременно
+        series = TournamentSeries.objects.select_for_update().filter(id=series_id).first()
+        if series is None:
+            # Строки и таблицы удалены вместе с серией
+            return False
+        tables = expected_tables(series)
+        SeriesStanding.objects.filter(series=series).delete()
+        SeriesStanding.objects.bulk_create([row for rows, _ in tables.values() for row in rows], batch_size=1000)
+        SeriesStandingTable.objects.filter(series=series).exclude(season_id__in=list(tables)).delete()
+        for season_id, (_, fingerprints) in tables.items():
+            SeriesStandingTable.objects.update_or_create(
+                season_id=season_id, series=series, defaults={'tournaments': fingerprints},
+            )
+    return True
+
+
+def enqueue_all():
+    """Пересчет зачета всех серий, у которых есть турниры: сезоны изменились в админке"""
+    series_ids = Tournament.objects.order_by().values_list('series_id', flat=True).distinct()
+    enqueue(RatingJob.KIND_STANDINGS, sorted(series_ids))
+
+
+def check_tournament(tournament_id, changed, results_count):
+    """
+    Из recalculate_tournament: ставит пересчет зачета серий, которых касается турнир - изменились места или итоги,
+    число результатов или дата, турнир перенесли в другую серию или удалили
+    """
+    tournament = Tournament.objects.filter(id=tournament_id).values_list('series_id', 'date').first()
+    stale = set()
+    covered = set()
+    for table in SeriesStandingTable.objects.select_related('season'):
+        inside = (
+            tournament is not None and tournament[0] == table.series_id
+            and table.season.start_date <= tournament[1] <= table.season.end_date
+        )
+        frozen = table.tournaments.get(str(tournament_id))
+        if inside:
+            covered.add(table.season_id)
+        if inside != (frozen is not None) or (
+            inside and (changed or frozen != _fingerprint(results_count, tournament[1]))
+        ):
+            stale.add(table.series_id)
+    # Первый турнир серии в сезоне: зачета для этой пары еще нет
+    if tournament is not None and Season.objects.filter(
+        start_date__lte=tournament[1], end_date__gte=tournament[1],
+    ).exclude(id__in=covered).exists():
+        stale.add(tournament[0])
+    enqueue(RatingJob.KIND_STANDINGS, sorted(stale))
+    return stale
+
+
+def season_table(season_id, series_id):
+    """Строки зачета по местам - одно чтение по индексу (сезон, серия, место)"""
+    return SeriesStanding.objects.filter(season_id=season_id, series_id=series_id).select_related(
+        'team__city',
+    ).order_by('position', 'id')
+
+
+def _row_key(row):
+    return (row.season_id, row.team_id, row.position, round(row.points, 6), round(row.total_points, 6),
+            row.progression, row.games_count, row.counted_count, row.wins, row.best_place,
+            repr(row.results))
+
+
+def _table_key(season_id, fingerprints):
+    # jsonb не хранит порядок ключей
+    return (season_id, tuple(sorted((tournament_id, tuple(value)) for tournament_id, value in fingerprints.items())))
+
+
+def find_divergences():
+    """
+    Серии, чей сохраненный зачет не совпадает с пересчитанным по играм:
+    [(серия, что, лишние сохраненные строки, недостающие строки)]
+    """
+    divergences = []
+    for series in TournamentSeries.objects.order_by('id'):
+        tables = expected_tables(series)
+        checks = [
+            ('rows', {_row_key(row) for row in SeriesStanding.objects.filter(series=series)},
+             {_row_key(row) for rows, _ in tables.values() for row in rows}),
+            ('tournaments',
+             {_table_key(season_id, fingerprints) for season_id, fingerprints in
+              SeriesStandingTable.objects.filter(series=series).values_list('season_id', 'tournaments')},
+             {_table_key(season_id, fingerprints) for season_id, (_, fingerprints) in tables.items()}),
+        ]
+        for kind, stored, expected in checks:
+            if stored != expected:
+                divergences.append((series.name, kind, sorted(stored - expected), sorted(expected - stored)))
+    return divergences
@@ -0,0 +1,68 @@
+import gzip
+from pathlib import Path
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+# Минификаторы и brotli необязательны (requirements-build.txt): без них файлы просто не сжимаются
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Для этих файлов рядом кладем .gz и .br (gzip_static / brotli_static в nginx)
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.otf', '.ttf'}
+
+
+def _minifier(name):
+    suffix = Path(name).suffix
+    if suffix == '.css' and rcssmin is not None:
+        return rcssmin.cssmin
+    if suffix == '.js' and rjsmin is not None and not name.endswith('.min.js'):
+        return rjsmin.jsmin
+    return None
+
+
+class OptimizedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Хранилище для collectstatic: минифицирует CSS/JS, добавляет хеш в имена файлов (manifest)
+    и пишет рядом предварительно сжатые .gz/.br копии.
+    """
+
+    def _save(self, name, content):
+        minify = _minifier(name)
+        if minify is not None:
+            content.seek(0)
+            content = ContentFile(minify(content.read().decode('utf-8')).encode('utf-8'))
+        return super()._save(name, content)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+
+        for hashed_name in set(self.hashed_files.values()):
+            if Path(hashed_name).suffix not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            path = Path(self.path(hashed_name))
+            data = path.read_bytes()
+            self._write_compressed(path.with_name(path.name + '.gz'), data, gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                self._write_compressed(path.with_name(path.name + '.br'), data, brotli.compress(data))
+
+    @staticmethod
+    def _write_compressed(target, original, compressed):
+        # Сжатая копия имеет смысл, только если она действительно меньше
+        if len(compressed) < len(original):
+            target.write_bytes(compressed)
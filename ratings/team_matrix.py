@@ -0,0 +1,199 @@
+"""
+Матрица команда × тема: средний балл каждой активной команды по каждой теме.
+
+manage.py build_team_matrix считает ее целиком на NumPy, вместе с похожими командами (косинусная близость
+отклонений от среднего по теме) и процентилями по темам, и сохраняет набором .npy-файлов в
+RATINGS_ANALYTICS_DIR. Карточка команды читает файлы через memory-map, без запросов к БД.
+NumPy необязателен (requirements-analytics.txt): без него блоки в карточке просто не показываются.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import GameResult
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+POINTER_NAME = 'team_matrix.json'
+ARRAYS = ['team_ids', 'topic_ids', 'averages', 'counts', 'percentiles', 'neighbours', 'similarity']
+# Сколько строк матрицы близости считаем за раз (блок строк × все команды)
+BLOCK_SIZE = 1024
+
+
+def analytics_dir():
+    return Path(getattr(settings, 'RATINGS_ANALYTICS_DIR', Path(settings.BASE_DIR) / 'analytics'))
+
+
+def collect_scores(active_days=None):
+    """
+    Читает topic_scores результатов активных команд (играли за последние active_days дней).
+    Возвращает три плоских массива: id команды, id темы, очки.
+    """
+    results = GameResult.objects.all()
+    if active_days:
+        since = timezone.localdate() - timedelta(days=active_days)
+        active_teams = GameResult.objects.filter(tournament__date__gte=since).values('team_id')
+        results = results.filter(team_id__in=active_teams)
+
+    team_column, topic_column, points_column = [], [], []
+    for team_id, topic_scores in results.values_list('team_id', 'topic_scores').iterator(chunk_size=5000):
+        for topic_id, points in topic_scores:
+            if points is not None:
+                team_column.append(team_id)
+                topic_column.append(topic_id)
+                points_column.append(points)
+    return (
+        np.asarray(team_column, dtype=np.int64),
+        np.asarray(topic_column, dtype=np.int64),
+        np.asarray(points_column, dtype=np.float64),
+    )
+
+
+def build_matrix(team_column, topic_column, points_column, neighbours=5):
+    """Строит все массивы из плоских (команда, тема, очки)"""
+    team_ids, team_index = np.unique(team_column, return_inverse=True)
+    topic_ids, topic_index = np.unique(topic_column, return_inverse=True)
+    shape = (len(team_ids), len(topic_ids))
+
+    sums = np.zeros(shape)
+    counts = np.zeros(shape, dtype=np.int32)
+    np.add.at(sums, (team_index, topic_index), points_column)
+    np.add.at(counts, (team_index, topic_index), 1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        averages = sums / counts  # NaN там, где команда тему не играла
+
+    # Процентиль: доля команд, сыгравших тему, с таким же или более низким средним баллом
+    percentiles = np.full(shape, np.nan, dtype=np.float32)
+    for column in range(shape[1]):
+        played = ~np.isnan(averages[:, column])
+        values = averages[played, column]
+        if values.size:
+            ranks = np.searchsorted(np.sort(values), values, side='right')
+            percentiles[played, column] = ranks * 100.0 / values.size
+
+    # Похожесть по профилю, а не по силе: отклонения от среднего по теме, несыгранные темы = 0
+    topic_means = np.nanmean(averages, axis=0)
+    deviations = np.nan_to_num(averages - topic_means)
+    norms = np.linalg.norm(deviations, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    unit = (deviations / norms).astype(np.float32)
+
+    k = min(neighbours, max(shape[0] - 1, 0))
+    neighbour_index = np.zeros((shape[0], k), dtype=np.int32)
+    neighbour_score = np.zeros((shape[0], k), dtype=np.float32)
+    if k:
+        for start in range(0, shape[0], BLOCK_SIZE):
+            block = unit[start:start + BLOCK_SIZE] @ unit.T
+            rows = np.arange(block.shape[0])
+            block[rows, rows + start] = -np.inf  # сама с собой не сравнивается
+            top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(block, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            neighbour_index[start:start + BLOCK_SIZE] = np.take_along_axis(top, order, axis=1)
+            neighbour_score[start:start + BLOCK_SIZE] = np.take_along_axis(top_scores, order, axis=1)
+
+    return {
+        'team_ids': team_ids,
+        'topic_ids': topic_ids,
+        'averages': averages.astype(np.float32),
+        'counts': counts,
+        'percentiles': percentiles,
+        'neighbours': neighbour_index,
+        'similarity': neighbour_score,
+    }
+
+
+def save_matrix(arrays, directory=None):
+    """
+    Пишет массивы в новую папку и атомарно переключает на нее указатель team_matrix.json,
+    чтобы работающие процессы не прочитали половину старых и половину новых файлов.
+    """
+    directory = Path(directory or analytics_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+    version = f'team_matrix-{time.strftime("%Y%m%d%H%M%S")}-{os.getpid()}'
+    target = directory / version
+    target.mkdir()
+    for name in ARRAYS:
+        np.save(target / f'{name}.npy', arrays[name])
+
+    pointer = directory / POINTER_NAME
+    tmp = pointer.with_name(pointer.name + '.tmp')
+    tmp.write_text(json.dumps({'version': version, 'built_at': timezone.now().isoformat()}), encoding='utf-8')
+    os.replace(tmp, pointer)
+
+    # Старые версии удаляем; процессы, которые их еще держат через mmap, дочитают открытые файлы
+    for old in directory.glob('team_matrix-*'):
+        if old.is_dir() and old.name != version:
+            shutil.rmtree(old, ignore_errors=True)
+    return target
+
+
+class TeamMatrix:
+    def __init__(self, path, built_at):
+        self.built_at = built_at
+        for name in ARRAYS:
+            setattr(self, name, np.load(path / f'{name}.npy', mmap_mode='r'))
+
+    def row(self, team_id):
+        index = int(np.searchsorted(self.team_ids, team_id))
+        if index < len(self.team_ids) and self.team_ids[index] == team_id:
+            return index
+        return None
+
+    def profile(self, team_id):
+        """Похожие команды [(team_id, близость)] и процентили по темам {topic_id: процентиль}"""
+        index = self.row(team_id)
+        if index is None:
+            return None
+        similar = [
+            (int(self.team_ids[neighbour]), float(score))
+            for neighbour, score in zip(self.neighbours[index], self.similarity[index])
+            if score > 0
+        ]
+        percentiles = {
+            int(topic_id): float(value)
+            for topic_id, value in zip(self.topic_ids, self.percentiles[index])
+            if not np.isnan(value)
+        }
+        return {'similar': similar, 'percentiles': percentiles}
+
+
+_loaded = None
+_loaded_pointer = None
+_lock = threading.Lock()
+
+
+def get_team_matrix():
+    """Текущая матрица процесса; перечитывается, когда build_team_matrix переключил указатель"""
+    global _loaded, _loaded_pointer
+    if np is None:
+        return None
+    pointer = analytics_dir() / POINTER_NAME
+    try:
+        stamp = pointer.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _loaded is not None and _loaded_pointer == stamp:
+        return _loaded
+
+    with _lock:
+        if _loaded is None or _loaded_pointer != stamp:
+            info = json.loads(pointer.read_text(encoding='utf-8'))
+            try:
+                _loaded = TeamMatrix(pointer.parent / info['version'], info['built_at'])
+            except FileNotFoundError:
+                return None
+            _loaded_pointer = stamp
+    return _loaded
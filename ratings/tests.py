@@ -1,3 +1,1441 @@
-from django.test import TestCase
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse
+from django.shortcuts import render
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from django.utils.formats import date_format
+
+from . import (
+    belts, changelog, difficulty, jobs, live, rankings, records, reference, search_index, seasons, standings, topic_leaders,
+)
+from .forms import ScoreGridForm
+from .models import (
+    BeltPromotion, ChangeConsumer, ChangeLogEntry, City, CityStats, GameResult, RatingJob, Season, SeriesStanding, Team,
+    TeamRecord, TeamStats, Topic, TopicDifficulty, TopicResult, Tournament, TournamentSeries, TournamentTopic,
+    pack_topic_scores,
+)
+from .routers import (
+    PRIMARY_ALIAS, STICKY_COOKIE, PrimaryReplicaRouter, PrimaryStickinessMiddleware, get_read_alias,
+    read_from_primary, use_read_replica,
+)
+from .utils import ALL_CITIES
+from .views import game_modal, parse_team_ids
+
+
+def make_tournament(name='Игра 1', series=None, city=None, day=date(2025, 1, 10), topics=2):
+    """Турнир с темами (в порядке TournamentTopic.order)"""
+    city = city or City.objects.get_or_create(name='Грозный')[0]
+    series = series or TournamentSeries.objects.get_or_create(name='Лига')[0]
+    tournament = Tournament.objects.create(series=series, name=name, date=day, city=city)
+    for order in range(1, topics + 1):
+        topic = Topic.objects.get_or_create(full_name=f'Тема {order}', short_name=f'Т{order}')[0]
+        TournamentTopic.objects.create(tournament=tournament, topic=topic, order=order)
+    return tournament
+
+
+def add_result(tournament, team, points, black_box=0):
+    """Результат команды: points - очки по темам турнира по порядку"""
+    result = GameResult.objects.create(tournament=tournament, team=team, black_box_points=Decimal(black_box))
+    for item, value in zip(tournament.tournamenttopic_set.order_by('order'), points):
+        TopicResult.objects.create(game_result=result, topic=item.topic, points=Decimal(value))
+    return result
+
+
+def drain_jobs(test):
+    """Выполняет очередь пересчетов, как run_rating_worker --once; задача с ошибкой валит тест"""
+    while (job := jobs.claim_job()) is not None:
+        if not jobs.run_job(job, max_attempts=1):
+            job.refresh_from_db()
+            test.fail(job.last_error)
+
+
+# Реплики в тестовой БД нет: подменяем алиас чтения, роутер от этого не зависит
+REPLICA = 'replica'
+
+
+class RouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        patcher = mock.patch('ratings.routers.get_read_alias', return_value=REPLICA)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read_alias_in_view(self, request=None):
+        """Алиас, куда роутер отправит чтение внутри публичного view"""
+        @use_read_replica
+        def view(request):
+            return self.router.db_for_read(Team)
+        return view(request)
+
+    def test_reads_outside_public_views_go_to_primary(self):
+        self.assertEqual(self.router.db_for_read(Team), PRIMARY_ALIAS)
+
+    def test_public_view_reads_from_replica(self):
+        self.assertEqual(self.read_alias_in_view(), REPLICA)
+        # После view чтения снова идут в default
+        self.assertEqual(self.router.db_for_read(Team), PRIMARY_ALIAS)
+
+    def test_writes_always_go_to_primary(self):
+        @use_read_replica
+        def view(request):
+            return self.router.db_for_write(Team)
+        self.assertEqual(view(None), PRIMARY_ALIAS)
+
+    def test_read_from_primary_inside_public_view(self):
+        @use_read_replica
+        def view(request):
+            with read_from_primary():
+                inside = self.router.db_for_read(Team)
+            return inside, self.router.db_for_read(Team)
+        self.assertEqual(view(None), (PRIMARY_ALIAS, REPLICA))
+
+    def test_view_exception_resets_replica_flag(self):
+        @use_read_replica
+        def view(request):
+            raise ValueError
+        with self.assertRaises(ValueError):
+            view(None)
+        self.assertEqual(self.router.db_for_read(Team), PRIMARY_ALIAS)
+
+
+class ReadAliasTests(SimpleTestCase):
+    def test_missing_replica_falls_back_to_primary(self):
+        with self.settings(DATABASE_READ_ALIAS='no-such-alias'):
+            self.assertEqual(get_read_alias(), PRIMARY_ALIAS)
+
+
+class StickinessTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = PrimaryReplicaRouter()
+        patcher = mock.patch('ratings.routers.get_read_alias', return_value=REPLICA)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_request(self, view, cookies=None):
+        request = self.factory.get('/')
+        request.COOKIES.update(cookies or {})
+        return PrimaryStickinessMiddleware(view)(request)
+
+    def reading_view(self):
+        @use_read_replica
+        def view(request):
+            return HttpResponse(self.router.db_for_read(Team))
+        return view
+
+    def test_fresh_browser_reads_replica(self):
+        response = self.run_request(self.reading_view())
+        self.assertEqual(response.content.decode(), REPLICA)
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_write_sets_sticky_cookie(self):
+        def view(request):
+            self.router.db_for_write(Team)
+            return HttpResponse()
+        with self.settings(DATABASE_STICKY_SECONDS=30):
+            response = self.run_request(view)
+        cookie = response.cookies[STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], 30)
+        self.assertGreater(float(cookie.value), time.time() + 25)
+
+    def test_write_outside_ratings_does_not_stick(self):
+        from django.contrib.auth import get_user_model
+
+        def view(request):
+            self.router.db_for_write(get_user_model())
+            return HttpResponse()
+        self.assertNotIn(STICKY_COOKIE, self.run_request(view).cookies)
+
+    def test_sticky_browser_reads_primary(self):
+        response = self.run_request(self.reading_view(), {STICKY_COOKIE: str(time.time() + 10)})
+        self.assertEqual(response.content.decode(), PRIMARY_ALIAS)
+
+    def test_expired_or_broken_cookie_reads_replica(self):
+        for value in (str(time.time() - 1), 'garbage'):
+            response = self.run_request(self.reading_view(), {STICKY_COOKIE: value})
+            self.assertEqual(response.content.decode(), REPLICA)
+
+
+class ReferenceSnapshotTests(TestCase):
+    def test_snapshot_is_loaded_from_primary_in_public_view(self):
+        City.objects.create(name='Грозный')
+        reference.bump_version()
+        aliases = []
+        original = PrimaryReplicaRouter.db_for_read
+
+        def db_for_read(router, model, **hints):
+            aliases.append(original(router, model, **hints))
+            return PRIMARY_ALIAS
+
+        @use_read_replica
+        def view(request):
+            return reference.get_reference_data()
+
+        with mock.patch('ratings.routers.get_read_alias', return_value=REPLICA), \
+                mock.patch.object(PrimaryReplicaRouter, 'db_for_read', db_for_read):
+            snapshot = view(None)
+        self.assertIn('Грозный', snapshot.city_ids_by_name)
+        # Снимок прочитан из default, хотя view читает с реплики
+        self.assertTrue(aliases)
+        self.assertEqual(set(aliases), {PRIMARY_ALIAS})
+
+    def test_lost_version_key_does_not_keep_stale_snapshot(self):
+        loads = []
+
+        def loader(version):
+            loads.append(version)
+            return mock.Mock(version=version)
+
+        snapshot = reference.VersionedSnapshot('ratings:test_version', loader)
+        self.addCleanup(snapshot.cache().delete, 'ratings:test_version')
+        first = snapshot.get()
+        self.assertIs(snapshot.get(), first)
+        # Ключ вытеснен из кеша: новая версия не должна совпасть с той, что уже в памяти
+        snapshot.cache().delete('ratings:test_version')
+        self.assertIsNot(snapshot.get(), first)
+        snapshot.bump_version()
+        snapshot.get()
+        self.assertEqual(len(set(loads)), 3)
+
+    def test_search_index_follows_team_changes(self):
+        city = City.objects.create(name='Грозный')
+        search_index.get_search_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            team = Team.objects.create(name='Зимний кубок', city=city)
+        teams, _ = search_index.get_search_index().suggest('кубок')
+        self.assertEqual([item.id for item in teams], [team.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            team.delete()
+        self.assertEqual(search_index.get_search_index().suggest('кубок'), ([], []))
+
+
+class SearchIndexTests(TestCase):
+    def expected(self, query, limit):
+        """Перебором: сначала названия с начала, потом со слова в середине, внутри - название и id"""
+        query = search_index.normalize(query)
+        answer = []
+        for model, kind in [(Team, search_index.KIND_TEAM), (Tournament, search_index.KIND_TOURNAMENT)]:
+            ranked = []
+            for item in model.objects.all():
+                words = search_index.normalize(item.name).split(' ')
+                tails = [' '.join(words[position:]) for position in range(len(words))]
+                if tails[0].startswith(query):
+                    ranked.append((0, search_index.normalize(item.name), item.id))
+                elif any(tail.startswith(query) for tail in tails[1:]):
+                    ranked.append((1, search_index.normalize(item.name), item.id))
+            answer.append([(kind, item_id) for _, _, item_id in sorted(ranked)[:limit]])
+        return answer
+
+    def test_suggest_matches_full_scan(self):
+        rng = random.Random(48)
+        words = ['кубок', 'кубань', 'зимний', 'к', 'клуб', 'ум', 'умники', 'Знатоки']
+        city = City.objects.create(name='Грозный')
+        series = TournamentSeries.objects.create(name='Лига')
+        for number in range(150):
+            name = ' '.join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+            Team.objects.create(name=f'{name} {number}', city=city)
+            Tournament.objects.create(name=name, series=series, city=city, date=date(2025, 1, 1 + number % 28))
+        search_index.bump_version()
+        index = search_index.get_search_index()
+
+        for query in ['к', 'ку', 'куб', 'у', 'ум ', 'зимний к', 'знатоки', '1', '3', 'я', 'КЛУБ  к']:
+            for limit in (1, 8, 500):
+                with self.subTest(query=query, limit=limit):
+                    teams, tournaments = index.suggest(query, limit)
+                    self.assertEqual(
+                        [[(item.kind, item.id) for item in teams], [(item.kind, item.id) for item in tournaments]],
+                        self.expected(query, limit),
+                    )
+
+
+
+class ScoreGridFormTests(TestCase):
+    def setUp(self):
+        self.tournament = make_tournament()
+        self.topics = [item.topic for item in self.tournament.tournamenttopic_set.order_by('order')]
+        self.city = self.tournament.city
+        self.first = Team.objects.create(name='Первая', city=self.city)
+        self.second = Team.objects.create(name='Вторая', city=self.city)
+        result = GameResult.objects.create(tournament=self.tournament, team=self.first)
+        TopicResult.objects.create(game_result=result, topic=self.topics[0], points=Decimal('3'))
+        TopicResult.objects.create(game_result=result, topic=self.topics[1], points=Decimal('2'))
+
+    def grid_data(self, **values):
+        """Данные формы: все ячейки пустые, кроме переданных"""
+        form = ScoreGridForm(self.tournament)
+        data = {name: '' for name in form.fields}
+        data.update({name: str(value) for name, value in values.items()})
+        return data
+
+    def test_save_updates_clears_and_inserts(self):
+        first, second = self.topics
+        form = ScoreGridForm(self.tournament, self.grid_data(**{
+            f'team_{self.first.id}_topic_{first.id}': '4.5',
+            # Очищенная ячейка удаляет TopicResult
+            f'team_{self.first.id}_topic_{second.id}': '',
+            'new_0_team': self.second.id,
+            f'new_0_topic_{first.id}': '5',
+            f'new_0_topic_{second.id}': '1',
+            'new_0_bb_answer': 'Ответ',
+            'new_0_bb_points': '1',
+        }))
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.save(), 2)
+
+        self.assertEqual(TopicResult.objects.filter(game_result__tournament=self.tournament).count(), 3)
+        results = {result.team_id: result for result in GameResult.objects.filter(tournament=self.tournament)}
+        self.assertEqual(
+            set(TopicResult.objects.filter(game_result=results[self.first.id]).values_list('topic_id', 'points')),
+            {(first.id, Decimal('4.5'))},
+        )
+        self.assertEqual(results[self.second.id].black_box_answer, 'Ответ')
+        # Итоги и места пересчитаны вместе с сохранением
+        self.assertEqual(results[self.second.id].total_points, 7.0)
+        self.assertEqual(results[self.first.id].total_points, 4.5)
+        self.assertEqual((results[self.second.id].place, results[self.first.id].place), (1, 2))
+
+    def test_resave_is_upsert(self):
+        first, _ = self.topics
+        data = self.grid_data(**{f'team_{self.first.id}_topic_{first.id}': '3', 'new_0_team': self.second.id,
+                                 f'new_0_topic_{first.id}': '2'})
+        form = ScoreGridForm(self.tournament, data)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        # Вторая команда теперь в строках турнира: ее очки правятся, а не вставляются повторно
+        form = ScoreGridForm(self.tournament, self.grid_data(**{
+            f'team_{self.first.id}_topic_{first.id}': '3', f'team_{self.second.id}_topic_{first.id}': '2.5',
+        }))
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertEqual(GameResult.objects.filter(tournament=self.tournament).count(), 2)
+        self.assertEqual(
+            TopicResult.objects.get(game_result__team=self.second, topic=first).points, Decimal('2.5'),
+        )
+
+    def test_filled_row_without_team_and_duplicate_team(self):
+        first, _ = self.topics
+        form = ScoreGridForm(self.tournament, self.grid_data(**{
+            f'new_0_topic_{first.id}': '1',
+            'new_1_team': self.second.id, 'new_2_team': self.second.id,
+        }))
+        self.assertFalse(form.is_valid())
+        self.assertIn('new_0_team', form.errors)
+        self.assertIn('new_2_team', form.errors)
+
+    def test_team_already_in_tournament_is_rejected(self):
+        form = ScoreGridForm(self.tournament, self.grid_data(new_0_team=self.first.id))
+        self.assertFalse(form.is_valid())
+        self.assertIn('new_0_team', form.errors)
+
+    def test_new_rows_do_not_list_all_teams(self):
+        html = str(ScoreGridForm(self.tournament)['new_0_team'])
+        self.assertNotIn(self.second.name, html)
+        self.assertIn('admin-autocomplete', html)
+
+
+def failing_handler(object_id):
+    raise RuntimeError('сбой пересчета')
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        # Задачи, которые поставили сигналы при создании данных других тестов, здесь не нужны
+        RatingJob.objects.all().delete()
+
+    def test_enqueue_skips_pending_duplicates(self):
+        jobs.enqueue(RatingJob.KIND_TEAM, [1, 2, None])
+        jobs.enqueue(RatingJob.KIND_TEAM, [2, 3])
+        self.assertEqual(
+            sorted(RatingJob.objects.values_list('object_id', flat=True)), [1, 2, 3],
+        )
+
+    def test_claim_marks_running_and_is_exclusive(self):
+        jobs.enqueue_tournament(7)
+        job = jobs.claim_job()
+        self.assertEqual((job.object_id, job.status, job.attempts), (7, RatingJob.STATUS_RUNNING, 1))
+        self.assertIsNone(jobs.claim_job())
+
+    def test_claim_waits_for_run_after(self):
+        jobs.enqueue_tournament(7)
+        RatingJob.objects.update(run_after=timezone.now() + timedelta(minutes=1))
+        self.assertIsNone(jobs.claim_job())
+
+    def test_success_deletes_job(self):
+        jobs.enqueue(RatingJob.KIND_TEAM, [1])
+        with mock.patch.dict(jobs.HANDLERS, {RatingJob.KIND_TEAM: 'ratings.tests.mock_handler'}), \
+                mock.patch('ratings.tests.mock_handler', create=True) as handler:
+            self.assertTrue(jobs.run_job(jobs.claim_job(), max_attempts=3))
+        handler.assert_called_once_with(1)
+        self.assertFalse(RatingJob.objects.exists())
+
+    def test_failures_back_off_then_fail(self):
+        jobs.enqueue(RatingJob.KIND_TEAM, [1])
+        delays = []
+        with mock.patch.dict(jobs.HANDLERS, {RatingJob.KIND_TEAM: 'ratings.tests.failing_handler'}):
+            for attempt in range(1, 4):
+                job = jobs.claim_job()
+                self.assertEqual(job.attempts, attempt)
+                started = timezone.now()
+                self.assertFalse(jobs.run_job(job, max_attempts=3))
+                job.refresh_from_db()
+                if job.status == RatingJob.STATUS_PENDING:
+                    delays.append(round((job.run_after - started).total_seconds()))
+                    # Повтор не раньше run_after: сдвигаем время, а не ждем
+                    RatingJob.objects.update(run_after=timezone.now())
+        # 10, 20, ... секунд, на последней попытке - failed с текстом ошибки
+        self.assertEqual(delays, [jobs.RETRY_BASE_DELAY, 2 * jobs.RETRY_BASE_DELAY])
+        self.assertEqual(job.status, RatingJob.STATUS_FAILED)
+        self.assertIn('сбой пересчета', job.last_error)
+        self.assertIsNone(jobs.claim_job())
+
+    def test_backoff_is_capped(self):
+        jobs.enqueue(RatingJob.KIND_TEAM, [1])
+        RatingJob.objects.update(attempts=20)
+        with mock.patch.dict(jobs.HANDLERS, {RatingJob.KIND_TEAM: 'ratings.tests.failing_handler'}):
+            started = timezone.now()
+            jobs.run_job(jobs.claim_job(), max_attempts=100)
+        job = RatingJob.objects.get()
+        self.assertAlmostEqual((job.run_after - started).total_seconds(), jobs.RETRY_MAX_DELAY, delta=2)
+
+    def test_failed_job_is_dropped_when_newer_is_pending(self):
+        jobs.enqueue(RatingJob.KIND_TEAM, [1])
+        job = jobs.claim_job()
+        # Пока задача выполнялась, сигнал поставил новую для того же объекта
+        jobs.enqueue(RatingJob.KIND_TEAM, [1])
+        with mock.patch.dict(jobs.HANDLERS, {RatingJob.KIND_TEAM: 'ratings.tests.failing_handler'}):
+            jobs.run_job(job, max_attempts=3)
+        self.assertEqual(RatingJob.objects.get().attempts, 0)
+
+    def test_stale_running_jobs_are_requeued(self):
+        jobs.enqueue(RatingJob.KIND_TEAM, [1])
+        jobs.claim_job()
+        RatingJob.objects.update(updated_at=timezone.now() - jobs.STALE_RUNNING_AFTER - timedelta(seconds=1))
+        self.assertEqual(jobs.requeue_stale_jobs(), 1)
+        self.assertEqual(RatingJob.objects.get().status, RatingJob.STATUS_PENDING)
+
+
+class BrokerCheckTests(SimpleTestCase):
+    def setUp(self):
+        # Брокер создается один раз на процесс - сбрасываем, чтобы подхватить настройки теста
+        patcher = mock.patch.object(live, '_broker', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_local_broker_with_worker_is_refused(self):
+        with self.settings(RATINGS_LIVE_BROKER='ratings.live.LocalBroker', RATINGS_JOBS_EAGER=False):
+            self.assertIn('LocalBroker', live.check_broker())
+
+    def test_local_broker_with_eager_jobs_is_allowed(self):
+        with self.settings(RATINGS_LIVE_BROKER='ratings.live.LocalBroker', RATINGS_JOBS_EAGER=True):
+            self.assertIsNone(live.check_broker())
+
+    def test_cache_broker_needs_shared_cache(self):
+        local = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with self.settings(RATINGS_LIVE_BROKER='ratings.live.CacheBroker', RATINGS_JOBS_EAGER=False, CACHES=local):
+            self.assertIsNotNone(live.check_broker())
+
+    def test_cache_broker_uses_live_cache(self):
+        caches_setting = {
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tempfile.gettempdir()},
+            'live': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        }
+        with self.settings(RATINGS_LIVE_BROKER='ratings.live.CacheBroker', RATINGS_JOBS_EAGER=False,
+                           CACHES=caches_setting):
+            self.assertEqual(live.get_broker().cache_alias, 'live')
+            # Проверяется кеш брокера, а не default
+            self.assertIsNotNone(live.check_broker())
+
+    def test_worker_refuses_to_start(self):
+        from django.core.management import CommandError, call_command
+
+        with self.settings(RATINGS_LIVE_BROKER='ratings.live.LocalBroker', RATINGS_JOBS_EAGER=False):
+            with self.assertRaises(CommandError):
+                call_command('run_rating_worker', '--once')
+
+
+# Отдельный процесс воркера: те же настройки, но тестовая БД и кеш теста
+WORKER_SCRIPT = """
+import sys
+import django
+from django.conf import settings
+
+django.setup()
+settings.DATABASES['default']['NAME'] = sys.argv[1]
+settings.CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': f'{sys.argv[2]}/{alias}'}
+    for alias in ('default', 'live')
+}
+settings.RATINGS_LIVE_BROKER = 'ratings.live.CacheBroker'
+from django.core.management import call_command
+call_command('run_rating_worker', '--once')
+"""
+
+
+class LiveAcrossProcessesTests(TransactionTestCase):
+    """Пересчет в процессе воркера доходит до SSE-подписчика в этом процессе (CacheBroker, файловый кеш)"""
+
+    def setUp(self):
+        if getattr(connection, 'is_in_memory_db', lambda: False)():
+            self.skipTest('Тестовая БД в памяти: другой процесс ее не видит (нужен TEST NAME у SQLite)')
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        overrides = self.settings(
+            RATINGS_LIVE_BROKER='ratings.live.CacheBroker', RATINGS_JOBS_EAGER=False,
+            CACHES={
+                alias: {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': f'{self.cache_dir}/{alias}',
+                }
+                for alias in ('default', 'live')
+            },
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        patcher = mock.patch.object(live, '_broker', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_worker_recalculation_reaches_subscriber(self):
+        tournament = make_tournament(topics=1)
+        topic = tournament.tournamenttopic_set.get().topic
+        team = Team.objects.create(name='Первая', city=tournament.city)
+        result = GameResult.objects.create(tournament=tournament, team=team)
+        TopicResult.objects.create(game_result=result, topic=topic, points=Decimal('4'))
+        # Сохранения только поставили задачи: итог посчитает воркер
+        self.assertTrue(RatingJob.objects.filter(kind=RatingJob.KIND_TOURNAMENT, object_id=tournament.id).exists())
+        self.assertEqual(GameResult.objects.get().total_points, 0)
+
+        message = asyncio.run(self.run_worker_and_listen(tournament.id))
+        self.assertEqual(message['changes'], [{'team_id': team.id, 'team': 'Первая', 'total': 4.0, 'place': 1}])
+
+    async def run_worker_and_listen(self, tournament_id, timeout=60):
+        messages = live.get_broker().subscribe(live.channel_name(tournament_id), heartbeat=1)
+        try:
+            await anext(messages)
+            worker = await asyncio.create_subprocess_exec(
+                sys.executable, '-c', WORKER_SCRIPT, str(connection.settings_dict['NAME']), self.cache_dir,
+                cwd=settings.BASE_DIR, env=os.environ.copy(),
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+            )
+            _, errors = await worker.communicate()
+            self.assertEqual(worker.returncode, 0, errors.decode())
+
+            async def first_message():
+                async for message in messages:
+                    if message is not None:
+                        return message
+            return await asyncio.wait_for(first_message(), timeout)
+        finally:
+            await messages.aclose()
+
+
+class ProfilerMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.factory = RequestFactory()
+
+    def run_request(self, view, path='/', sample_rate=1.0, slow_ms=10_000):
+        """Запрос через middleware (view только передается в process_view). Возвращает (запусков сэмплера, профили)"""
+        from .profiling import SamplingProfilerMiddleware, iter_profiles
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return HttpResponse()
+
+        with self.settings(RATINGS_PROFILER_ENABLED=True, RATINGS_PROFILER_DIR=self.directory,
+                           RATINGS_PROFILER_SAMPLE_RATE=sample_rate, RATINGS_PROFILER_SLOW_MS=slow_ms):
+            middleware = SamplingProfilerMiddleware(get_response)
+            with mock.patch.object(middleware.sampler, 'start', wraps=middleware.sampler.start) as start:
+                middleware(self.factory.get(path))
+        return start.call_count, list(iter_profiles(self.directory))
+
+    @staticmethod
+    def sync_view(request):
+        return HttpResponse()
+
+    def test_unsampled_fast_request_is_not_profiled(self):
+        self.assertEqual(self.run_request(self.sync_view, sample_rate=0), (0, []))
+
+    def test_unsampled_slow_request_is_saved_without_stacks(self):
+        started, records = self.run_request(self.sync_view, sample_rate=0, slow_ms=0)
+        self.assertEqual(started, 0)
+        self.assertEqual([(record['reason'], record['samples']) for record in records], [('slow', {})])
+
+    def test_sampled_sync_view(self):
+        started, records = self.run_request(self.sync_view)
+        self.assertEqual(started, 1)
+        self.assertEqual([record['reason'] for record in records], ['sampled'])
+
+    def test_async_view_is_not_profiled(self):
+        async def view(request):
+            return HttpResponse()
+        self.assertEqual(self.run_request(view, slow_ms=0), (0, []))
+
+    def test_skipped_paths(self):
+        self.assertEqual(self.run_request(self.sync_view, path='/static/app.js', slow_ms=0), (0, []))
+
+    def test_sampler_sleeps_without_active_profiles(self):
+        from .profiling import Sampler
+
+        sampler = Sampler(0.001)
+        profile = mock.Mock(thread_id=threading.get_ident())
+        real_sleep = time.sleep
+        wakeups = []
+
+        def sleep(seconds):
+            if threading.current_thread() is sampler.thread:
+                wakeups.append(seconds)
+            real_sleep(seconds)
+
+        def wait_for_sample():
+            deadline = time.monotonic() + 5
+            while not profile.add_sample.called and time.monotonic() < deadline:
+                real_sleep(0.001)
+            self.assertTrue(profile.add_sample.called)
+
+        with mock.patch('ratings.profiling.time.sleep', side_effect=sleep):
+            sampler.start(profile)
+            wait_for_sample()
+            sampler.stop(profile)
+            real_sleep(0.02)
+            # Поток ждет start(): за паузу ни одного пробуждения
+            idle = len(wakeups)
+            real_sleep(0.05)
+            self.assertEqual(len(wakeups), idle)
+
+            profile.add_sample.reset_mock()
+            sampler.start(profile)
+            wait_for_sample()
+            sampler.stop(profile)
+
+
+class RankingsTestCase(TestCase):
+    """Случайные команды и игры в двух городах; места пересчитываются задачами очереди"""
+
+    def setUp(self):
+        self.rng = random.Random(41)
+        self.cities = [City.objects.create(name='Грозный'), City.objects.create(name='Москва')]
+        self.series = [TournamentSeries.objects.create(name='Лига'), TournamentSeries.objects.create(name='Кубок')]
+        self.teams = [
+            Team.objects.create(name=f'Команда {number}', city=self.cities[number % 2]) for number in range(12)
+        ]
+        self.tournaments = [
+            make_tournament(f'Игра {number}', series=self.series[number % 2], city=self.cities[0],
+                            day=date(2025, 1, number))
+            for number in range(1, 5)
+        ]
+        for tournament in self.tournaments:
+            for team in self.rng.sample(self.teams, 8):
+                self.add_random_result(tournament, team)
+        drain_jobs(self)
+
+    def random_points(self):
+        # Шаг 0.5 и мало вариантов: много равных очков, места делятся
+        return [self.rng.randrange(0, 6) / 2 for _ in range(2)]
+
+    def add_random_result(self, tournament, team):
+        return add_result(tournament, team, self.random_points(), black_box=self.rng.choice([0, 0, 1]))
+
+    def assertRanksConsistent(self):
+        self.assertEqual(rankings.find_divergences(), [])
+
+    def random_edit(self):
+        """Одна случайная правка через модели (сигналы ставят задачи, как админка)"""
+        action = self.rng.random()
+        teams = list(Team.objects.all())
+        if action < 0.3:
+            topic_result = self.rng.choice(list(TopicResult.objects.all()))
+            topic_result.points = Decimal(self.rng.randrange(0, 6)) / 2
+            topic_result.save()
+        elif action < 0.42:
+            tournament = self.rng.choice(self.tournaments)
+            playing = set(GameResult.objects.filter(tournament=tournament).values_list('team_id', flat=True))
+            free = [team for team in teams if team.id not in playing]
+            if free:
+                self.add_random_result(tournament, self.rng.choice(free))
+        elif action < 0.52:
+            self.rng.choice(list(GameResult.objects.all())).delete()
+        elif action < 0.6:
+            team = self.rng.choice(teams)
+            team.city = self.rng.choice(self.cities)
+            team.save()
+        elif action < 0.67:
+            team = Team.objects.create(name=f'Новая {len(teams)} {self.rng.random()}', city=self.rng.choice(self.cities))
+            self.add_random_result(self.rng.choice(self.tournaments), team)
+        elif action < 0.72:
+            if len(teams) > 4:
+                self.rng.choice(teams).delete()
+        elif action < 0.82:
+            # Новая игра позже всех: рекорды делают один шаг от сохраненного состояния
+            day = max(tournament.date for tournament in self.tournaments) + timedelta(days=1)
+            tournament = make_tournament(f'Игра {day}', series=self.rng.choice(self.series), city=self.cities[0], day=day)
+            self.tournaments.append(tournament)
+            for team in self.rng.sample(teams, min(5, len(teams))):
+                self.add_random_result(tournament, team)
+        elif action < 0.9:
+            # Перенос даты или серии меняет порядок игр команд и итоги серий
+            tournament = self.rng.choice(self.tournaments)
+            if self.rng.random() < 0.5:
+                tournament.date = date(2025, 1, self.rng.randint(1, 20))
+            else:
+                tournament.series = self.rng.choice(self.series)
+            tournament.save()
+        elif len(self.tournaments) > 2:
+            tournament = self.rng.choice(self.tournaments)
+            self.tournaments.remove(tournament)
+            tournament.delete()
+
+
+class RankingsTests(RankingsTestCase):
+    def test_queue_builds_ranks_like_rebuild(self):
+        self.assertEqual(TeamStats.objects.count(), len(self.teams))
+        self.assertRanksConsistent()
+
+    def test_incremental_moves_match_full_rebuild(self):
+        for step in range(40):
+            self.random_edit()
+            drain_jobs(self)
+            with self.subTest(step=step):
+                self.assertRanksConsistent()
+
+    def test_city_ranks_and_positions(self):
+        for city in self.cities:
+            rows = list(TeamStats.objects.filter(city_id=city.id).order_by('points_position'))
+            self.assertEqual([row.points_position for row in rows], list(range(1, len(rows) + 1)))
+            # Место - с дележом: равные очки - одно место, следующее место - номер строки
+            for previous, row in zip(rows, rows[1:]):
+                if row.total_points_sum == previous.total_points_sum:
+                    self.assertEqual(row.points_rank, previous.points_rank)
+                else:
+                    self.assertEqual(row.points_rank, row.points_position)
+
+    def test_team_rank_page(self):
+        row = TeamStats.objects.filter(city_id=self.cities[0].id).order_by('-points_position').first()
+        rank = rankings.team_rank(row.team_id, 'points', per_page=2)
+        self.assertEqual((rank['position'], rank['page']), (row.points_position, (row.points_position - 1) // 2 + 1))
+        self.assertIsNone(rankings.team_rank(0))
+
+
+class RecordsTests(RankingsTestCase):
+    def test_incremental_records_match_full_rebuild(self):
+        self.assertEqual(records.find_divergences(), [])
+        for step in range(60):
+            self.random_edit()
+            drain_jobs(self)
+            with self.subTest(step=step):
+                self.assertEqual(records.find_divergences(), [])
+
+    def test_new_game_is_one_step_without_replay(self):
+        team = self.teams[0]
+        before = TeamRecord.objects.get(team=team)
+        day = max(tournament.date for tournament in self.tournaments) + timedelta(days=1)
+        tournament = make_tournament('Последняя', city=self.cities[0], day=day)
+        add_result(tournament, team, [5, 5], black_box=1)
+        with mock.patch.object(records, '_replayed', wraps=records._replayed) as replayed:
+            drain_jobs(self)
+        replayed.assert_not_called()
+        row = TeamRecord.objects.get(team=team)
+        self.assertEqual((row.games_count, row.last_tournament_id), (before.games_count + 1, tournament.id))
+        self.assertEqual(records.find_divergences(), [])
+
+        # Ввод очков по ходу вечера: тот же турнир - шаг заново от base, тоже без переигровки
+        result_topic = TopicResult.objects.filter(game_result__tournament=tournament).first()
+        result_topic.points = Decimal('1')
+        result_topic.save()
+        with mock.patch.object(records, '_replayed', wraps=records._replayed) as replayed:
+            drain_jobs(self)
+        replayed.assert_not_called()
+        self.assertEqual(records.find_divergences(), [])
+
+        # Правка более ранней игры - переигровка истории команд этой игры
+        earliest = min(self.tournaments, key=lambda item: (item.date, item.id))
+        result = GameResult.objects.filter(tournament=earliest).first()
+        topic_result = result.topicresult_set.first()
+        topic_result.points = Decimal('2.5') if topic_result.points != Decimal('2.5') else Decimal('0')
+        topic_result.save()
+        with mock.patch.object(records, '_replayed', wraps=records._replayed) as replayed:
+            drain_jobs(self)
+        self.assertIn(result.team_id, {call.args[0] for call in replayed.call_args_list})
+        self.assertEqual(records.find_divergences(), [])
+
+
+class TopicLeadersTests(RankingsTestCase):
+    def test_incremental_leaders_match_full_rebuild(self):
+        # Короткие списки: команды часто выпадают с края полного списка, и он перечитывается
+        with self.settings(RATINGS_TOPIC_TOP_K=3, RATINGS_TOPIC_MIN_GAMES=2), \
+                mock.patch.object(topic_leaders, '_leading_entries', wraps=topic_leaders._leading_entries) as reload:
+            topic_leaders.rebuild_all()
+            for step in range(60):
+                self.random_edit()
+                drain_jobs(self)
+                with self.subTest(step=step):
+                    self.assertEqual(topic_leaders.find_divergences(), [])
+        # Ветка "список полон, команда ушла с края" действительно срабатывала
+        self.assertTrue(reload.called)
+
+class DifficultyTests(RankingsTestCase):
+    def stored_rows(self):
+        return {
+            (row.scope, row.object_id, row.topic_id, row.series_id, row.games_count, round(row.points_sum, 6),
+             round(row.points_sq_sum, 6), tuple(sorted(row.histogram.items())))
+            for row in TopicDifficulty.objects.all()
+        }
+
+    def assertDifficultyMatchesRebuild(self):
+        stored = self.stored_rows()
+        difficulty.rebuild_all()
+        self.assertEqual(stored, self.stored_rows())
+
+    def test_incremental_totals_match_rebuild(self):
+        for step in range(40):
+            self.random_edit()
+            drain_jobs(self)
+            with self.subTest(step=step):
+                self.assertDifficultyMatchesRebuild()
+
+    def test_series_move_and_deletion(self):
+        tournament = self.tournaments[0]
+        tournament.series = self.series[1] if tournament.series_id == self.series[0].id else self.series[0]
+        tournament.save()
+        drain_jobs(self)
+        self.assertDifficultyMatchesRebuild()
+
+        tournament.delete()
+        drain_jobs(self)
+        self.assertFalse(TopicDifficulty.objects.filter(
+            scope=TopicDifficulty.SCOPE_TOURNAMENT, object_id=tournament.id,
+        ).exists())
+        self.assertDifficultyMatchesRebuild()
+
+
+class BeltsTests(TestCase):
+    """События поясов пишутся по разнице очков; уровни: Белый 0 - до 10 очков, Белый 1 - до 20, ..."""
+
+    def setUp(self):
+        self.city = City.objects.create(name='Грозный')
+        self.first = Team.objects.create(name='Первая', city=self.city)
+        self.second = Team.objects.create(name='Вторая', city=self.city)
+        self.january = make_tournament('Январь', city=self.city, day=date(2025, 1, 10))
+        self.february = make_tournament('Февраль', city=self.city, day=date(2025, 2, 10))
+
+    def stored(self):
+        return [
+            (event.team_id, event.tournament_id, event.from_level, event.to_level, event.total_points)
+            for event in BeltPromotion.objects.order_by('created_at', 'id')
+        ]
+
+    def expected(self):
+        return [
+            (event.team_id, event.tournament_id, event.from_level, event.to_level, event.total_points)
+            for event in belts.expected_history()
+        ]
+
+    def final_levels(self, events):
+        return {team_id: to_level for team_id, _, _, to_level, _ in events}
+
+    def assertLevelsMatchHistory(self):
+        """Понижения после правок в истории по играм не видны, но последний уровень команды тот же"""
+        stored, expected = self.final_levels(self.stored()), self.final_levels(self.expected())
+        for team in (self.first, self.second):
+            level = belts.level_of(GameResult.objects.filter(team=team).aggregate(total=Sum('total_points'))['total'])
+            self.assertEqual(stored.get(team.id, 0), level)
+            self.assertEqual(expected.get(team.id, 0), level)
+
+    def test_events_follow_point_changes(self):
+        add_result(self.january, self.first, [4, 4])
+        add_result(self.january, self.second, [5, 5])
+        drain_jobs(self)
+        add_result(self.february, self.first, [3, 3])
+        second_result = add_result(self.february, self.second, [5, 5])
+        drain_jobs(self)
+        # Игры введены по порядку дат: события те же, что при восстановлении по истории
+        self.assertEqual(sorted(self.stored()), sorted(self.expected()))
+        self.assertEqual(sorted(self.stored()), [
+            (self.first.id, self.february.id, 0, 1, 14.0),
+            (self.second.id, self.january.id, 0, 1, 10.0),
+            (self.second.id, self.february.id, 1, 2, 20.0),
+        ])
+
+        # Правка очков: 20 -> 15, понижение с тем же турниром
+        topic_result = second_result.topicresult_set.order_by('topic__full_name').first()
+        topic_result.points = Decimal('0')
+        topic_result.save()
+        drain_jobs(self)
+        self.assertEqual(self.stored()[-1], (self.second.id, self.february.id, 2, 1, 15.0))
+        self.assertLevelsMatchHistory()
+
+        # Удаление результата: у первой 14 -> 8
+        GameResult.objects.get(tournament=self.february, team=self.first).delete()
+        drain_jobs(self)
+        self.assertEqual(self.stored()[-1], (self.first.id, self.february.id, 1, 0, 8.0))
+        self.assertLevelsMatchHistory()
+
+        # Удаление турнира: у второй 15 -> 5, у первой 8 -> 0 без смены уровня
+        january_id = self.january.id
+        self.january.delete()
+        drain_jobs(self)
+        self.assertEqual(self.stored()[-1], (self.second.id, january_id, 1, 0, 5.0))
+        self.assertEqual(len(self.stored()), 6)
+        self.assertLevelsMatchHistory()
+
+
+class StaticSiteVersionTests(RankingsTestCase):
+    def test_stored_rows_of_team_change_its_card_version(self):
+        from .management.commands.build_static_site import compute_versions
+
+        before = compute_versions()['teams']
+        # Место команды сдвинули чужие игры: ее собственные результаты те же
+        row = TeamStats.objects.order_by('team_id').first()
+        TeamStats.objects.filter(team_id=row.team_id).update(global_points_rank=row.global_points_rank + 1)
+        after = compute_versions()['teams']
+        self.assertEqual({key for key in after if after[key] != before[key]}, {str(row.team_id)})
+
+
+class GlobalRankingsTests(RankingsTestCase):
+    def test_global_positions_cover_all_teams(self):
+        rows = list(TeamStats.objects.order_by('global_points_position'))
+        self.assertEqual([row.global_points_position for row in rows], list(range(1, len(rows) + 1)))
+        values = [row.total_points_sum for row in rows]
+        self.assertEqual(values, sorted(values, reverse=True))
+
+    def test_all_cities_page_is_position_range(self):
+        table = rankings.RankedTeams('wins')
+        self.assertEqual(len(table), Team.objects.count())
+        page = table[2:5]
+        self.assertEqual(
+            [team.id for team in page],
+            list(TeamStats.objects.order_by('global_wins_position').values_list('team_id', flat=True)[2:5]),
+        )
+        for team in page:
+            self.assertEqual(team.city_rank, TeamStats.objects.get(team_id=team.id).wins_rank)
+
+    def test_city_strength_follows_edits(self):
+        for top in (2, 0):
+            with self.settings(RATINGS_CITY_TOP_TEAMS=top), self.subTest(top=top):
+                rankings.rebuild_all()
+                for _ in range(15):
+                    self.random_edit()
+                    drain_jobs(self)
+                self.assertRanksConsistent()
+        self.assertEqual(set(CityStats.objects.values_list('top_points_avg', flat=True)), {0.0})
+
+
+class SeasonsTests(RankingsTestCase):
+    """Закрытый сезон: после правок его турниров задача сезона собирает сводки заново, карточка команды та же"""
+
+    def setUp(self):
+        super().setUp()
+        # Первые три игры в сезоне, четвертая и новые - после него; перенос даты двигает игры в сезон и из него
+        self.season = Season.objects.create(name='Начало', start_date=date(2025, 1, 1), end_date=date(2025, 1, 3))
+        seasons.close(self.season)
+
+    def card(self, team):
+        """Что карточка берет из сводок: участия и места по сериям, средние и игры по темам"""
+        series = sorted(
+            (row['tournament__series__name'], row['participations'], row['wins'], row['second_places'], row['third_places'])
+            for row in team.get_series_stats()
+        )
+        topics = team.get_topic_statistics()
+        return series, {topic_id: round(average, 6) for topic_id, average in topics['averages'].items()}, topics['counts']
+
+    def cards(self):
+        return {team.id: self.card(team) for team in Team.objects.order_by('id')}
+
+    def raw_cards(self):
+        """Карточки по сырым играм: сезон открывается и закрывается обратно откатом"""
+        with transaction.atomic():
+            seasons.reopen(Season.objects.get(id=self.season.id))
+            cards = self.cards()
+            transaction.set_rollback(True)
+        return cards
+
+    def test_closed_season_card_matches_raw_results(self):
+        self.assertTrue(Season.objects.get(id=self.season.id).tournaments)
+        self.assertEqual(seasons.find_divergences(), [])
+        self.assertEqual(self.cards(), self.raw_cards())
+
+    def test_edits_and_moves_refreeze_season(self):
+        inside = self.tournaments[0]
+        topic_result = TopicResult.objects.filter(game_result__tournament=inside).order_by('id').first()
+        topic_result.points = topic_result.points + 1
+        topic_result.save()
+        drain_jobs(self)
+        self.assertEqual(seasons.find_divergences(), [])
+
+        # Перенос из сезона и в сезон
+        inside.date = date(2025, 1, 10)
+        inside.save()
+        outside = self.tournaments[3]
+        outside.date = date(2025, 1, 2)
+        outside.series = self.series[0]
+        outside.save()
+        drain_jobs(self)
+        self.assertEqual(seasons.find_divergences(), [])
+        self.assertEqual(Season.objects.get(id=self.season.id).tournaments.keys(), {
+            str(tournament.id) for tournament in self.tournaments[1:]
+        })
+        self.assertEqual(self.cards(), self.raw_cards())
+
+    def test_random_edits_keep_summaries(self):
+        for step in range(40):
+            self.random_edit()
+            drain_jobs(self)
+            with self.subTest(step=step):
+                self.assertEqual(seasons.find_divergences(), [])
+                self.assertEqual(self.cards(), self.raw_cards())
+
+
+class ChangelogTests(TestCase):
+    """Позиция потребителя, пачки, пропуски номеров и очистка журнала"""
+
+    def setUp(self):
+        self.city = City.objects.create(name='Грозный')
+        ChangeLogEntry.objects.all().delete()
+
+    def add(self, count, tournament_id=None):
+        changelog.record_many(Tournament, [
+            (number, ChangeLogEntry.ACTION_UPDATE, tournament_id) for number in range(count)
+        ])
+        return list(ChangeLogEntry.objects.order_by('-seq').values_list('seq', flat=True)[:count])[::-1]
+
+    def seqs(self, entries):
+        return [entry.seq for entry in entries]
+
+    def test_new_consumer_starts_from_head(self):
+        self.add(3)
+        changelog.register('new')
+        self.assertEqual(changelog.read('new'), [])
+        later = self.add(2)
+        self.assertEqual(self.seqs(changelog.read('new')), later)
+
+        everything = changelog.register('from_start', from_head=False)
+        self.assertEqual(everything.last_seq, 0)
+        self.assertEqual(len(changelog.read('from_start')), 5)
+
+    def test_ack_moves_position_forward_only(self):
+        seqs = self.add(5)
+        changelog.register('audit', from_head=False)
+        self.assertEqual(self.seqs(changelog.read('audit', limit=2)), seqs[:2])
+        # Без ack чтение начинается с того же места
+        self.assertEqual(self.seqs(changelog.read('audit', limit=2)), seqs[:2])
+        changelog.ack('audit', seqs[1])
+        self.assertEqual(self.seqs(changelog.read('audit')), seqs[2:])
+        changelog.ack('audit', seqs[0])
+        self.assertEqual(ChangeConsumer.objects.get(name='audit').last_seq, seqs[1])
+
+    def test_batches_stop_without_ack(self):
+        seqs = self.add(5, tournament_id=7)
+        changelog.register('audit', from_head=False)
+        read = []
+        for batch in changelog.batches('audit', limit=2):
+            read.append(self.seqs(batch))
+            self.assertEqual(changelog.changed_tournaments(batch), {7})
+            changelog.ack('audit', batch[-1].seq)
+        self.assertEqual(read, [seqs[:2], seqs[2:4], seqs[4:]])
+        self.assertEqual(changelog.read('audit'), [])
+
+        more = self.add(3)
+        self.assertEqual([self.seqs(batch) for batch in changelog.batches('audit', limit=2)], [more[:2]])
+
+    def test_read_waits_on_fresh_gap(self):
+        seqs = self.add(4)
+        changelog.register('audit', from_head=False)
+        # Номер выдан, но запись не видна: транзакция еще идет или откатилась
+        ChangeLogEntry.objects.filter(seq=seqs[1]).delete()
+        self.assertEqual(self.seqs(changelog.read('audit')), seqs[:1])
+        changelog.ack('audit', seqs[0])
+        self.assertEqual(changelog.read('audit'), [])
+
+        # Пропуск старше RATINGS_CHANGELOG_GAP_SECONDS - откат, читаем дальше
+        with self.settings(RATINGS_CHANGELOG_GAP_SECONDS=0):
+            self.assertEqual(self.seqs(changelog.read('audit')), seqs[2:])
+        ChangeLogEntry.objects.filter(seq__in=seqs[2:]).update(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(self.seqs(changelog.read('audit')), seqs[2:])
+
+    def test_prune_keeps_unread_and_last_entry(self):
+        seqs = self.add(6)
+        ChangeLogEntry.objects.update(created_at=timezone.now() - timedelta(days=40))
+        changelog.register('slow', from_head=False)
+        changelog.ack('slow', seqs[2])
+        changelog.register('fast', from_head=False)
+        changelog.ack('fast', seqs[-1])
+
+        # Медленный потребитель прочитал три записи: удаляются только они
+        self.assertEqual(changelog.prune(retention_days=30), 3)
+        self.assertEqual(self.seqs(changelog.read('slow')), seqs[3:])
+        # Свежие записи не удаляются, даже если их все прочитали
+        self.assertEqual(changelog.prune(retention_days=60), 0)
+
+        changelog.ack('slow', seqs[-1])
+        self.assertEqual(changelog.prune(retention_days=30), 2)
+        self.assertEqual(list(ChangeLogEntry.objects.values_list('seq', flat=True)), seqs[-1:])
+        self.assertEqual(changelog.head(), seqs[-1])
+
+    def test_signals_record_changes_in_the_same_transaction(self):
+        changelog.register('audit')
+        tournament = make_tournament('Игра', city=self.city, day=date(2025, 1, 1))
+        try:
+            with transaction.atomic():
+                tournament.name = 'Откат'
+                tournament.save()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        entries = changelog.read('audit')
+        self.assertTrue(entries)
+        self.assertEqual(changelog.changed_tournaments(entries), {tournament.id})
+        self.assertNotIn(ChangeLogEntry.ACTION_UPDATE, {entry.action for entry in entries if entry.model == 'tournament'})
+
+
+def old_points_before_black_box(result):
+    """Очки до черного ящика, как считались до topic_scores - JOIN с темами турнира"""
+    return result.topicresult_set.filter(
+        topic__tournamenttopic__tournament=result.tournament,
+    ).aggregate(total=Coalesce(Sum('points'), Decimal('0.0')))['total']
+
+
+def old_first_three_topics_points(result):
+    topic_results = result.topicresult_set.filter(
+        topic__tournamenttopic__tournament=result.tournament,
+    ).order_by('topic__tournamenttopic__order')[:3]
+    return sum((topic_result.points or Decimal('0.0')) for topic_result in topic_results)
+
+
+def old_game_modal(request, game_id):
+    """game_modal до topic_scores: очки тем из TopicResult по порядку тем турнира"""
+    tournament = Tournament.objects.get(id=game_id)
+    topics = tournament.topics.all().order_by('tournamenttopic__order')
+    results = GameResult.objects.filter(tournament=tournament).select_related('team')\
+        .prefetch_related('topicresult_set__topic').order_by('place')
+    for result in results:
+        result.topic_points = ['-'] * topics.count()
+        for topic_result in result.topicresult_set.all():
+            for index, topic in enumerate(topics):
+                if topic_result.topic_id == topic.id:
+                    result.topic_points[index] = topic_result.points
+                    break
+    context = {'game': tournament, 'results': results, 'topics': topics}
+    with mock.patch.object(GameResult, 'points_before_black_box', old_points_before_black_box), \
+            mock.patch.object(GameResult, 'first_three_topics_points', property(old_first_three_topics_points)):
+        return render(request, 'ratings/includes/modals/game_modal.html', context)
+
+
+class TopicScoresTests(TestCase):
+    """GameResult.topic_scores - копия TopicResult; после правок тем турнира задача турнира пересобирает ее"""
+
+    def setUp(self):
+        self.city = City.objects.create(name='Грозный')
+        self.tournament = make_tournament('Игра', city=self.city, topics=5)
+        self.topics = [item.topic for item in self.tournament.tournamenttopic_set.order_by('order')]
+        self.teams = [Team.objects.create(name=f'Команда {number}', city=self.city) for number in range(4)]
+        for number, team in enumerate(self.teams):
+            add_result(self.tournament, team, [number, 2.5, 1, 0.5, 3], black_box=number % 2)
+        # Тема без ответа: в карточке прочерк, в векторе None
+        TopicResult.objects.filter(game_result__team=self.teams[0], topic=self.topics[1]).delete()
+        drain_jobs(self)
+
+    def expected_scores(self, result):
+        points = {
+            topic_id: float(value)
+            for topic_id, value in TopicResult.objects.filter(game_result=result).values_list('topic_id', 'points')
+        }
+        return [
+            [topic_id, points.get(topic_id)]
+            for topic_id in self.tournament.tournamenttopic_set.order_by('order', 'id').values_list('topic_id', flat=True)
+        ]
+
+    def assertScoresMatchTopicResults(self):
+        results = list(GameResult.objects.filter(tournament=self.tournament).order_by('id'))
+        packed = pack_topic_scores(results)
+        for result in results:
+            with self.subTest(team=result.team_id):
+                self.assertEqual(result.topic_scores, self.expected_scores(result))
+                self.assertEqual(packed[result.id], result.topic_scores)
+                self.assertEqual(result.points_before_black_box(), old_points_before_black_box(result))
+                self.assertEqual(result.first_three_topics_points, old_first_three_topics_points(result))
+        request = RequestFactory().get('/')
+        self.assertEqual(
+            game_modal(request, self.tournament.id).content.decode(),
+            old_game_modal(request, self.tournament.id).content.decode(),
+        )
+
+    def test_topic_changes_rebuild_scores(self):
+        self.assertScoresMatchTopicResults()
+
+        # Темы переставили: первая стала последней
+        items = list(self.tournament.tournamenttopic_set.order_by('order'))
+        items[0].order = len(items) + 1
+        items[0].save()
+        drain_jobs(self)
+        self.assertEqual(GameResult.objects.filter(tournament=self.tournament).first().topic_scores[-1][0], self.topics[0].id)
+        self.assertScoresMatchTopicResults()
+
+        # Тему убрали из турнира: ее TopicResult остаются, но в очки турнира не входят
+        TournamentTopic.objects.filter(tournament=self.tournament, topic=self.topics[2]).delete()
+        drain_jobs(self)
+        self.assertScoresMatchTopicResults()
+
+        # Тему удалили из справочника вместе с результатами по ней
+        self.topics[3].delete()
+        drain_jobs(self)
+        self.assertEqual(len(GameResult.objects.filter(tournament=self.tournament).first().topic_scores), 3)
+        self.assertScoresMatchTopicResults()
+
+
+class StandingsTests(TestCase):
+    """Зачет серии собирается задачами очереди после правок через модели"""
+
+    def setUp(self):
+        self.season = Season.objects.create(name='2025', start_date=date(2025, 1, 1), end_date=date(2025, 12, 31))
+        self.city = City.objects.create(name='Грозный')
+        self.a, self.b, self.c = [Team.objects.create(name=name, city=self.city) for name in ('А', 'Б', 'В')]
+
+    def play(self, series, day, points_by_team):
+        """Турнир серии: points_by_team - {команда: сумма очков}, очки делятся на две темы поровну"""
+        tournament = make_tournament(f'{series.name} {day}', series=series, city=self.city, day=day)
+        for team, points in points_by_team.items():
+            add_result(tournament, team, [points / 2, points / 2])
+        return tournament
+
+    def table(self, series):
+        return [
+            (row.team_id, row.points) for row in standings.season_table(self.season.id, series.id)
+        ]
+
+    def test_best_of_counts_best_games_only(self):
+        series = TournamentSeries.objects.create(name='Лига', best_of=2)
+        first = self.play(series, date(2025, 2, 1), {self.a: 10, self.b: 8, self.c: 6})
+        second = self.play(series, date(2025, 3, 1), {self.b: 10, self.c: 8, self.a: 6})
+        third = self.play(series, date(2025, 4, 1), {self.b: 10, self.a: 8, self.c: 6})
+        drain_jobs(self)
+
+        # А: 25 + 16 + 20, в зачет 1-я и 3-я игры; В: 16 + 20 + 16, из равных игр берется более ранняя
+        self.assertEqual(self.table(series), [(self.b.id, 50.0), (self.a.id, 45.0), (self.c.id, 36.0)])
+        row = SeriesStanding.objects.get(series=series, team=self.a)
+        self.assertEqual(row.results, [[first.id, 1, 25, True], [second.id, 3, 16, False], [third.id, 2, 20, True]])
+        self.assertEqual((row.games_count, row.counted_count, row.wins, row.best_place), (3, 2, 1, 1))
+        self.assertEqual(
+            SeriesStanding.objects.get(series=series, team=self.c).results,
+            [[first.id, 3, 16, True], [second.id, 2, 20, True], [third.id, 3, 16, False]],
+        )
+
+        series.best_of = None
+        series.save()
+        drain_jobs(self)
+        self.assertEqual(self.table(series), [(self.b.id, 70.0), (self.a.id, 61.0), (self.c.id, 52.0)])
+        self.assertEqual(standings.find_divergences(), [])
+
+    def test_cup_orders_by_stage_reached_first(self):
+        with self.settings(RATINGS_STANDINGS_POINTS=[10, 1]):
+            self.check_cup()
+
+    def check_cup(self):
+        self.assertEqual([standings.place_points(place) for place in (1, 2, 3)], [10, 1, 0])
+        series = TournamentSeries.objects.create(name='Кубок', tournament_type='cup')
+        opening = self.play(series, date(2025, 2, 1), {self.a: 10, self.b: 8, self.c: 6})
+        final = self.play(series, date(2025, 3, 1), {self.c: 10, self.b: 8})
+        drain_jobs(self)
+
+        # А набрал больше Б, но Б дошел до второго этапа
+        self.assertEqual(self.table(series), [(self.c.id, 10.0), (self.b.id, 2.0), (self.a.id, 10.0)])
+        self.assertEqual(
+            [row.progression for row in standings.season_table(self.season.id, series.id)], [2, 2, 1],
+        )
+
+        # Перенос даты меняет порядок этапов: игра на двоих - первый этап, до второго дошли все,
+        # и при равных очках зачета выше В, набравшая больше очков в играх
+        final.date = date(2025, 1, 15)
+        final.save()
+        drain_jobs(self)
+        self.assertEqual(self.table(series), [(self.c.id, 10.0), (self.a.id, 10.0), (self.b.id, 2.0)])
+        self.assertEqual(standings.find_divergences(), [])
+
+        # Турнир вне дат сезона выпадает из зачета
+        opening.date = date(2024, 12, 1)
+        opening.save()
+        drain_jobs(self)
+        self.assertEqual(self.table(series), [(self.c.id, 10.0), (self.b.id, 1.0)])
+        self.assertEqual(standings.find_divergences(), [])
+
+
+class SeedLoadDataTests(TestCase):
+    SMALL = {'cities': 1, 'teams': 6, 'tournaments': 2, 'teams_per_game': 4, 'topics': 3, 'topics_per_game': 2}
+
+    def test_refuses_known_password_on_production_database(self):
+        with mock.patch('ratings.management.commands.seed_load_data.connection') as db, \
+                self.settings(DEBUG=False):
+            db.vendor = 'postgresql'
+            with self.assertRaisesMessage(CommandError, '--admin-password'):
+                call_command('seed_load_data', stdout=StringIO(), **self.SMALL)
+        self.assertFalse(Team.objects.exists())
+        self.assertFalse(get_user_model().objects.exists())
+
+    def test_explicit_password_outside_debug(self):
+        with mock.patch('ratings.management.commands.seed_load_data.connection') as db, \
+                self.settings(DEBUG=False):
+            db.vendor = 'postgresql'
+            call_command('seed_load_data', admin_password='s3cret', stdout=StringIO(), **self.SMALL)
+        user = get_user_model().objects.get(username='loadtest')
+        self.assertTrue(user.is_superuser)
+        self.assertTrue(user.check_password('s3cret'))
+
+    def test_default_password_does_not_reset_existing_user(self):
+        user = get_user_model().objects.create_user('loadtest', password='s3cret')
+        call_command('seed_load_data', stdout=StringIO(), **self.SMALL)
+        user.refresh_from_db()
+        self.assertTrue(user.check_password('s3cret'))
+
+
+class PublicPagesTests(TestCase):
+    """Страницы открываются с настройками по умолчанию (тесты идут с DEBUG = False, без collectstatic)"""
+
+    def setUp(self):
+        self.tournament = make_tournament()
+        self.team = Team.objects.create(name='Первая', city=self.tournament.city)
+        add_result(self.tournament, self.team, [3, 2])
+        drain_jobs(self)
+
+    def test_pages_render(self):
+        for url in [
+            '/', '/?format=json', f'/teams/compare/?teams={self.team.id}', '/topics/', '/promotions/',
+            '/records/', '/standings/', f'/team/{self.team.id}/modal/', f'/game/{self.tournament.id}/modal/',
+        ]:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class TeamModalTests(TestCase):
+    """Карточка команды под фильтрами таблицы"""
+
+    def setUp(self):
+        self.grozny = City.objects.create(name='Грозный')
+        self.moscow = City.objects.create(name='Москва')
+        self.guest = Team.objects.create(name='Гости', city=self.moscow)
+        reference.bump_version()
+        self.tournament = make_tournament(city=self.grozny)
+        add_result(self.tournament, self.guest, [3, 2])
+        drain_jobs(self)
+
+    def card(self, **params):
+        response = self.client.get(f'/team/{self.guest.id}/modal/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['team']
+
+    def test_team_outside_table_filters_gets_empty_card(self):
+        # Раньше team.first() по отфильтрованному queryset давал None и карточка падала с 500
+        other_series = TournamentSeries.objects.create(name='Кубок')
+        reference.bump_version()
+        team = self.card(game_series=other_series.name)
+        self.assertEqual((team.id, team.games_played_count, team.total_points_sum), (self.guest.id, 0, 0.0))
+
+    def test_card_ignores_table_city(self):
+        # Карточку открывают и из подсказок поиска: команда из другого города показывает свои игры
+        for params in ({}, {'city': 'Грозный'}, {'city': 'Москва'}, {'city': ALL_CITIES}):
+            with self.subTest(params=params):
+                team = self.card(**params)
+                self.assertEqual((team.games_played_count, team.total_points_sum), (1, 5.0))
+
+    def test_unknown_team_is_404(self):
+        self.assertEqual(self.client.get('/team/0/modal/').status_code, 404)
+
+
+class TableJsonTests(TestCase):
+    """?format=json для app.js: t - вкладка, p/n - страница и всего страниц, o - номер первой строки, r - строки"""
+
+    def setUp(self):
+        self.grozny = City.objects.create(name='Грозный')
+        self.moscow = City.objects.create(name='Москва')
+        self.first = Team.objects.create(name='Первая', city=self.grozny)
+        self.second = Team.objects.create(name='Вторая', city=self.grozny)
+        self.guest = Team.objects.create(name='Гости', city=self.moscow)
+        # Справочники в памяти процесса: в TestCase on_commit не срабатывает, версию меняем сами
+        reference.bump_version()
+        self.tournament = make_tournament(city=self.grozny)
+        add_result(self.tournament, self.first, [3, 2])
+        add_result(self.tournament, self.second, [1, 1])
+        add_result(self.tournament, self.guest, [2, 2])
+        drain_jobs(self)
+
+    def get_json(self, **params):
+        response = self.client.get('/', {'format': 'json', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def assertPage(self, data, tab):
+        self.assertEqual((data['t'], data['p'], data['n'], data['o']), (tab, 1, 1, 1))
+
+    def test_city_teams(self):
+        for params in [{}, {'game_series': self.tournament.series.name}]:
+            with self.subTest(params=params):
+                data = self.get_json(**params)
+                self.assertPage(data, 'teams')
+                self.assertEqual([(row['i'], row['m']) for row in data['r']], [(self.first.id, 1), (self.second.id, 2)])
+                row = data['r'][0]
+                self.assertEqual(set(row), {'i', 'n', 'b', 's', 'p', 'g', 'w', 'a', 'm'})
+                self.assertEqual((row['n'], row['p'], row['g'], row['w'], row['a']), ('Первая', 5.0, 1, 1, 5.0))
+                self.assertNotIn('cs', data)
+
+    def test_all_cities_teams(self):
+        data = self.get_json(city='all')
+        self.assertPage(data, 'teams')
+        self.assertEqual(
+            [(row['i'], row['m'], row['c'], row['l']) for row in data['r']],
+            [(self.first.id, 1, 'Грозный', 1), (self.guest.id, 2, 'Москва', 1), (self.second.id, 3, 'Грозный', 2)],
+        )
+        self.assertEqual({city['n'] for city in data['cs']}, {'Грозный', 'Москва'})
+        self.assertEqual(set(data['cs'][0]), {'n', 'r', 's', 'k', 'a', 'p'})
+
+    def test_same_named_cities(self):
+        # Название города не уникально: фильтр по названию показывает команды всех таких городов
+        other = City.objects.create(name='Грозный')
+        reference.bump_version()
+        twin = Team.objects.create(name='Тезка', city=other)
+        add_result(self.tournament, twin, [4, 4])
+        drain_jobs(self)
+
+        data = self.get_json()
+        self.assertEqual(
+            [(row['i'], row['m']) for row in data['r']], [(twin.id, 1), (self.first.id, 2), (self.second.id, 3)],
+        )
+        topic = self.tournament.tournamenttopic_set.order_by('order').first().topic
+        response = self.client.get('/topics/', {'format': 'json', 'topic': topic.id, 'sort': 'total'})
+        self.assertEqual([row['i'] for row in response.json()['r']], [twin.id, self.first.id, self.second.id])
+        records_page = self.client.get('/records/').content.decode()
+        self.assertIn('Тезка', records_page)
+        self.assertIn('Первая', records_page)
+
+    def test_games(self):
+        data = self.get_json(active_tab='games')
+        self.assertPage(data, 'games')
+        self.assertEqual(data['r'], [{
+            'i': self.tournament.id, 'd': date_format(self.tournament.date), 'c': 'Грозный',
+            'n': self.tournament.name, 'k': 3, 'w': ['Первая'],
+        }])
+
+
+class ParseTeamIdsTests(SimpleTestCase):
+    def test_order_duplicates_and_garbage(self):
+        self.assertEqual(parse_team_ids('3, 1,3,x,,-2,²,' + '9' * 5000 + ',7'), [3, 1, 7])
+
+    def test_stops_at_limit(self):
+        self.assertEqual(parse_team_ids(','.join(str(number) for number in range(100000)), limit=3), [0, 1, 2])
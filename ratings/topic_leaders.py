@@ -0,0 +1,275 @@
+"""
+Лидеры по темам: лучшие команды каждой темы по среднему баллу (не меньше RATINGS_TOPIC_MIN_GAMES игр)
+и по сумме очков - в каждом городе и среди всех городов.
+
+TeamTopicStat хранит очки и число игр команды по теме (из topic_scores). TopicLeaderboard - только первые
+RATINGS_TOPIC_TOP_K команд темы одним списком, поэтому страница таблицы - одна строка БД. Задача команды
+(RatingJob.KIND_TEAM) пересчитывает строки TeamTopicStat этой команды и переставляет ее в списках тех тем,
+где ее числа изменились. Из TeamTopicStat (по индексу, LIMIT K) список перечитывается, только когда команда
+из полного списка опустилась на его край или ниже - тогда неизвестно, кто займет освободившееся место.
+
+Полный пересчет: python manage.py rebuild_topic_leaders
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.utils import timezone
+
+from .difficulty import collect_topic_stats
+from .models import GameResult, Team, TeamTopicStat, Topic, TopicLeaderboard
+
+
+# city_id списков по всем городам
+ALL_CITIES_ID = 0
+KINDS = [TopicLeaderboard.KIND_AVG, TopicLeaderboard.KIND_TOTAL]
+STAT_FIELDS = ['city_id', 'games_count', 'points_sum', 'avg_points']
+
+
+def top_k():
+    return getattr(settings, 'RATINGS_TOPIC_TOP_K', 100)
+
+
+def min_games():
+    """Сколько игр по теме нужно, чтобы попасть в список по среднему баллу"""
+    return getattr(settings, 'RATINGS_TOPIC_MIN_GAMES', 3)
+
+
+def _entry(stat, kind):
+    """Строка списка [team_id, значение, игр] или None, если команда в этот список не попадает"""
+    if kind == TopicLeaderboard.KIND_AVG:
+        if stat.games_count < min_games():
+            return None
+        return [stat.team_id, stat.avg_points, stat.games_count]
+    return [stat.team_id, stat.points_sum, stat.games_count]
+
+
+def _sort_key(entry):
+    return (-entry[1], entry[0])
+
+
+def _stat_rows(team_id, city_id, topic_stats, topic_ids):
+    """
+    Строки TeamTopicStat по {topic_id: Stats}. Темы не из topic_ids пропускаются: тему могли удалить,
+    а topic_scores еще не пересобраны
+    """
+    return {
+        topic_id: TeamTopicStat(
+            team_id=team_id, topic_id=topic_id, city_id=city_id, games_count=stats.games_count,
+            points_sum=stats.points_sum, avg_points=stats.points_sum / stats.games_count,
+        )
+        for topic_id, stats in topic_stats.items() if topic_id in topic_ids
+    }
+
+
+def refresh_team(team_id):
+    """
+    Пересчитывает TeamTopicStat команды и ее места в списках лидеров. Вызывается из задачи команды
+    (rankings.refresh_team) после refresh_team_stats, которая уже заблокировала таблицы всех городов
+    """
+    city_id = Team.objects.filter(id=team_id).values_list('city_id', flat=True).first()
+    new_rows = {}
+    if city_id is not None:
+        # Порядок игр тот же, что в expected_stats, - суммы дробных очков совпадут до последнего знака
+        topic_scores_list = GameResult.objects.filter(team_id=team_id).order_by('id').values_list('topic_scores', flat=True)
+        topic_stats = collect_topic_stats(topic_scores_list)
+        topic_ids = set(Topic.objects.filter(id__in=list(topic_stats)).values_list('id', flat=True))
+        new_rows = _stat_rows(team_id, city_id, topic_stats, topic_ids)
+    old_rows = {row.topic_id: row for row in TeamTopicStat.objects.filter(team_id=team_id)}
+
+    # (topic_id, city_id) списков, где команда могла сдвинуться
+    boards = set()
+    now = timezone.now()
+    created, updated, deleted = [], [], []
+    for topic_id in set(old_rows) | set(new_rows):
+        old, new = old_rows.get(topic_id), new_rows.get(topic_id)
+        if old is not None and new is not None:
+            if (old.city_id, old.games_count, old.points_sum) == (new.city_id, new.games_count, new.points_sum):
+                continue
+        for row in (old, new):
+            if row is not None:
+                boards.update({(topic_id, row.city_id), (topic_id, ALL_CITIES_ID)})
+
+        if old is not None and new is not None:
+            for field in STAT_FIELDS:
+                setattr(old, field, getattr(new, field))
+            old.updated_at = now
+            updated.append(old)
+        elif new is not None:
+            created.append(new)
+        else:
+            deleted.append(old.id)
+    if not boards:
+        return False
+
+    TeamTopicStat.objects.filter(id__in=deleted).delete()
+    TeamTopicStat.objects.bulk_create(created)
+    TeamTopicStat.objects.bulk_update(updated, [*STAT_FIELDS, 'updated_at'])
+    _update_boards(team_id, boards, new_rows)
+    return True
+
+
+def _update_boards(team_id, boards, new_rows):
+    topic_ids = {topic_id for topic_id, _ in boards}
+    city_ids = {city_id for _, city_id in boards}
+    existing = {
+        (board.topic_id, board.city_id, board.kind): board
+        for board in TopicLeaderboard.objects.filter(topic_id__in=topic_ids, city_id__in=city_ids)
+    }
+
+    created, updated = [], []
+    for topic_id, city_id in boards:
+        stat = new_rows.get(topic_id)
+        if stat is not None and city_id not in (ALL_CITIES_ID, stat.city_id):
+            # Команда переехала: из списка старого города ее просто убираем
+            stat = None
+        for kind in KINDS:
+            board = existing.get((topic_id, city_id, kind))
+            if board is None:
+                board = TopicLeaderboard(topic_id=topic_id, city_id=city_id, kind=kind, entries=[])
+            entries = _place(board.entries, team_id, stat and _entry(stat, kind))
+            if entries is None:
+                entries = _leading_entries(topic_id, city_id, kind)
+            if entries == board.entries:
+                continue
+            board.entries = entries
+            board.updated_at = timezone.now()
+            (updated if board.pk else created).append(board)
+
+    TopicLeaderboard.objects.bulk_create(created)
+    TopicLeaderboard.objects.bulk_update(updated, ['entries', 'updated_at'])
+
+
+def _place(entries, team_id, entry):
+    """
+    Новый список после изменения одной команды (entry = None - команда в списке быть не должна).
+    None - список надо перечитать: команда из полного списка опустилась на край или ниже
+    """
+    limit = top_k()
+    was_member = any(current[0] == team_id for current in entries)
+    result = [current for current in entries if current[0] != team_id]
+    if entry is not None:
+        result.append(entry)
+        result.sort(key=_sort_key)
+    if was_member and len(entries) >= limit:
+        # За краем полного списка могут быть команды сильнее новой строки
+        if entry is None or _sort_key(entry) >= _sort_key(result[limit - 1]):
+            return None
+    return result[:limit]
+
+
+def _leading_entries(topic_id, city_id, kind):
+    """Первые K строк списка прямо из TeamTopicStat (индекс по теме, городу и значению)"""
+    stats = TeamTopicStat.objects.filter(topic_id=topic_id)
+    if city_id != ALL_CITIES_ID:
+        stats = stats.filter(city_id=city_id)
+    if kind == TopicLeaderboard.KIND_AVG:
+        stats = stats.filter(games_count__gte=min_games()).order_by('-avg_points', 'team_id')
+    else:
+        stats = stats.order_by('-points_sum', 'team_id')
+    return [_entry(stat, kind) for stat in stats.only('team_id', 'games_count', 'points_sum', 'avg_points')[:top_k()]]
+
+
+def expected_stats():
+    """Все строки TeamTopicStat, посчитанные с нуля: {(team_id, topic_id): TeamTopicStat}"""
+    by_team = defaultdict(list)
+    results = GameResult.objects.order_by('id').values_list('team_id', 'topic_scores')
+    for team_id, topic_scores in results.iterator(chunk_size=5000):
+        by_team[team_id].append(topic_scores)
+    cities = dict(Team.objects.values_list('id', 'city_id'))
+    topic_ids = set(Topic.objects.values_list('id', flat=True))
+
+    rows = {}
+    for team_id, topic_scores_list in by_team.items():
+        if team_id not in cities:
+            continue
+        topic_stats = collect_topic_stats(topic_scores_list)
+        for topic_id, row in _stat_rows(team_id, cities[team_id], topic_stats, topic_ids).items():
+            rows[(team_id, topic_id)] = row
+    return rows
+
+
+def expected_boards(rows):
+    """Списки лидеров по строкам TeamTopicStat: {(topic_id, city_id, kind): entries}, пустые не хранятся"""
+    candidates = defaultdict(list)
+    for (_, topic_id), row in rows.items():
+        for kind in KINDS:
+            entry = _entry(row, kind)
+            if entry is not None:
+                candidates[(topic_id, row.city_id, kind)].append(entry)
+                candidates[(topic_id, ALL_CITIES_ID, kind)].append(entry)
+    return {key: sorted(entries, key=_sort_key)[:top_k()] for key, entries in candidates.items()}
+
+
+def rebuild_all():
+    """Полный пересчет TeamTopicStat и TopicLeaderboard. Возвращает (строк статистики, списков)"""
+    rows = expected_stats()
+    boards = expected_boards(rows)
+    with transaction.atomic():
+        TeamTopicStat.objects.all().delete()
+        TeamTopicStat.objects.bulk_create(rows.values(), batch_size=1000)
+        TopicLeaderboard.objects.all().delete()
+        TopicLeaderboard.objects.bulk_create(
+            [
+                TopicLeaderboard(topic_id=topic_id, city_id=city_id, kind=kind, entries=entries)
+                for (topic_id, city_id, kind), entries in boards.items()
+            ],
+            batch_size=1000,
+        )
+    return len(rows), len(boards)
+
+
+def find_divergences():
+    """Строки статистики и списки, которые не совпадают с пересчитанными: [(что, ключ, сохранено, должно быть)]"""
+    expected_rows = expected_stats()
+    stored_rows = {(row.team_id, row.topic_id): row for row in TeamTopicStat.objects.all()}
+    divergences = []
+    for key in sorted(set(expected_rows) | set(stored_rows)):
+        stored = stored_rows.get(key) and [getattr(stored_rows[key], field) for field in STAT_FIELDS]
+        expected = expected_rows.get(key) and [getattr(expected_rows[key], field) for field in STAT_FIELDS]
+        if stored != expected:
+            divergences.append(('stat', key, stored, expected))
+
+    expected_lists = expected_boards(expected_rows)
+    stored_lists = {
+        (board.topic_id, board.city_id, board.kind): board.entries
+        for board in TopicLeaderboard.objects.all()
+    }
+    for key in sorted(set(expected_lists) | set(stored_lists)):
+        # Пустой сохраненный список - то же, что его отсутствие
+        if (stored_lists.get(key) or []) != expected_lists.get(key, []):
+            divergences.append(('board', key, stored_lists.get(key), expected_lists.get(key)))
+    return divergences
+
+
+def leaders_page(topic_id, city_ids, kind, page, per_page):
+    """
+    Страница списка лидеров городов city_ids (обычно один город; несколько - у городов с одним названием):
+    (page_obj, строки). Строка - team_id, название, город, место (с дележом), значение и число игр.
+    Запросы - сами списки и названия команд страницы
+    """
+    boards = TopicLeaderboard.objects.filter(topic_id=topic_id, city_id__in=city_ids, kind=kind)
+    entries = [entry for board in boards for entry in board.entries]
+    if len(boards) > 1:
+        # Первые K объединения - среди первых K каждого списка
+        entries = sorted(entries, key=_sort_key)[:top_k()]
+    page_obj = Paginator(entries, per_page).get_page(page)
+
+    teams = {
+        team_id: (name, team_city_id)
+        for team_id, name, team_city_id in Team.objects.filter(
+            id__in=[entry[0] for entry in page_obj]
+        ).values_list('id', 'name', 'city_id')
+    }
+    rows = []
+    for index, (team_id, value, games) in enumerate(page_obj, start=page_obj.start_index() - 1):
+        # Место - номер первой строки с таким же значением
+        rank = index + 1
+        while rank > 1 and entries[rank - 2][1] == value:
+            rank -= 1
+        name, team_city_id = teams.get(team_id, ('', None))
+        rows.append({
+            'team_id': team_id, 'name': name, 'city_id': team_city_id, 'rank': rank, 'value': value, 'games': games,
+        })
+    return page_obj, rows
@@ -7,5 +7,14 @@ app_name = 'rating'
 urlpatterns = [
     path('', views.index, name='index'),
     path('team/<int:team_id>/modal/', views.team_modal, name='team_modal'),
+    path('team/<int:team_id>/rank/', views.team_rank, name='team_rank'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
+    path('teams/compare/', views.teams_compare, name='teams_compare'),
+    path('topics/', views.topic_leaders_view, name='topic_leaders'),
+    path('promotions/', views.promotions, name='promotions'),
+    path('records/', views.records_view, name='records'),
+    path('standings/', views.series_standings, name='series_standings'),
     path('game/<int:game_id>/modal/', views.game_modal, name='game_modal'),
+    path('game/<int:game_id>/live/', views.live_scoreboard, name='live_scoreboard'),
+    path('game/<int:game_id>/live/stream/', views.live_stream, name='live_stream'),
 ]
\ No newline at end of file
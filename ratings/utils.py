@@ -1,8 +1,14 @@
 from django.db.models import Q
 from .models import Team, Tournament
+from .reference import get_reference_data
 from datetime import datetime
 
 
+DEFAULT_CITY = 'Грозный'
+# Значение фильтра города для общей таблицы всех городов
+ALL_CITIES = 'all'
+
+
 def q_search(query):
     if not query:
         return {
@@ -69,7 +75,7 @@ def filter_team_and_tournament(params, teams, tournaments=None, active_tab='team
         tournaments = Tournament.objects.all()
 
     search_query = params.get('search', '')
-    city = params.get('city', 'Грозный')
+    city = params.get('city', DEFAULT_CITY)
     game_series = params.get('game_series')
     date_from = params.get('date_from')
     date_to = params.get('date_to')
@@ -104,17 +110,33 @@ def filter_team_and_tournament(params, teams, tournaments=None, active_tab='team
     if date_from and date_to:
         teams = teams.distinct()
 
+    # Названия города и серии переводим в id через справочники в памяти, без JOIN по строкам
+    reference = get_reference_data()
+
     # === ФИЛЬТР ГОРОДА ===
-    teams = teams.filter(city__name=city)
-    tournaments = tournaments.filter(city__name=city)
+    if city != ALL_CITIES:
+        city_ids = reference.city_ids_by_name.get(city)
+        if city_ids is None:
+            teams = teams.none()
+            tournaments = tournaments.none()
+        else:
+            teams = teams.filter(city_id__in=city_ids)
+            tournaments = tournaments.filter(city_id__in=city_ids)
 
     # === ФИЛЬТР ПО СЕРИИ ТУРНИРОВ ===
     if game_series:
+        series_id = reference.series_ids_by_name.get(game_series)
         if active_tab == 'teams':
-            teams = teams.filter(
-                gameresult__tournament__series__name=game_series
-            ).distinct()
+            if series_id is None:
+                teams = teams.none()
+            else:
+                teams = teams.filter(
+                    gameresult__tournament__series_id=series_id
+                ).distinct()
         elif active_tab == 'games':
-            tournaments = tournaments.filter(series__name=game_series)
+            if series_id is None:
+                tournaments = tournaments.none()
+            else:
+                tournaments = tournaments.filter(series_id=series_id)
 
     return teams, tournaments
\ No newline at end of file
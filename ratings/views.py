@@ -1,10 +1,22 @@
+import json
+from collections import defaultdict
 from datetime import datetime
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
-from .models import City, GameResult,Team, Topic, Tournament, TournamentSeries, BELT_SYSTEM
+from .models import GameResult,Team, Tournament, TopicLeaderboard, BELT_SYSTEM, get_belt_info
 from django.db.models import Count, Prefetch
 from django.core.paginator import Paginator
+from django.utils.formats import date_format
 
-from .utils import filter_team_and_tournament
+from .difficulty import collect_topic_stats, get_difficulty
+from . import belts, rankings, records, standings, topic_leaders
+from .live import channel_name, get_broker, get_cached_standings, get_standings
+from .reference import get_reference_data
+from .search_index import get_search_index
+from .routers import use_read_replica
+from .team_matrix import get_team_matrix
+from .utils import ALL_CITIES, DEFAULT_CITY, filter_team_and_tournament
 
 
 
@@ -24,13 +36,18 @@ from .utils import filter_team_and_tournament
 
 # Попросить проверить шрифт и загрузку у Ислама
 
+# Размер страницы таблиц команд и игр на главной (его же использует build_static_site)
+ITEMS_PER_PAGE = 100
+
+
+@use_read_replica
 def index(request):
     search_query = request.GET.get('search', '')
     team_sort = request.GET.get('team_sort')
     active_tab = request.GET.get('active_tab', 'teams')
 
-    # Базовые queryset
-    teams = Team.objects.select_related('city')
+    # Базовые queryset (stats - сохраненные места команд, ratings/rankings.py)
+    teams = Team.objects.select_related('city', 'stats')
     tournaments = Tournament.objects.select_related('series', 'city').prefetch_related(
         Prefetch(
             'gameresult_set',
@@ -48,36 +65,63 @@ def index(request):
     teams = teams.with_stats()
     tournaments = tournaments.order_by('-date')
 
-    if team_sort == "wins":
-        teams = teams.order_by('-wins_count')
-    elif team_sort == "avg":
-        teams = teams.order_by('-avg_points')
-    else:
-        teams = teams.order_by('-total_points_sum')
+    # При равенстве раньше команда с меньшим id - так же считаются сохраненные места (rankings.team_order)
+    teams = teams.order_by(*rankings.team_order(team_sort))
+    rank_field = stored_rank_field(request.GET)
+    all_cities = request.GET.get('city') == ALL_CITIES
+    # В общей таблице рядом с общим местом - место в своем городе
+    city_rank_field = rankings.SORT_FIELDS[rankings.sort_key(team_sort)][1] if all_cities and rank_field else None
+    # Без поиска и фильтров по серии и датам страница берется из сохраненных мест, без агрегации по всем командам
+    ranked = ranked_teams(request.GET) if active_tab == 'teams' else None
 
     # === Пагинация ===
     page = request.GET.get('page', 1)
-    items_per_page = 100
+
+    # JSON-режим для app.js: только видимые колонки, таблицу рисует браузер
+    if request.GET.get('format') == 'json':
+        if active_tab == 'teams':
+            if ranked is not None:
+                data = ranked_teams_json(ranked, page, ITEMS_PER_PAGE)
+            else:
+                data = teams_table_json(teams, page, ITEMS_PER_PAGE, rank_field, city_rank_field, all_cities)
+            if all_cities:
+                data['cs'] = city_strength_json(rankings.city_table())
+        else:
+            data = tournaments_table_json(tournaments, page, ITEMS_PER_PAGE)
+        # Кириллицу не экранируем в \uXXXX - так ответ заметно короче
+        return JsonResponse(data, json_dumps_params={'ensure_ascii': False})
 
     if active_tab == 'teams':
-        paginator = Paginator(teams, items_per_page)
+        paginator = Paginator(teams if ranked is None else ranked, ITEMS_PER_PAGE)
         teams_page = paginator.get_page(page)
         tournaments_page = []
         current_page = teams_page
+        # Место в таблице: сохраненное (с дележом), а при фильтрах по серии и датам - номер строки.
+        # У RankedTeams места уже проставлены
+        if ranked is None:
+            for index, team in enumerate(teams_page, start=teams_page.start_index()):
+                stats = getattr(team, 'stats', None)
+                team.rank = getattr(stats, rank_field) if rank_field and stats else index
+                team.city_rank = getattr(stats, city_rank_field) if city_rank_field and stats else None
     else:
-        paginator = Paginator(tournaments, items_per_page)
+        paginator = Paginator(tournaments, ITEMS_PER_PAGE)
         teams_page = []
         tournaments_page = paginator.get_page(page)
         current_page = tournaments_page
 
+    reference = get_reference_data()
+
     context = {
         'teams': teams_page,
         'tournaments': tournaments_page,
         'page_obj': current_page,
         'paginator': paginator,
-        'all_series': TournamentSeries.objects.all(),
-        'all_cities': City.objects.all().order_by('name'),
+        'all_series': reference.series,
+        'all_cities': reference.cities,
         'selected_city': request.GET.get('city'),
+        'all_cities_value': ALL_CITIES,
+        'all_cities_mode': all_cities,
+        'city_strength': rankings.city_table() if all_cities and active_tab == 'teams' else [],
         'selected_team_sort': team_sort,
         'selected_game_series': request.GET.get('game_series'),
         'active_tab': active_tab,
@@ -91,47 +135,247 @@ def index(request):
 
 
 
+# === JSON-ТАБЛИЦЫ ===
+# Короткие ключи: t - вкладка, p - страница, n - всего страниц, o - номер первой строки, r - строки
+
+def _page_json(tab, page_obj, rows):
+    return {
+        't': tab,
+        'p': page_obj.number,
+        'n': page_obj.paginator.num_pages,
+        'o': page_obj.start_index(),
+        'r': rows,
+    }
+
+
+def stored_rank_field(params):
+    """
+    Поле сохраненного места для текущей сортировки (в общей таблице всех городов - общее место).
+    Места посчитаны по всем играм, поэтому с фильтрами по серии и датам (другие очки) их не показываем -
+    возвращаем None.
+    """
+    if any(params.get(key) for key in ('game_series', 'date_from', 'date_to')):
+        return None
+    # Несколько городов с одним названием: места посчитаны в каждом отдельно, вместе их не сравнить
+    if len(get_reference_data().city_ids_by_name.get(params.get('city', DEFAULT_CITY), ())) > 1:
+        return None
+    tables = rankings.GLOBAL_SORT_FIELDS if params.get('city') == ALL_CITIES else rankings.SORT_FIELDS
+    return tables[rankings.sort_key(params.get('team_sort'))][1]
+
+
+def ranked_teams(params):
+    """
+    Таблица команд по сохраненным местам (rankings.RankedTeams) или None, если нужен запрос с агрегацией:
+    поиск и фильтры по серии и датам меняют состав таблицы и очки
+    """
+    if any(params.get(key) for key in ('search', 'game_series', 'date_from', 'date_to')):
+        return None
+    city = params.get('city', DEFAULT_CITY)
+    if city == ALL_CITIES:
+        return rankings.RankedTeams(params.get('team_sort'))
+    city_ids = get_reference_data().city_ids_by_name.get(city, ())
+    if len(city_ids) != 1:
+        return None
+    return rankings.RankedTeams(params.get('team_sort'), city_ids[0])
+
+
+def _team_json(team, rank):
+    belt = get_belt_info(team['total_points_sum'])
+    return {
+        'i': team['id'],
+        'n': team['name'],
+        'b': belt['belt_index'],
+        's': belt['stripes_count'],
+        'p': round(team['total_points_sum'] or 0, 1),
+        'g': team['games_played_count'] or 0,
+        'w': team['wins_count'] or 0,
+        'a': round(team['avg_points'] or 0, 1),
+        'm': rank,
+    }
+
+
+def teams_table_json(teams, page, per_page, rank_field=None, city_rank_field=None, all_cities=False):
+    """
+    Строка команды: i - id, n - название, m - место (нет - номер строки), b/s - пояс и полоски,
+    p - очки, g - игр, w - побед, a - ср. балл; в общей таблице еще c - город, l - место в городе
+    """
+    fields = ['id', 'name', 'total_points_sum', 'games_played_count', 'wins_count', 'avg_points']
+    if rank_field:
+        fields.append(f'stats__{rank_field}')
+    if city_rank_field:
+        fields.append(f'stats__{city_rank_field}')
+    if all_cities:
+        fields.append('city__name')
+    teams = teams.values(*fields)
+    page_obj = Paginator(teams, per_page).get_page(page)
+    rows = []
+    for index, team in enumerate(page_obj, start=page_obj.start_index()):
+        row = _team_json(team, team.get(f'stats__{rank_field}') or index)
+        if all_cities:
+            row['c'] = team['city__name']
+            row['l'] = team.get(f'stats__{city_rank_field}')
+        rows.append(row)
+    return _page_json('teams', page_obj, rows)
+
+
+def ranked_teams_json(ranked, page, per_page):
+    """Та же таблица по сохраненным местам (rankings.RankedTeams)"""
+    page_obj = Paginator(ranked, per_page).get_page(page)
+    rows = []
+    for team in page_obj:
+        values = {'id': team.id, 'name': team.name, **{field: getattr(team, field) for field in rankings.STAT_FIELDS}}
+        row = _team_json(values, team.rank)
+        if ranked.city_id is None:
+            row['c'] = team.city.name
+            row['l'] = team.city_rank
+        rows.append(row)
+    return _page_json('teams', page_obj, rows)
+
+
+def city_strength_json(cities):
+    """Сравнение городов: n - город, r - место по силе, s - сила, k - команд, a - играющих, p - очки"""
+    return [
+        {
+            'n': city.city.name,
+            'r': city.strength_rank,
+            's': round(city.top_points_avg, 1),
+            'k': city.teams_count,
+            'a': city.active_teams_count,
+            'p': round(city.total_points_sum),
+        }
+        for city in cities
+    ]
+
+
+def tournaments_table_json(tournaments, page, per_page):
+    """Строка игры: i - id, d - дата, c - город, n - название, k - число команд, w - победители"""
+    # Prefetch победителей с объектами здесь не нужен: их достаем отдельным запросом ниже
+    tournaments = tournaments.prefetch_related(None).select_related(None).values(
+        'id', 'date', 'city__name', 'name', 'results_count'
+    )
+    page_obj = Paginator(tournaments, per_page).get_page(page)
+    tournaments = list(page_obj)
+
+    # Победители всех турниров страницы одним запросом вместо Prefetch с объектами
+    winners = {}
+    for tournament_id, team_name in GameResult.objects.filter(
+        place=1, tournament_id__in=[tournament['id'] for tournament in tournaments]
+    ).values_list('tournament_id', 'team__name'):
+        winners.setdefault(tournament_id, []).append(team_name)
+
+    rows = [
+        {
+            'i': tournament['id'],
+            'd': date_format(tournament['date']),
+            'c': tournament['city__name'],
+            'n': tournament['name'],
+            'k': tournament['results_count'],
+            'w': winners.get(tournament['id'], []),
+        }
+        for tournament in tournaments
+    ]
+    return _page_json('games', page_obj, rows)
+
+
+def team_insights(team_id):
+    """Блоки "Похожие команды" и "Процентили по темам"; пустые, если матрица не построена или нет NumPy"""
+    matrix = get_team_matrix()
+    profile = matrix.profile(team_id) if matrix is not None else None
+    if not profile:
+        return [], []
+
+    names = dict(Team.objects.filter(id__in=[team for team, _ in profile['similar']]).values_list('id', 'name'))
+    similar_teams = [
+        {'id': team, 'name': names[team], 'similarity': round(score * 100)}
+        for team, score in profile['similar']
+        if team in names
+    ]
+    topic_percentiles = [
+        {'short_name': topic.short_name, 'full_name': topic.full_name, 'percentile': round(profile['percentiles'][topic.id])}
+        for topic in get_reference_data().topics
+        if topic.id in profile['percentiles']
+    ]
+    return similar_teams, topic_percentiles
+
+
+@use_read_replica
 def team_modal(request, team_id):
-    team = Team.objects.filter(id=team_id).select_related('city')
+    team = Team.objects.filter(id=team_id).select_related('city', 'stats', 'records')
+    base_team = team.first()
+    if base_team is None:
+        raise Http404("Команда не найдена")
 
     # Получаем результаты последних 5 игр(Без фильтров)
-    recent_games =  team.first().gameresult_set.select_related(
+    recent_games =  base_team.gameresult_set.select_related(
         'tournament', 'tournament__city'
     ).order_by('-tournament__date')[:5]
 
     # Достижения(Без фильтров)
-    series_stats = team.first().get_series_stats()
+    series_stats = base_team.get_series_stats()
+
+    # Карточка открывается и из общей таблицы, и из подсказок поиска: город таблицы к одной команде не относится,
+    # действуют только серия и даты
+    params = request.GET.copy()
+    params['city'] = ALL_CITIES
 
     # Применяем фильтр к команде, чтобы получить статистику которая соответствует фильтрации в teams
-    team_filtered, _ = filter_team_and_tournament(request.GET, team, None, 'teams')
-    team = team_filtered.with_stats()
+    team_filtered, _ = filter_team_and_tournament(params, team, None, 'teams')
+    team_obj = team_filtered.with_stats().first()
+    if team_obj is None:
+        # Под фильтрами серии и дат у команды нет игр - карточка с нулями, а не 500
+        team_obj = base_team
+        team_obj.games_played_count = team_obj.wins_count = 0
+        team_obj.total_points_sum = team_obj.avg_points = 0.0
+        team_obj.last_game_date = None
     
     # Получаем все турниры, которые отфильтрованны по серии и дате(если есть)
-    _, tournaments_filtered = filter_team_and_tournament(request.GET, Team.objects.none(),Tournament.objects.all(),'games')
+    _, tournaments_filtered = filter_team_and_tournament(params, Team.objects.none(),Tournament.objects.all(),'games')
     
     # получаем только те игры команды, которые были в этих отфильтрованных турнирах
     filtered_games = GameResult.objects.filter(
         team_id=team_id, # Игры нашей команды
         tournament__in=tournaments_filtered # Только в отфильтрованных турнирах
     )
-    # Статистику для радара получаем
-    topic_stats = team.first().get_topic_statistics(results_qs=filtered_games)
+    # Статистику для радара получаем. Без фильтров - по всем играм: закрытые сезоны берутся из сводок
+    filtered = any(request.GET.get(key) for key in ('game_series', 'date_from', 'date_to'))
+    topic_stats = base_team.get_topic_statistics(results_qs=filtered_games if filtered else None)
     
     # Формируем данные для радара
-    radar_data = {'labels': [],'data': [], 'full_names': []}
+    radar_data = {'labels': [],'data': [], 'full_names': [], 'z_scores': []}
+
+    # Сложность тем из памяти процесса: средний балл сравнивается с полем выбранной серии или всех турниров
+    reference = get_reference_data()
+    series_id = reference.series_ids_by_name.get(request.GET.get('game_series'))
+    difficulty = get_difficulty()
     
-    for topic in Topic.objects.all().order_by('full_name'):
+    for topic in reference.topics:
         if topic.id in topic_stats['averages']:
+            average = topic_stats['averages'][topic.id]
+            z_score = difficulty.z_score(topic.id, average, series_id)
             radar_data['labels'].append(topic.short_name)
-            radar_data['data'].append(topic_stats['averages'][topic.id])
+            radar_data['data'].append(average)
             radar_data['full_names'].append(topic.full_name)
+            radar_data['z_scores'].append('' if z_score is None else round(z_score, 2))
+
+    # Похожие команды и процентили по темам из матрицы build_team_matrix (за все время, без фильтров)
+    similar_teams, topic_percentiles = team_insights(team_id)
+    # Смены поясов записаны в момент изменения очков - история не пересчитывается по играм
+    belt_history = belts.team_history(team_id)
     
+    # Серии и рекорды хранятся готовыми (ratings/records.py)
+    team_records = team_records_context(getattr(team_obj, 'records', None), reference)
     context = {
-        'team': team.first(),
+        'team': team_obj,
+        # Места в таблице города по всем играм (без фильтров)
+        'team_ranks': getattr(team_obj, 'stats', None),
         'best_topic': topic_stats['best_topic'],
         'radar_data': radar_data,
         'series_stats': series_stats,
         'recent_games': recent_games,
+        'similar_teams': similar_teams,
+        'topic_percentiles': topic_percentiles,
+        'belt_history': belt_history,
+        'team_records': team_records,
         'active_filters': {
             'game_series': request.GET.get('game_series'),
             'date_from': request.GET.get('date_from'),
@@ -142,31 +386,342 @@ def team_modal(request, team_id):
     return render(request, 'ratings/includes/modals/team_modal.html', context)
 
 
+def team_records_context(row, reference):
+    """Рекорды для карточки команды: строка TeamRecord и лучшие результаты по сериям (турниры - одним запросом)"""
+    if row is None or not row.games_count:
+        return None
+    tournaments = Tournament.objects.in_bulk(
+        {row.best_total_tournament_id, *(tournament_id for _, tournament_id in row.series_best.values())} - {None}
+    )
+    series = []
+    for series_ref in reference.series:
+        best = row.series_best.get(str(series_ref.id))
+        if best:
+            series.append({'series': series_ref.name, 'points': best[0], 'tournament': tournaments.get(best[1])})
+    return {'row': row, 'best_tournament': tournaments.get(row.best_total_tournament_id), 'series': series}
+
+
+@use_read_replica
+def team_rank(request, team_id):
+    """
+    Место команды в таблице ее города (с city=all - в общей таблице) и страница, на которой она стоит
+    (для "Показать в таблице")
+    """
+    # per_page по умолчанию - 100, как в index
+    rank = rankings.team_rank(
+        team_id, request.GET.get('team_sort'), all_cities=request.GET.get('city') == ALL_CITIES,
+    )
+    if rank is None:
+        raise Http404("Места команды еще не посчитаны")
+    city = get_reference_data().cities_by_id.get(rank['city_id'])
+    rank['city'] = city.name if city else None
+    return JsonResponse(rank, json_dumps_params={'ensure_ascii': False})
+
+
+# Подсказок каждого вида по умолчанию и максимум
+SUGGEST_LIMIT = 8
+SUGGEST_MAX_LIMIT = 20
+
+
+@use_read_replica
+def search_suggest(request):
+    """
+    Подсказки для строки поиска: команды и турниры, чье название или слово названия начинается с ?q=.
+    Отвечает из индекса в памяти процесса (search_index.py) - к БД только версия индекса и справочников в кеше.
+    Ответ короткий: {"q", "teams": [[id, название, город]], "games": [[id, название, дата]]}
+    """
+    query = request.GET.get('q', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', SUGGEST_LIMIT)), 1), SUGGEST_MAX_LIMIT)
+    except ValueError:
+        limit = SUGGEST_LIMIT
+    teams, tournaments = get_search_index().suggest(query, limit)
+    cities = get_reference_data().cities_by_id if teams else {}
+    response = JsonResponse({
+        'q': query,
+        'teams': [[team.id, team.name, getattr(cities.get(team.extra), 'name', '')] for team in teams],
+        'games': [[tournament.id, tournament.name, tournament.extra] for tournament in tournaments],
+    }, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+    # Повторные нажатия той же буквы за пару секунд браузер возьмет из своего кеша
+    response['Cache-Control'] = 'private, max-age=5'
+    return response
+
+
+# Сколько команд можно наложить на один радар
+COMPARE_MAX_TEAMS = 10
+
+
+def parse_team_ids(value, limit=COMPARE_MAX_TEAMS):
+    """'3,1,3,x' -> [3, 1]: id по порядку, без повторов и мусора, не больше limit"""
+    team_ids = []
+    for part in value.split(','):
+        part = part.strip()
+        # Только ASCII-цифры ('²'.isdigit() тоже True) и не длиннее bigint: int() от них не упадет
+        if part.isascii() and part.isdigit() and len(part) <= 18 and int(part) not in team_ids:
+            team_ids.append(int(part))
+            # Длинная строка запроса не стоит лишней работы: дальше limit не смотрим
+            if len(team_ids) == limit:
+                break
+    return team_ids
+
+
+@use_read_replica
+def teams_compare(request):
+    """
+    Профили команд по темам для наложения радаров: средний балл каждой команды (?teams=1,2,3) по каждой теме
+    с теми же фильтрами серии и дат, что у таблицы. Игры всех команд - одним запросом по topic_scores,
+    темы - общая ось в порядке справочника (значение None - команда тему не играла).
+    """
+    team_ids = parse_team_ids(request.GET.get('teams', ''))
+    names = dict(Team.objects.filter(id__in=team_ids).values_list('id', 'name'))
+    team_ids = [team_id for team_id in team_ids if team_id in names]
+
+    # Только серия и даты: город и поиск таблицы не должны отрезать игры команд из других городов
+    params = {key: request.GET.get(key) for key in ('game_series', 'date_from', 'date_to')}
+    params['city'] = ALL_CITIES
+    _, tournaments_filtered = filter_team_and_tournament(params, Team.objects.none(), Tournament.objects.all(), 'games')
+
+    topic_scores_by_team = defaultdict(list)
+    for team_id, topic_scores in GameResult.objects.filter(
+        team_id__in=team_ids, tournament__in=tournaments_filtered,
+    ).values_list('team_id', 'topic_scores'):
+        topic_scores_by_team[team_id].append(topic_scores)
+    stats = {team_id: collect_topic_stats(topic_scores_by_team[team_id]) for team_id in team_ids}
+
+    topics = [
+        topic for topic in get_reference_data().topics
+        if any(topic.id in team_stats for team_stats in stats.values())
+    ]
+    teams = []
+    for team_id in team_ids:
+        team_stats = stats[team_id]
+        teams.append({
+            'id': team_id,
+            'name': names[team_id],
+            'games': len(topic_scores_by_team[team_id]),
+            'values': [
+                round(team_stats[topic.id].points_sum / team_stats[topic.id].games_count, 2)
+                if topic.id in team_stats else None
+                for topic in topics
+            ],
+        })
+    return JsonResponse({
+        'topics': [{'id': topic.id, 'short_name': topic.short_name, 'full_name': topic.full_name} for topic in topics],
+        'teams': teams,
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+TOPIC_LEADERS_PER_PAGE = 20
+
+
+@use_read_replica
+def topic_leaders_view(request):
+    """
+    Лидеры темы (?topic=) в городе или среди всех городов (city=all): по среднему баллу или по сумме очков (sort).
+    Список уже отсортирован и хранится одной строкой (ratings/topic_leaders.py), ?format=json - то же для app.js
+    """
+    reference = get_reference_data()
+    if not reference.topics:
+        raise Http404("Тем еще нет")
+    try:
+        topic = reference.topics_by_id.get(int(request.GET.get('topic', '')))
+    except ValueError:
+        topic = None
+    topic = topic or reference.topics[0]
+
+    city = request.GET.get('city', DEFAULT_CITY)
+    if city == ALL_CITIES:
+        city_ids = [topic_leaders.ALL_CITIES_ID]
+    else:
+        city_ids = reference.city_ids_by_name.get(city, ())
+    kind = request.GET.get('sort')
+    if kind not in topic_leaders.KINDS:
+        kind = TopicLeaderboard.KIND_AVG
+
+    page_obj, rows = topic_leaders.leaders_page(
+        topic.id, city_ids, kind, request.GET.get('page', 1), TOPIC_LEADERS_PER_PAGE,
+    )
+    for row in rows:
+        city_ref = reference.cities_by_id.get(row['city_id'])
+        row['city'] = city_ref.name if city_ref else ''
+
+    if request.GET.get('format') == 'json':
+        # Строка: i - id команды, n - название, c - город, m - место, v - значение, g - игр по теме
+        data = _page_json('topic_leaders', page_obj, [
+            {'i': row['team_id'], 'n': row['name'], 'c': row['city'], 'm': row['rank'],
+             'v': round(row['value'], 2), 'g': row['games']}
+            for row in rows
+        ])
+        data.update({'topic': topic.id, 'city': city, 'sort': kind})
+        return JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+
+    context = {
+        'topic': topic,
+        'rows': rows,
+        'page_obj': page_obj,
+        'all_topics': reference.topics,
+        'all_cities': reference.cities,
+        'all_cities_value': ALL_CITIES,
+        'selected_city': city,
+        'selected_sort': kind,
+        'kinds': TopicLeaderboard.KINDS,
+        'min_games': topic_leaders.min_games(),
+    }
+    return render(request, 'ratings/topic_leaders.html', context)
+
+
+PROMOTIONS_PER_PAGE = 30
+
+
+@use_read_replica
+def promotions(request):
+    """
+    Лента повышений поясов в городе или во всех городах (city=all), новые сверху. События записаны в момент
+    изменения очков (ratings/belts.py), страница - запрос по индексу (город, время). ?format=json - для скриптов
+    """
+    reference = get_reference_data()
+    city = request.GET.get('city', DEFAULT_CITY)
+    city_ids = None if city == ALL_CITIES else reference.city_ids_by_name.get(city, ())
+    page_obj = Paginator(belts.city_feed(city_ids), PROMOTIONS_PER_PAGE).get_page(request.GET.get('page', 1))
+    events = belts.with_tournaments(page_obj)
+
+    if request.GET.get('format') == 'json':
+        # Событие: i - id команды, n - название, c - город, f/l - уровень до и после, p - очки, d - время, g - турнир
+        data = _page_json('promotions', page_obj, [
+            {'i': event.team_id, 'n': event.team.name, 'c': event.team.city.name,
+             'f': event.from_name, 'l': event.to_name, 'p': round(event.total_points, 1),
+             'd': event.created_at.isoformat(), 'g': event.tournament.name if event.tournament else None}
+            for event in events
+        ])
+        data['city'] = city
+        return JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+
+    context = {
+        'events': events,
+        'page_obj': page_obj,
+        'all_cities': reference.cities,
+        'all_cities_value': ALL_CITIES,
+        'selected_city': city,
+    }
+    return render(request, 'ratings/promotions.html', context)
+
+
+@use_read_replica
+def records_view(request):
+    """
+    Рекорды города или всех городов (city=all): серии побед, призовых мест и черных ящиков, лучшие результаты
+    в турнире и в каждой серии. Все значения уже посчитаны (ratings/records.py), ?format=json - для скриптов
+    """
+    reference = get_reference_data()
+    city = request.GET.get('city', DEFAULT_CITY)
+    city_ids = None if city == ALL_CITIES else reference.city_ids_by_name.get(city, ())
+
+    tables = records.city_records(city_ids)
+    by_series = records.series_records(city_ids)
+    teams = Team.objects.select_related('city').in_bulk([team_id for _, team_id, _ in by_series.values()])
+    tournament_ids = {tournament_id for _, _, tournament_id in by_series.values()}
+    tournament_ids.update(row.best_total_tournament_id for _, _, rows in tables for row in rows)
+    tournaments = Tournament.objects.in_bulk(tournament_ids - {None})
+
+    series_rows = []
+    for series in reference.series:
+        if series.id in by_series:
+            points, team_id, tournament_id = by_series[series.id]
+            series_rows.append({
+                'series': series.name, 'team': teams.get(team_id), 'points': points,
+                'tournament': tournaments.get(tournament_id),
+            })
+    for _, _, rows in tables:
+        for row in rows:
+            row.best_total_tournament = tournaments.get(row.best_total_tournament_id)
+
+    if request.GET.get('format') == 'json':
+        # Рекорд: i - id команды, n - название, c - город, v - значение; s - лучшие по сериям (s - серия, v - очки)
+        data = {
+            field: [{'i': row.team_id, 'n': row.team.name, 'c': row.team.city.name, 'v': getattr(row, field)} for row in rows]
+            for field, _, rows in tables
+        }
+        data['s'] = [
+            {'s': row['series'], 'i': row['team'].id if row['team'] else None,
+             'n': row['team'].name if row['team'] else '', 'v': row['points']}
+            for row in series_rows
+        ]
+        data['city'] = city
+        return JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+
+    context = {
+        'tables': tables,
+        'series_rows': series_rows,
+        'all_cities': reference.cities,
+        'all_cities_value': ALL_CITIES,
+        'selected_city': city,
+    }
+    return render(request, 'ratings/records.html', context)
+
+
+@use_read_replica
+def series_standings(request):
+    """
+    Зачет серии за сезон: очки за места в лучших играх, у кубков сначала этап, при равенстве - очки в играх.
+    Строки посчитаны заранее (ratings/standings.py), сезоны и серии - из справочников в памяти, так что страница -
+    одно чтение по индексу (сезон, серия, место). ?format=json - для скриптов
+    """
+    reference = get_reference_data()
+    season_id = request.GET.get('season', '')
+    season = reference.seasons_by_id.get(int(season_id)) if season_id.isdigit() else None
+    season = season or (reference.seasons[0] if reference.seasons else None)
+    ordered_series = sorted(reference.series, key=lambda series: (series.display_order, series.id))
+    series = reference.series_by_id.get(reference.series_ids_by_name.get(request.GET.get('series')))
+    series = series or (ordered_series[0] if ordered_series else None)
+    rows = list(standings.season_table(season.id, series.id)) if season and series else []
+
+    if request.GET.get('format') == 'json':
+        # Строка: m - место, i - id команды, n - название, c - город, p - очки зачета, t - очки в играх,
+        # e - этап (кубок), g - игр, k - игр в зачете, r - игры [id турнира, место, очки зачета, в зачете]
+        data = {
+            'season': season.name if season else None,
+            'series': series.name if series else None,
+            'best_of': series.best_of if series else None,
+            'r': [
+                {'m': row.position, 'i': row.team_id, 'n': row.team.name, 'c': row.team.city.name,
+                 'p': row.points, 't': round(row.total_points, 1), 'e': row.progression,
+                 'g': row.games_count, 'k': row.counted_count, 'r': row.results}
+                for row in rows
+            ],
+        }
+        return JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+
+    context = {
+        'rows': rows,
+        'all_seasons': reference.seasons,
+        'all_series': ordered_series,
+        'selected_season': season,
+        'selected_series': series,
+        'is_cup': series is not None and series.tournament_type == 'cup',
+    }
+    return render(request, 'ratings/standings.html', context)
+
+
+@use_read_replica
 def game_modal(request, game_id):
     # Получаем турнир
     tournament = get_object_or_404(Tournament, id=game_id)
     # Получаем темы в правильном порядке
     topics = tournament.topics.all().order_by('tournamenttopic__order')
     
-    # Получаем результаты с динамическими местами + оптимизированные запросы
+    # Получаем результаты с динамическими местами; очки по темам уже упакованы в topic_scores
     results = GameResult.objects.filter(tournament=tournament)\
         .select_related('team')\
-        .prefetch_related('topicresult_set__topic')\
         .order_by('place')
     
 
     # Заполняет незаполненные поля в таблице(для незаполненных тем в результате, делаем прочерки)
     for result in results:
-        # Создаем список ['-', '-', '-', ...] по количеству тем
-        result.topic_points = ['-'] * topics.count()
-        
-        # Заполняем реальными данными
-        for tr in result.topicresult_set.all():
-            # Находим индекс темы в ordered topics
-            for idx, topic in enumerate(topics):
-                if tr.topic_id == topic.id:
-                    result.topic_points[idx] = tr.points
-                    break
+        scores = dict(result.topic_scores)
+        result.topic_points = [
+            '-' if scores.get(topic.id) is None else scores[topic.id]
+            for topic in topics
+        ]
     
     context = {
         'game': tournament,
@@ -176,3 +731,46 @@ def game_modal(request, game_id):
     
     return render(request, 'ratings/includes/modals/game_modal.html', context)
 
+
+
+
+# Экран для проектора: таблица турнира, которая обновляется через SSE
+def live_scoreboard(request, game_id):
+    tournament = get_object_or_404(Tournament.objects.select_related('city'), id=game_id)
+    context = {
+        'game': tournament,
+        'standings': get_cached_standings(tournament.id) or get_standings(tournament.id),
+    }
+    return render(request, 'ratings/live.html', context)
+
+
+# Поток изменений таблицы (text/event-stream). Работает только под ASGI.
+async def live_stream(request, game_id):
+    if not await Tournament.objects.filter(id=game_id).aexists():
+        raise Http404
+
+    messages = get_broker().subscribe(channel_name(game_id), heartbeat=15)
+
+    async def event_stream():
+        try:
+            # Сначала дожидаемся подписки, потом читаем снимок, чтобы не потерять изменения между ними
+            await anext(messages)
+            standings = await sync_to_async(get_cached_standings)(game_id)
+            if standings is None:
+                standings = await sync_to_async(get_standings)(game_id)
+            yield f'event: snapshot\ndata: {json.dumps(standings, ensure_ascii=False)}\n\n'
+
+            async for message in messages:
+                if message is None:
+                    # Комментарий-пинг, чтобы прокси не закрыли соединение
+                    yield ': ping\n\n'
+                else:
+                    yield f'event: delta\ndata: {json.dumps(message, ensure_ascii=False)}\n\n'
+        finally:
+            await messages.aclose()
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
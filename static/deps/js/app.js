@@ -196,10 +196,70 @@ function cleanupPageParam() {
             .then(html => {
                 teamModal.querySelector('.modal-content').innerHTML = html;
                 setTimeout(initRadarChart, 100);
+                // Клик по похожей команде открывает ее карточку
+                teamModal.querySelectorAll('.similar-team').forEach(row => {
+                    row.addEventListener('click', () => loadTeamModal(row.getAttribute('data-team-id')));
+                });
+                const showInTable = teamModal.querySelector('.show-in-table');
+                if (showInTable) {
+                    showInTable.addEventListener('click', () => showTeamInTable(showInTable.getAttribute('data-team-id')));
+                }
+                const compareToggle = teamModal.querySelector('.compare-toggle');
+                if (compareToggle) {
+                    updateCompareButton(compareToggle);
+                    compareToggle.addEventListener('click', () => {
+                        toggleCompare(compareToggle.getAttribute('data-team-id'), compareToggle.getAttribute('data-team-name'));
+                        updateCompareButton(compareToggle);
+                    });
+                }
             })
             .catch(error => showError(teamModal, `Ошибка загрузки команды: ${error}`));
     }
 
+    /**
+     * Открывает страницу таблицы команд, на которой стоит команда, и подсвечивает ее строку.
+     * Место хранится на сервере (/team/<id>/rank/), поэтому всю таблицу листать не нужно.
+     * Места посчитаны по всем играм города, поэтому фильтры серии, дат и поиск сбрасываются.
+     * Если открыта общая таблица всех городов, команда ищется в ней
+     * @param {number} teamId - ID команды
+     */
+    function showTeamInTable(teamId) {
+        const form = document.getElementById('filters');
+        const sort = form.querySelector('select[name="team_sort"]');
+        const city = form.querySelector('select[name="city"]');
+        const params = new URLSearchParams();
+        if (sort && sort.value) params.set('team_sort', sort.value);
+        if (city && city.value === ALL_CITIES) params.set('city', ALL_CITIES);
+
+        fetch(`/team/${teamId}/rank/?${params.toString()}`)
+            .then(response => response.ok ? response.json() : Promise.reject(response.status))
+            .then(rank => {
+                if (city && rank.city && !rank.all_cities) city.value = rank.city;
+                ['game_series', 'date_from', 'date_to', 'search'].forEach(name => {
+                    const field = form.querySelector(`[name="${name}"]`);
+                    if (field) field.value = '';
+                });
+                const searchInput = document.getElementById('search-input');
+                if (searchInput) searchInput.value = '';
+                updatePeriodButton();
+
+                let pageInput = form.querySelector('input[name="page"]');
+                if (!pageInput) {
+                    pageInput = document.createElement('input');
+                    pageInput.type = 'hidden';
+                    pageInput.name = 'page';
+                    form.appendChild(pageInput);
+                }
+                pageInput.value = rank.page;
+
+                updateAppliedFilters();
+                highlightTeamId = String(teamId);
+                hideModal(teamModal);
+                loadTabContent('teams');
+            })
+            .catch(error => showError(teamModal, `Не удалось найти команду в таблице: ${error}`));
+    }
+
     /**
      * Загружает содержимое модального окна для игры через AJAX
      * @param {number} gameId - ID игры для загрузки
@@ -229,6 +289,25 @@ function cleanupPageParam() {
         document.querySelectorAll('.game-row').forEach(row => {
             row.addEventListener('click', () => loadGameModal(row.getAttribute('data-game-id')));
         });
+
+        // Город в сравнении городов открывает таблицу этого города
+        document.querySelectorAll('.city-strength-row').forEach(row => {
+            row.addEventListener('click', () => showCityTable(row.getAttribute('data-city')));
+        });
+    }
+
+    /**
+     * Открывает первую страницу таблицы команд города
+     * @param {string} cityName - Название города
+     */
+    function showCityTable(cityName) {
+        const form = document.getElementById('filters');
+        const city = form.querySelector('select[name="city"]');
+        if (city) city.value = cityName;
+        const pageInput = form.querySelector('input[name="page"]');
+        if (pageInput) pageInput.value = 1;
+        updateAppliedFilters();
+        loadTabContent('teams');
     }
 
     // =============================================
@@ -279,37 +358,263 @@ function cleanupPageParam() {
         updateFilterVisibility();
     }
 
+    // =============================================
+    // 6.1 JSON-ТАБЛИЦЫ: КЭШ, ПРЕДЗАГРУЗКА, ОТМЕНА ЗАПРОСОВ
+    // =============================================
+
+    // Сервер отдает только данные (?format=json), таблицы рисуются здесь
+    const BELT_CLASSES = ['white', 'blue', 'purple', 'brown', 'black', 'red']; // в порядке BELT_SYSTEM
+    const BELT_NAMES = ['Белый', 'Синий', 'Пурпурный', 'Коричневый', 'Чёрный', 'Красный'];
+    const TABLE_CACHE_SIZE = 20;       // Сколько последних страниц/комбинаций фильтров помним
+    const TABLE_CACHE_TTL = 60 * 1000; // Через минуту данные запрашиваются заново
+    const ALL_CITIES = 'all';          // Значение фильтра города для общей таблицы (utils.ALL_CITIES)
+
+    // query -> {promise, time}; Map помнит порядок вставки, поэтому первый ключ - самый старый (LRU)
+    const tableCache = new Map();
+    // Номер последнего запроса: ответы на устаревшие запросы не рисуем. Сами запросы не отменяются:
+    // промис в кэше общий для всех, кто ждет тот же query, и отмена одним вызовом сломала бы его для остальных
+    let tableRequestId = 0;
+    // Команда, строку которой нужно подсветить после загрузки таблицы ("Показать в таблице")
+    let highlightTeamId = null;
+
+    /**
+     * Собирает строку запроса для таблицы из формы фильтров
+     * @param {string} tabName - Вкладка ('teams' или 'games')
+     * @param {number} [page] - Номер страницы (по умолчанию берется из формы)
+     */
+    function tableQuery(tabName, page) {
+        const params = new URLSearchParams(new FormData(document.getElementById('filters')));
+        params.set('active_tab', tabName);
+        if (page) params.set('page', page);
+        params.set('format', 'json');
+        // Пустые значения и порядок ключей не должны давать разные ключи кэша
+        for (const [key, value] of [...params]) {
+            if (value === '') params.delete(key);
+        }
+        params.sort();
+        return params.toString();
+    }
+
+    /**
+     * Возвращает данные таблицы из кэша или запрашивает их с сервера
+     * @param {string} query - Строка запроса из tableQuery
+     */
+    function fetchTable(query) {
+        const cached = tableCache.get(query);
+        if (cached && Date.now() - cached.time < TABLE_CACHE_TTL) {
+            // Освежаем позицию в LRU
+            tableCache.delete(query);
+            tableCache.set(query, cached);
+            return cached.promise;
+        }
+
+        const promise = fetch(`?${query}`)
+            .then(response => response.ok ? response.json() : Promise.reject(response.status));
+        const entry = { promise, time: Date.now() };
+        tableCache.delete(query);
+        tableCache.set(query, entry);
+        // Неудачный запрос не кэшируем
+        promise.catch(() => {
+            if (tableCache.get(query) === entry) tableCache.delete(query);
+        });
+        if (tableCache.size > TABLE_CACHE_SIZE) {
+            tableCache.delete(tableCache.keys().next().value);
+        }
+        return promise;
+    }
+
+    function isTableCached(query) {
+        const cached = tableCache.get(query);
+        return Boolean(cached) && Date.now() - cached.time < TABLE_CACHE_TTL;
+    }
+
+    function escapeHtml(value) {
+        return String(value).replace(/[&<>"']/g, char => ({
+            '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+        })[char]);
+    }
+
+    /**
+     * Разметка пагинации, как в pagination.html: не больше 3 номеров страниц
+     * @param {number} page - Текущая страница
+     * @param {number} pages - Всего страниц
+     */
+    function renderPagination(page, pages) {
+        if (pages <= 1) return '';
+        const from = Math.max(1, Math.min(page - 1, pages - 2));
+        const to = Math.min(pages, from + 2);
+
+        let html = '<div class="pagination-wrapper"><div class="pagination">';
+        if (page > 1) html += `<a href="?page=${page - 1}" class="pagination-arrow">&lt;</a>`;
+        for (let num = from; num <= to; num++) {
+            html += num === page
+                ? `<span class="pagination-btn active">${num}</span>`
+                : `<a href="?page=${num}" class="pagination-btn">${num}</a>`;
+        }
+        if (page < pages) html += `<a href="?page=${page + 1}" class="pagination-arrow">&gt;</a>`;
+        return html + '</div></div>';
+    }
+
+    /**
+     * Сравнение городов, как в teams.html
+     * Город: n - название, r - место по силе, s - сила, k - команд, a - играющих, p - очки
+     */
+    function renderCityStrength(cities) {
+        const rows = cities.map(city => `
+            <tr class="city-strength-row" data-city="${escapeHtml(city.n)}">
+                <td>${city.r}</td><td>${escapeHtml(city.n)}</td><td>${city.s}</td>
+                <td>${city.k}</td><td>${city.a}</td><td>${city.p}</td>
+            </tr>`).join('');
+        return `
+            <div class="city-strength">
+                <table class="data-table">
+                    <thead>
+                        <tr>
+                            <th>Место</th><th>Город</th><th title="Средние очки лучших команд города">Сила</th>
+                            <th>Команд</th><th>Играющих</th><th>Очки</th>
+                        </tr>
+                    </thead>
+                    <tbody>${rows}</tbody>
+                </table>
+            </div>`;
+    }
+
+    /**
+     * Таблица команд, как в teams.html
+     * Строка: i - id, n - название, m - место, b/s - пояс и полоски, p - очки, g - игр, w - побед, a - ср. балл;
+     * в общей таблице всех городов (есть data.cs) еще c - город, l - место в городе
+     */
+    function renderTeamsTable(data) {
+        const allCities = Boolean(data.cs);
+        const rows = data.r.map((team, index) => `
+            <tr class="team-row" data-team-id="${team.i}" id="team-row-${team.i}">
+                <td>${team.m ?? data.o + index}</td>
+                ${allCities ? `<td>${team.l ?? '-'}</td>` : ''}
+                <td>${escapeHtml(team.n)}</td>
+                ${allCities ? `<td>${escapeHtml(team.c)}</td>` : ''}
+                <td class="power-cell">
+                    <div class="clean-belt mini ${BELT_CLASSES[team.b]} s-${team.s}"
+                         title="${BELT_NAMES[team.b]} ${team.s} (${Math.round(team.p)} очков)">
+                        <div class="clean-vertical-lines">
+                            <span class="clean-line"></span>
+                            <span class="clean-line"></span>
+                            <span class="clean-line"></span>
+                            <span class="clean-line"></span>
+                        </div>
+                    </div>
+                </td>
+                <td>${team.p}</td>
+                <td>${team.g}</td>
+                <td>${team.w}</td>
+                <td>${team.a}</td>
+            </tr>`).join('');
+
+        return `
+            ${allCities && data.cs.length ? renderCityStrength(data.cs) : ''}
+            <table class="data-table">
+                <thead>
+                    <tr>
+                        <th>Место</th>${allCities ? '<th>В городе</th>' : ''}<th>Команда</th>
+                        ${allCities ? '<th>Город</th>' : ''}<th>Пояс</th><th>Очки</th>
+                        <th>Игр сыграно</th><th>Побед</th><th>Ср. балл</th>
+                    </tr>
+                </thead>
+                <tbody>${rows || `<tr><td colspan="${allCities ? 9 : 7}">Нет данных о командах</td></tr>`}</tbody>
+            </table>
+            ${renderPagination(data.p, data.n)}`;
+    }
+
+    /**
+     * Таблица игр, как в games.html
+     * Строка: i - id, d - дата, c - город, n - название, k - число команд, w - победители
+     */
+    function renderGamesTable(data) {
+        const rows = data.r.map(game => `
+            <tr class="game-row" data-game-id="${game.i}">
+                <td>${escapeHtml(game.d)}</td>
+                <td>${escapeHtml(game.c)}</td>
+                <td>${escapeHtml(game.n)}</td>
+                <td>${game.k}</td>
+                <td>${game.w.length ? game.w.map(escapeHtml).join(' ') : '-'}</td>
+            </tr>`).join('');
+
+        return `
+            <table class="data-table">
+                <thead>
+                    <tr><th>Дата</th><th>Город</th><th>Турнир</th><th>Число команд</th><th>Победитель</th></tr>
+                </thead>
+                <tbody>${rows}</tbody>
+            </table>
+            ${renderPagination(data.p, data.n)}`;
+    }
+
     /**
      * Основная функция загрузки контента вкладки через AJAX
+     * Повторные комбинации фильтров и предзагруженные страницы отдаются из кэша без запроса
      * @param {string} tabName - Название вкладки для загрузки
      */
     function loadTabContent(tabName) {
         const tablesContainer = document.getElementById('ajax-content');
-        tablesContainer.innerHTML = '<div class="loading">Загрузка...</div>';
 
         // Обновляем значение active_tab в форме перед отправкой
         document.getElementById('active_tab').value = tabName;
+        const query = tableQuery(tabName);
 
-        const formData = new FormData(document.getElementById('filters'));
+        // Ответ незавершенного запроса по другим фильтрам не нарисуется (requestId), но останется в кэше
+        const requestId = ++tableRequestId;
 
-        fetch(`?${new URLSearchParams(formData)}`, {
-            headers: { 'X-Requested-With': 'XMLHttpRequest' }
-        })
-        .then(response => response.ok ? response.text() : Promise.reject(response.status))
-        .then(html => {
-            tablesContainer.innerHTML = html;
+        if (!isTableCached(query)) {
+            tablesContainer.innerHTML = '<div class="loading">Загрузка...</div>';
+        }
+
+        fetchTable(query)
+        .then(data => {
+            if (requestId !== tableRequestId) return;
+            const teamsHtml = data.t === 'teams' ? renderTeamsTable(data) : '';
+            const gamesHtml = data.t === 'games' ? renderGamesTable(data) : '';
+            tablesContainer.innerHTML = `
+                <div class="table-wrapper" id="teams-table">${teamsHtml}</div>
+                <div class="table-wrapper" id="games-table">${gamesHtml}</div>`;
             switchTab(tabName);
             attachEventHandlers();
             setupPaginationHandlers();
             cleanupPageParam();
             cleanUrl();
+
+            if (highlightTeamId && data.t === 'teams') {
+                const row = document.getElementById(`team-row-${highlightTeamId}`);
+                if (row) {
+                    row.classList.add('highlight');
+                    row.scrollIntoView({ behavior: 'smooth', block: 'center' });
+                }
+                highlightTeamId = null;
+            }
+
+            // Предзагружаем следующую страницу, чтобы переход по пагинации был мгновенным
+            if (data.p < data.n) {
+                fetchTable(tableQuery(tabName, data.p + 1)).catch(() => {});
+            }
         })
         .catch(error => {
+            if (requestId !== tableRequestId) return;
             console.error('Load error:', error);
             tablesContainer.innerHTML = `<div class="error">Ошибка загрузки</div>`;
         });
     }
 
+    /**
+     * Откладывает вызов функции, пока события идут чаще, чем раз в delay мс
+     * @param {Function} func - Функция
+     * @param {number} delay - Задержка в миллисекундах
+     */
+    function debounce(func, delay) {
+        let timer = null;
+        return function(...args) {
+            clearTimeout(timer);
+            timer = setTimeout(() => func.apply(this, args), delay);
+        };
+    }
+
 
     // =============================================
     // 7. ИНИЦИАЛИЗАЦИЯ ВКЛАДОК
@@ -422,11 +727,18 @@ function cleanupPageParam() {
             });
         }
 
-        // Поиск по Enter
+        // По мере ввода - только подсказки (/search/suggest/), вся таблица пересчитывается по Enter или кнопке
+        if (searchInput) {
+            setupSearchSuggest(searchInput);
+        }
+
+        // Поиск по Enter (если в подсказках ничего не выбрано стрелками)
         if (searchInput) {
             searchInput.addEventListener('keypress', function(e) {
                 if (e.key === 'Enter') {
                     e.preventDefault();
+                    if (pickActiveSuggestion()) return;
+                    hideSuggestions();
                     updateSearchInForm();
                     loadActiveTabContent();
                 }
@@ -439,6 +751,7 @@ function cleanupPageParam() {
                 e.preventDefault();
                 if (searchInput) {
                     searchInput.value = '';
+                    hideSuggestions();
                     updateSearchInForm();
                     loadActiveTabContent();
                 }
@@ -446,6 +759,217 @@ function cleanupPageParam() {
         }
     }
 
+    // =============================================
+    // ПОДСКАЗКИ ПОИСКА
+    // =============================================
+    const SUGGEST_DELAY = 120;
+    let suggestBox = null;
+    let suggestController = null;
+    // Последний запрос подсказок: ответ на более старый не показываем
+    let suggestQuery = '';
+
+    /**
+     * Выпадающий список под строкой поиска: команды открывают карточку команды, турниры - карточку игры
+     * @param {HTMLInputElement} searchInput - Строка поиска
+     */
+    function setupSearchSuggest(searchInput) {
+        suggestBox = document.createElement('div');
+        suggestBox.className = 'search-suggest';
+        suggestBox.hidden = true;
+        searchInput.closest('.search-field').appendChild(suggestBox);
+
+        searchInput.addEventListener('input', debounce(function() {
+            loadSuggestions(searchInput.value.trim());
+        }, SUGGEST_DELAY));
+
+        searchInput.addEventListener('keydown', function(e) {
+            if (suggestBox.hidden) return;
+            if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+                e.preventDefault();
+                moveActiveSuggestion(e.key === 'ArrowDown' ? 1 : -1);
+            } else if (e.key === 'Escape') {
+                hideSuggestions();
+            }
+        });
+
+        // mousedown срабатывает раньше blur строки поиска
+        suggestBox.addEventListener('mousedown', function(e) {
+            const item = e.target.closest('.suggest-item');
+            if (!item) return;
+            e.preventDefault();
+            pickSuggestion(item);
+        });
+
+        searchInput.addEventListener('blur', hideSuggestions);
+    }
+
+    function loadSuggestions(query) {
+        suggestQuery = query;
+        if (suggestController) suggestController.abort();
+        if (!query) {
+            hideSuggestions();
+            return;
+        }
+        suggestController = new AbortController();
+        fetch(`/search/suggest/?q=${encodeURIComponent(query)}`, { signal: suggestController.signal })
+            .then(response => response.ok ? response.json() : Promise.reject(response.status))
+            .then(data => {
+                if (data.q === suggestQuery) renderSuggestions(data);
+            })
+            .catch(error => {
+                if (error.name !== 'AbortError') hideSuggestions();
+            });
+    }
+
+    function renderSuggestions(data) {
+        const teams = data.teams.map(([id, name, city]) => `
+            <div class="suggest-item" data-kind="team" data-id="${id}">
+                <i class="fas fa-users"></i>
+                <span class="suggest-name">${escapeHtml(name)}</span>
+                <span class="suggest-extra">${escapeHtml(city)}</span>
+            </div>`).join('');
+        const games = data.games.map(([id, name, date]) => `
+            <div class="suggest-item" data-kind="game" data-id="${id}">
+                <i class="fas fa-trophy"></i>
+                <span class="suggest-name">${escapeHtml(name)}</span>
+                <span class="suggest-extra">${escapeHtml(date.split('-').reverse().join('.'))}</span>
+            </div>`).join('');
+        if (!teams && !games) {
+            hideSuggestions();
+            return;
+        }
+        suggestBox.innerHTML = `
+            ${teams ? `<div class="suggest-group">Команды</div>${teams}` : ''}
+            ${games ? `<div class="suggest-group">Игры</div>${games}` : ''}`;
+        suggestBox.hidden = false;
+    }
+
+    function hideSuggestions() {
+        if (!suggestBox) return;
+        suggestBox.hidden = true;
+        suggestBox.innerHTML = '';
+    }
+
+    function moveActiveSuggestion(step) {
+        const items = Array.from(suggestBox.querySelectorAll('.suggest-item'));
+        const current = items.findIndex(item => item.classList.contains('active'));
+        const next = current === -1 ? (step > 0 ? 0 : items.length - 1) : (current + step + items.length) % items.length;
+        items.forEach((item, index) => item.classList.toggle('active', index === next));
+    }
+
+    /**
+     * Открывает подсказку, выбранную стрелками. false - ничего не выбрано
+     */
+    function pickActiveSuggestion() {
+        const item = suggestBox && !suggestBox.hidden && suggestBox.querySelector('.suggest-item.active');
+        if (!item) return false;
+        pickSuggestion(item);
+        return true;
+    }
+
+    function pickSuggestion(item) {
+        hideSuggestions();
+        if (item.dataset.kind === 'team') {
+            loadTeamModal(item.dataset.id);
+        } else {
+            loadGameModal(item.dataset.id);
+        }
+    }
+
+    // =============================================
+    // СРАВНЕНИЕ КОМАНД (РАДАРЫ НА ОДНОЙ ДИАГРАММЕ)
+    // =============================================
+    const COMPARE_MAX_TEAMS = 10; // как COMPARE_MAX_TEAMS в views.py
+    // Команды для сравнения в порядке добавления: [{id, name}]
+    let compareTeams = [];
+
+    function isCompared(teamId) {
+        return compareTeams.some(team => team.id === String(teamId));
+    }
+
+    /**
+     * Добавляет команду в сравнение или убирает из него
+     * @param {number|string} teamId - ID команды
+     * @param {string} teamName - Название (для панели сравнения)
+     */
+    function toggleCompare(teamId, teamName) {
+        teamId = String(teamId);
+        if (isCompared(teamId)) {
+            compareTeams = compareTeams.filter(team => team.id !== teamId);
+        } else if (compareTeams.length < COMPARE_MAX_TEAMS) {
+            compareTeams.push({ id: teamId, name: teamName });
+        }
+        renderCompareBar();
+    }
+
+    /**
+     * Текст кнопки "Сравнить" в карточке команды
+     * @param {HTMLElement} button - Кнопка .compare-toggle
+     */
+    function updateCompareButton(button) {
+        const compared = isCompared(button.getAttribute('data-team-id'));
+        const full = !compared && compareTeams.length >= COMPARE_MAX_TEAMS;
+        button.textContent = compared ? 'Убрать из сравнения' : 'Сравнить';
+        button.disabled = full;
+        button.title = full ? `Сравнивать можно не больше ${COMPARE_MAX_TEAMS} команд` : '';
+    }
+
+    /**
+     * Панель внизу страницы: выбранные команды и кнопка сравнения (от двух команд)
+     */
+    function renderCompareBar() {
+        const bar = document.getElementById('compare-bar');
+        if (!bar) return;
+        bar.hidden = compareTeams.length === 0;
+        bar.querySelector('.compare-teams').innerHTML = compareTeams.map(team => `
+            <span class="compare-chip" data-team-id="${team.id}" title="Убрать из сравнения">
+                ${escapeHtml(team.name)} <i class="fas fa-times"></i>
+            </span>`).join('');
+        bar.querySelectorAll('.compare-chip').forEach(chip => {
+            chip.addEventListener('click', () => toggleCompare(chip.getAttribute('data-team-id')));
+        });
+        bar.querySelector('.compare-show').disabled = compareTeams.length < 2;
+    }
+
+    /**
+     * Загружает профили выбранных команд (/teams/compare/) с примененными фильтрами серии и дат
+     * и показывает их радары на одной диаграмме
+     */
+    function showComparison() {
+        const params = new URLSearchParams();
+        params.set('teams', compareTeams.map(team => team.id).join(','));
+        ['game_series', 'date_from', 'date_to'].forEach(key => {
+            if (appliedFilters[key]) params.set(key, appliedFilters[key]);
+        });
+
+        showModalWithLoader(teamModal, 'Загрузка сравнения...');
+        fetch(`/teams/compare/?${params.toString()}`)
+            .then(response => response.ok ? response.json() : Promise.reject(response.status))
+            .then(data => {
+                const empty = data.teams.filter(team => team.games === 0).map(team => escapeHtml(team.name));
+                teamModal.querySelector('.modal-content').innerHTML = `
+                    <button class="close-modal">&times;</button>
+                    <div class="stats-radar compare-radar">
+                        <h3><i class="fas fa-chart-radar"></i> Сравнение команд по темам</h3>
+                        ${empty.length ? `<p class="compare-note">Нет игр с такими фильтрами: ${empty.join(', ')}</p>` : ''}
+                        ${data.topics.length
+                            ? '<div class="chart-container"><canvas id="compareRadarChart"></canvas></div>'
+                            : '<div class="loading">Нет результатов по темам</div>'}
+                    </div>`;
+                initCompareChart(document.getElementById('compareRadarChart'), data);
+            })
+            .catch(error => showError(teamModal, `Ошибка загрузки сравнения: ${error}`));
+    }
+
+    const compareBar = document.getElementById('compare-bar');
+    if (compareBar) {
+        compareBar.querySelector('.compare-show').addEventListener('click', showComparison);
+        compareBar.querySelector('.compare-clear').addEventListener('click', () => {
+            compareTeams = [];
+            renderCompareBar();
+        });
+    }
+
     // =============================================
     // 12. ИНИЦИАЛИЗАЦИЯ ПРИ ЗАГРУЗКЕ
     // =============================================
@@ -517,8 +1041,8 @@ document.querySelectorAll('input[type="date"]').forEach(input => {
 // Инициализация текста кнопки при загрузке
 document.addEventListener('DOMContentLoaded', updatePeriodButton);
 
-// Обработчик кнопки сброса
-document.getElementById('reset-filters').addEventListener('click', function() {
+// Обработчик кнопки сброса (на странице онлайн-таблицы фильтров нет)
+document.getElementById('reset-filters')?.addEventListener('click', function() {
     // Сбрасываем значения всех полей формы
     document.getElementById('filters').reset();
     
@@ -560,6 +1084,9 @@ function initRadarChart() {
     const labels = radarCanvas.dataset.labels.split(',');          
     const rawValues = radarCanvas.dataset.values.split(',').map(Number); 
     const fullNames = radarCanvas.dataset.fullnames.split(',');    
+    // Z-оценки: отклонение от среднего по теме в стандартных отклонениях (пусто - сравнивать не с чем)
+    const zScores = (radarCanvas.dataset.zscores || '').split(',').map(value => value === '' ? null : Number(value));
+    let mode = 'points';
 
     // === ОКРУГЛЕНИЕ ДЛЯ ОТОБРАЖЕНИЯ (до 0.5) ===
     const displayValues = rawValues.map(value => {
@@ -569,12 +1096,15 @@ function initRadarChart() {
         return Math.min(rounded, 5);
     });   
 
+    // Z-оценка на той же шкале 0..5: середина (2.5) - средний уровень поля, края - ±2.5 отклонения
+    const zDisplayValues = zScores.map(value => value === null ? 2.5 : Math.max(0, Math.min(5, value + 2.5)));
+
     // === НАСТРОЙКИ МАСШТАБА ДИАГРАММЫ ===
     const minValue = 0;   // Минимальное значение на шкале (центр диаграммы)
     const maxValue = 5;   // Максимальное значение на шкале (внешний круг)
 
     // === СОЗДАНИЕ И НАСТРОЙКА ДИАГРАММЫ ===
-    new Chart(radarCanvas, {
+    const chart = new Chart(radarCanvas, {
         type: 'radar',   // Тип диаграммы: радарная (паутинная)
         data: {
             labels: labels,   // Подписи для осей (короткие названия тем)
@@ -648,6 +1178,12 @@ function initRadarChart() {
                         label: function(context) { 
                             const index = context.dataIndex; // Получаем индекс данных
                             // ★ ВОТ ЗДЕСЬ ИСПОЛЬЗУЮТСЯ ДАННЫЕ ДЛЯ ПОДСКАЗОК ★
+                            if (mode === 'z') {
+                                const z = zScores[index];
+                                if (z === null) return `Средний балл: ${rawValues[index].toFixed(1)} (мало данных)`;
+                                const sign = z > 0 ? '+' : '';
+                                return `Относительно поля: ${sign}${z.toFixed(2)}σ (балл ${rawValues[index].toFixed(1)})`;
+                            }
                             return `Средний балл: ${rawValues[index].toFixed(1)}`;
                         },
                         // Функция для стиля точки в подсказке
@@ -676,4 +1212,148 @@ function initRadarChart() {
             }
         }
     });
-}
\ No newline at end of file
+
+    // === ПЕРЕКЛЮЧАТЕЛЬ "БАЛЛЫ / С УЧЕТОМ СЛОЖНОСТИ" ===
+    const modeSwitch = radarCanvas.closest('.stats-radar').querySelector('.radar-mode');
+    if (!modeSwitch || zScores.every(value => value === null)) return;
+    modeSwitch.hidden = false;
+    modeSwitch.querySelectorAll('.radar-mode-btn').forEach(button => {
+        button.addEventListener('click', () => {
+            mode = button.dataset.mode;
+            modeSwitch.querySelectorAll('.radar-mode-btn').forEach(other => other.classList.toggle('active', other === button));
+            chart.data.datasets[0].data = mode === 'z' ? zDisplayValues : displayValues;
+            chart.data.datasets[0].label = mode === 'z' ? 'Относительно поля' : 'Средний балл по темам';
+            chart.update();
+        });
+    });
+}
+
+
+// Цвета команд на радаре сравнения (до 10 команд)
+const COMPARE_COLORS = [
+    '#7c4dff', '#ff9800', '#26c6da', '#ef5350', '#66bb6a',
+    '#ffee58', '#ec407a', '#8d6e63', '#42a5f5', '#bdbdbd'
+];
+
+/**
+ * Радар сравнения: по набору данных на команду, общая ось тем (та же шкала 0..5, что у радара команды)
+ * @param {HTMLCanvasElement} canvas - Холст диаграммы
+ * @param {Object} data - Ответ /teams/compare/: topics [{short_name, full_name}], teams [{name, values}]
+ */
+function initCompareChart(canvas, data) {
+    if (!canvas) return;
+    const fullNames = data.topics.map(topic => topic.full_name);
+
+    new Chart(canvas, {
+        type: 'radar',
+        data: {
+            labels: data.topics.map(topic => topic.short_name),
+            datasets: data.teams.map((team, index) => {
+                const color = COMPARE_COLORS[index % COMPARE_COLORS.length];
+                return {
+                    label: team.name,
+                    // Несыгранная тема - разрыв линии (null), значения ограничены 5, как у радара команды
+                    data: team.values.map(value => value === null ? null : Math.min(value, 5)),
+                    rawValues: team.values,
+                    borderColor: color,
+                    backgroundColor: `${color}22`,
+                    pointBackgroundColor: color,
+                    pointRadius: 3,
+                    borderWidth: 2,
+                    spanGaps: true,
+                    fill: true
+                };
+            })
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            scales: {
+                r: {
+                    angleLines: { color: 'rgba(255, 255, 255, 0.2)' },
+                    grid: { color: 'rgba(255, 255, 255, 0.1)' },
+                    pointLabels: { color: '#e6ddff', font: { size: 14, weight: 'bold' } },
+                    ticks: { display: false, stepSize: 0.5 },
+                    min: 0,
+                    max: 5
+                }
+            },
+            plugins: {
+                legend: { display: true, labels: { color: '#e6ddff' } },
+                tooltip: {
+                    callbacks: {
+                        title: tooltipItems => fullNames[tooltipItems[0].dataIndex],
+                        label: context => {
+                            const value = context.dataset.rawValues[context.dataIndex];
+                            return `${context.dataset.label}: ${value === null ? '-' : value.toFixed(1)}`;
+                        }
+                    },
+                    backgroundColor: 'rgba(31, 15, 58, 0.95)',
+                    borderColor: '#7c4dff',
+                    borderWidth: 1
+                }
+            }
+        }
+    });
+}
+
+
+// =============================================
+// 15. ОНЛАЙН-ТАБЛИЦА ТУРНИРА (SSE)
+// =============================================
+
+/**
+ * Подключается к потоку изменений таблицы и обновляет строки без перезагрузки.
+ * Сервер присылает snapshot (вся таблица) при подключении и delta (только изменившиеся команды) после каждого сохранения.
+ */
+function initLiveScoreboard() {
+    const board = document.getElementById('live-scoreboard');
+    if (!board || !window.EventSource) return;
+
+    const tbody = board.querySelector('.live-table tbody');
+    const statusText = board.querySelector('.live-status-text');
+    // team_id -> {team, total, place}
+    const rows = new Map();
+
+    // Перерисовывает таблицу, отсортированную по месту
+    function render() {
+        const sorted = [...rows.entries()].sort((a, b) => a[1].place - b[1].place || a[1].team.localeCompare(b[1].team));
+        if (!sorted.length) {
+            tbody.innerHTML = '<tr class="live-empty"><td colspan="3">Результатов пока нет</td></tr>';
+            return;
+        }
+        tbody.innerHTML = '';
+        sorted.forEach(([teamId, row]) => {
+            const tr = document.createElement('tr');
+            tr.dataset.teamId = teamId;
+            if (row.changed) tr.classList.add('live-changed');
+            [row.place, row.team, Math.round(row.total * 10) / 10].forEach(value => {
+                const td = document.createElement('td');
+                td.textContent = value;
+                tr.appendChild(td);
+            });
+            tbody.appendChild(tr);
+            row.changed = false;
+        });
+    }
+
+    const source = new EventSource(board.dataset.streamUrl);
+
+    source.addEventListener('open', () => { statusText.textContent = 'В эфире'; });
+    source.addEventListener('error', () => { statusText.textContent = 'Переподключение...'; });
+
+    source.addEventListener('snapshot', event => {
+        rows.clear();
+        JSON.parse(event.data).forEach(row => rows.set(row.team_id, row));
+        render();
+    });
+
+    source.addEventListener('delta', event => {
+        const delta = JSON.parse(event.data);
+        delta.changes.forEach(row => rows.set(row.team_id, { ...row, changed: true }));
+        delta.removed.forEach(teamId => rows.delete(teamId));
+        render();
+    });
+}
+
+document.addEventListener('DOMContentLoaded', initLiveScoreboard);